@@ -44,9 +44,6 @@ from scipy.stats import chi2
 import lal
 from lal.utils import CacheEntry
 
-from lalburst import snglcluster
-from lalburst import bucluster
-
 from glue import datafind
 
 from ligo.lw import ligolw, lsctables
@@ -148,12 +145,15 @@ class EPHandler(Handler):
 
 		# Defaults -- data products
 		self.output = True
-		self.triggers = None
 		self.process_params = None
 		self.process = None
 		self.outdir = os.getcwd()
 		self.outdirfmt = ""
-		self.triggers = EPHandler.make_output_table()
+		# Triggers are accumulated as arrays of utils.TRIGGER_DTYPE with
+		# times relative to this integer GPS second, set from the first
+		# buffer
+		self.epoch = None
+		self.triggers = numpy.zeros(0, dtype = utils.TRIGGER_DTYPE)
 		self.output_cache = Cache()
 		self.output_cache_name = None
 		self.snr_thresh = None
@@ -484,13 +484,53 @@ class EPHandler(Handler):
 	def clustering(self):
 		return self._clustering
 
-	# Ensure that if clustering is on, we add the appropriate columns to be 
-	# output
+	# The trigger arrays always carry the columns clustering needs
 	@clustering.setter
 	def clustering(self, value):
 		self._clustering = value
-		if len(self.triggers) > 1:
-			bucluster.add_ms_columns_to_table(self.triggers)
+
+	@property
+	def triggers(self):
+		"""
+		Array (see utils.TRIGGER_DTYPE) of the triggers not yet written out. Buffers are appended in chunks which are only joined when the array is needed.
+		"""
+		if len(self._trigger_chunks) > 1:
+			self._trigger_chunks = [numpy.concatenate(self._trigger_chunks)]
+		return self._trigger_chunks[0]
+
+	@triggers.setter
+	def triggers(self, triggers):
+		self._trigger_chunks = [triggers]
+		self.ntriggers = len(triggers)
+
+	def append_triggers(self, triggers):
+		self._trigger_chunks.append(triggers)
+		self.ntriggers += len(triggers)
+
+	def trigger_rows(self, triggers):
+		"""
+		Construct SnglBurst rows for the output table from a trigger array.
+		"""
+		rows = []
+		epoch = lal.LIGOTimeGPS(self.epoch or 0)
+		columns = ("ifo", "search", "channel", "start", "stop", "peak", "flow", "fhigh", "amplitude", "snr", "confidence", "chisq", "chisq_dof", "event_id")
+		for ifo, search, channel, start, stop, peak, flow, fhigh, amplitude, snr, confidence, chisq, chisq_dof, event_id in zip(*[triggers[name].tolist() for name in columns]):
+			row = lsctables.SnglBurstTable.RowType()
+			row.ifo, row.search, row.channel = ifo, search, channel
+			row.set_start(epoch + start)
+			row.set_peak(epoch + peak)
+			row.duration = stop - start
+			row.central_freq = (flow + fhigh) / 2.0
+			row.bandwidth = fhigh - flow
+			row.amplitude = amplitude
+			row.snr = snr
+			row.confidence = confidence
+			row.chisq = chisq
+			row.chisq_dof = chisq_dof
+			row.event_id = event_id
+			row.process_id = self.process.process_id
+			rows.append(row)
+		return rows
 
 	@classmethod
 	def make_output_table(cls, add_ms_columns=False):
@@ -513,48 +553,45 @@ class EPHandler(Handler):
 		if not self.output:
 			return # We don't want event information
 
-		# What comes out of SnglBurst.from_buffer is a
-		# pylal.xlal.datatypes.snglburst.SnglBurst object. It does not have
-		# all the trappings of its ligo.lw.lsctables cousin, so we
-		# convert it here first
-		for event in [utils.convert_sngl_burst(sb, self.triggers) for sb in SnglBurst.from_buffer(buf)]:
-
-			# FIXME: Determine "magic number" or remove it
-			event.confidence = -math.log(chi2.sf(event.snr * 0.62, event.chisq_dof * 0.62))
+		# Update the timestamps which tell us how far along in the trigger
+		# streams we are
+		buf_ts = buf.timestamp*1e-9 / self.units
+		buf_dur = buf.duration*1e-9 / self.units
+		self.stop = (buf_ts + buf_dur)
+		if self.epoch is None:
+			self.epoch = int(buf_ts)
 
-			# This is done here so that the current PSD is used rather than what
-			# might be there when the triggers are actually output
-			utils.compute_amplitude(event, self.psd)
+		# What comes out of SnglBurst.from_buffer is a sequence of
+		# pylal.xlal.datatypes.snglburst.SnglBurst objects. Their columns are
+		# gathered into arrays here, the rest of the processing is done on
+		# whole buffers at a time, and output table rows are only made when
+		# the triggers are written out. Times are converted back to SI.
+		events = utils.sngl_burst_array(SnglBurst.from_buffer(buf), self.epoch, self.units)
 
-			event.snr = numpy.sqrt(event.snr / event.chisq_dof - 1)
+		# FIXME: Determine "magic number" or remove it
+		events["confidence"] = -chi2.logsf(events["snr"] * 0.62, events["chisq_dof"] * 0.62)
 
-			# Reassign IDs since they won't be unique
-			event.event_id = self.triggers.get_next_id()
-			event.process_id = self.process.process_id
-			self.event_number += 1
+		# This is done here so that the current PSD is used rather than what
+		# might be there when the triggers are actually output
+		events["amplitude"] = utils.compute_amplitudes(events, self.psd)
 
-			# If we're using a different units system, adjust back to SI
-			# Readjust start time for units
-			event.set_start(event.get_start() / self.units)
-			event.set_peak(event.get_peak() / self.units)
-			event.duration /= self.units
+		events["snr"] = numpy.sqrt(events["snr"] / events["chisq_dof"] - 1)
+		utils.init_ms_columns(events)
 
-			self.triggers.append(event)
+		# Reassign IDs since they won't be unique
+		events["event_id"] = numpy.arange(self.event_number, self.event_number + len(events))
+		self.event_number += len(events)
 
-		# Update the timestamps which tell us how far along in the trigger
-		# streams we are
-		buf_ts = buf.timestamp*1e-9 / self.units
-		buf_dur = buf.duration*1e-9 / self.units
-		self.stop = (buf_ts + buf_dur)
+		self.append_triggers(events)
 
 		# Check if clustering reduces the amount of events
-		if len(self.triggers) >= self.max_events and self._clustering:
+		if self.ntriggers >= self.max_events and self._clustering:
 			self.process_triggers(cluster_passes=1)
 
 		# We use the buffer timestamp here, since it's always guaranteed to be
 		# the earliest available buffer, so we guarantee that the span of
 		# triggers is always greater than file stride duration
-		if buf_ts - self.time_since_dump > self.dump_frequency or len(self.triggers) >= self.max_events:
+		if buf_ts - self.time_since_dump > self.dump_frequency or self.ntriggers >= self.max_events:
 			trigseg = segment(lal.LIGOTimeGPS(self.time_since_dump), lal.LIGOTimeGPS(buf_ts))
 			outseg = segment(lal.LIGOTimeGPS(self.time_since_dump), lal.LIGOTimeGPS(self.time_since_dump + self.dump_frequency))
 			outseg = trigseg if abs(trigseg) < abs(outseg) else outseg
@@ -579,47 +616,26 @@ class EPHandler(Handler):
 				self.process_triggers(cluster_passes = True)
 
 				# Final check on clustered SNR
-				for i in range(len(self.triggers))[::-1]:
-					if self.snr_thresh and self.triggers[i].snr < self.snr_thresh:
-						del self.triggers[i]
+				if self.snr_thresh:
+					self.triggers = self.triggers[~(self.triggers["snr"] < self.snr_thresh)]
 
 			self.write_triggers(filename = fname, seg = outseg)
 			self.time_since_dump = float(outseg[1])
 
 	def process_triggers(self, cluster_passes=0):
 		"""
-		Cluster triggers with a varying number of cluster passes. The cluster parameter controls how many passes of the clustering routine should be performed, with True being a special value indicating "as many as neccessary".
-		FIXME: Dear god, the logic in this function is twisted. Rework.
+		Cluster the triggers accumulated so far. A cluster_passes of 0 disables clustering. Any other value, including True, clusters until no two clusters' time-frequency tiles touch, which is what a single pass of snglcluster.cluster_events() already did.
 		"""
 
-		# Avoid all the temporary writing and the such
 		if cluster_passes == 0 or not self._clustering:
 			return
 
-		full = cluster_passes is True
-		if full:
-			cluster_passes = 1
 		# Pipe down unless its important
-		verbose = self.verbose and full
-		changed = True
-		bucluster.add_ms_columns_to_table(self.triggers)
-		off = bucluster.ExcessPowerPreFunc(self.triggers)
-		while changed and self._clustering:
-			changed = snglcluster.cluster_events( 
-				events = self.triggers,
-				testfunc = bucluster.ExcessPowerTestFunc,
-				clusterfunc = bucluster.ExcessPowerClusterFunc,
-				sortfunc = bucluster.ExcessPowerSortFunc,
-				bailoutfunc = bucluster.ExcessPowerBailoutFunc,
-				verbose = verbose
-			)
-			# If full clustering is on, ignore the number of cluster_passes
-			if not full:
-				cluster_passes -= 1
-			# If we've reached the number of requested passes, break out
-			if cluster_passes <= 0: 
-				break
-		bucluster.ExcessPowerPostFunc(self.triggers, off)
+		verbose = self.verbose and cluster_passes is True
+		nevents = self.ntriggers
+		self.triggers = utils.cluster_triggers(self.triggers)
+		if verbose:
+			print >>sys.stderr, "clustered %d events into %d" % (nevents, self.ntriggers)
 
 	# FIXME: Remove flush argument, it serves no purpose
 	def write_triggers(self, filename, flush=False, seg=None):
@@ -651,13 +667,14 @@ class EPHandler(Handler):
 
 		# Append only triggers in requested segment
 		outtable = EPHandler.make_output_table(self._clustering)
-		for i in list(range(len(self.triggers)))[::-1]:
-			# FIXME: Less than here rather than a check for being in the segment
-			# This is because triggers can arrive "late" and thus not be put in
-			# the proper file span. This might be a bug in the AppSync.
-			if self.triggers[i].get_peak() < analysis_segment[1]:
-				outtable.append(self.triggers[i])	
-				del self.triggers[i]
+		# FIXME: Less than here rather than a check for being in the segment
+		# This is because triggers can arrive "late" and thus not be put in
+		# the proper file span. This might be a bug in the AppSync.
+		triggers = self.triggers
+		if len(triggers):
+			inseg = triggers["peak"] < float(analysis_segment[1] - self.epoch)
+			outtable.extend(self.trigger_rows(triggers[inseg]))
+			self.triggers = triggers[~inseg]
 		output.childNodes[0].appendChild(outtable)
 
 		ligolw_search_summary.append_search_summary(output, process, lalwrapper_cvs_tag=None, lal_cvs_tag=None, inseg=requested_segment)
@@ -716,7 +733,7 @@ class EPHandler(Handler):
 		# Keeping statistics about event rates
 		# FIXME: This needs to be moved up before the trigger dumping
 		if self.channel_monitoring:
-			self.stats.add_events(self.triggers, cur_seg)
+			self.stats.add_events(self.trigger_rows(self.triggers), cur_seg)
 			self.stats.normalize()
 			stat_json = {}
 			stat_json["current_seg"] = [float(t) for t in (cur_seg or analysis_segment)] 
@@ -750,7 +767,7 @@ class EPHandler(Handler):
 			self.lock.release()
 
 		if flush: 
-			self.triggers = EPHandler.make_output_table(self._clustering)
+			self.triggers = numpy.zeros(0, dtype = utils.TRIGGER_DTYPE)
 		
 	def shutdown(self, signum, frame):
 		"""
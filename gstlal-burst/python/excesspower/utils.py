@@ -24,6 +24,8 @@ from itertools import chain, ifilter
 import numpy
 
 from scipy.stats import chi2, poisson, mannwhitneyu, norm
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 from pylal import datatypes as laltypes
 
@@ -400,3 +402,195 @@ def convert_sngl_burst(snglburst, sb_table):
 		# FIXME: This is probably slow
 		setattr(event, attr, getattr(snglburst, attr))
 	return event
+
+#
+# =============================================================================
+#
+#                                Trigger Arrays
+#
+# =============================================================================
+#
+
+# Triggers are held as structured arrays with one row per time-frequency
+# tile (or cluster of tiles). Times are float seconds relative to an
+# integer GPS epoch kept by the owner of the array, tiles are stored by
+# their edges, and the ms_* columns describe the "most significant
+# contributor" to a cluster as in lalburst.bucluster.
+TRIGGER_DTYPE = numpy.dtype([
+	("ifo", "S3"),
+	("search", "S25"),
+	("channel", "S65"),
+	("start", "f8"),
+	("stop", "f8"),
+	("peak", "f8"),
+	("flow", "f8"),
+	("fhigh", "f8"),
+	("peak_frequency", "f8"),
+	("amplitude", "f8"),
+	("snr", "f8"),
+	("confidence", "f8"),
+	("chisq", "f8"),
+	("chisq_dof", "f8"),
+	("ms_start", "f8"),
+	("ms_stop", "f8"),
+	("ms_flow", "f8"),
+	("ms_fhigh", "f8"),
+	("ms_hrss", "f8"),
+	("ms_snr", "f8"),
+	("ms_confidence", "f8"),
+	("event_id", "i8"),
+])
+
+# Tiles sharing an edge are not disjoint, but their times only agree to
+# the nanosecond they were recorded with
+TIME_SLOP = 5e-10
+
+def sngl_burst_array(snglbursts, epoch, units=1):
+	"""
+	Gather the columns of the pylal.xlal SnglBurst objects in snglbursts into a trigger array (see TRIGGER_DTYPE). Times and durations are divided by units to convert them back to SI, and are then stored relative to the integer GPS time epoch. Only the tile columns are filled in, see init_ms_columns().
+	"""
+	offset = epoch * units
+	rows = [(sb.ifo, sb.search, sb.channel, sb.start_time - offset + 1e-9 * sb.start_time_ns, sb.duration, sb.peak_time - offset + 1e-9 * sb.peak_time_ns, sb.central_freq, sb.bandwidth, sb.amplitude, sb.snr, sb.confidence, sb.chisq, sb.chisq_dof) for sb in snglbursts]
+	columns = numpy.array(rows, dtype = [("ifo", "S3"), ("search", "S25"), ("channel", "S65"), ("start", "f8"), ("duration", "f8"), ("peak", "f8"), ("central_freq", "f8"), ("bandwidth", "f8"), ("amplitude", "f8"), ("snr", "f8"), ("confidence", "f8"), ("chisq", "f8"), ("chisq_dof", "f8")])
+
+	triggers = numpy.zeros(len(columns), dtype = TRIGGER_DTYPE)
+	for name in ("ifo", "search", "channel", "amplitude", "snr", "confidence", "chisq", "chisq_dof"):
+		triggers[name] = columns[name]
+	triggers["start"] = columns["start"] / units
+	triggers["stop"] = triggers["start"] + columns["duration"] / units
+	triggers["peak"] = columns["peak"] / units
+	triggers["flow"] = columns["central_freq"] - columns["bandwidth"] / 2.0
+	triggers["fhigh"] = columns["central_freq"] + columns["bandwidth"] / 2.0
+	return triggers
+
+def init_ms_columns(triggers):
+	"""
+	Initialize the peak frequency and "most significant contributor" columns of unclustered triggers from the tiles themselves, as lalburst.bucluster.add_ms_columns_to_table() does.
+	"""
+	triggers["peak_frequency"] = (triggers["flow"] + triggers["fhigh"]) / 2.0
+	for name in ("start", "stop", "flow", "fhigh"):
+		triggers["ms_" + name] = triggers[name]
+	triggers["ms_hrss"] = triggers["amplitude"]
+	triggers["ms_snr"] = triggers["snr"]
+	triggers["ms_confidence"] = triggers["confidence"]
+
+def compute_amplitudes(triggers, psd):
+	"""
+	Vectorized version of compute_amplitude() for a trigger array whose snr column still holds the tile energy per degree of freedom. The sums of the inverse PSD over the tiles' bands are differences of one cumulative sum.
+	"""
+	flow = numpy.clip(((triggers["flow"] - psd.f0) / psd.deltaF).astype(int), 0, len(psd.data))
+	fhigh = numpy.clip(((triggers["fhigh"] - psd.f0) / psd.deltaF).astype(int), 0, len(psd.data))
+	with numpy.errstate(divide = "ignore"):
+		inv_psd = psd.deltaF / numpy.asarray(psd.data, dtype = "f8")
+	# bins where the PSD is 0 make the whole band's sum infinite
+	bad = ~numpy.isfinite(inv_psd)
+	cumsum = numpy.concatenate(([0.], numpy.cumsum(numpy.where(bad, 0., inv_psd))))
+	cumbad = numpy.concatenate(([0], numpy.cumsum(bad)))
+	band_sum = cumsum[fhigh] - cumsum[flow]
+	band_sum[cumbad[fhigh] > cumbad[flow]] = numpy.inf
+	bandwidth = triggers["fhigh"] - triggers["flow"]
+	with numpy.errstate(divide = "ignore", invalid = "ignore"):
+		return numpy.sqrt(0.5 * triggers["snr"] * triggers["chisq_dof"] / (band_sum / bandwidth))
+
+def _tile_components(triggers, block=1 << 20):
+	"""
+	Label the connected components of the graph joining triggers whose time-frequency tiles are not disjoint. triggers must be sorted by start time.
+	"""
+	n = len(triggers)
+	start, stop = triggers["start"], triggers["stop"] + TIME_SLOP
+	flow, fhigh = triggers["flow"], triggers["fhigh"]
+
+	# for each tile, the tiles after it in the sorted order that start
+	# before it ends are the candidates for overlapping it
+	first = numpy.arange(1, n + 1)
+	counts = numpy.searchsorted(start, stop, side = "right") - first
+	cumcounts = numpy.cumsum(counts)
+	edges_i, edges_j = [], []
+	i = 0
+	while i < n:
+		# bound the number of candidate pairs examined at once
+		j = max(i + 1, numpy.searchsorted(cumcounts, cumcounts[i] - counts[i] + block, side = "right"))
+		idx = numpy.repeat(numpy.arange(i, j), counts[i:j])
+		other = numpy.arange(len(idx)) + numpy.repeat(first[i:j] - (cumcounts[i:j] - cumcounts[i] + counts[i] - counts[i:j]), counts[i:j])
+		keep = (flow[other] <= fhigh[idx]) & (flow[idx] <= fhigh[other])
+		edges_i.append(idx[keep])
+		edges_j.append(other[keep])
+		i = j
+	edges_i = numpy.concatenate(edges_i)
+	edges_j = numpy.concatenate(edges_j)
+	graph = coo_matrix((numpy.ones(len(edges_i), dtype = bool), (edges_i, edges_j)), shape = (n, n))
+	return connected_components(graph, directed = False)
+
+def _merge_tiles(triggers, labels):
+	"""
+	Replace each connected component of tiles with their cluster, following lalburst.bucluster.ExcessPowerClusterFunc(): the cluster's tile is the smallest tile enclosing the components, its peak time and frequency and most significant contributor's tile are the SNR^2 weighted averages of the components', the most significant contributor's h_rss, SNR and confidence are those of the component with the highest confidence, and amplitudes and squared SNRs are summed. The remaining columns are those of the earliest component.
+	"""
+	order = numpy.argsort(labels, kind = "mergesort")
+	triggers, labels = triggers[order], labels[order]
+	first = numpy.flatnonzero(numpy.concatenate(([True], labels[1:] != labels[:-1])))
+
+	clusters = triggers[first]
+	weight = triggers["snr"]**2
+	total = numpy.add.reduceat(weight, first)
+	for name in ("start", "flow"):
+		clusters[name] = numpy.minimum.reduceat(triggers[name], first)
+	for name in ("stop", "fhigh"):
+		clusters[name] = numpy.maximum.reduceat(triggers[name], first)
+	for name in ("peak", "peak_frequency", "ms_start", "ms_stop", "ms_flow", "ms_fhigh"):
+		clusters[name] = numpy.add.reduceat(weight * triggers[name], first) / total
+	clusters["amplitude"] = numpy.add.reduceat(triggers["amplitude"], first)
+	clusters["snr"] = numpy.sqrt(total)
+
+	# the first entry of each component is its most confident tile
+	best = numpy.lexsort((-triggers["ms_confidence"], labels))[first]
+	for name in ("ms_hrss", "ms_snr", "ms_confidence"):
+		clusters[name] = triggers[name][best]
+	clusters["confidence"] = clusters["ms_confidence"]
+	return clusters
+
+def cluster_triggers(triggers):
+	"""
+	Cluster a trigger array the way lalburst.snglcluster.cluster_events() does with the lalburst.bucluster.ExcessPower*Func() functions: tiles from the same instrument, channel and search that are not disjoint in time and frequency are merged, and this is repeated with the clusters until no two touch. Identical tiles are not merged, the most confident one is kept. Returns a new trigger array sorted by start time.
+	"""
+	triggers = triggers[numpy.argsort(triggers["start"], kind = "mergesort")]
+	if len(triggers) < 2:
+		return triggers
+
+	# keep only the most confident of identical tiles
+	tile = ["ifo", "channel", "search", "start", "stop", "flow", "fhigh"]
+	order = numpy.lexsort([-triggers["ms_confidence"]] + [triggers[name] for name in tile[::-1]])
+	ordered = triggers[order]
+	dup = numpy.ones(len(ordered), dtype = bool)
+	for name in tile:
+		dup[1:] &= ordered[name][1:] == ordered[name][:-1]
+	dup[0] = False
+	if dup.any():
+		triggers = triggers[numpy.sort(order[~dup])]
+
+	# only triggers from the same instrument, channel and search cluster
+	groups = numpy.zeros(len(triggers), dtype = bool)
+	for name in tile[:3]:
+		groups |= triggers[name] != triggers[name][0]
+	if groups.any():
+		groups = numpy.unique(triggers[tile[:3]].tolist(), axis = 0, return_inverse = True)[1].ravel()
+		triggers = numpy.concatenate([cluster_triggers(triggers[groups == group]) for group in range(groups.max() + 1)])
+		return triggers[numpy.argsort(triggers["start"], kind = "mergesort")]
+
+	# leave the strings behind while shuffling the rows around
+	names = [name for name in TRIGGER_DTYPE.names if name not in tile[:3]]
+	clusters = numpy.empty(len(triggers), dtype = [(name, TRIGGER_DTYPE[name]) for name in names])
+	for name in names:
+		clusters[name] = triggers[name]
+	while True:
+		ncomponents, labels = _tile_components(clusters)
+		if ncomponents == len(clusters):
+			break
+		clusters = _merge_tiles(clusters, labels)
+		clusters = clusters[numpy.argsort(clusters["start"], kind = "mergesort")]
+
+	result = numpy.empty(len(clusters), dtype = TRIGGER_DTYPE)
+	for name in tile[:3]:
+		result[name] = triggers[name][0]
+	for name in names:
+		result[name] = clusters[name]
+	return result
@@ -27,7 +27,6 @@
 
 
 from collections import deque
-import json
 import optparse
 import os
 import threading
@@ -105,6 +104,7 @@ class MultiChannelHandler(simplehandler.Handler):
 		self.basename = basename
 		self.waveform_type = options.waveform
 		self.psds = {}
+		self._waveform_params = {}
 
 		# format channel names for features
 		self.channels = []
@@ -172,6 +172,9 @@ class MultiChannelHandler(simplehandler.Handler):
 		elif self.save_format == 'kafka':
 			check_kafka()
 			self.kafka_partition = options.kafka_partition
+			self.packet_format = options.packet_format
+			if self.packet_format not in utils.PACKET_FORMATS:
+				raise ValueError('not a valid packet format option')
 			self.kafka_topic = '_'.join([options.kafka_topic, self.job_id])
 			self.kafka_conf = {'bootstrap.servers': options.kafka_server}
 			self.producer = kafka.Producer(self.kafka_conf)
@@ -246,7 +249,7 @@ class MultiChannelHandler(simplehandler.Handler):
 
 				# add features to respective format specified
 				if self.save_format == 'kafka':
-					self.producer.produce(timestamp = self.timestamp, topic = self.kafka_topic, value = json.dumps(feature_subset))
+					self.producer.produce(timestamp = self.timestamp, topic = self.kafka_topic, value = utils.encode_packet(self.timestamp, feature_subset['features'], self.packet_format))
 
 					self.logger.info("pushing features to disk at timestamp = %.3f, latency = %.3f" % (self.timestamp, utils.gps2latency(self.timestamp)))
 					self.producer.poll(0) ### flush out queue of sent packets
@@ -270,8 +273,11 @@ class MultiChannelHandler(simplehandler.Handler):
 				# will happen
 				if mapinfo.data:
 					if (buftime >= self.feature_start_time and buftime <= self.feature_end_time):
-						for row in sngltriggertable.GSTLALSnglTrigger.from_buffer(mapinfo.data):
-							self.process_row(channel, rate, bin_idx, buftime, row)
+						if self.feature_mode == 'timeseries':
+							self.process_rows(channel, rate, bin_idx, buftime, sngltriggertable.GSTLALSnglTrigger.from_buffer(mapinfo.data))
+						else:
+							for row in sngltriggertable.GSTLALSnglTrigger.from_buffer(mapinfo.data):
+								self.process_row(channel, rate, bin_idx, buftime, row)
 				memory.unmap(mapinfo)
 
 			del buf
@@ -305,6 +311,45 @@ class MultiChannelHandler(simplehandler.Handler):
 			timestamp = utils.floor_div(buftime, self.buffer_size)
 			self.feature_queue.append(timestamp, channel_name, feature_row)
 
+	def process_rows(self, channel, rate, bin_idx, buftime, rows):
+		"""
+		Given a channel, rate, and the current buffer
+		time, will process all rows from a gstreamer buffer
+		at once. Used in timeseries mode.
+		"""
+		# if segments provided, ensure that triggers fall within these segments
+		if self.frame_segments[self.instrument]:
+			rows = [row for row in rows if self.frame_segments[self.instrument].intersects_segment(segments.segment(LIGOTimeGPS(row.end_time, row.end_time_ns), LIGOTimeGPS(row.end_time, row.end_time_ns)))]
+		if not rows:
+			return
+
+		features = numpy.empty((len(rows),), dtype = self.feature_queue.dtype)
+		features['timestamp'] = utils.floor_div(buftime, 1. / self.sample_rate)
+		features['time'] = numpy.fromiter((row.end_time + row.end_time_ns * 1e-9 for row in rows), dtype = numpy.float64, count = len(rows))
+		features['snr'] = numpy.fromiter((row.snr for row in rows), dtype = numpy.float32, count = len(rows))
+		features['phase'] = numpy.fromiter((row.phase for row in rows), dtype = numpy.float32, count = len(rows))
+		waveforms = self.waveform_params(channel, rate, bin_idx)[numpy.fromiter((row.channel_index for row in rows), dtype = int, count = len(rows))]
+		for column in ('frequency', 'q', 'duration'):
+			features[column] = waveforms[column]
+
+		timestamp = utils.floor_div(buftime, self.buffer_size)
+		self.feature_queue.extend(timestamp, self.bin_to_channel(channel, bin_idx), features)
+
+	def waveform_params(self, channel, rate, bin_idx):
+		"""
+		Given a channel, rate and frequency bin index, return the
+		frequency, q and duration of its waveforms as a structured
+		array, indexed by a row's channel index.
+		"""
+		try:
+			return self._waveform_params[(channel, rate, bin_idx)]
+		except KeyError:
+			num_waveforms = len(self.waveforms[channel].index_by_bin(rate)[bin_idx])
+			waveforms = [self.waveforms[channel].index_to_waveform(rate, bin_idx, row_idx) for row_idx in range(num_waveforms)]
+			params = numpy.array([(waveform['frequency'], waveform['q'], waveform['duration']) for waveform in waveforms], dtype = utils.feature_dtype(('frequency', 'q', 'duration')))
+			self._waveform_params[(channel, rate, bin_idx)] = params
+			return params
+
 	def bin_to_channel(self, channel, bin_idx):
 		"""
 		Given a frequency bin index and a channel name,
@@ -506,6 +551,7 @@ def append_options(parser):
 	group.add_option("--kafka-partition", metavar = "string", help = "If using Kafka, sets the partition that this feature extractor is assigned to.")
 	group.add_option("--kafka-topic", metavar = "string", help = "If using Kafka, sets the topic name that this feature extractor publishes feature vector subsets to.")
 	group.add_option("--kafka-server", metavar = "string", help = "If using Kafka, sets the server url that the kafka topic is hosted on.")
+	group.add_option("--packet-format", metavar = "string", default = "json", help = "If using Kafka, sets the encoding (json/binary) of feature packets published to the topic. Consumers accept either. Default = json")
 	group.add_option("--job-id", type = "string", default = "0001", help = "Sets the job identication of the feature extractor with a 4 digit integer string code, padded with zeros. Default = 0001")
 	parser.add_option_group(group)
 
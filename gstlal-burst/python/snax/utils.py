@@ -28,9 +28,12 @@
 from collections import Counter, defaultdict, deque
 import glob
 import itertools
+import json
 import logging
+import math
 import operator
 import os
+import struct
 import timeit
 
 import h5py
@@ -112,6 +115,135 @@ def feature_dtype(columns):
 	"""
 	return [(column, numpy.float64) if 'time' in column else (column, numpy.float32) for column in columns]
 
+def feature_rows(data):
+	"""
+	given a structured array of regularly sampled features, as produced by
+	a TimeseriesFeatureQueue, returns a list holding a dict of column values
+	for each sample with a feature and None for each sample without one.
+	This is the representation used in JSON feature packets.
+	"""
+	columns = data.dtype.names
+	time_idx = columns.index('time')
+	return [dict(zip(columns, row)) if row[time_idx] == row[time_idx] else None for row in data.tolist()]
+
+def feature_array(rows, columns):
+	"""
+	given a list of dicts of column values and/or Nones, as found in JSON
+	feature packets, returns a double-precision structured array with the
+	given columns, the inverse of feature_rows(). Rows that are None are
+	filled with NaNs.
+	"""
+	data = numpy.full((len(rows),), numpy.nan, dtype = [(column, numpy.float64) for column in columns])
+	for idx, row in enumerate(rows):
+		if row:
+			data[idx] = tuple(row.get(column, numpy.nan) for column in columns)
+	return data
+
+#----------------------------------
+### feature packet utilities
+
+PACKET_FORMATS = ('json', 'binary')
+
+### columns assumed for JSON feature packets containing no features
+FEATURE_COLUMNS = ('timestamp', 'time', 'snr', 'phase', 'frequency', 'q', 'duration')
+
+### binary feature packets consist of a header (magic, format version,
+### timestamp, number of channels, number of samples per channel, metadata
+### length), JSON metadata holding the channel names and the (column, dtype)
+### pairs, then a (channels x samples) array for each column in turn.
+### channels with fewer rows than others are padded with NaNs, as are
+### samples without a feature
+PACKET_MAGIC = b'SNAX'
+PACKET_VERSION = 1
+PACKET_HEADER = struct.Struct('<4sHdIII')
+
+def encode_packet(timestamp, features, packet_format = 'json'):
+	"""
+	Encode a timestamp and its features, a dict mapping channels to
+	structured arrays (or lists of row dicts), as a feature packet in the
+	given format (json/binary).
+
+	>>> features = {'channel1': numpy.array([(123450.25, 5.5), (numpy.nan, numpy.nan)], dtype=feature_dtype(['time', 'snr']))}
+	>>> encode_packet(123450, features)
+	b'{"timestamp": 123450, "features": {"channel1": [{"time": 123450.25, "snr": 5.5}, null]}}'
+	>>> packet = decode_packet(encode_packet(123450, features, packet_format='binary'))
+	>>> packet['timestamp']
+	123450
+	>>> feature_rows(packet['features']['channel1'])
+	[{'time': 123450.25, 'snr': 5.5}, None]
+
+	"""
+	if packet_format == 'json':
+		features = {channel: (feature_rows(rows) if isinstance(rows, numpy.ndarray) else rows) for channel, rows in features.items()}
+		return json.dumps({'timestamp': timestamp, 'features': features}).encode('utf-8')
+
+	elif packet_format == 'binary':
+		channels = list(features.keys())
+		arrays = [rows if isinstance(rows, numpy.ndarray) else None for rows in features.values()]
+		if any(rows is None for rows in arrays):
+			columns = _json_columns(rows for rows in features.values() if not isinstance(rows, numpy.ndarray))
+			arrays = [rows if rows is not None else feature_array(features[channel], columns) for channel, rows in zip(channels, arrays)]
+		dtype = arrays[0].dtype if arrays else numpy.dtype(feature_dtype(FEATURE_COLUMNS))
+		num_samples = max(len(rows) for rows in arrays) if arrays else 0
+
+		### pack rows into a single array
+		data = numpy.full((len(channels), num_samples), numpy.nan, dtype = dtype)
+		for idx, rows in enumerate(arrays):
+			if rows.dtype == dtype:
+				data[idx, :len(rows)] = rows
+			else:
+				for column in dtype.names:
+					data[column][idx, :len(rows)] = rows[column]
+
+		metadata = json.dumps({'channels': channels, 'columns': [(column, dtype[column].str) for column in dtype.names]}).encode('utf-8')
+		header = PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, timestamp, len(channels), num_samples, len(metadata))
+		return b''.join([header, metadata] + [numpy.ascontiguousarray(data[column]).tobytes() for column in dtype.names])
+
+	else:
+		raise ValueError('unknown packet format %s, must be one of %s' % (packet_format, ', '.join(PACKET_FORMATS)))
+
+def decode_packet(value):
+	"""
+	Decode a feature packet in either format, returning a dict with the
+	packet's timestamp and its features as a dict mapping channels to
+	structured arrays, with NaNs for samples without a feature.
+	"""
+	if value[:len(PACKET_MAGIC)] != PACKET_MAGIC:
+		packet = json.loads(value)
+		columns = _json_columns(packet['features'].values())
+		packet['features'] = {channel: feature_array(rows, columns) for channel, rows in packet['features'].items()}
+		return packet
+
+	magic, version, timestamp, num_channels, num_samples, metadata_length = PACKET_HEADER.unpack_from(value)
+	if version != PACKET_VERSION:
+		raise ValueError('unsupported feature packet version %d' % version)
+	offset = PACKET_HEADER.size
+	metadata = json.loads(value[offset:offset + metadata_length])
+	offset += metadata_length
+
+	### unpack columns into a single array
+	dtype = numpy.dtype([(str(column), coltype) for column, coltype in metadata['columns']])
+	data = numpy.empty((num_channels, num_samples), dtype = dtype)
+	for column in dtype.names:
+		count = num_channels * num_samples
+		data[column] = numpy.frombuffer(value, dtype = dtype[column], count = count, offset = offset).reshape((num_channels, num_samples))
+		offset += count * dtype[column].itemsize
+
+	if timestamp.is_integer():
+		timestamp = int(timestamp)
+	return {'timestamp': timestamp, 'features': dict(zip(metadata['channels'], data))}
+
+def _json_columns(channel_rows):
+	"""
+	Returns the numeric columns of the first row found in the given lists
+	of row dicts.
+	"""
+	for rows in channel_rows:
+		for row in rows:
+			if row:
+				return [column for column, value in row.items() if isinstance(value, (int, float))]
+	return list(FEATURE_COLUMNS)
+
 #----------------------------------
 ### gps time utilities
 
@@ -309,10 +441,19 @@ class HDF5TimeseriesFeatureData(FeatureData):
 		time_idx = (timestamp - self.last_save_time) * self.sample_rate
 
 		for key in features.keys():
-			for row_idx, row in enumerate(features[key]):
-				if row:
-					idx = int(time_idx + row_idx)
-					self.feature_data[key][idx] = numpy.array(tuple(row[col] for col in self.columns), dtype=self.dtype)
+			if isinstance(features[key], numpy.ndarray):
+				### structured array from a TimeseriesFeatureQueue,
+				### copy over samples with features
+				rows = features[key]
+				present = numpy.flatnonzero(numpy.isfinite(rows['time']))
+				data = self.feature_data[key][int(time_idx):int(time_idx) + len(rows)]
+				for col in self.columns:
+					data[col][present] = rows[col][present]
+			else:
+				for row_idx, row in enumerate(features[key]):
+					if row:
+						idx = int(time_idx + row_idx)
+						self.feature_data[key][idx] = numpy.array(tuple(row[col] for col in self.columns), dtype=self.dtype)
 
 	def clear(self):
 		for key in self.keys:
@@ -359,6 +500,13 @@ class TimeseriesFeatureQueue(object):
 	Class for storing regularly sampled feature data.
 	NOTE: assumes that ingested features are time ordered.
 
+	Features are aggregated into preallocated structured arrays, one
+	per timestamp, holding a row per channel and sample.  Only the
+	loudest feature in each sample is kept, samples without a feature
+	are NaN.  The arrays are recycled once they have been popped, so
+	the features returned by pop() are views that remain valid until
+	the next call to pop().
+
 	Example:
 		>>> # create the queue
 		>>> columns = ['time', 'snr']
@@ -372,8 +520,14 @@ class TimeseriesFeatureQueue(object):
 		>>> row = queue.pop()
 		>>> row['timestamp']
 		123450
-		>>> row['features']['channel1']
+		>>> feature_rows(row['features']['channel1'])
 		[{'time': 123450.3, 'snr': 3.0}]
+		>>> # add several features at once, keeping the loudest
+		>>> features = numpy.array([(123453.2, 4.0), (123453.6, 7.5), (123453.9, 5.0)], dtype=feature_dtype(columns))
+		>>> queue.extend(123453, 'channel1', features)
+		>>> queue.flush()
+		>>> [feature_rows(queue.pop()['features']['channel1']) for i in range(len(queue))]
+		[[{'time': 123451.7, 'snr': 6.5}], [{'time': 123452.4, 'snr': 5.199999809265137}], [{'time': 123453.6, 'snr': 7.5}]]
 
 	"""
 	def __init__(self, channels, columns, **kwargs):
@@ -382,52 +536,106 @@ class TimeseriesFeatureQueue(object):
 		self.sample_rate = kwargs.pop('sample_rate')
 		self.buffer_size = kwargs.pop('buffer_size')
 		self.num_streams = kwargs.pop('num_streams', len(channels))
+		self.num_samples = max(int(round(self.sample_rate * self.buffer_size)), 1)
+		self.dtype = numpy.dtype(feature_dtype(columns))
+		self.channel_index = {channel: idx for idx, channel in enumerate(channels)}
 		self.out_queue = deque(maxlen = 5)
 		self.in_queue = {}
 		self.counter = Counter()
 		self.last_timestamp = None
 		self.effective_latency = 2 # NOTE: set so that late features are not dropped
 
-	def append(self, timestamp, channel, row):
-		if not self.last_timestamp:
-			self.last_timestamp = timestamp
-
-		if timestamp >= self.last_timestamp:
-			### create new buffer if one isn't available for new timestamp
-			if timestamp not in self.in_queue:
-				self.in_queue[timestamp] = self._create_buffer()
-			self.counter[timestamp] += 1
+		### ring of buffers, enough for the timestamps being filled,
+		### those waiting to be popped and the one last popped
+		self._free = deque(self._create_buffer() for ii in range(self.effective_latency + self.out_queue.maxlen + 1))
+		self._popped = None
 
+	def append(self, timestamp, channel, row):
+		"""
+		Add a single feature, given as a dict of column values.
+		"""
+		if self._accept(timestamp):
 			### store row, aggregating if necessary
-			idx = self._idx(row['time'])
-			if not self.in_queue[timestamp][channel][idx] or (row['snr'] > self.in_queue[timestamp][channel][idx]['snr']):
-				self.in_queue[timestamp][channel][idx] = row
-
-			### check if there's enough new samples that the oldest sample needs to be pushed
-			if self.counter[self.last_timestamp] == self.num_streams or len(self.counter) >= self.effective_latency:
-				self.out_queue.append({'timestamp': self.last_timestamp, 'features': self.in_queue.pop(self.last_timestamp)})
-				del self.counter[self.last_timestamp]
-				try:
-					self.last_timestamp = min(self.counter.keys())
-				except ValueError:
-					self.last_timestamp = None
+			buf = self.in_queue[timestamp]
+			idx = self.channel_index[channel], int(math.floor(((row['time'] / self.buffer_size) % 1) * self.buffer_size * self.sample_rate))
+			if not buf[idx]['snr'] >= row['snr']:
+				buf[idx] = tuple(row.get(column, numpy.nan) for column in self.columns)
+			self._push_ready()
 
+	def extend(self, timestamp, channel, rows):
+		"""
+		Add several features from one stream at once, given as a
+		structured array with (at least) the queue's columns.
+		"""
+		if len(rows) and self._accept(timestamp):
+			### keep the loudest row in each sample
+			idx = self._idx(rows['time'])
+			order = numpy.lexsort((rows['snr'], idx))
+			idx = idx[order]
+			loudest = numpy.append(idx[1:] != idx[:-1], True)
+			idx, rows = idx[loudest], rows[order[loudest]]
+
+			### and only if it's louder than what's stored
+			buf = self.in_queue[timestamp][self.channel_index[channel]]
+			louder = ~(buf['snr'][idx] >= rows['snr'])
+			idx = idx[louder]
+			for column in self.columns:
+				buf[column][idx] = rows[column][louder]
+			self._push_ready()
 
 	def pop(self):
 		if len(self):
-			return self.out_queue.popleft()
+			if self._popped is not None:
+				self._free.append(self._popped)
+			feature_subset = self.out_queue.popleft()
+			self._popped = feature_subset['buffer']
+			return {'timestamp': feature_subset['timestamp'], 'features': dict(zip(self.channels, self._popped))}
 
 	def flush(self):
 		while self.in_queue:
 			oldest_timestamp = min(self.counter.keys())
 			del self.counter[oldest_timestamp]
-			self.out_queue.append({'timestamp': oldest_timestamp, 'features': self.in_queue.pop(oldest_timestamp)})
+			self._push(oldest_timestamp)
+
+	def _accept(self, timestamp):
+		"""
+		Count a new feature at this timestamp, creating a buffer for it if
+		needed.  Returns False if the timestamp has already been pushed.
+		"""
+		if not self.last_timestamp:
+			self.last_timestamp = timestamp
+		if timestamp < self.last_timestamp:
+			return False
+
+		### create new buffer if one isn't available for new timestamp
+		if timestamp not in self.in_queue:
+			buf = self._free.popleft() if self._free else self._create_buffer()
+			buf.fill(numpy.nan)
+			self.in_queue[timestamp] = buf
+		self.counter[timestamp] += 1
+		return True
+
+	def _push_ready(self):
+		### check if there's enough new samples that the oldest sample needs to be pushed
+		if self.counter[self.last_timestamp] >= self.num_streams or len(self.counter) >= self.effective_latency:
+			del self.counter[self.last_timestamp]
+			self._push(self.last_timestamp)
+			try:
+				self.last_timestamp = min(self.counter.keys())
+			except ValueError:
+				self.last_timestamp = None
+
+	def _push(self, timestamp):
+		### recycle the buffer of the oldest timestamp if it is about to be dropped
+		if len(self.out_queue) == self.out_queue.maxlen:
+			self._free.append(self.out_queue[0]['buffer'])
+		self.out_queue.append({'timestamp': timestamp, 'buffer': self.in_queue.pop(timestamp)})
 
 	def _create_buffer(self):
-		return defaultdict(lambda: [None for ii in range(int(self.sample_rate * self.buffer_size))])
+		return numpy.empty((len(self.channels), self.num_samples), dtype = self.dtype)
 
 	def _idx(self, timestamp):
-		return int(numpy.floor(((timestamp / self.buffer_size) % 1) * self.buffer_size *self.sample_rate))
+		return (numpy.floor(((timestamp / self.buffer_size) % 1) * self.buffer_size * self.sample_rate)).astype(int)
 
 	def __len__(self):
 		return len(self.out_queue)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of each stage of the SNAX Kafka chain for each
+feature packet format, without Kafka:  encoding in the feature extractor,
+decoding, combining and re-encoding in gstlal_snax_synchronize, and
+decoding in gstlal_snax_sink (including appending to its HDF5 feature
+data), gstlal_snax_aggregate and gstlal_snax_monitor.
+
+Example:
+
+	./snax_packet_benchmark.py --channels 5000 --sample-rate 16 --jobs 4
+"""
+
+
+from optparse import OptionParser
+import time
+
+
+import numpy
+from gstlal.snax import utils
+
+
+parser = OptionParser(description = __doc__)
+parser.add_option("--channels", metavar = "count", type = "int", default = 2000, help = "Number of channels in all (default = 2000).")
+parser.add_option("--sample-rate", metavar = "Hz", type = "int", default = 16, help = "Feature sample rate (default = 16).")
+parser.add_option("--jobs", metavar = "count", type = "int", default = 4, help = "Number of feature extractor jobs the channels are divided between (default = 4).")
+parser.add_option("--fill", metavar = "fraction", type = "float", default = 0.5, help = "Fraction of samples with a feature (default = 0.5).")
+parser.add_option("--repeat", metavar = "count", type = "int", default = 10, help = "Time each stage this many times and report the best (default = 10).")
+options, filenames = parser.parse_args()
+
+
+columns = ['timestamp', 'time', 'snr', 'phase', 'frequency', 'q', 'duration']
+channels = ["H1:AUX-CHANNEL_%d_32_2048" % idx for idx in range(options.channels)]
+timestamp = 1234567890
+rng = numpy.random.RandomState(0)
+
+
+#
+# one packet's worth of features per job, as popped from a
+# TimeseriesFeatureQueue
+#
+
+
+subsets = []
+for job_channels in numpy.array_split(numpy.array(channels), options.jobs):
+	queue = utils.TimeseriesFeatureQueue(list(job_channels), columns, sample_rate = options.sample_rate, buffer_size = 1, num_streams = len(job_channels))
+	for channel in job_channels:
+		rows = numpy.zeros((options.sample_rate,), dtype = queue.dtype)
+		for column in columns:
+			rows[column] = rng.uniform(1., 100., len(rows))
+		rows['timestamp'] = timestamp
+		rows['time'] = timestamp + (numpy.arange(len(rows)) + rng.uniform(0., 1., len(rows))) / options.sample_rate
+		queue.extend(timestamp, channel, rows[rng.uniform(size = len(rows)) < options.fill])
+	queue.flush()
+	subsets.append(queue.pop()['features'])
+
+
+def best_time(func):
+	best = float("inf")
+	for i in range(options.repeat):
+		t_start = time.time()
+		func()
+		best = min(best, time.time() - t_start)
+	return best
+
+
+print("%d channels at %d Hz in %d jobs" % (options.channels, options.sample_rate, options.jobs))
+print("%8s %14s %14s %14s %14s %14s %14s %12s" % ("format", "extract (ms)", "sync (ms)", "sink (ms)", "aggregate (ms)", "monitor (ms)", "total (ms)", "size (kB)"))
+for packet_format in utils.PACKET_FORMATS:
+	packets = [utils.encode_packet(timestamp, features, packet_format) for features in subsets]
+	combined = {}
+	for features in subsets:
+		combined.update(features)
+	synchronized = utils.encode_packet(timestamp, combined, packet_format)
+
+	def extract():
+		for features in subsets:
+			utils.encode_packet(timestamp, features, packet_format)
+
+	def synchronize():
+		features = {}
+		for packet in packets:
+			features.update(utils.decode_packet(packet)['features'])
+		utils.encode_packet(timestamp, features, packet_format)
+
+	feature_data = utils.HDF5TimeseriesFeatureData(columns, channels, cadence = 1, sample_rate = options.sample_rate, waveform = "sine_gaussian")
+	def sink():
+		packet = utils.decode_packet(synchronized)
+		feature_data.append(packet['timestamp'], packet['features'])
+
+	def aggregate():
+		for packet in packets:
+			for channel, rows in utils.decode_packet(packet)['features'].items():
+				rows = rows[numpy.isfinite(rows['time'])]
+				rows['time'].tolist(), rows['snr'].tolist()
+
+	def monitor():
+		utils.decode_packet(synchronized)
+
+	times = [best_time(func) for func in (extract, synchronize, sink, aggregate, monitor)]
+	print("%8s %14.2f %14.2f %14.2f %14.2f %14.2f %14.2f %12.1f" % tuple([packet_format] + [t * 1e3 for t in times] + [sum(times) * 1e3, len(synchronized) / 1024.]))
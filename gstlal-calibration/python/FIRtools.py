@@ -17,10 +17,13 @@
 
 
 import sys
+import decimal
+import functools
 import numpy as np
 import math
 import time
 import timeit
+import warnings
 
 
 #
@@ -152,10 +155,30 @@ def find_smallest_primitive_root_prime(N):
 		coprime += 1	
 
 
-# A function to compute the array of exponentials
-def find_exp_array(N, inverse = False):
+#
+# Arrays of exponentials and the other "plans" used below are cached per length, since
+# computing them costs about as much as a transform.  The cached arrays are read-only;
+# find_exp_array() and find_exp_array2() return copies.
+#
+
+
+plan_cache_size = 64
+
+
+# numpy >= 2.0 computes FFTs natively in long double precision, so we let it do the work.
+# Older versions convert to double, and the vectorized Cooley-Tukey and Bluestein
+# implementations below are used instead.
+numpy_longdouble_fft = np.fft.fft(np.zeros(4, dtype = np.complex256)).dtype == np.complex256
+
+
+@functools.lru_cache(maxsize = plan_cache_size)
+def _prime_factors(N):
+	return tuple(int(factor) for factor in find_prime_factors(N)[:-1])
+
+
+@functools.lru_cache(maxsize = plan_cache_size)
+def _exp_array(N, inverse):
 
-	N = int(N)
 	exp_array = np.zeros(N, dtype = np.complex256)
 
 	# If this is the inverse DFT, just don't negate 2*pi
@@ -164,56 +187,229 @@ def find_exp_array(N, inverse = False):
 	else:
 		prefactor = -two_pi * 1j
 
+	# We know these values right away:
+	exp_array[0] = 1 + 0j
 	if not N % 4:
-		# It's a multiple of 4, so we know these values right away:
-		exp_array[0] = 1 + 0j
 		exp_array[N // 2] = -1 + 0j
+		exp_array[N // 4] = (0 + 1j) if inverse else (0 - 1j)
+		exp_array[3 * N // 4] = np.conj(exp_array[N // 4])
+		n = np.arange(1, N // 4)
+	elif not N % 2:
+		exp_array[N // 2] = -1 + 0j
+		n = np.arange(1, N // 4 + 1)
+	else:
+		n = np.arange(1, N // 2 + 1)
+
+	# Only compute one fourth (or half, if N is odd) of the array, and use symmetry for the rest.
+	exp_array[n] = np.exp(prefactor * n / N)
+	if not N % 2:
+		exp_array[N // 2 - n] = -np.conj(exp_array[n])
+		exp_array[N // 2 + n] = -exp_array[n]
+	exp_array[N - n] = np.conj(exp_array[n])
+
+	exp_array.setflags(write = False)
+	return exp_array
+
+
+# A function to compute the array of exponentials
+def find_exp_array(N, inverse = False):
+
+	return _exp_array(int(N), bool(inverse)).copy()
+
+
+@functools.lru_cache(maxsize = plan_cache_size)
+def _exp_array2(N, inverse):
+
+	# First compute the usual fft array, then rearrange it
+	exp_array2 = _exp_array(2 * N, inverse)[pow(np.arange(N), 2) % (2 * N)]
+	exp_array2.setflags(write = False)
+	return exp_array2
+
+
+# A function to compute the array of exponentials for Bluestein's algorithm
+def find_exp_array2(N, inverse = False):
+
+	return _exp_array2(int(N), bool(inverse)).copy()
+
+
+# The matrix of exponentials for a DFT evaluated according to the definition
+@functools.lru_cache(maxsize = plan_cache_size)
+def _dft_matrix(N, inverse):
+
+	n = np.arange(N)
+	dft_matrix = _exp_array(N, inverse)[np.outer(n, n) % N]
+	dft_matrix.setflags(write = False)
+	return dft_matrix
+
+
+# Phase rotations for the Cooley-Tukey algorithm.  The output of the r'th of p shorter
+# transforms is rotated by twiddles[r - 1, q, m] before it is added to element
+# q * N // p + m of the output.
+@functools.lru_cache(maxsize = plan_cache_size)
+def _twiddles(N, p):
+
+	twiddles = _exp_array(N, False)[np.outer(np.arange(1, p), np.arange(N)) % N].reshape(p - 1, p, N // p)
+	twiddles.setflags(write = False)
+	return twiddles
+
+
+# For Bluestein's algorithm (see below), with N_out outputs.  The padded length, the array of
+# exponentials, and the fft of the padded sequence B_n.
+@functools.lru_cache(maxsize = plan_cache_size)
+def _bluestein_plan(N, N_out, inverse):
+
+	M, prime_factors = find_M(N + N_out - 1)
+	exp_array2 = _exp_array2(N, inverse)
+	b_n = np.conj(exp_array2)
+	B_n = np.concatenate((b_n[:N_out], np.zeros(M - N - N_out + 1, dtype = np.complex256), b_n[1:][::-1]))
+	B_n_fft = _fft(B_n[np.newaxis, :])[0]
+	B_n_fft.setflags(write = False)
+	return M, exp_array2, B_n_fft
+
+
+# The engine behind all the Fourier transforms below.  Transform each row of a 2-D complex256
+# array.  The inverse transform is not normalized.  Without native long double support in
+# numpy, lengths are factored as in the Cooley-Tukey algorithm, and all the shorter
+# transforms at each stage are done at once.  Prime lengths are done as DFTs if they are
+# short, and with Bluestein's algorithm otherwise.
+def _fft(data, inverse = False):
+
+	num_rows, N = data.shape
+
+	if N < 2:
+		return np.array(data, dtype = np.complex256)
+
+	if numpy_longdouble_fft:
 		if inverse:
-			exp_array[N // 4] = 0 + 1j
-			exp_array[3 * N // 4] = 0 - 1j
+			return np.fft.ifft(data, norm = "forward")
 		else:
-			exp_array[N // 4] = 0 - 1j
-			exp_array[3 * N // 4] = 0 + 1j
+			return np.fft.fft(data)
 
-		# Only compute one fourth of the array, and use symmetry for the rest.
-		for n in range(1, N // 4):
-			exp_array[n] = np.exp(prefactor * n / N)
-			exp_array[N // 2 - n] = -np.conj(exp_array[n])
-			exp_array[N // 2 + n] = -exp_array[n]
-			exp_array[N - n] = np.conj(exp_array[n])
+	factor = _prime_factors(N)[0]
+	if factor == N:
+		if N < 37:
+			return np.matmul(data, _dft_matrix(N, inverse))
+		return _bluestein(data, inverse = inverse)
+
+	# We will break this up into smaller Fourier transforms, of every factor'th sample
+	N_mini = N // factor
+	mini_ffts = _fft(data.reshape(num_rows, N_mini, factor).transpose(0, 2, 1).reshape(num_rows * factor, N_mini), inverse = inverse).reshape(num_rows, factor, 1, N_mini)
+
+	# Now "mix" the output: apply phase rotations and add them all to each output location.
+	twiddles = _twiddles(N, factor)
+	if inverse:
+		twiddles = np.conj(twiddles)
+	fd_data = np.repeat(mini_ffts[:, 0], factor, axis = 1)
+	for i in range(1, factor):
+		fd_data += twiddles[i - 1] * mini_ffts[:, i]
+
+	return fd_data.reshape(num_rows, N)
+
+
+# Bluestein's algorithm for each row of a 2-D complex256 array, computing only the first
+# N_out outputs (see prime_fft() for a description).
+def _bluestein(data, inverse = False, N_out = None):
+
+	N = data.shape[1]
+	if N_out is None:
+		N_out = N
+	M, exp_array2, B_n_fft = _bluestein_plan(N, N_out, inverse)
+	A_n = np.zeros((len(data), M), dtype = np.complex256)
+	A_n[:, :N] = data * exp_array2
+	long_data = _fft(_fft(A_n) * B_n_fft, inverse = True) / M
+
+	return exp_array2[:N_out] * long_data[:, :N_out]
 
-	elif not N % 2:
-		# It's a multiple of 2, so we know these values right away:
-		exp_array[0] = 1 + 0j
-		exp_array[N // 2] = -1 + 0j
 
-		# Only compute one fourth of the array, and use symmetry for the rest.
-		for n in range(1, N // 4 + 1):
-			exp_array[n] = np.exp(prefactor * n / N)
-			exp_array[N // 2 - n] = -np.conj(exp_array[n])
-			exp_array[N // 2 + n] = -exp_array[n]
-			exp_array[N - n] = np.conj(exp_array[n])
+# Real-input fft of each row of a 2-D float128 array, returning N // 2 + 1 samples.
+# For even N, the even and odd samples are transformed together as the real and imaginary
+# parts of one complex sequence of half the length.
+def _rfft(td_data):
 
+	num_rows, N = td_data.shape
+	N_out = N // 2 + 1
+
+	if numpy_longdouble_fft:
+		fd_data = np.fft.rfft(td_data)
+	elif N % 2:
+		fd_data = _fft(np.complex256(td_data))[:, :N_out]
 	else:
-		# It's odd, but we still know this:
-		exp_array[0] = 1 + 0j
+		half_N = N // 2
+		z = _fft(td_data[:, 0::2] + 1j * td_data[:, 1::2])
+		k = np.arange(N_out)
+		z_k = z[:, k % half_N]
+		z_conj = np.conj(z[:, (half_N - k) % half_N])
+		fd_data = (z_k + z_conj) / 2 - 0.5j * _exp_array(N, False)[k] * (z_k - z_conj)
+
+	# The DC and Nyquist components are real
+	fd_data[:, 0] = np.real(fd_data[:, 0])
+	if not N % 2:
+		fd_data[:, -1] = np.real(fd_data[:, -1])
 
-		# Only compute half of the array, and use symmetry for the rest.
-		for n in range(1, N // 2 + 1):
-			exp_array[n] = np.exp(prefactor * n / N)
-			exp_array[N - n] = np.conj(exp_array[n])
+	return fd_data
 
-	return exp_array
 
+# Inverse of _rfft(), without normalization, for output length N.  The imaginary parts of
+# the DC and Nyquist components are ignored.
+def _irfft(fd_data, N):
+
+	half_N = N // 2
+	fd_data = np.array(fd_data[:, :half_N + 1], dtype = np.complex256)
+	fd_data[:, 0] = np.real(fd_data[:, 0])
+	if not N % 2:
+		fd_data[:, -1] = np.real(fd_data[:, -1])
+
+	if numpy_longdouble_fft:
+		return np.fft.irfft(fd_data, n = N, norm = "forward")
+	elif N % 2:
+		return np.real(_fft(np.concatenate((fd_data, np.conj(fd_data[:, 1:][:, ::-1])), axis = 1), inverse = True))
+	else:
+		# Undo the mixing done by _rfft() to get the transforms of the even and odd samples
+		k = np.arange(half_N)
+		x_k = fd_data[:, k]
+		x_k_plus_half_N = np.conj(fd_data[:, half_N - k])
+		z = _fft((x_k + x_k_plus_half_N) + 1j * _exp_array(N, True)[k] * (x_k - x_k_plus_half_N), inverse = True)
+		td_data = np.zeros((len(fd_data), N), dtype = np.float128)
+		td_data[:, 0::2] = np.real(z)
+		td_data[:, 1::2] = np.imag(z)
+		return td_data
 
-# A function to compute the array of exponentials for Bluestein's algorithm
-def find_exp_array2(N, inverse = False):
 
-	# First compute the usual fft array
-	exp_array = find_exp_array(2 * N, inverse = inverse)
+# Find N, the original number of samples of a real-input transform. If the imaginary part
+# of the last sample is zero, assume N was even
+def _find_N(fd_data):
 
-	# Rearrange it
-	return exp_array[pow(np.arange(N), 2) % (2 * N)]
+	N_in = len(fd_data)
+	if np.imag(fd_data[-1]) == 0:
+		return (N_in - 1) * 2
+	elif np.real(fd_data[-1]) == 0:
+		return N_in * 2 - 1
+	elif abs(np.imag(fd_data[-1]) / np.real(fd_data[-1])) < 1e-14:
+		return (N_in - 1) * 2
+	else:
+		return N_in * 2 - 1
+
+
+# Evaluate rows of the matrix of exponentials times a vector in blocks, to bound the memory
+# used for the matrix.
+def _dft_rows(data, exp_array, rows):
+
+	N = len(data)
+	n = np.arange(N)
+	fd_data = np.zeros(len(rows), dtype = np.complex256)
+	block = max(1, (1 << 20) // max(N, 1))
+	for i in range(0, len(rows), block):
+		fd_data[i : i + block] = np.matmul(exp_array[np.outer(rows[i : i + block], n) % N], data)
+
+	return fd_data
+
+
+#
+# The functions below keep the interfaces of the original implementations.  The arrays of
+# exponentials and other plan arguments may still be passed in, but any that are omitted
+# are taken from the cache instead of being recomputed.  Setting return_double = True
+# computes the transform in double precision using numpy.
+#
 
 
 # First, a discrete Fourier transform, evaluated according to the definition
@@ -222,25 +418,9 @@ def dft(td_data, exp_array = None, return_double = False, inverse = False):
 	N = len(td_data)
 
 	if exp_array is None:
-		# Make array of exp(-2 pi i f t) to multiply.  This is expensive, so only make
-		# the code do it once.
-		exp_array = find_exp_array(N, inverse = inverse)
-
-	fd_data = np.zeros(N, dtype = np.complex256)
+		exp_array = _exp_array(N, inverse)
 
-	# The first term is the DC component, which is just the sum.
-	fd_data[0] = sum(np.complex256(td_data))
-
-	# Since this function is most often called by fft(), N is most likely a prime, so assume
-	# there are no more trivial multiplications
-	if N == 2:
-		fd_data[1] += td_data[0]
-		fd_data[1] -= td_data[1]
-	else:
-		for i in range(1, N):
-			fd_data[i] += td_data[0]
-			for j in range(1, N):
-				fd_data[i] += td_data[j] * exp_array[i * j % N]
+	fd_data = _dft_rows(np.complex256(td_data), exp_array, np.arange(N))
 
 	if return_double:
 		return np.complex128(fd_data)
@@ -261,40 +441,20 @@ def idft(fd_data, exp_array = None, return_double = False, normalize = True):
 
 
 # If the input is real, the output is conjugate-symmetric: fd_data[n] = conj(fd_data[N - n]).
-# We can reduce the number of operations by a factor of ~2.  Also, we have the option to only
-# output half of the result, since the second half is redundant.
+# We have the option to only output half of the result, since the second half is redundant.
 def rdft(td_data, exp_array = None, return_double = False, return_full = False):
 
 	N = len(td_data)
 	N_out = N // 2 + 1
 
 	if exp_array is None:
-		# Make array of exp(-2 pi i f t) to multiply.  This is expensive, so only make
-		# the code do it once.
-		exp_array = find_exp_array(N)
-
-	if return_full:
-		fd_data = np.zeros(N, dtype = np.complex256)
-	else:
-		fd_data = np.zeros(N_out, dtype = np.complex256)
-
-	# The first term is the DC component, which is just the sum.
-	fd_data[0] = sum(np.complex256(td_data))
+		exp_array = _exp_array(N, False)
 
-	# Since this function is most often called by fft(), N is most likely a prime, so assume
-	# there are no more trivial multiplications
-	if N == 2:
-		fd_data[1] += td_data[0]
-		fd_data[1] -= td_data[1]
-	else:
-		for i in range(1, N_out):
-			fd_data[i] += td_data[0]
-			for j in range(1, N):
-				fd_data[i] += td_data[j] * exp_array[i * j % N]
+	fd_data = _dft_rows(np.float128(td_data), exp_array, np.arange(N_out))
 
 	if return_full and N > 2:
 		# Then fill in the second half
-		fd_data[N_out : N] = np.conj(fd_data[1 : N - N_out + 1][::-1])
+		fd_data = np.concatenate((fd_data, np.conj(fd_data[1 : N - N_out + 1][::-1])))
 
 	if return_double:
 		return np.complex128(fd_data)
@@ -309,50 +469,21 @@ def irdft(fd_data, exp_array = None, return_double = False, N = None, normalize
 	N_in = len(fd_data)
 
 	if N is None:
-		# Find N, the original number of samples. If the imaginary part of the last
-		# sample is zero, assume N was even
-		if np.imag(fd_data[-1]) == 0:
-			N = (N_in - 1) * 2
-		elif np.real(fd_data[-1]) == 0:
-			N = N_in * 2 - 1
-		elif abs(np.imag(fd_data[-1]) / np.real(fd_data[-1])) < 1e-14:
-			N = (N_in - 1) * 2
-		else:
-			N = N_in * 2 - 1
+		N = _find_N(fd_data)
 
 	if exp_array is None:
-		# Make array of exp(-2 pi i f t) to multiply.  This is expensive, so only make
-		# the code do it once.
-		exp_array = find_exp_array(N, inverse = True)
-
-	td_data = np.zeros(N, dtype = np.float128)
+		exp_array = _exp_array(N, True)
 
-	# The first term is the DC component, which is just the sum.
-	td_data[0] = sum(np.float128(np.real(fd_data))) + sum(np.float128(np.real(fd_data)[1 : 1 + N - N_in]))
-
-	# Since this function is most often called by irfft(), N is most likely a prime, so assume
-	# there are no more trivial multiplications
-	if N == 2:
-		td_data[1] += np.real(fd_data[0])
-		td_data[1] -= np.real(fd_data[1])
-	else:
-		for i in range(1, N):
-			td_data[i] += np.real(fd_data[0])
-			for j in range(1, N_in):
-				td_data[i] += np.real(fd_data[j] * exp_array[i * j % N])
-			for j in range(N_in, N):
-				td_data[i] += np.real(np.conj(fd_data[N - j]) * exp_array[i * j % N])
+	fd_data = np.complex256(fd_data)
+	full_fd_data = np.concatenate((fd_data, np.conj(fd_data[1 : 1 + N - N_in][::-1])))
+	td_data = np.real(_dft_rows(full_fd_data, exp_array, np.arange(N)))
 
 	if normalize:
-		if return_double:
-			return np.float64(td_data / N)
-		else:
-			return td_data / N
+		td_data = td_data / N
+	if return_double:
+		return np.float64(td_data)
 	else:
-		if return_double:
-			return np.float64(td_data)
-		else:
-			return td_data
+		return td_data
 
 
 # A fast Fourier transform using the Cooley-Tukey algorithm, which
@@ -367,72 +498,13 @@ def fft(td_data, prime_factors = None, exp_array = None, return_double = False,
 		else:
 			return np.complex256(td_data)
 
-	if prime_factors is None:
-		# Find prime factors
-		prime_factors = find_prime_factors(N)
-
-		# Check if we will need to use prime_fft() for this
-		if prime_factors[-2] >= 37:
-			# Find the first member greater than or equal to 37
-			i = 0
-			while prime_factors[i] < 37:
-				i += 1
-			M, M_prime_factors = find_M(2 * np.product(prime_factors[i:]) - 1)
-
-			M_exp_array2 = find_exp_array2(np.product(prime_factors[i:]), inverse = inverse)
-			M_exp_array = find_exp_array(M)
-
-	if exp_array is None and prime_factors[0] < 37:
-		# Make array of exp(-2 pi i f t) to multiply.  This is expensive, so only make
-		# the code do it once.
-		exp_array = find_exp_array(N, inverse = inverse)
-
-	if prime_factors[0] >= 37:
-		# Use Bluestein's algorithm for a prime-length fft
-		return prime_fft(td_data, return_double = return_double, inverse = inverse, exp_array2 = M_exp_array2, M = M, prime_factors = M_prime_factors, exp_array = M_exp_array)
-	elif prime_factors[0] == N:
-		# Do an ordinary DFT
-		return dft(td_data, exp_array = exp_array, return_double = return_double)
-	else:
-		# We will break this up into smaller Fourier transforms
-		fd_data = np.zeros(N, dtype = np.complex256)
-		num_ffts = prime_factors[0]
-		N_mini = N // num_ffts
-		for i in range(num_ffts):
-			fd_data[i * N_mini : (i + 1) * N_mini] = fft(td_data[i::num_ffts], prime_factors = prime_factors[1:], exp_array = exp_array[::num_ffts], return_double = False, M = M, M_prime_factors = M_prime_factors, M_exp_array2 = M_exp_array2, M_exp_array = M_exp_array)
-
-		# Now we need to "mix" the output appropriately.  First, copy all but the first fft.
-		fd_data_copy = np.copy(fd_data[N_mini:])
-
-		# Apply phase rotations to all but the first fft
-		for i in range(N_mini, N):
-			exp_index = (i * (i // N_mini)) % N
-			# Do a multiplication only if we have to
-			if(exp_index):
-				fd_data[i] *= exp_array[exp_index]
-
-		# Add the first fft to all the others
-		for i in range(N_mini, N, N_mini):
-			fd_data[i : i + N_mini] += fd_data[:N_mini]
-
-		# Now we have to use the copied data.  Apply phase rotations and add to all other locations.
-		for i in range(N_mini, N):
-			copy_index = i - N_mini
-			dst_indices = list(range(i % N_mini, N, N_mini))
-			# We've already taken care of the below contribution (2 for loops ago), so remove it
-			dst_indices.remove(i)
-			for j in dst_indices:
-				exp_index = (j * (i // N_mini)) % N
-				# Do a multiplication only if we have to
-				if(exp_index):
-					fd_data[j] += fd_data_copy[copy_index] * exp_array[exp_index]
-				else:
-					fd_data[j] += fd_data_copy[copy_index]
-		# Done
-		if return_double:
-			return np.complex128(fd_data)
+	if return_double:
+		if inverse:
+			return np.fft.ifft(np.complex128(td_data), norm = "forward")
 		else:
-			return fd_data
+			return np.fft.fft(np.complex128(td_data))
+
+	return _fft(np.complex256(td_data).reshape(1, N), inverse = inverse)[0]
 
 
 # An inverse fast Fourier transform that factors the length N to break up the
@@ -462,105 +534,16 @@ def rfft(td_data, prime_factors = None, exp_array = None, return_double = False,
 		else:
 			return np.complex256(td_data)
 
-	if prime_factors is None:
-		# Find prime factors
-		prime_factors = find_prime_factors(N)
-
-		# Check if we will need to use prime_rfft() for this
-		if prime_factors[-2] >= 61:
-			# Find the first member greater than or equal to 61
-			i = 0
-			while prime_factors[i] < 61:
-				i += 1
-			M_in = np.product(prime_factors[i:])
-			M_out = M_in // 2 + 1
-			M, M_prime_factors = find_M(M_in + M_out - 1)
-			M_exp_array2 = find_exp_array2(M_in)
-			M_exp_array = find_exp_array(M)
-
-	if exp_array is None and prime_factors[0] < 61:
-		# Make array of exp(-2 pi i f t) to multiply.  This is expensive, so only make
-		# the code do it once.
-		exp_array = find_exp_array(N)
-
-	if prime_factors[0] >= 61:
-		# Use Bluestein's algorithm for a prime-length fft
-		return prime_rfft(td_data, return_double = return_double, return_full = return_full, exp_array2 = M_exp_array2, M = M, prime_factors = M_prime_factors, exp_array = M_exp_array)
-	elif prime_factors[0] == N:
-		# Do an ordinary DFT
-		return rdft(td_data, exp_array = exp_array, return_double = return_double, return_full = return_full)
+	if return_double:
+		fd_data = np.fft.rfft(np.float64(td_data))
 	else:
-		# We will break this up into smaller Fourier transforms.  Therefore, we still
-		# need to allocate enough memory for N elements.
-		fd_data = np.zeros(N, dtype = np.complex256)
-		num_ffts = prime_factors[0]
-		N_mini = N // num_ffts
-		N_mini_out = N_mini // 2 + 1		
-		for i in range(num_ffts):
-			fd_data[i * N_mini : (i + 1) * N_mini] = rfft(td_data[i::num_ffts], prime_factors = prime_factors[1:], exp_array = exp_array[::num_ffts], return_double = False, return_full = True, M = M, M_prime_factors = M_prime_factors, M_exp_array2 = M_exp_array2, M_exp_array = M_exp_array)
-
-		# Now we need to "mix" the output appropriately.  First, copy all but the first fft.
-		populated_indices = [x for x in range(N_mini, N) if x % N_mini < N_mini_out]
-		fd_data_copy = fd_data[populated_indices]
-
-		# Apply phase rotations to all but the first fft
-		for i in range(N_mini, N_out):
-			exp_index = (i * (i // N_mini)) % N
-			# Do a multiplication only if we have to
-			if(exp_index):
-				fd_data[i] *= exp_array[exp_index]
-
-		# Add the first fft to all the others
-		for i in range(N_mini, N_out, N_mini):
-			fd_data[i : i + N_mini] += fd_data[:N_mini]
-
-		# Now we have to use the copied data.  Apply phase rotations and add to all other locations.
-		for i in range(len(fd_data_copy)):
-			original_index = N_mini + i // N_mini_out * N_mini + i % N_mini_out
-			dst_indices = list(range(original_index % N_mini, N_out, N_mini))
-			if original_index in dst_indices:
-				# We've already taken care of this contribution (2 for loops ago), so remove it
-				dst_indices.remove(original_index)
-			for j in dst_indices:
-				exp_index = (j * (original_index // N_mini)) % N
-				# Do a multiplication only if we have to
-				if(exp_index):
-					fd_data[j] += fd_data_copy[i] * exp_array[exp_index]
-				else:
-					fd_data[j] += fd_data_copy[i]
-
-			if original_index % N_mini and original_index % N_mini < (N_mini + 1) // 2:
-				# Then handle the contribution from the complex conjugate
-				original_index += N_mini - 2 * (original_index % N_mini)
-				dst_indices = list(range(original_index % N_mini, N_out, N_mini))
-				if original_index in dst_indices:
-					# We've already taken care of this contribution, so remove it
-					dst_indices.remove(original_index)
-				for j in dst_indices:
-					exp_index = (j * (original_index // N_mini)) % N
-					# Do a multiplication only if we have to
-					if(exp_index):
-						fd_data[j] += np.conj(fd_data_copy[i]) * exp_array[exp_index]
-					else:
-						fd_data[j] += np.conj(fd_data_copy[i])
-
-		if not N % 2:
-			# The Nyquist component is real
-			fd_data[N_out - 1] = np.real(fd_data[N_out - 1]) + 0j
-
-		if return_full and N > 2:
-			# Then fill in the second half
-			fd_data[N_out : N] = np.conj(fd_data[1 : N - N_out + 1][::-1])
-			if return_double:
-				return np.complex128(fd_data)
-			else:
-				return fd_data
-		else:
-			# Shorten the array
-			if return_double:
-				return np.complex128(fd_data[:N_out])
-			else:
-				return fd_data[:N_out]
+		fd_data = _rfft(np.float128(td_data).reshape(1, N))[0]
+
+	if return_full and N > 2:
+		# Then fill in the second half
+		fd_data = np.concatenate((fd_data, np.conj(fd_data[1 : N - N_out + 1][::-1])))
+
+	return fd_data
 
 
 # Inverse of the above real-input FFT.  So the output of this is real and the input is assumed
@@ -576,93 +559,19 @@ def irfft(fd_data, prime_factors = None, exp_array = None, return_double = False
 			return np.float128(fd_data)
 
 	if prime_factors is None:
-		# First, find N, the original number of samples. If the imaginary part of the last
-		# sample is zero, assume N was even
-		if np.imag(fd_data[-1]) == 0:
-			N = (N_in - 1) * 2
-		elif np.real(fd_data[-1]) == 0:
-			N = N_in * 2 - 1
-		elif abs(np.imag(fd_data[-1]) / np.real(fd_data[-1])) < 1e-14:
-			N = (N_in - 1) * 2
-		else:
-			N = N_in * 2 - 1
-		# Find prime factors
-		prime_factors = find_prime_factors(N)
-
-		# Check if we will need to use prime_irfft() for this
-		if prime_factors[-2] >= 17:
-			# Find the first member greater than or equal to 17
-			i = 0
-			while prime_factors[i] < 17:
-				i += 1
-			M_irfft, M_irfft_prime_factors = find_M(2 * np.product(prime_factors[i:]) - 1)
-
-			M_irfft_exp_array2 = find_exp_array2(np.product(prime_factors[i:]), inverse = True)
-			M_irfft_exp_array = find_exp_array(M_irfft)
-
-		# Check if we will need to use prime_fft() for this
-		if prime_factors[-2] >= 37:
-			# Find the first member greater than or equal to 37
-			i = 0
-			while prime_factors[i] < 37:
-				i += 1
-			M_fft, M_fft_prime_factors = find_M(2 * np.product(prime_factors[i:]) - 1)
-
-			M_fft_exp_array2 = find_exp_array2(np.product(prime_factors[i:]), inverse = True)
-			M_fft_exp_array = find_exp_array(M_fft)
-
+		N = _find_N(fd_data)
 	else:
-		N = np.product(prime_factors)
-
-	if exp_array is None and prime_factors[0] < 17:
-		# Make array of exp(-2 pi i f t) to multiply.  This is expensive, so only make
-		# the code do it once.
-		exp_array = find_exp_array(N, inverse = True)
-
-	if prime_factors[0] >= 17:
-		# Use Bluestein's algorithm for a prime-length fft
-		return prime_irfft(fd_data, return_double = return_double, N = N, normalize = normalize, exp_array2 = M_irfft_exp_array2, M = M_irfft, prime_factors = M_irfft_prime_factors, exp_array = M_irfft_exp_array)
-	elif prime_factors[0] == N:
-		# Do an ordinary DFT
-		return irdft(fd_data, exp_array = exp_array, return_double = return_double, N = N, normalize = normalize)
+		N = int(np.prod(prime_factors))
+
+	if return_double:
+		td_data = np.fft.irfft(np.complex128(fd_data), n = N, norm = "forward")
 	else:
-		# We will break this up into smaller Fourier transforms
-		td_data = np.zeros(N, dtype = np.float128)
-		num_ffts = prime_factors[0]
-		N_mini = N // num_ffts
-		td_data[:N_mini] = irfft(fd_data[0::num_ffts], prime_factors = prime_factors[1:], exp_array = exp_array[::num_ffts], return_double = False, normalize = False, M_fft = M_fft, M_fft_prime_factors = M_fft_prime_factors, M_fft_exp_array2 = M_fft_exp_array2, M_fft_exp_array = M_fft_exp_array, M_irfft = M_irfft, M_irfft_prime_factors = M_irfft_prime_factors, M_irfft_exp_array2 = M_irfft_exp_array2, M_irfft_exp_array = M_irfft_exp_array)
-
-		# The rest of the transforms will, in general, produce complex output
-		td_data_complex = np.zeros(N - N_mini, dtype = np.complex256)
-		for i in range(1, num_ffts):
-			td_data_complex[(i - 1) * N_mini : i * N_mini] = fft(np.concatenate((fd_data, np.conj(fd_data)[1 : 1 + N - len(fd_data)][::-1]))[i::num_ffts], prime_factors = prime_factors[1:], exp_array = exp_array[::num_ffts], return_double = False, M = M_fft, M_prime_factors = M_fft_prime_factors, M_exp_array2 = M_fft_exp_array2, M_exp_array = M_fft_exp_array)
-
-		# Now we need to "mix" the output appropriately.  Start by adding the first ifft to the others.
-		for i in range(N_mini, N, N_mini):
-			td_data[i : i + N_mini] += td_data[:N_mini]
-
-		# Now use the complex data.  Apply phase rotations and add real parts to all other locations.
-		for i in range(N_mini, N):
-			complex_index = i - N_mini
-			dst_indices = list(range(i % N_mini, N, N_mini))
-			for j in dst_indices:
-				exp_index = (j * (i // N_mini)) % N
-				# Do a multiplication only if we have to
-				if(exp_index):
-					td_data[j] += np.real(td_data_complex[complex_index] * exp_array[exp_index])
-				else:
-					td_data[j] += np.real(td_data_complex[complex_index])
-		# Done
-		if normalize:
-			if return_double:
-				return np.float64(td_data / N)
-			else:
-				return td_data / N
-		else:
-			if return_double:
-				return np.float64(td_data)
-			else:
-				return td_data
+		td_data = _irfft(np.complex256(fd_data).reshape(1, N_in), N)[0]
+
+	if normalize:
+		td_data = td_data / N
+
+	return td_data
 
 
 # Bluestein's algorithm for FFTs of prime length, for which the Cooley-Tukey algorithm is
@@ -691,28 +600,13 @@ def irfft(fd_data, prime_factors = None, exp_array = None, return_double = False
 # The convolution of A_n and B_n can be evaluated using the convolution theorem and the
 # Cooley-Tukey FFT algorithm:
 # X_k = conj(b_k) * ifft(fft(A_n) * fft(B_n))[:N]
+# The padded length, the exponentials and fft(B_n) are cached for each N.
 
 def prime_fft(td_data, return_double = False, inverse = False, exp_array2 = None, M = None, prime_factors = None, exp_array = None):
 
 	N = len(td_data)
 
-	# Find the array of exponentials.
-	if exp_array2 is None:
-		exp_array2 = find_exp_array2(N, inverse = inverse)
-
-	# Find the sequences we need, padding with zeros as necessary.
-	if M is None or prime_factors is None:
-		M, prime_factors = find_M(2 * N - 1)
-	if exp_array is None:
-		exp_array = find_exp_array(M)
-	A_n = np.concatenate((td_data * exp_array2, np.zeros(M - N, dtype = np.complex256)))
-	b_n = np.conj(exp_array2)
-	B_n = np.concatenate((b_n, np.zeros(M - 2 * N + 1, dtype = np.complex256), b_n[1:][::-1]))
-
-	# Do the convolution using the convolution theorem and the Cooley-Tukey algorithm, and
-	# multiply by exp_array2.
-	long_data = ifft(fft(A_n, prime_factors = prime_factors, exp_array = exp_array) * fft(B_n, prime_factors = prime_factors, exp_array = exp_array), prime_factors = prime_factors, exp_array = np.conj(exp_array))
-	fd_data = exp_array2 * long_data[:N]
+	fd_data = _bluestein(np.complex256(td_data).reshape(1, N), inverse = inverse)[0]
 
 	if return_double:
 		return np.complex128(fd_data)
@@ -728,24 +622,7 @@ def prime_rfft(td_data, return_double = False, return_full = False, exp_array2 =
 	N = len(td_data)
 	N_out = N // 2 + 1
 
-	# Find the array of exponentials.
-	if exp_array2 is None:
-		exp_array2 = find_exp_array2(N)
-
-	# Find the sequences we need, padding with zeros as necessary.
-	if M is None or prime_factors is None:
-		M, prime_factors = find_M(N + N_out - 1)
-	if exp_array is None:
-		exp_array = find_exp_array(M)
-	A_n = np.concatenate((td_data * exp_array2, np.zeros(M - N, dtype = np.complex256)))
-	b_n = np.conj(exp_array2)
-	B_n = np.concatenate((b_n[:N_out], np.zeros(M - N - N_out + 1, dtype = np.complex256), b_n[1:][::-1]))
-
-	# Do the convolution using the convolution theorem and the Cooley-Tukey algorithm, and
-	# multiply by exp_array2.
-	long_data = ifft(fft(A_n, prime_factors = prime_factors, exp_array = exp_array) * fft(B_n, prime_factors = prime_factors, exp_array = exp_array), prime_factors = prime_factors, exp_array = np.conj(exp_array))
-
-	fd_data = exp_array2[:N_out] * long_data[:N_out]
+	fd_data = _bluestein(np.complex256(td_data).reshape(1, N), N_out = N_out)[0]
 	if return_full:
 		fd_data = np.concatenate((fd_data[:N_out], np.conj(fd_data[1:N-N_out+1][::-1])))
 
@@ -762,58 +639,47 @@ def prime_irfft(fd_data, return_double = False, N = None, normalize = True, exp_
 	N_in = len(fd_data)
 
 	if N is None:
-		# Find N, the original number of samples. If the imaginary part of the last
-		# sample is zero, assume N was even
-		if np.imag(fd_data[-1]) == 0:
-			N = (N_in - 1) * 2
-		elif np.real(fd_data[-1]) == 0:
-			N = N_in * 2 - 1
-		elif abs(np.imag(fd_data[-1]) / np.real(fd_data[-1])) < 1e-14:
-			N = (N_in - 1) * 2
-		else:
-			N = N_in * 2 - 1
+		N = _find_N(fd_data)
 
-	# Find the array of exponentials.
-	if exp_array2 is None:
-		exp_array2 = find_exp_array2(N, inverse = True)
-
-	# Find the sequences we need, padding with zeros as necessary.
-	if M is None or prime_factors is None:
-		M, prime_factors = find_M(2 * N - 1)
-	if exp_array is None:
-		exp_array = find_exp_array(M)
-	A_n = np.concatenate((fd_data * exp_array2[:N_in], np.conj(fd_data[1:N-N_in+1][::-1]) * exp_array2[N_in:], np.zeros(M - N, dtype = np.complex256)))
-	b_n = np.conj(exp_array2)
-	B_n = np.concatenate((b_n, np.zeros(M - 2 * N + 1, dtype = np.complex256), b_n[1:][::-1]))
-
-	# Do the convolution using the convolution theorem and the Cooley-Tukey algorithm, and
-	# multiply by exp_array2.
-	long_data = ifft(fft(A_n, prime_factors = prime_factors, exp_array = exp_array) * fft(B_n, prime_factors = prime_factors, exp_array = exp_array), prime_factors = prime_factors, exp_array = np.conj(exp_array))
-	td_data = np.real(exp_array2 * long_data[:N])
+	fd_data = np.complex256(fd_data)
+	full_fd_data = np.concatenate((fd_data, np.conj(fd_data[1:N-N_in+1][::-1])))
+	td_data = np.real(_bluestein(full_fd_data.reshape(1, N), inverse = True)[0])
 
 	if normalize:
-		if return_double:
-			return np.float64(td_data / N)
-		else:
-			return td_data / N
+		td_data = td_data / N
+	if return_double:
+		return np.float64(td_data)
 	else:
-		if return_double:
-			return np.float64(td_data)
-		else:
-			return td_data
+		return td_data
 
 
-def compare_speed(length, iterations = 100, numerator = 'prime_fft', denominator = 'dft'):
+# Time how long one function in this module takes relative to another, on the same random
+# data of the given length.  Functions are named as strings.  Names starting with "np." are
+# taken from numpy, e.g., 'np.fft.rfft', and kwargs are passed to the functions from this
+# module, e.g., {'return_double': True}.  The plans are made before timing starts.
+def compare_speed(length, iterations = 100, numerator = 'prime_fft', denominator = 'dft', kwargs = {}):
 
-	mysetup = 'import numpy as np\nimport longDoubleFFT as fft'
+	data = np.random.rand(length)
+	times = []
+	for name in (numerator, denominator):
+		if name.startswith("np."):
+			func = eval(name)
+			func_kwargs = {}
+		else:
+			func = globals()[name]
+			func_kwargs = kwargs
+		func(data, **func_kwargs)
+		times.append(timeit.timeit(lambda: func(data, **func_kwargs), number = iterations))
 
-	num_command = "fft.%s(np.random.rand(%d))" % (numerator, length)
-	denom_command = "fft.%s(np.random.rand(%d))" % (denominator, length)
+	return times[0] / times[1]
 
-	num = timeit.timeit(setup = mysetup, stmt = num_command, number = iterations)
-	denom = timeit.timeit(setup = mysetup, stmt = denom_command, number = iterations)
 
-	return num / denom
+# Print a table of compare_speed() results for several lengths
+def compare_speeds(lengths, iterations = 100, numerators = ('fft', 'rfft', 'irfft'), denominator = 'np.fft.fft', kwargs = {}):
+
+	print("%10s" % "length" + "".join("%16s" % name for name in numerators))
+	for length in lengths:
+		print("%10d" % length + "".join("%16.3f" % compare_speed(length, iterations = iterations, numerator = name, denominator = denominator, kwargs = kwargs) for name in numerators))
 
 
 def test(a):
@@ -887,7 +753,8 @@ factorials_inv[0] = 1.0
 current = 1
 for n in range(1, 1755):
 	current *= n
-	factorials_inv[n] = 1.0 / np.float128(str(current))
+	# Python >= 3.11 limits the length of str(int), and numpy cannot parse it all anyway
+	factorials_inv[n] = 1.0 / np.float128(format(decimal.Decimal(current), '.30e'))
 
 
 #
@@ -903,33 +770,53 @@ for n in range(1, 1755):
 # Compute a discrete prolate spheroidal sequence (DPSS) window,
 # which maximizes the energy concentration in the central lobe
 
+# A symmetric Toeplitz matrix times a vector is a convolution, so it can be done with FFTs
+# by embedding the matrix in a circulant matrix of a convenient length >= 2N - 1.  This
+# computes the FFT of the zeroth column of that circulant matrix.  Only the first row of
+# the Toeplitz matrix, mat, is needed.  The FFT is done to long double precision if mat is.
+def toeplitz_fft(mat):
+	N = len(mat)
+	M = find_M(2 * N - 1)[0]
+	circulant = np.zeros(M, dtype = mat.dtype)
+	circulant[:N] = mat
+	circulant[M-N+1:] = mat[1:][::-1]
+	if mat.dtype == np.float128:
+		return _rfft(circulant.reshape(1, M))[0]
+	else:
+		return np.fft.rfft(circulant)
+
+
 # A function to multiply a symmetric Toeplitz matrix times a vector and normalize.
 # Assume that only the first row of the matrix is stored, to save memory.
 # Assume that only half of the vector is stored, due to symmetry.
-def mat_times_vec(mat, vec):
+# Pass mat_fft = toeplitz_fft(mat) to avoid recomputing it on every call.
+def mat_times_vec(mat, vec, mat_fft = None):
 	N = len(mat)
 	n = len(vec)
-	outvec = np.zeros(n, dtype = type(mat[0]))
-	for i in range(n):
-		reordered_mat = np.copy(mat[N-1-i:N-1-n-i:-1]) if N > n + i else np.copy(mat[N-1-i::-1])
-		reordered_mat[i:N-n] += mat[:N-n-i]
-		reordered_mat[:i] += mat[i:0:-1]
-		outvec[i] = np.sum(vec * reordered_mat)
+	if mat_fft is None:
+		mat_fft = toeplitz_fft(mat)
+	M = 2 * (len(mat_fft) - 1)
+	# Fill in the second half of the vector
+	long_vec = np.zeros(M, dtype = mat.dtype)
+	long_vec[:n] = vec
+	long_vec[n:N] = vec[::-1][N%2:]
+	if mat.dtype == np.float128:
+		outvec = _irfft(_rfft(long_vec.reshape(1, M)) * mat_fft, M)[0][:n] / M
+	else:
+		outvec = np.fft.irfft(np.fft.rfft(long_vec) * mat_fft, M)[:n]
 	# Normalize
 	return outvec / outvec[-1]
 
 
-def DPSS(N, alpha, return_double = False, max_time = 10):
+def DPSS(N, alpha, return_double = False, max_iterations = 1000, max_time = None):
 
 	N = int(N)
 
-	# Estimate how long each process should take.  This is based on data taken from a Macbook
-	# Pro purchased in 2016.
-	seconds_per_iteration_double = 4.775e-10 * N * N + 1.858e-6 * N
-	seconds_per_iteration_longdouble = 1.296e-9 * N * N + 5.064e-6 * N
-
-	double_iterations = int(max_time / 2.0 / seconds_per_iteration_double)
-	longdouble_iterations = int(max_time / 2.0 / seconds_per_iteration_longdouble)
+	# Each stage of the power iteration below stops once the window stops changing, or after
+	# max_iterations iterations, so the same call always gives the same window.  max_time is
+	# accepted for compatibility but no longer used.
+	if max_time is not None:
+		warnings.warn("DPSS(): max_time is deprecated and ignored, use max_iterations", DeprecationWarning, stacklevel = 2)
 
 	# Start with ordinary double precision to make it run faster.
 	# Angular cutoff frequency times sample period
@@ -938,11 +825,9 @@ def DPSS(N, alpha, return_double = False, max_time = 10):
 	# The DPSS window is the eigenvector associated with the largest eigenvalue of the symmetric
 	# Toeplitz matrix (Toeplitz means all elements along negative sloping diagonals are equal),
 	# where the zeroth column and row are the sampled sinc function below:
-	sinc = np.zeros(N)
-	sinc[0] = omega_c_Ts
-	for i in range(1, N):
-		sinc[i] = np.sin(omega_c_Ts * i) / i
-
+	i = np.arange(1, N, dtype = np.float64)
+	sinc = np.concatenate(([omega_c_Ts], np.sin(omega_c_Ts * i) / i))
+	sinc_fft = toeplitz_fft(sinc)
 
 	# Start by approximating the DPSS window with a Kaiser window with the same value of alpha.
 	# Note that kaiser() takes beta = pi * alpha as an argument.  Due to symmetry, we need to
@@ -957,28 +842,39 @@ def DPSS(N, alpha, return_double = False, max_time = 10):
 	# Compute an estimate of the error: how much the window changes during each iteration.
 	# We will compare this to how much it changes in each iteration at the end as an
 	# indicator of how much the window improved over the original Kaiser window.
-	new_dpss = mat_times_vec(sinc, dpss)
+	new_dpss = mat_times_vec(sinc, dpss, mat_fft = sinc_fft)
 	first_error = sum(pow(dpss - new_dpss, 2))
 
-	for i in range(double_iterations):
-		new_dpss = mat_times_vec(sinc, new_dpss)
+	iterations = 2
+	tolerance = 4 * np.finfo(np.float64).eps
+	for j in range(max_iterations):
+		dpss = new_dpss
+		new_dpss = mat_times_vec(sinc, dpss, mat_fft = sinc_fft)
+		iterations += 1
+		if max(abs(new_dpss - dpss)) <= tolerance:
+			break
 
 	# Now do this with extra precision
 	omega_c_Ts = two_pi * alpha / N
-	sinc = np.zeros(N, dtype = np.float128)
-	sinc[0] = omega_c_Ts
-	for i in range(1, N):
-		sinc[i] = np.sin(omega_c_Ts * i) / i
-
-	for i in range(longdouble_iterations):
-		new_dpss = mat_times_vec(sinc, new_dpss)
+	i = np.arange(1, N, dtype = np.float128)
+	sinc = np.concatenate(([omega_c_Ts], np.sin(omega_c_Ts * i) / i))
+	sinc_fft = toeplitz_fft(sinc)
+	new_dpss = np.float128(new_dpss)
+
+	tolerance = 4 * np.finfo(np.float128).eps
+	for j in range(max_iterations):
+		dpss = new_dpss
+		new_dpss = mat_times_vec(sinc, dpss, mat_fft = sinc_fft)
+		iterations += 1
+		if max(abs(new_dpss - dpss)) <= tolerance:
+			break
 
 	dpss = new_dpss
-	new_dpss = mat_times_vec(sinc, dpss)
+	new_dpss = mat_times_vec(sinc, dpss, mat_fft = sinc_fft)
 	last_error = sum(pow(dpss - new_dpss, 2))
 	dpss = new_dpss
 
-	print("After %d iterations, the RMS error of the DPSS window is approximately %e of what it was originally." % (2 + double_iterations + longdouble_iterations, np.sqrt(last_error / first_error)))
+	print("After %d iterations, the RMS error of the DPSS window is approximately %e of what it was originally." % (iterations, np.sqrt(last_error / first_error)))
 
 	if return_double:
 		dpss = np.float64(dpss)
@@ -534,7 +534,7 @@ def lowpass(pipeline, head, rate, length = 1.0, fcut = 500, filter_latency = 0.5
 
 	# Compute a low-pass filter.
 	lowpass = numpy.sinc(2 * numpy.float128(fcut) / rate * (numpy.arange(numpy.float128(length)) - (length - 1) // 2))
-	lowpass *= fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha, max_time = 10)
+	lowpass *= fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha)
 	lowpass /= numpy.sum(lowpass)
 	lowpass = numpy.float64(lowpass)
 
@@ -554,7 +554,7 @@ def highpass(pipeline, head, rate, length = 1.0, fcut = 10.0, filter_latency = 0
 
 	# Compute a low-pass filter.
 	lowpass = numpy.sinc(2 * numpy.float128(fcut) / rate * (numpy.arange(numpy.float128(length)) - (length - 1) // 2))
-	lowpass *= fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha, max_time = 10)
+	lowpass *= fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha)
 	lowpass /= numpy.sum(lowpass)
 
 	# Create a high-pass filter from the low-pass filter through spectral inversion.
@@ -578,7 +578,7 @@ def bandpass(pipeline, head, rate, length = 1.0, f_low = 100, f_high = 400, filt
 	f_low -= 0.75 * freq_res
 
 	# Make a DPSS window
-	dpss = fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha, max_time = 10)
+	dpss = fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha)
 
 	# Compute a temporary low-pass filter.
 	lowpass = numpy.sinc(2 * numpy.float128(f_low) / rate * (numpy.arange(numpy.float128(length)) - (length - 1) // 2))
@@ -619,7 +619,7 @@ def bandstop(pipeline, head, rate, length = 1.0, f_low = 100, f_high = 400, filt
 	f_low += 0.75 * freq_res
 
 	# Make a DPSS window
-	dpss = fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha, max_time = 10)
+	dpss = fir.kaiser(length, numpy.pi * alpha) # fir.DPSS(length, alpha)
 
 	# Compute a temporary low-pass filter.
 	lowpass = numpy.sinc(2 * numpy.float128(f_low) / rate * (numpy.arange(numpy.float128(length)) - (length - 1) // 2))
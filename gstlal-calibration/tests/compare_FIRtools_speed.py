@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Time the long double Fourier transforms in FIRtools against numpy's double
+precision transforms, and check their accuracy against the transforms
+evaluated according to the definition.  The first call at each length,
+which makes the plans, is not timed.
+
+Example:
+
+	./compare_FIRtools_speed.py --lengths 1000,1024,1031,16384 --dpss-length 1000
+"""
+
+
+#
+# =============================================================================
+#
+#				   Preamble
+#
+# =============================================================================
+#
+
+
+from optparse import OptionParser
+import time
+import timeit
+
+
+import numpy
+from gstlal import FIRtools as fir
+
+
+parser = OptionParser(description = __doc__)
+parser.add_option("--lengths", metavar = "N[,N...]", default = "1000,1024,1031,4096,16384", help = "Comma-separated list of transform lengths (default = \"1000,1024,1031,4096,16384\").")
+parser.add_option("--iterations", metavar = "count", type = "int", default = 20, help = "Time this many calls of each function (default = 20).")
+parser.add_option("--max-dft-length", metavar = "N", type = "int", default = 4096, help = "Check accuracy against fir.dft() and fir.rdft() up to this length (default = 4096).  They are slow.")
+parser.add_option("--dpss-length", metavar = "N", type = "int", help = "Also compute a DPSS window of this length (optional).")
+parser.add_option("--dpss-alpha", metavar = "alpha", type = "float", default = 3., help = "Set alpha for the DPSS window (default = 3).")
+parser.add_option("--dpss-max-iterations", metavar = "count", type = "int", default = 1000, help = "Set the maximum number of power iterations in each precision for the DPSS window (default = 1000).")
+options, filenames = parser.parse_args()
+
+lengths = [int(n) for n in options.lengths.split(",")]
+
+
+#
+# =============================================================================
+#
+#				     Main
+#
+# =============================================================================
+#
+
+
+print("numpy computes long double FFTs natively: %s" % fir.numpy_longdouble_fft)
+print("%10s %10s %12s %12s %12s %12s %12s" % ("length", "function", "np (us)", "double (us)", "long (us)", "long / np", "max err"))
+for N in lengths:
+	td_data = numpy.float128(numpy.random.rand(N))
+	fd_data = fir.rfft(td_data)
+	for name, np_func, data, reference in (
+		("fft", lambda x: numpy.fft.fft(numpy.float64(x)), td_data, fir.dft if N <= options.max_dft_length else None),
+		("rfft", lambda x: numpy.fft.rfft(numpy.float64(x)), td_data, fir.rdft if N <= options.max_dft_length else None),
+		("irfft", lambda x: numpy.fft.irfft(numpy.complex128(x), N), fd_data, lambda x: td_data)
+	):
+		func = getattr(fir, name)
+		times = []
+		for f in (lambda: np_func(data), lambda: func(data, return_double = True), lambda: func(data)):
+			f()
+			times.append(timeit.timeit(f, number = options.iterations) / options.iterations)
+		if reference is not None:
+			expected = reference(data)
+			err = "%12.1e" % (numpy.max(abs(func(data) - expected)) / numpy.max(abs(expected)))
+		else:
+			err = "%12s" % "-"
+		print("%10d %10s %12.1f %12.1f %12.1f %12.2f %s" % (N, name, times[0] * 1e6, times[1] * 1e6, times[2] * 1e6, times[2] / times[0], err))
+
+if options.dpss_length is not None:
+	t_start = time.time()
+	dpss = fir.DPSS(options.dpss_length, options.dpss_alpha, max_iterations = options.dpss_max_iterations)
+	print("DPSS(%d, %g) took %.2f s" % (options.dpss_length, options.dpss_alpha, time.time() - t_start))
@@ -53,10 +53,15 @@ STATUS: reviewed with actions
 
 import bisect
 import cmath
+import hashlib
+import json
 import math
+import multiprocessing
 import numpy
 import sys
 import os
+import shutil
+import tempfile
 
 
 import lal
@@ -415,8 +420,132 @@ def condition_psd(psd, newdeltaF, minfs = (35.0, 40.0), maxfs = (1800., 2048.),
 	return psd
 
 
+class TemplateCache(object):
+	"""
+	A persistent, content-addressed on-disk cache of whitened
+	templates.
+
+	Each entry is a directory named by a key (see
+	templates_workspace.template_cache_key()) holding the template's
+	time-domain data and autocorrelation as .npy files, which are
+	memory-mapped read-only when retrieved, and a small JSON file
+	holding sigmasq and the template's end time.  Entries are created
+	under a temporary name and renamed into place, so concurrent
+	writers (e.g. template generation worker processes or other jobs
+	sharing the directory) never see partial entries.
+
+	If max_bytes is not None the total size of the cache is kept below
+	that many bytes by deleting the least recently used entries.
+	Retrieving an entry updates its modification time, which is used
+	as the LRU clock.  Each process only counts the entries it adds
+	itself between scans of the directory, so when nwriters processes
+	write through copies of the same object, as the workers of
+	whitened_templates() do, each is allowed 1/nwriters of the free
+	space.  Other jobs sharing the directory are not accounted for,
+	and can make the cache exceed max_bytes until the next eviction.
+	"""
+	# bump this whenever the contents of the whitened templates change
+	# to invalidate existing caches
+	format_version = 2
+
+	def __init__(self, path, max_bytes = None):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.nwriters = 1
+		self.size = None
+		self.added = 0
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	def entry_size(self, entrypath):
+		return sum(os.path.getsize(os.path.join(entrypath, name)) for name in os.listdir(entrypath))
+
+	def get(self, key):
+		"""
+		Return (data, autocorrelation, sigmasq, end) for the entry
+		with the given key, or None if there is no such entry.  end
+		is None or an (end_time, end_time_ns) tuple.
+		"""
+		entrypath = os.path.join(self.path, key)
+		try:
+			with open(os.path.join(entrypath, "meta.json")) as f:
+				meta = json.load(f)
+			data = numpy.load(os.path.join(entrypath, "data.npy"), mmap_mode = "r")
+			if meta["autocorrelation"]:
+				autocorrelation = numpy.load(os.path.join(entrypath, "autocorrelation.npy"), mmap_mode = "r")
+			else:
+				autocorrelation = None
+			os.utime(entrypath, None)
+		except (IOError, OSError):
+			# missing, or evicted while we were reading it
+			return None
+		return data, autocorrelation, meta["sigmasq"], (tuple(meta["end"]) if meta["end"] is not None else None)
+
+	def put(self, key, data, autocorrelation, sigmasq, end = None):
+		entrypath = os.path.join(self.path, key)
+		if os.path.exists(entrypath):
+			return
+		tmppath = tempfile.mkdtemp(prefix = ".%s." % key, dir = self.path)
+		try:
+			# mkdtemp() makes the directory private, but the cache
+			# is meant to be shared
+			os.chmod(tmppath, 0o755)
+			numpy.save(os.path.join(tmppath, "data.npy"), numpy.ascontiguousarray(data))
+			if autocorrelation is not None:
+				numpy.save(os.path.join(tmppath, "autocorrelation.npy"), numpy.ascontiguousarray(autocorrelation))
+			with open(os.path.join(tmppath, "meta.json"), "w") as f:
+				json.dump({"sigmasq": float(sigmasq), "end": (tuple(int(x) for x in end) if end is not None else None), "autocorrelation": autocorrelation is not None}, f)
+			size = self.entry_size(tmppath)
+			os.rename(tmppath, entrypath)
+		except OSError:
+			# somebody else has already put this entry in place
+			shutil.rmtree(tmppath, ignore_errors = True)
+			if not os.path.isdir(entrypath):
+				raise
+			return
+		except:
+			shutil.rmtree(tmppath, ignore_errors = True)
+			raise
+		if self.max_bytes is not None:
+			if self.size is None:
+				self.size = sum(size for size, mtime, entrypath in self.entries())
+			else:
+				self.added += size
+			if self.size + self.added * self.nwriters > self.max_bytes:
+				self.evict()
+
+	def entries(self):
+		"""
+		Return a list of (size, mtime, path) tuples for all entries
+		in the cache.
+		"""
+		entries = []
+		for name in os.listdir(self.path):
+			if name.startswith("."):
+				continue
+			entrypath = os.path.join(self.path, name)
+			try:
+				entries.append((self.entry_size(entrypath), os.path.getmtime(entrypath), entrypath))
+			except OSError:
+				pass
+		return entries
+
+	def evict(self):
+		"""
+		Delete least recently used entries until the cache's total
+		size is no greater than max_bytes.
+		"""
+		entries = sorted(self.entries(), key = lambda entry: entry[1])
+		self.size = sum(size for size, mtime, entrypath in entries)
+		self.added = 0
+		while entries and self.size > self.max_bytes:
+			size, mtime, entrypath = entries.pop(0)
+			shutil.rmtree(entrypath, ignore_errors = True)
+			self.size -= size
+
+
 class templates_workspace(object):
-	def __init__(self, template_table, approximant, psd, f_low, time_slices, autocorrelation_length = None, fhigh = None):
+	def __init__(self, template_table, approximant, psd, f_low, time_slices, autocorrelation_length = None, fhigh = None, cache = None):
 		self.template_table = template_table
 		self.approximant = approximant
 		self.f_low = f_low
@@ -490,13 +619,55 @@ class templates_workspace(object):
 			# fhigh to ISCO.
 				self.max_shift_time = max([spawaveform.chirptime(row.mass1, row.mass2, 7, fhigh, 0., spawaveform.computechi(row.mass1, row.mass2, row.spin1z, row.spin2z)) for row in self.template_table])
 
+		#
+		# everything except the template's own parameters that
+		# goes into a whitened template, for building cache keys
+		#
+
+		self.cache = cache
+		if cache is not None:
+			self.cache_hash = hashlib.sha1()
+			self.cache_hash.update(repr((TemplateCache.format_version, str(approximant), FIR_WHITENER, self.sample_rate_max, self.length_max, self.working_length, self.f_low, self.fhigh, self.working_f_low, autocorrelation_length is not None, getattr(self, "max_ringtime", None), getattr(self, "max_shift_time", None))).encode("utf-8"))
+			if psd is not None:
+				self.cache_hash.update(repr((self.psd.f0, self.psd.deltaF)).encode("utf-8"))
+				self.cache_hash.update(numpy.ascontiguousarray(self.psd.data.data).tobytes())
+			if FIR_WHITENER:
+				self.cache_hash.update(numpy.ascontiguousarray(self.kernel_fseries.data.data).tobytes())
+
 			#
 			# Generate each template, downsampling as we go to save memory
 			# generate "cosine" component of frequency-domain template.
 			# waveform is generated for a canonical distance of 1 Mpc.
 			#
 
+	def template_cache_key(self, template_table_row):
+		h = self.cache_hash.copy()
+		h.update(repr(tuple(float(getattr(template_table_row, attr)) for attr in ("mass1", "mass2", "spin1x", "spin1y", "spin1z", "spin2x", "spin2y", "spin2z"))).encode("utf-8"))
+		return h.hexdigest()
+
+	@property
+	def sets_end_time(self):
+		# whether ._make_whitened_template() conditions the
+		# templates in a way that sets the rows' end times
+		return self.approximant in templates.gstlal_IMR_approximants or self.sample_rate_max > self.fhigh * 2.
+
 	def make_whitened_template(self, template_table_row):
+		if self.cache is None:
+			return self._make_whitened_template(template_table_row)
+
+		key = self.template_cache_key(template_table_row)
+		entry = self.cache.get(key)
+		if entry is not None:
+			data, autocorrelation, sigmasq, end = entry
+			if self.sets_end_time:
+				template_table_row.end_time, template_table_row.end_time_ns = end
+			return data, autocorrelation, sigmasq
+
+		data, autocorrelation, sigmasq = self._make_whitened_template(template_table_row)
+		self.cache.put(key, data, autocorrelation, sigmasq, end = (template_table_row.end_time, template_table_row.end_time_ns) if self.sets_end_time else None)
+		return data, autocorrelation, sigmasq
+
+	def _make_whitened_template(self, template_table_row):
 		# FIXME: This is won't work
 		#assert template_table_row in self.template_table, "The input Sngl_Inspiral:Table is not found in the workspace."
 
@@ -602,9 +773,72 @@ class templates_workspace(object):
 		return data, autocorrelation, sigmasq
 
 
-def generate_templates(template_table, approximant, psd, f_low, time_slices, autocorrelation_length = None, fhigh = None, verbose = False):
+#
+# the workspace used by template generation worker processes.  it is
+# installed here before the process pool is started so that each forked
+# worker inherits its own private copy of the FFT plans and work buffers
+# instead of having to pickle them (the LAL objects can't be)
+#
+
+_worker_workspace = None
+
+
+def _make_whitened_template_worker(i):
+	row = _worker_workspace.template_table[i]
+	template, autocorrelation, sigmasq = _worker_workspace.make_whitened_template(row)
+	# make_whitened_template() might have adjusted the row's end time.
+	# that happened in the worker's copy of the row, so send it back
+	return i, template, autocorrelation, sigmasq, (row.end_time, row.end_time_ns)
+
+
+def whitened_templates(workspace, nprocs = 1, chunksize = None):
+	"""
+	Iterate over (index, template, autocorrelation, sigmasq) tuples
+	for the rows of the workspace's template table, in order.
+
+	If nprocs is greater than 1 the templates are generated by a pool
+	of nprocs forked worker processes, each working on batches of
+	chunksize rows with its own copy of the workspace.  Any changes the
+	workers make to the rows' end times are copied back to the rows in
+	the parent process.
+	"""
+	global _worker_workspace
+
+	nprocs = min(int(nprocs), len(workspace.template_table))
+	if nprocs <= 1:
+		for i, row in enumerate(workspace.template_table):
+			template, autocorrelation, sigmasq = workspace.make_whitened_template(row)
+			yield i, template, autocorrelation, sigmasq
+		return
+
+	if chunksize is None:
+		# a handful of batches per worker keeps them all busy
+		# until the end without paying the IPC cost per template
+		chunksize = max(1, len(workspace.template_table) // (4 * nprocs))
+
+	_worker_workspace = workspace
+	if workspace.cache is not None:
+		# the workers share the cache's size limit
+		workspace.cache.nwriters = nprocs
+	try:
+		pool = multiprocessing.get_context("fork").Pool(nprocs)
+		try:
+			for i, template, autocorrelation, sigmasq, (end_time, end_time_ns) in pool.imap(_make_whitened_template_worker, range(len(workspace.template_table)), chunksize = chunksize):
+				row = workspace.template_table[i]
+				row.end_time, row.end_time_ns = end_time, end_time_ns
+				yield i, template, autocorrelation, sigmasq
+		finally:
+			pool.terminate()
+			pool.join()
+	finally:
+		_worker_workspace = None
+		if workspace.cache is not None:
+			workspace.cache.nwriters = 1
+
+
+def generate_templates(template_table, approximant, psd, f_low, time_slices, autocorrelation_length = None, fhigh = None, nprocs = 1, cache = None, verbose = False):
 	# Create workspace for making template bank
-	workspace = templates_workspace(template_table, approximant, psd, f_low, time_slices, autocorrelation_length = autocorrelation_length, fhigh = fhigh)
+	workspace = templates_workspace(template_table, approximant, psd, f_low, time_slices, autocorrelation_length = autocorrelation_length, fhigh = fhigh, cache = cache)
 
 	# Check parity of autocorrelation length
 	if autocorrelation_length is not None:
@@ -624,11 +858,10 @@ def generate_templates(template_table, approximant, psd, f_low, time_slices, aut
 	# to get back the original waveform.
 	sigmasq = []
 
-	for i, row in enumerate(template_table):
+	for i, template, autocorrelation, this_sigmasq in whitened_templates(workspace, nprocs = nprocs):
 		if verbose:
-			print("generating template %d/%d:  m1 = %g, m2 = %g, s1x = %g, s1y = %g, s1z = %g, s2x = %g, s2y = %g, s2z = %g" % (i + 1, len(template_table), row.mass1, row.mass2, row.spin1x, row.spin1y, row.spin1z, row.spin2x, row.spin2y, row.spin2z), file=sys.stderr)
-		# FIXME: ensure the row is in template_table
-		template, autocorrelation, this_sigmasq = workspace.make_whitened_template(row)
+			row = template_table[i]
+			print("generated template %d/%d:  m1 = %g, m2 = %g, s1x = %g, s1y = %g, s1z = %g, s2x = %g, s2y = %g, s2z = %g" % (i + 1, len(template_table), row.mass1, row.mass2, row.spin1x, row.spin1y, row.spin1z, row.spin2x, row.spin2y, row.spin2z), file=sys.stderr)
 
 		sigmasq.append(this_sigmasq)
 
@@ -671,7 +904,65 @@ def generate_templates(template_table, approximant, psd, f_low, time_slices, aut
 	return template_bank, autocorrelation_bank, autocorrelation_mask, sigmasq, workspace
 
 
-def decompose_templates(template_bank, tolerance, identity = False):
+def randomized_svd(A, tolerance, rank_min = 6, oversample = 10, power_iterations = 2, rank_guess = 32, seed = 0):
+	"""
+	Compute a truncated singular value decomposition of A by
+	randomized range finding (Halko, Martinsson & Tropp 2011,
+	arXiv:0909.4061).  Returns U, s, Vh such that numpy.dot(U * s, Vh)
+	approximates A.
+
+	Only as many singular vectors are found as are needed to reconstruct
+	A to within tolerance, using the same criterion as
+	decompose_templates():  the number of components, n, is the smallest
+	for which the fraction of the Frobenius norm of A captured by the
+	first n components is at least tolerance, but no fewer than
+	rank_min.  The rank of the random projection starts at rank_guess
+	and is doubled until it exceeds n by at least oversample, or reaches
+	the full rank of A in which case the result is exact (up to
+	rounding).  The random projections are seeded with seed so the
+	decomposition is reproducible.
+
+	Example:
+
+	>>> A = numpy.dot(numpy.random.randn(200, 20), numpy.random.randn(20, 50))
+	>>> U, s, Vh = randomized_svd(A, 0.9999)
+	>>> len(s) <= 50
+	True
+	>>> bool(abs(numpy.dot(U * s, Vh) - A).max() < 1e-8)
+	True
+	"""
+	M, N = A.shape
+	total = (A * A).sum()
+	kmax = min(M, N)
+	k = min(max(rank_guess, rank_min + oversample), kmax)
+	rng = numpy.random.RandomState(seed)
+	while True:
+		#
+		# approximate basis for the range of A, refined by a few
+		# steps of subspace iteration to sharpen the spectrum
+		#
+
+		Q, _ = numpy.linalg.qr(numpy.dot(A, rng.standard_normal((N, k))))
+		for i in range(power_iterations):
+			Q, _ = numpy.linalg.qr(numpy.dot(A.T, Q))
+			Q, _ = numpy.linalg.qr(numpy.dot(A, Q))
+
+		#
+		# exact SVD of the projection of A onto that basis
+		#
+
+		Ub, s, Vh = numpy.linalg.svd(numpy.dot(Q.T, A), full_matrices = False)
+		if k >= kmax:
+			break
+		residual = numpy.sqrt((s * s).cumsum() / total)
+		n = max(residual.searchsorted(tolerance) + 1, rank_min)
+		if n + oversample <= k:
+			break
+		k = min(2 * k, kmax)
+	return numpy.dot(Q, Ub), s, Vh
+
+
+def decompose_templates(template_bank, tolerance, identity = False, svd_method = "gsl"):
 	#
 	# sum-of-squares for each template (row).
 	#
@@ -695,16 +986,27 @@ def decompose_templates(template_bank, tolerance, identity = False):
 	tolerance = 1 - (1 - tolerance) / chifacs.max()
 
 	#
-	# S.V.D.
+	# S.V.D.  the sum of the squares of the singular values is the
+	# normalization for the reconstruction residual.  the truncated SVD
+	# does not provide all of them, but their sum is also the square of
+	# the Frobenius norm of the template bank, which is the sum of the
+	# chifacs.
 	#
 
-	U, s, Vh = spawaveform.svd(template_bank.T,mod=True,inplace=True)
+	if svd_method == "gsl":
+		U, s, Vh = spawaveform.svd(template_bank.T,mod=True,inplace=True)
+		norm = numpy.dot(s, s)
+	elif svd_method == "randomized":
+		U, s, Vh = randomized_svd(template_bank.T, tolerance)
+		norm = chifacs.sum()
+	else:
+		raise ValueError("unrecognized svd_method '%s'" % svd_method)
 
 	#
 	# determine component count
 	#
 
-	residual = numpy.sqrt((s * s).cumsum() / numpy.dot(s, s))
+	residual = numpy.sqrt((s * s).cumsum() / norm)
 	# FIXME in an ad hoc way force at least 6 principle components
 	n = max(min(residual.searchsorted(tolerance) + 1, len(s)), 6)
 
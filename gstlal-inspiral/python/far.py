@@ -54,6 +54,8 @@ except ImportError:
 	NaN = float("nan")
 	NegInf = float("-inf")
 	PosInf = float("+inf")
+import hashlib
+import io
 import itertools
 import math
 import multiprocessing
@@ -62,8 +64,11 @@ import random
 from scipy import interpolate
 from scipy import optimize
 import os
+import queue
 import sys
+import tempfile
 import time
+import urllib.request
 
 
 from ligo.lw import ligolw
@@ -155,6 +160,15 @@ class RankingStat(snglcoinc.LnLikelihoodRatioMixin):
 			return True
 		return False
 
+	def fast_path_cut_block(self, block):
+		"""
+		Array counterpart of .fast_path_cut() for the candidates
+		in an inspiral_lr.CandidateBlock.  Returns a numpy array
+		that is True for the candidates that should be cut.
+		"""
+		# network SNR cut
+		return (block.snrs**2.).sum(axis = 1) < self.network_snrsq_threshold
+
 	def __call__(self, **kwargs):
 		"""
 		Evaluate the ranking statistic.
@@ -179,6 +193,164 @@ class RankingStat(snglcoinc.LnLikelihoodRatioMixin):
 		# triggers. Maximizes over higher than double IFO combos.
 		return lnP + super(RankingStat, self).__call__(**kwargs) if len(kwargs["snrs"])==1 else max(super(RankingStat, self).__call__(**kwargs) for kwargs in kwarggen(min_instruments = max(2, self.min_instruments), **kwargs))
 
+	def ln_lr_batch(self, kwargs_seq):
+		"""
+		Evaluate the ranking statistic for a sequence of
+		candidates.  kwargs_seq is a sequence of dictionaries of the
+		keyword arguments that would be passed to .__call__().
+		Returns a numpy array of the ranking statistic values.  The
+		results are the same as those of .__call__(), but the
+		numerator and denominator densities are evaluated for all
+		candidates together.
+		"""
+		# see .__call__() for the definition
+		assert all(snr >= self.snr_min for kwargs in kwargs_seq for snr in kwargs["snrs"].values())
+		ln_lr = numpy.full(len(kwargs_seq), NegInf, dtype = "double")
+
+		# fast-path cut, and expand the candidates that survive it
+		# into the subsets of triggers over which the ranking
+		# statistic is maximized
+		index = []
+		penalty = []
+		subsets = []
+		for n, kwargs in enumerate(kwargs_seq):
+			if self.fast_path_cut(**kwargs):
+				continue
+			if len(kwargs["snrs"]) == 1:
+				index.append(n)
+				penalty.append(-10.)
+				subsets.append(kwargs)
+			else:
+				for subset in kwarggen(min_instruments = max(2, self.min_instruments), **kwargs):
+					index.append(n)
+					penalty.append(0.)
+					subsets.append(subset)
+		if not subsets:
+			return ln_lr
+
+		# ln L for all subsets.  special cases as in
+		# snglcoinc.LnLikelihoodRatioMixin.__call__()
+		lnP_signal = self.numerator.lnP_batch(subsets)
+		lnP_noise = self.denominator.lnP_batch(subsets)
+		with numpy.errstate(invalid = "ignore"):
+			subset_ln_lr = lnP_signal - lnP_noise
+		subset_ln_lr[numpy.isneginf(lnP_signal) & numpy.isneginf(lnP_noise)] = NegInf
+		if (numpy.isposinf(lnP_signal) & numpy.isposinf(lnP_noise)).any():
+			raise ValueError("inf/inf encountered")
+
+		numpy.maximum.at(ln_lr, index, subset_ln_lr + numpy.array(penalty))
+		return ln_lr
+
+	def ln_lr_block(self, block):
+		"""
+		Array counterpart of .ln_lr_batch() for the candidates in
+		an inspiral_lr.CandidateBlock.  The subsets of triggers
+		over which the ranking statistic is maximized are formed by
+		masking the candidates' triggers, and the numerator and
+		denominator densities are evaluated for all of them
+		together with their .lnP_block() methods.
+		"""
+		# see .__call__() for the definition
+		assert (block.snrs[block.mask] >= self.snr_min).all()
+		ln_lr = numpy.full((len(block),), NegInf, dtype = "double")
+
+		# fast-path cut, and expand the candidates that survive it
+		# into the subsets of triggers over which the ranking
+		# statistic is maximized
+		keep = ~self.fast_path_cut_block(block)
+		count = block.mask.sum(axis = 1)
+		index, = (keep & (count == 1)).nonzero()
+		indexes = [index]
+		masks = [block.mask[index]]
+		penalties = [numpy.full((len(index),), -10., dtype = "double")]
+		keep &= count > 1
+		for k in range(max(2, self.min_instruments), len(block.instruments) + 1):
+			for subset in itertools.combinations(range(len(block.instruments)), k):
+				index, = (keep & block.mask[:,subset].all(axis = 1)).nonzero()
+				mask = numpy.zeros((len(index), len(block.instruments)), dtype = "bool")
+				mask[:,subset] = True
+				indexes.append(index)
+				masks.append(mask)
+				penalties.append(numpy.zeros((len(index),), dtype = "double"))
+		index = numpy.concatenate(indexes)
+		if not len(index):
+			return ln_lr
+		subsets = block.select(index, numpy.concatenate(masks))
+
+		# ln L for all subsets.  special cases as in
+		# snglcoinc.LnLikelihoodRatioMixin.__call__()
+		lnP_signal = self.numerator.lnP_block(subsets)
+		lnP_noise = self.denominator.lnP_block(subsets)
+		with numpy.errstate(invalid = "ignore"):
+			subset_ln_lr = lnP_signal - lnP_noise
+		subset_ln_lr[numpy.isneginf(lnP_signal) & numpy.isneginf(lnP_noise)] = NegInf
+		if (numpy.isposinf(lnP_signal) & numpy.isposinf(lnP_noise)).any():
+			raise ValueError("inf/inf encountered")
+
+		numpy.maximum.at(ln_lr, index, subset_ln_lr + numpy.concatenate(penalties))
+		return ln_lr
+
+	def ln_lr_samples_batch(self, random_params_seq, nsamples, signal_noise_pdfs = None, chunk_size = 16384):
+		"""
+		Array version of .ln_lr_samples().  Draws nsamples
+		parameter samples from random_params_seq and yields them in
+		chunks of at most chunk_size samples.  Each chunk is a
+		three-element tuple of numpy arrays giving the natural
+		logarithms of the likelihood ratio, and of the relative
+		frequencies of that likelihood ratio in the signal and
+		noise populations, with the same meanings as the elements
+		of the tuples yielded by .ln_lr_samples().  The ranking
+		statistic and the densities are evaluated for all samples
+		in a chunk together using .ln_lr_batch() and the
+		.lnP_batch() methods of the numerator and denominator.
+
+		The *args element of each parameter sample must be empty.
+		"""
+		if signal_noise_pdfs is None:
+			signal_noise_pdfs = self
+		random_params_seq = iter(random_params_seq)
+		while nsamples > 0:
+			kwargs_seq = []
+			lnP_params = []
+			for args, kwargs, lnP in itertools.islice(random_params_seq, min(chunk_size, nsamples)):
+				assert not args
+				kwargs_seq.append(kwargs)
+				lnP_params.append(lnP)
+			if not kwargs_seq:
+				# random_params_seq is exhausted
+				break
+			nsamples -= len(kwargs_seq)
+			lnP_params = numpy.array(lnP_params, dtype = "double")
+			yield self.ln_lr_batch(kwargs_seq), signal_noise_pdfs.numerator.lnP_batch(kwargs_seq) - lnP_params, signal_noise_pdfs.denominator.lnP_batch(kwargs_seq) - lnP_params
+
+	def ln_lr_samples_blocks(self, random_params_blocks, nsamples, signal_noise_pdfs = None):
+		"""
+		Block version of .ln_lr_samples_batch().
+		random_params_blocks is a sequence of two-element tuples,
+		each an inspiral_lr.CandidateBlock of parameter samples and
+		an array of the natural logarithms of the PDF from which
+		they were drawn, like that yielded by
+		inspiral_lr.LnNoiseDensity.random_params_blocks().  Draws
+		nsamples parameter samples from it, and yields a
+		three-element tuple of numpy arrays for each block with the
+		same meanings as those yielded by .ln_lr_samples_batch().
+		The ranking statistic and the densities are evaluated
+		directly from the blocks' arrays using .ln_lr_block() and
+		the .lnP_block() methods of the numerator and denominator.
+		"""
+		if signal_noise_pdfs is None:
+			signal_noise_pdfs = self
+		random_params_blocks = iter(random_params_blocks)
+		while nsamples > 0:
+			try:
+				block, lnP_params = next(random_params_blocks)
+			except StopIteration:
+				break
+			if len(block) > nsamples:
+				block, lnP_params = block.select(slice(None, nsamples)), lnP_params[:nsamples]
+			nsamples -= len(block)
+			yield self.ln_lr_block(block), signal_noise_pdfs.numerator.lnP_block(block) - lnP_params, signal_noise_pdfs.denominator.lnP_block(block) - lnP_params
+
 	@property
 	def template_ids(self):
 		return self.denominator.template_ids
@@ -333,6 +505,25 @@ class RankingStat(snglcoinc.LnLikelihoodRatioMixin):
 		except (ValueError, AssertionError) as e:
 			raise type(e)("%s: event IDs %s, offsets %s" % (str(e), ", ".join(sorted(str(event.event_id) for event in events)), str(offsetvector)))
 
+	def ln_lr_from_triggers_batch(self, candidates):
+		"""
+		Evaluate the ranking statistic for a sequence of
+		candidates, each a two-element tuple of a sequence of
+		single-detector triggers and the offset vector with which
+		they were collected.  Returns a numpy array of the values
+		.ln_lr_from_triggers() would return for each.
+		"""
+		kwargs_seq = []
+		for events, offsetvector in candidates:
+			try:
+				kwargs_seq.append(self.kwargs_from_triggers(events, offsetvector))
+			except (ValueError, AssertionError) as e:
+				raise type(e)("%s: event IDs %s, offsets %s" % (str(e), ", ".join(sorted(str(event.event_id) for event in events)), str(offsetvector)))
+		try:
+			return self.ln_lr_batch(kwargs_seq)
+		except (ValueError, AssertionError) as e:
+			raise type(e)("%s: in batch of %d candidates" % (str(e), len(kwargs_seq)))
+
 	def finish(self):
 		self.numerator.finish()
 		self.denominator.finish()
@@ -462,7 +653,41 @@ class OnlineFrankensteinRankingStat(RankingStat):
 #
 
 
-def binned_log_likelihood_ratio_rates_from_samples(signal_lr_lnpdf, noise_lr_lnpdf, samples, nsamples):
+def ln_lr_bin_indices(bins, ln_lamb):
+	"""
+	Vectorized version of bins[ln_lamb,] for the one-dimensional
+	binnings of the ranking statistic PDFs.  Returns a numpy array of
+	the bin indices of the values in the array ln_lamb.
+	"""
+	binning, = bins
+	if not isinstance(binning, rate.ATanBins):
+		return numpy.fromiter((binning[x] for x in ln_lamb), dtype = "intp", count = len(ln_lamb))
+	# same arithmetic as rate.ATanBins.__getitem__().  map to the
+	# domain [0, 1], 1 is the "measure zero" corner case that goes in
+	# the last bin
+	x = numpy.arctan((ln_lamb - binning.mid) * binning.scale) / math.pi + 0.5
+	return numpy.minimum(numpy.floor(x / binning.delta), len(binning) - 1).astype("intp")
+
+
+def binned_log_likelihood_ratio_rates_from_sample_arrays(signal_lr_lnpdf, noise_lr_lnpdf, ln_lamb, lnP_signal, lnP_noise):
+	"""
+	Add a chunk of samples to signal and noise BinnedLnPDF densities.
+	ln_lamb, lnP_signal and lnP_noise are equal-length arrays of values
+	of the ranking statistic (likelihood ratio) and the logs of the
+	probabilities of obtaining those values of the ranking statistic
+	in the signal and noise populations respectively.  The two
+	densities must share the same binning.
+	"""
+	if numpy.isnan(ln_lamb).any():
+		raise ValueError("encountered NaN likelihood ratio")
+	if numpy.isnan(lnP_signal).any() or numpy.isnan(lnP_noise).any():
+		raise ValueError("encountered NaN signal or noise model probability densities")
+	index = ln_lr_bin_indices(signal_lr_lnpdf.bins, ln_lamb)
+	signal_lr_lnpdf.array += numpy.bincount(index, weights = numpy.exp(lnP_signal), minlength = len(signal_lr_lnpdf.array))
+	noise_lr_lnpdf.array += numpy.bincount(index, weights = numpy.exp(lnP_noise), minlength = len(noise_lr_lnpdf.array))
+
+
+def binned_log_likelihood_ratio_rates_from_samples(signal_lr_lnpdf, noise_lr_lnpdf, samples, nsamples, chunk_size = 16384):
 	"""
 	Populate signal and noise BinnedLnPDF densities from a sequence of
 	samples (which can be a generator).  The first nsamples elements
@@ -471,19 +696,17 @@ def binned_log_likelihood_ratio_rates_from_samples(signal_lr_lnpdf, noise_lr_lnp
 	value of the ranking statistic (likelihood ratio) and the second
 	and third elements the logs of the probabilities of obtaining that
 	value of the ranking statistic in the signal and noise populations
-	respectively.
+	respectively.  The samples are binned in chunks of chunk_size.
 	"""
-	exp = math.exp
-	isnan = math.isnan
-	signal_lr_lnpdf_count = signal_lr_lnpdf.count
-	noise_lr_lnpdf_count = noise_lr_lnpdf.count
-	for ln_lamb, lnP_signal, lnP_noise in itertools.islice(samples, nsamples):
-		if isnan(ln_lamb):
-			raise ValueError("encountered NaN likelihood ratio")
-		if isnan(lnP_signal) or isnan(lnP_noise):
-			raise ValueError("encountered NaN signal or noise model probability densities")
-		signal_lr_lnpdf_count[ln_lamb,] += exp(lnP_signal)
-		noise_lr_lnpdf_count[ln_lamb,] += exp(lnP_noise)
+	samples = iter(samples)
+	while nsamples > 0:
+		n = min(chunk_size, nsamples)
+		chunk = numpy.fromiter(itertools.chain.from_iterable(itertools.islice(samples, n)), dtype = "double")
+		if not len(chunk):
+			break
+		ln_lamb, lnP_signal, lnP_noise = chunk.reshape((-1, 3)).T
+		binned_log_likelihood_ratio_rates_from_sample_arrays(signal_lr_lnpdf, noise_lr_lnpdf, ln_lamb, lnP_signal, lnP_noise)
+		nsamples -= n
 
 
 #
@@ -504,24 +727,38 @@ class RankingStatPDF(object):
 		rate.filter_array(lnpdf.array, kernel)
 
 	@staticmethod
-	def binned_log_likelihood_ratio_rates_from_samples_wrapper(queue, signal_lr_lnpdf, noise_lr_lnpdf, samples, nsamples):
+	def binned_log_likelihood_ratio_rates_from_samples_wrapper(q, signal_lr_lnpdf, noise_lr_lnpdf, rankingstat, signal_noise_pdfs, seed_sequence, nsamples, chunk_size):
 		"""
 		For internal use only.
 		"""
 		try:
-			# want the forked processes to use different random
-			# number sequences, so we re-seed Python and
-			# numpy's random number generators here in the
-			# wrapper in the hope that that takes care of it
-			random.seed()
-			numpy.random.seed()
-			binned_log_likelihood_ratio_rates_from_samples(signal_lr_lnpdf, noise_lr_lnpdf, samples, nsamples)
-			queue.put((signal_lr_lnpdf.array, noise_lr_lnpdf.array))
+			# each forked process draws from its own
+			# statistically independent random number stream.
+			# the parameter samplers use both Python's and
+			# numpy's random number generators, seed both from
+			# it
+			state = seed_sequence.generate_state(8)
+			random.seed(int.from_bytes(state[:4].tobytes(), "little"))
+			numpy.random.seed(state[4:])
+			for ln_lamb, lnP_signal, lnP_noise in rankingstat.ln_lr_samples_blocks(rankingstat.denominator.random_params_blocks(block_size = chunk_size), nsamples, signal_noise_pdfs):
+				binned_log_likelihood_ratio_rates_from_sample_arrays(signal_lr_lnpdf, noise_lr_lnpdf, ln_lamb, lnP_signal, lnP_noise)
+				q.put((len(ln_lamb), None, None))
+			q.put((0, signal_lr_lnpdf.array, noise_lr_lnpdf.array))
 		except:
-			queue.put((None, None))
+			q.put((0, None, None))
 			raise
 
-	def __init__(self, rankingstat, signal_noise_pdfs = None, nsamples = 2**24, nthreads = 8, verbose = False):
+	def __init__(self, rankingstat, signal_noise_pdfs = None, nsamples = 2**24, nthreads = 8, seed = None, chunk_size = 16384, verbose = False):
+		"""
+		Populate the signal and noise ranking statistic PDFs by
+		drawing nsamples importance-weighted samples of the
+		ranking statistic from rankingstat.  The sampling is split
+		across nthreads processes, each of which draws from its own
+		independent random number stream spawned from a
+		numpy.random.SeedSequence initialized from seed (None =
+		fresh entropy from the OS), and evaluates the ranking
+		statistic in chunks of chunk_size samples.
+		"""
 		#
 		# bailout out used by .from_xml() class method to get an
 		# uninitialized instance
@@ -559,31 +796,62 @@ class RankingStatPDF(object):
 
 		nthreads = int(nthreads)
 		assert nthreads >= 1
+		assert nsamples // nthreads >= 1
+		# the workers inherit rankingstat and the PDFs by forking,
+		# they cannot be pickled
+		ctx = multiprocessing.get_context("fork")
+		q = ctx.Queue()
 		threads = []
-		for i in range(nthreads):
-			assert nsamples // nthreads >= 1
-			q = multiprocessing.SimpleQueue()
-			p = multiprocessing.Process(target = lambda: self.binned_log_likelihood_ratio_rates_from_samples_wrapper(
+		for i, seed_sequence in enumerate(numpy.random.SeedSequence(seed).spawn(nthreads)):
+			p = ctx.Process(target = self.binned_log_likelihood_ratio_rates_from_samples_wrapper, args = (
 				q,
 				self.signal_lr_lnpdf,
 				self.noise_lr_lnpdf,
-				rankingstat.ln_lr_samples(rankingstat.denominator.random_params(), signal_noise_pdfs),
-				nsamples = nsamples // nthreads
+				rankingstat,
+				signal_noise_pdfs,
+				seed_sequence,
+				nsamples // nthreads + (i < nsamples % nthreads),
+				chunk_size
 			))
 			p.start()
-			threads.append((p, q))
-			nsamples -= nsamples // nthreads
-			nthreads -= 1
-			# sleep a bit to help random number seeds change
-			time.sleep(1.5)
-		while threads:
-			p, q = threads.pop(0)
-			signal_counts, noise_counts = q.get()
-			self.signal_lr_lnpdf.array += signal_counts
-			self.noise_lr_lnpdf.array += noise_counts
-			p.join()
-			if p.exitcode:
-				raise Exception("sampling thread failed")
+			threads.append(p)
+		if verbose:
+			progressbar = ProgressBar(text = "sampling ranking statistic", max = nsamples)
+			progressbar.show()
+		t_start = time.time()
+		ndone = 0
+		running = len(threads)
+		try:
+			while running:
+				try:
+					n, signal_counts, noise_counts = q.get(timeout = 10.)
+				except queue.Empty:
+					# a process that dies without
+					# reporting back would leave us
+					# waiting forever
+					if any(p.exitcode for p in threads):
+						raise Exception("sampling thread failed")
+					continue
+				if n:
+					ndone += n
+					if verbose:
+						progressbar.update(ndone, text = "sampling ranking statistic (%.0f samples/s)" % (ndone / (time.time() - t_start)))
+					continue
+				if signal_counts is None:
+					raise Exception("sampling thread failed")
+				self.signal_lr_lnpdf.array += signal_counts
+				self.noise_lr_lnpdf.array += noise_counts
+				running -= 1
+		finally:
+			for p in threads:
+				if running:
+					p.terminate()
+				p.join()
+		if any(p.exitcode for p in threads):
+			raise Exception("sampling thread failed")
+		if verbose:
+			progressbar.linefeed()
+			print("drew %d samples in %g s (%.0f samples/s)" % (ndone, time.time() - t_start, ndone / (time.time() - t_start)), file=sys.stderr)
 		if verbose:
 			print("done computing ranking statistic PDFs", file=sys.stderr)
 
@@ -903,6 +1171,25 @@ class FAPFAR(object):
 		self.minrank = ranks[0]
 		self.maxrank = ranks[-1]
 
+	@classmethod
+	def from_ccdf(cls, ranks, ccdf, livetime, count_above_threshold):
+		"""
+		Construct a FAPFAR object directly from the ranking
+		statistic co-ordinates and corresponding CCDF values
+		computed by .__init__() (available as the .ccdf_interpolator
+		attribute's .x and .y arrays), the livetime, and the
+		zero-lag count above threshold.  Used to restore FAPFAR
+		objects from their binary serialization without repeating
+		the calculation.
+		"""
+		self = cls.__new__(cls)
+		self.livetime = float(livetime)
+		self.count_above_threshold = count_above_threshold
+		self.ccdf_interpolator = interpolate.interp1d(ranks, ccdf)
+		self.minrank = ranks[0]
+		self.maxrank = ranks[-1]
+		return self
+
 	@gstlalstats.assert_probability
 	def ccdf_from_rank(self, rank):
 		return self.ccdf_interpolator(numpy.clip(rank, self.minrank, self.maxrank))
@@ -1036,6 +1323,72 @@ def parse_likelihood_control_doc(xmldoc):
 	return rankingstat, rankingstatpdf
 
 
+def write_rankingstatpdf_binary(filename, rankingstatpdf, fapfar = None, verbose = False):
+	"""
+	Write a RankingStatPDF, and optionally the FAPFAR object computed
+	from it, to filename in numpy's .npz format.  This is a compact
+	alternative to the XML document written with
+	gen_likelihood_control_doc() that can be loaded quickly by
+	read_rankingstatpdf_binary().  The file is written to a temporary
+	file in the same directory and moved into place, so readers never
+	see a partially-written file.
+	"""
+	binning, = rankingstatpdf.noise_lr_lnpdf.bins
+	if not isinstance(binning, rate.ATanBins) or any(lnpdf.bins != rankingstatpdf.noise_lr_lnpdf.bins for lnpdf in (rankingstatpdf.signal_lr_lnpdf, rankingstatpdf.zero_lag_lr_lnpdf)):
+		raise ValueError("binary format requires identical ATanBins binnings")
+	arrays = {
+		"lr_bins": numpy.array((binning.min, binning.max, binning.n), dtype = "double"),
+		"noise_lr_lnpdf": rankingstatpdf.noise_lr_lnpdf.array,
+		"signal_lr_lnpdf": rankingstatpdf.signal_lr_lnpdf.array,
+		"zero_lag_lr_lnpdf": rankingstatpdf.zero_lag_lr_lnpdf.array,
+		"segments": numpy.array([(float(seg[0]), float(seg[1])) for seg in rankingstatpdf.segments], dtype = "double").reshape((-1, 2)),
+		"template_ids": numpy.array(sorted(rankingstatpdf.template_ids), dtype = "int64")
+	}
+	if fapfar is not None:
+		arrays.update({
+			"fapfar_ranks": fapfar.ccdf_interpolator.x,
+			"fapfar_ccdf": fapfar.ccdf_interpolator.y,
+			"fapfar_livetime": numpy.array(fapfar.livetime, dtype = "double"),
+			"fapfar_count_above_threshold": numpy.array(fapfar.count_above_threshold, dtype = "double")
+		})
+	if verbose:
+		print("writing \"%s\" ..." % filename, file=sys.stderr)
+	fd, tmp = tempfile.mkstemp(suffix = ".npz", dir = os.path.dirname(filename) or ".")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			numpy.savez(f, **arrays)
+		os.chmod(tmp, 0o644)
+		os.rename(tmp, filename)
+	except:
+		os.unlink(tmp)
+		raise
+
+
+def read_rankingstatpdf_binary(filename, verbose = False):
+	"""
+	Read a file written by write_rankingstatpdf_binary().  Returns a
+	(RankingStatPDF, FAPFAR) tuple.  The FAPFAR is None if none was
+	written to the file.
+	"""
+	if verbose:
+		print("reading \"%s\" ..." % filename, file=sys.stderr)
+	with numpy.load(filename, allow_pickle = False) as data:
+		rankingstatpdf = RankingStatPDF(None)
+		lr_min, lr_max, lr_n = data["lr_bins"]
+		for name in ("noise_lr_lnpdf", "signal_lr_lnpdf", "zero_lag_lr_lnpdf"):
+			lnpdf = rate.BinnedLnPDF(rate.NDBins((rate.ATanBins(float(lr_min), float(lr_max), int(lr_n)),)))
+			lnpdf.array[:] = data[name]
+			lnpdf.normalize()
+			setattr(rankingstatpdf, name, lnpdf)
+		rankingstatpdf.segments = segments.segmentlist(segments.segment(*seg) for seg in data["segments"].tolist())
+		rankingstatpdf.template_ids = frozenset(data["template_ids"].tolist())
+		if "fapfar_ranks" in data:
+			fapfar = FAPFAR.from_ccdf(data["fapfar_ranks"], data["fapfar_ccdf"], data["fapfar_livetime"][()], data["fapfar_count_above_threshold"][()])
+		else:
+			fapfar = None
+	return rankingstatpdf, fapfar
+
+
 def marginalize_pdf_urls(urls, which, ignore_missing_files = False, verbose = False):
 	"""
 	Implements marginalization of PDFs in ranking statistic data files.
@@ -1086,3 +1439,159 @@ def marginalize_pdf_urls(urls, which, ignore_missing_files = False, verbose = Fa
 		xmldoc.unlink()
 
 	return data
+
+
+class RankingStatPDFMarginalizer(object):
+	"""
+	Incrementally-updated marginalization of the RankingStatPDFs in a
+	collection of ranking statistic data files.  Equivalent to
+	marginalize_pdf_urls(urls, "RankingStatPDF") but intended to be
+	invoked repeatedly by a long-running process on the same
+	collection of URLs.  Each invocation of .update() re-reads only
+	those documents that have changed since they were last read, and
+	applies the difference between the new and the previously-seen
+	counts to a running sum.  Local files are judged to have changed
+	if their modification times or sizes have changed, for other URLs
+	the documents are retrieved and judged to have changed if a hash
+	of their contents has changed.
+
+	Because the running sum is maintained by subtraction as well as
+	addition it accumulates round-off noise, so the sum is recomputed
+	from the cached PDFs after every rebuild_interval updates.
+	"""
+	lnpdf_names = ("noise_lr_lnpdf", "signal_lr_lnpdf", "zero_lag_lr_lnpdf")
+
+	def __init__(self, rebuild_interval = 100, verbose = False):
+		self.rebuild_interval = rebuild_interval
+		self.verbose = verbose
+		# url --> (fingerprint, RankingStatPDF)
+		self.cache = {}
+		# name --> array of summed counts
+		self.counts = None
+		self.updates_since_rebuild = 0
+
+	@staticmethod
+	def fingerprint(url):
+		"""
+		For internal use only.  Returns a (fingerprint, contents)
+		tuple.  For local files the fingerprint is the modification
+		time and size and contents is None.  For other URLs the
+		document is retrieved, the fingerprint is a hash of its
+		contents, and contents is the retrieved document.
+		"""
+		try:
+			path = ligolw_utils.local_path_from_url(url)
+		except ValueError:
+			# not a local file
+			contents = urllib.request.urlopen(url).read()
+			return hashlib.sha1(contents).hexdigest(), contents
+		stat = os.stat(path)
+		return (stat.st_mtime_ns, stat.st_size), None
+
+	def rebuild(self):
+		"""
+		Recompute the running sum from the cached PDFs.
+		"""
+		self.counts = None
+		for fingerprint, rankingstatpdf in self.cache.values():
+			if self.counts is None:
+				self.counts = dict((name, getattr(rankingstatpdf, name).array.copy()) for name in self.lnpdf_names)
+			else:
+				for name in self.lnpdf_names:
+					self.counts[name] += getattr(rankingstatpdf, name).array
+		self.updates_since_rebuild = 0
+
+	def update(self, urls, ignore_missing_files = False):
+		"""
+		Bring the running sum up to date with the documents at urls.
+		Documents that were seen previously but are not in urls
+		are removed from the sum.  If ignore_missing_files is True
+		then documents that cannot be loaded are skipped and the
+		last-seen version of their contents, if any, is retained in
+		the sum.  Returns the number of documents that have been
+		added, changed or removed.
+		"""
+		try:
+			deltas = self._update_cache(list(urls), ignore_missing_files)
+		except:
+			# the cache might have been partially updated, force
+			# the running sum to be recomputed next time
+			self.counts = None
+			raise
+
+		#
+		# apply deltas to running sum, or recompute it
+		#
+
+		self.updates_since_rebuild += 1
+		if self.counts is None or self.updates_since_rebuild >= self.rebuild_interval:
+			self.rebuild()
+		else:
+			for old, new in deltas:
+				for name in self.lnpdf_names:
+					if old is not None:
+						self.counts[name] -= getattr(old, name).array
+					if new is not None:
+						self.counts[name] += getattr(new, name).array
+		return len(deltas)
+
+	def _update_cache(self, urls, ignore_missing_files):
+		"""
+		For internal use only.  Re-read changed documents into the
+		cache.  Returns a list of (old, new) RankingStatPDF pairs
+		for the documents that have changed, with None for old or
+		new when a document has been added or removed.
+		"""
+		name = u"gstlal_inspiral_likelihood"
+		deltas = []
+		for n, url in enumerate(urls, start = 1):
+			try:
+				fingerprint, contents = self.fingerprint(url)
+				if url in self.cache and self.cache[url][0] == fingerprint:
+					continue
+				if self.verbose:
+					print("%d/%d:" % (n, len(urls)), file=sys.stderr)
+				if contents is None:
+					xmldoc = ligolw_utils.load_url(url, verbose = self.verbose, contenthandler = RankingStat.LIGOLWContentHandler)
+				else:
+					xmldoc = ligolw_utils.load_fileobj(io.BytesIO(contents), contenthandler = RankingStat.LIGOLWContentHandler)
+			except IOError:
+				if not ignore_missing_files:
+					raise
+				if self.verbose:
+					print("Could not load \"%s\" ... skipping as requested" % url, file=sys.stderr)
+				continue
+			rankingstatpdf = RankingStatPDF.from_xml(xmldoc, name)
+			xmldoc.unlink()
+			if self.cache and rankingstatpdf.noise_lr_lnpdf.bins != next(iter(self.cache.values()))[1].noise_lr_lnpdf.bins:
+				raise ValueError("\"%s\" has incompatible ranking statistic binning" % url)
+			deltas.append((self.cache.get(url, (None, None))[1], rankingstatpdf))
+			self.cache[url] = fingerprint, rankingstatpdf
+		for url in set(self.cache) - set(urls):
+			deltas.append((self.cache.pop(url)[1], None))
+		return deltas
+
+	def marginalized(self):
+		"""
+		Return a RankingStatPDF containing the current
+		marginalization.  Returns None if no documents have been
+		loaded.  Like the result of marginalize_pdf_urls(), the
+		zero-lag counts have not had density estimation applied.
+		"""
+		if not self.cache:
+			return None
+		template = next(iter(self.cache.values()))[1]
+		rankingstatpdf = RankingStatPDF(None)
+		for name in self.lnpdf_names:
+			lnpdf = getattr(template, name).copy()
+			# round-off noise can leave small negative counts
+			# where contributions have been removed
+			lnpdf.array[:] = numpy.clip(self.counts[name], 0., None)
+			lnpdf.normalize()
+			setattr(rankingstatpdf, name, lnpdf)
+		rankingstatpdf.segments = segments.segmentlist()
+		rankingstatpdf.template_ids = frozenset()
+		for fingerprint, pdf in self.cache.values():
+			rankingstatpdf.segments |= pdf.segments
+			rankingstatpdf.template_ids |= pdf.template_ids
+		return rankingstatpdf
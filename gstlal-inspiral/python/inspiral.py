@@ -56,6 +56,7 @@ import numpy
 from scipy import random
 import sqlite3
 import io
+import shutil
 import sys
 import time
 import http.client
@@ -87,6 +88,7 @@ from ligo import gracedb
 from gstlal import bottle
 from gstlal import ilwdify
 from gstlal import svd_bank
+from gstlal import triggerstore
 
 
 #
@@ -276,6 +278,9 @@ def chisq_distribution(df, non_centralities, size):
 
 class CoincsDocument(object):
 	sngl_inspiral_columns = ("process:process_id", "ifo", "end_time", "end_time_ns", "eff_distance", "coa_phase", "mass1", "mass2", "snr", "chisq", "chisq_dof", "bank_chisq", "bank_chisq_dof", "sigmasq", "spin1x", "spin1y", "spin1z", "spin2x", "spin2y", "spin2z", "template_duration", "event_id", "Gamma0", "Gamma1")
+	# tables whose rows are moved to the trigger store when the
+	# output is a trigger store file
+	stored_table_classes = (lsctables.SnglInspiralTable, lsctables.CoincTable, lsctables.CoincMapTable, lsctables.CoincInspiralTable)
 
 	def __init__(self, url, process_params, process_start_time, comment, instruments, seg, offsetvectors, injection_filename = None, tmp_path = None, replace_file = None, verbose = False):
 		#
@@ -364,8 +369,28 @@ class CoincsDocument(object):
 
 			(self.process.process_id,), = self.connection.cursor().execute("SELECT process_id FROM process WHERE program == ? AND node == ? AND username == ? AND unix_procid == ? AND start_time == ?", (self.process.program, self.process.node, self.process.username, self.process.unix_procid, self.process.start_time)).fetchall()
 			self.process.process_id = ilwd.ilwdchar(self.process.process_id)
+			self.store = None
+
+		#
+		# if the output is a trigger store, the trigger tables' rows
+		# are moved in batches to a column-oriented HDF5 file in
+		# the work area, and the XML document retains only the
+		# tables' metadata.  the file is moved to its final
+		# location by .write_output_url()
+		#
+
+		elif url is not None and url.endswith(".h5"):
+			self.connection = None
+			fd, self.working_filename = tempfile.mkstemp(suffix = ".h5", dir = tmp_path)
+			os.close(fd)
+			if verbose:
+				print("writing triggers to %s ..." % self.working_filename, file=sys.stderr)
+			self.store = triggerstore.TriggerStore(self.working_filename)
+			self.stored_tables = [cls.get_table(self.xmldoc) for cls in self.stored_table_classes]
+			for tbl in self.stored_tables:
+				self.store.create_table(tbl)
 		else:
-			self.connection = self.working_filename = None
+			self.connection = self.working_filename = self.store = None
 
 		#
 		# retrieve references to the table objects, now that we
@@ -379,6 +404,13 @@ class CoincsDocument(object):
 		# update output document
 		if self.connection is not None:
 			self.connection.commit()
+		elif self.store is not None:
+			# sort each batch of triggers as .write_output_url()
+			# sorts the XML document's
+			self.sngl_inspiral_table.sort(key = lambda row: (row.end, row.ifo))
+			for tbl in self.stored_tables:
+				self.store.append(tbl.Name, tbl)
+				del tbl[:]
 
 
 	@property
@@ -409,6 +441,15 @@ class CoincsDocument(object):
 			self.connection.close()
 			self.connection = None
 			dbtables.put_connection_filename(ligolw_utils.local_path_from_url(self.url), self.working_filename, verbose = verbose)
+		elif self.store is not None:
+			self.commit()
+			triggerstore.write_document(self.store, self.xmldoc)
+			self.store.close()
+			self.store = None
+			os.chmod(self.working_filename, 0o644)
+			if verbose:
+				print("moving %s to %s ..." % (self.working_filename, self.url), file=sys.stderr)
+			shutil.move(self.working_filename, ligolw_utils.local_path_from_url(self.url))
 		else:
 			self.sngl_inspiral_table.sort(key = lambda row: (row.end, row.ifo))
 			ligolw_utils.write_url(self.xmldoc, self.url, gz = (self.url or "stdout").endswith(".gz"), verbose = verbose, trap_signals = None)
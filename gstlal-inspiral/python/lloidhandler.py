@@ -62,9 +62,11 @@ import os
 import resource
 from scipy.interpolate import interp1d
 import io
+import queue
 import sys
 import threading
 import time
+import traceback
 import shutil
 import json
 
@@ -640,6 +642,62 @@ class SegmentsTracker(object):
 		return outstr
 
 
+#
+# =============================================================================
+#
+#                               Snapshot Writer
+#
+# =============================================================================
+#
+
+
+class SnapshotWriter(object):
+	"""!
+	Runs the file I/O for snapshots in a background thread so that it
+	does not need to be done while holding the Handler's lock.  Jobs
+	are callables, and are run one at a time in the order in which
+	they were submitted.  If a job raises an exception the traceback
+	is printed and the exception is re-raised in the submitting thread
+	by the next call to .submit() or .wait().
+	"""
+	def __init__(self):
+		self.queue = queue.Queue()
+		self.exception = None
+		self.thread = threading.Thread(target = self.run, name = "snapshot writer")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		while True:
+			func = self.queue.get()
+			try:
+				func()
+			except Exception as e:
+				traceback.print_exc()
+				self.exception = e
+			finally:
+				self.queue.task_done()
+
+	def raise_exception(self):
+		exception, self.exception = self.exception, None
+		if exception is not None:
+			raise exception
+
+	def submit(self, func):
+		"""!
+		Queue func to be invoked in the background.
+		"""
+		self.queue.put(func)
+		self.raise_exception()
+
+	def wait(self):
+		"""!
+		Block until all submitted jobs have completed.
+		"""
+		self.queue.join()
+		self.raise_exception()
+
+
 #
 # =============================================================================
 #
@@ -717,6 +775,19 @@ class Handler(simplehandler.Handler):
 		bottle.route("/sngls_snr_threshold.txt", method = "GET")(self.web_get_sngls_snr_threshold)
 		bottle.route("/sngls_snr_threshold.txt", method = "POST")(self.web_set_sngls_snr_threshold)
 		bottle.route("/zerolag_rankingstatpdf.xml")(self.web_get_zerolag_rankingstatpdf)
+		bottle.route("/snapshot_history.txt")(self.web_get_snapshot_history)
+
+		#
+		# snapshots are handed to a background thread to be
+		# written to disk.  record (GPS time, seconds the lock was
+		# held, seconds until the files were written) for each
+		# one.  the history has its own lock because it is
+		# appended to by the writer thread
+		#
+
+		self.snapshot_writer = SnapshotWriter()
+		self.snapshot_history = deque(maxlen = 300)
+		self.snapshot_history_lock = threading.Lock()
 
 		#
 		# attach a StreamThinca instance to ourselves
@@ -766,11 +837,11 @@ class Handler(simplehandler.Handler):
 
 		if self.ranking_stat_input_url is not None:
 			if self.rankingstat.is_healthy(self.verbose):
-				self.stream_thinca.ln_lr_from_triggers = far.OnlineFrankensteinRankingStat(self.rankingstat, self.rankingstat).finish().ln_lr_from_triggers
+				self.stream_thinca.ln_lr_from_triggers_batch = far.OnlineFrankensteinRankingStat(self.rankingstat, self.rankingstat).finish().ln_lr_from_triggers_batch
 				if self.verbose:
 					print("ranking statistic assignment ENABLED", file=sys.stderr)
 			else:
-				self.stream_thinca.ln_lr_from_triggers = None
+				self.stream_thinca.ln_lr_from_triggers_batch = None
 				if self.verbose:
 					print("ranking statistic assignment DISABLED", file=sys.stderr)
 		elif False:
@@ -778,16 +849,16 @@ class Handler(simplehandler.Handler):
 			# .__call__() and then use as coinc sieve function
 			# instead.  left here temporariliy to remember how
 			# to initialize it
-			self.stream_thinca.ln_lr_from_triggers = far.DatalessRankingStat(
+			self.stream_thinca.ln_lr_from_triggers_batch = far.DatalessRankingStat(
 				template_ids = rankingstat.template_ids,
 				instruments = rankingstat.instruments,
 				min_instruments = rankingstat.min_instruments,
 				delta_t = rankingstat.delta_t
-			).finish().ln_lr_from_triggers
+			).finish().ln_lr_from_triggers_batch
 			if self.verbose:
 				print("ranking statistic assignment ENABLED", file=sys.stderr)
 		else:
-			self.stream_thinca.ln_lr_from_triggers = None
+			self.stream_thinca.ln_lr_from_triggers_batch = None
 			if self.verbose:
 				print("ranking statistic assignment DISABLED", file=sys.stderr)
 
@@ -830,10 +901,14 @@ class Handler(simplehandler.Handler):
 		# interface for diagnostic purposes and uploaded to gracedb
 		# with candidates.  the extinction model is applied to
 		# initialize the FAPFAR object but the original is retained
-		# for upload to gracedb, etc.
+		# for upload to gracedb, etc.  if the URL names a binary file
+		# written by far.write_rankingstatpdf_binary() the FAPFAR
+		# object is loaded from it instead of being recomputed.  the
+		# file is only re-read when its modification time changes.
 		#
 
 		self.rankingstatpdf_url = rankingstatpdf_url
+		self.rankingstatpdf_mtime = None
 		self.load_rankingstat_pdf()
 
 		#
@@ -956,14 +1031,24 @@ class Handler(simplehandler.Handler):
 		# disables FAP/FAR assignment.  need to figure out when
 		# failure is OK and when it's not OK and put a better check
 		# here.
-		if self.rankingstatpdf_url is not None and os.access(ligolw_utils.local_path_from_url(self.rankingstatpdf_url), os.R_OK):
-			_, self.rankingstatpdf = far.parse_likelihood_control_doc(ligolw_utils.load_url(self.rankingstatpdf_url, verbose = self.verbose, contenthandler = far.RankingStat.LIGOLWContentHandler))
+		path = ligolw_utils.local_path_from_url(self.rankingstatpdf_url)
+		if path is not None and os.access(path, os.R_OK):
+			mtime = os.stat(path).st_mtime_ns
+			if mtime == self.rankingstatpdf_mtime:
+				# unchanged since last loaded
+				return
+			if path.endswith(".npz"):
+				self.rankingstatpdf, fapfar = far.read_rankingstatpdf_binary(path, verbose = self.verbose)
+			else:
+				_, self.rankingstatpdf = far.parse_likelihood_control_doc(ligolw_utils.load_url(self.rankingstatpdf_url, verbose = self.verbose, contenthandler = far.RankingStat.LIGOLWContentHandler))
+				fapfar = None
 			if self.rankingstatpdf is None:
 				raise ValueError("\"%s\" does not contain ranking statistic PDFs" % url)
 			if not self.rankingstat.template_ids <= self.rankingstatpdf.template_ids:
 				raise ValueError("\"%s\" is for the wrong templates")
+			self.rankingstatpdf_mtime = mtime
 			if self.rankingstatpdf.is_healthy(self.verbose):
-				self.fapfar = far.FAPFAR(self.rankingstatpdf.new_with_extinction())
+				self.fapfar = fapfar if fapfar is not None else far.FAPFAR(self.rankingstatpdf.new_with_extinction())
 				if self.verbose:
 					print("false-alarm probability and rate assignment ENABLED", file=sys.stderr)
 			else:
@@ -972,14 +1057,22 @@ class Handler(simplehandler.Handler):
 					print("false-alarm probability and rate assignment DISABLED", file=sys.stderr)
 		else:
 			self.rankingstatpdf = None
+			self.rankingstatpdf_mtime = None
 			self.fapfar = None
 
 
 	def appsink_new_buffer(self, elem):
 		with self.lock:
-			# retrieve triggers from appsink element
+			# retrieve triggers from appsink element.  the
+			# records' headers are decoded into a numpy
+			# structured array and the per-buffer bookkeeping
+			# below is done on that.  row objects are
+			# constructed only for the triggers that survive
+			# the SNR cut
 			buf = elem.emit("pull-sample").get_buffer()
+			snr_min = self.rankingstat.snr_min
 			events = []
+			headers = []
 			for i in range(buf.n_memory()):
 				memory = buf.peek_memory(i)
 				result, mapinfo = memory.map(Gst.MapFlags.READ)
@@ -998,15 +1091,20 @@ class Handler(simplehandler.Handler):
 				# FIXME why does mapinfo.data come out as
 				# an empty list on some occasions???
 				if mapinfo.data:
-					events.extend(SnglInspiral.from_buffer(mapinfo.data))
+					offsets, memory_headers = SnglInspiral.headers_from_buffer(mapinfo.data)
+					headers.append(memory_headers)
+					events.extend(SnglInspiral.from_buffer(mapinfo.data, offsets[memory_headers["snr"].astype("double") >= snr_min]))
 				memory.unmap(mapinfo)
+			headers = numpy.concatenate(headers) if headers else numpy.empty((0,), dtype = SnglInspiral.row_dtype)
+			# NOTE:  compare in double precision, as the row
+			# objects' .snr attributes would be
+			snrs = headers["snr"].astype("double")
+			above_threshold = snrs >= snr_min
+			end_ns = headers["end_time"].astype("int64") * 1000000000 + headers["end_time_ns"]
 
 			# FIXME:  ugly way to get the instrument
-			instruments = set([event.ifo for event in events])
-
-			# FIXME calculate a chisq weighted SNR and store it in the bank_chisq column
-			for event in events:
-				event.bank_chisq = event.snr / ((1 + max(1., event.chisq)**3)/2.0)**(1./5.)
+			instrument_masks = dict((ifo.decode(), headers["ifo"] == ifo) for ifo in numpy.unique(headers["ifo"]))
+			instruments = set(instrument_masks)
 
 			# extract segment.  move the segment's upper
 			# boundary to include all triggers.  ARGH the 1 ns
@@ -1014,10 +1112,10 @@ class Handler(simplehandler.Handler):
 			# "in" the segment (segments are open from above)
 			# FIXME:  is there another way?
 			buf_timestamp = LIGOTimeGPS(0, buf.pts)
-			buf_seg = dict((instrument, segments.segment(buf_timestamp, max(buf_timestamp + LIGOTimeGPS(0, buf.duration), max(event.end for event in events if event.ifo == instrument) + 0.000000001))) for instrument in instruments)
+			buf_seg = dict((instrument, segments.segment(buf_timestamp, max(buf_timestamp + LIGOTimeGPS(0, buf.duration), LIGOTimeGPS(0, int(end_ns[mask].max()) + 1)))) for instrument, mask in instrument_masks.items())
 			buf_is_gap = bool(buf.mini_object.flags & Gst.BufferFlags.GAP)
 			# sanity check that gap buffers are empty
-			assert not (buf_is_gap and events)
+			assert not (buf_is_gap and len(headers))
 
 			# safety check end times.  we cannot allow triggr
 			# times to go backwards.  they cannot precede the
@@ -1027,20 +1125,24 @@ class Handler(simplehandler.Handler):
 			# this method to be fed buffers in time order:  we
 			# must never receive a buffer whose timestamp
 			# precedes the timestamp of a buffer we have
-			# already received.  NOTE:  the trigger objects'
-			# comparison operators can be used for this test
-			# directly, without explicitly retrieving .end
-			assert all(event >= buf_timestamp for event in events)
-
-			# assign IDs to triggers.  set all effective
-			# distances to NaN.  gstlal_inspiral's effective
-			# distances are incorrect, and the PE codes require
-			# us to either provide correct effective distances
-			# or communicate to them that they are incorrect.
+			# already received.
+			assert (end_ns >= buf.pts).all()
+
+			# FIXME calculate a chisq weighted SNR and store it
+			# in the bank_chisq column.  assign IDs to
+			# triggers.  set all effective distances to NaN.
+			# gstlal_inspiral's effective distances are
+			# incorrect, and the PE codes require us to either
+			# provide correct effective distances or
+			# communicate to them that they are incorrect.
 			# they have explained that setting them to NaN is
-			# sufficient for the latter.
+			# sufficient for the latter.  NOTE:  only the
+			# triggers that survive the SNR cut are assigned
+			# IDs, the others are discarded below.
 			# FIXME:  fix the effective distances
-			for event in events:
+			bank_chisqs = snrs[above_threshold] / ((1. + numpy.maximum(1., headers["chisq"][above_threshold].astype("double"))**3) / 2.)**(1. / 5.)
+			for event, bank_chisq in zip(events, bank_chisqs):
+				event.bank_chisq = bank_chisq
 				event.process_id = self.coincs_document.process_id
 				event.event_id = self.coincs_document.get_next_sngl_id()
 				event.eff_distance = NaN
@@ -1084,11 +1186,11 @@ class Handler(simplehandler.Handler):
 				# update streamthinca's ranking statistic
 				# data
 				if self.rankingstat.is_healthy(self.verbose):
-					self.stream_thinca.ln_lr_from_triggers = far.OnlineFrankensteinRankingStat(self.rankingstat, self.rankingstat).finish().ln_lr_from_triggers
+					self.stream_thinca.ln_lr_from_triggers_batch = far.OnlineFrankensteinRankingStat(self.rankingstat, self.rankingstat).finish().ln_lr_from_triggers_batch
 					if self.verbose:
 						print("ranking statistic assignment ENABLED", file=sys.stderr)
 				else:
-					self.stream_thinca.ln_lr_from_triggers = None
+					self.stream_thinca.ln_lr_from_triggers_batch = None
 					if self.verbose:
 						print("ranking statistic assignment DISABLED", file=sys.stderr)
 
@@ -1114,26 +1216,21 @@ class Handler(simplehandler.Handler):
 			# so that the "how many instruments were on test"
 			# is aware of this buffer.
 			if not buf_is_gap:
-				snr_min = self.rankingstat.snr_min
-				for instrument in instruments:
+				for instrument, mask in instrument_masks.items():
 					# FIXME At the moment, empty triggers are added to
 					# inform the "how many instruments were on test", the
 					# correct thing to do is probably to add metadata to
 					# the buffer containing information about which
 					# instruments were on
-					self.rankingstat.denominator.triggerrates[instrument].add_ratebin(list(map(float, buf_seg[instrument])), len([event for event in events if event.snr >= snr_min and event.ifo == instrument]))
+					self.rankingstat.denominator.triggerrates[instrument].add_ratebin(list(map(float, buf_seg[instrument])), int(numpy.count_nonzero(mask & above_threshold)))
 
 			# FIXME At the moment, empty triggers are added to
 			# inform the "how many instruments were on test", the
 			# correct thing to do is probably to add metadata to
 			# the buffer containing information about which
-			# instruments were on
-			real_events = []
-			for event in events:
-				if event.snr >= snr_min:
-					real_events.append(event)
-
-			events = real_events
+			# instruments were on.  the empty triggers were
+			# removed by the SNR cut above, when the row
+			# objects were constructed
 
 			# run stream thinca.
 			instruments |= self.absent_instruments
@@ -1263,7 +1360,7 @@ class Handler(simplehandler.Handler):
 		writing to disk
 		"""
 		try:
-			self.snapshot_output_url("%s_LLOID" % self.tag, "xml.gz", verbose = self.verbose)
+			self.snapshot_output_url("%s_LLOID" % self.tag, "h5" if self.coincs_document.store is not None else "xml.gz", verbose = self.verbose)
 		except TypeError as te:
 			print("Warning: couldn't build output file on checkpoint, probably there aren't any triggers: %s" % te, file=sys.stderr)
 		# FIXME:  the timestamp is used to close off open segments
@@ -1292,7 +1389,7 @@ class Handler(simplehandler.Handler):
 		return outstr
 
 
-	def __get_rankingstat_xmldoc(self, clipped = False):
+	def __get_rankingstat_xmldoc(self, clipped = False, rankingstat = None, rankingstatpdf = None):
 		# generate a ranking statistic output document.  NOTE:  if
 		# we are in possession of ranking statistic PDFs then those
 		# are included in the output.  this allows a single
@@ -1303,14 +1400,20 @@ class Handler(simplehandler.Handler):
 		# total observed zero-lag ranking statistic histogram ---
 		# everything required to re-evaluate the FAP and FAR for an
 		# uploaded candidate.
+		#
+		# rankingstat and rankingstatpdf default to our own, they
+		# can be given to generate the document from copies
+		if rankingstat is None:
+			rankingstat = self.rankingstat
+			rankingstatpdf = self.rankingstatpdf
 		xmldoc = ligolw.Document()
 		xmldoc.appendChild(ligolw.LIGO_LW())
-		process = ligolw_process.register_to_xmldoc(xmldoc, u"gstlal_inspiral", paramdict = {}, ifos = self.rankingstat.instruments)
+		process = ligolw_process.register_to_xmldoc(xmldoc, u"gstlal_inspiral", paramdict = {}, ifos = rankingstat.instruments)
 		# FIXME:  don't do this.  find a way to reduce the storage
 		# requirements of the horizon distance history and then go
 		# back to uploading the full file to gracedb
 		if clipped:
-			rankingstat = self.rankingstat.copy()
+			rankingstat = rankingstat.copy()
 			try:
 				endtime = rankingstat.numerator.horizon_history.maxkey()
 			except ValueError:
@@ -1321,9 +1424,7 @@ class Handler(simplehandler.Handler):
 				endtime -= 3600. * 1
 				for history in rankingstat.numerator.horizon_history.values():
 					del history[:endtime]
-		else:
-			rankingstat = self.rankingstat
-		far.gen_likelihood_control_doc(xmldoc, rankingstat, self.rankingstatpdf)
+		far.gen_likelihood_control_doc(xmldoc, rankingstat, rankingstatpdf)
 		ligolw_process.set_process_end_time(process)
 		return xmldoc
 
@@ -1345,11 +1446,11 @@ class Handler(simplehandler.Handler):
 			return outstr
 
 
-	def __get_zerolag_rankingstatpdf_xmldoc(self):
+	def __get_zerolag_rankingstatpdf_xmldoc(self, zerolag_rankingstatpdf = None):
 		xmldoc = ligolw.Document()
 		xmldoc.appendChild(ligolw.LIGO_LW())
 		process = ligolw_process.register_to_xmldoc(xmldoc, u"gstlal_inspiral", paramdict = {}, ifos = self.rankingstat.instruments)
-		far.gen_likelihood_control_doc(xmldoc, None, self.zerolag_rankingstatpdf)
+		far.gen_likelihood_control_doc(xmldoc, None, zerolag_rankingstatpdf if zerolag_rankingstatpdf is not None else self.zerolag_rankingstatpdf)
 		ligolw_process.set_process_end_time(process)
 		return xmldoc
 
@@ -1430,37 +1531,84 @@ class Handler(simplehandler.Handler):
 		del self.coincs_document
 
 
-	def __write_ranking_stat_url(self, url, description, snapshot = False, verbose = False):
+	def __write_ranking_stat_url(self, url, snapshot_fname = None, xmldoc = None, verbose = False):
 		# write the ranking statistic file.
-		ligolw_utils.write_url(self.__get_rankingstat_xmldoc(), url, gz = (url or "stdout").endswith(".gz"), verbose = verbose, trap_signals = None)
+		if xmldoc is None:
+			xmldoc = self.__get_rankingstat_xmldoc()
+		ligolw_utils.write_url(xmldoc, url, gz = (url or "stdout").endswith(".gz"), verbose = verbose, trap_signals = None)
 		# Snapshots get their own custom file and path
-		if snapshot:
-			fname = self.segmentstracker.T050017_filename(description + '_DISTSTATS', 'xml.gz')
-			shutil.copy(ligolw_utils.local_path_from_url(url), os.path.join(subdir_from_T050017_filename(fname), fname))
+		if snapshot_fname is not None:
+			shutil.copy(ligolw_utils.local_path_from_url(url), snapshot_fname)
 
 
 	def write_output_url(self, url = None, description = "", verbose = False):
+		# finish any snapshots still being written so that they
+		# do not overwrite this output.  a failed snapshot must
+		# not prevent the final output from being written, its
+		# traceback has already been printed
+		try:
+			self.snapshot_writer.wait()
+		except Exception as e:
+			print("Warning: snapshot failed: %s" % e, file=sys.stderr)
 		with self.lock:
 			if self.ranking_stat_output_url is not None:
-				self.__write_ranking_stat_url(self.ranking_stat_output_url, description, verbose = verbose)
+				self.__write_ranking_stat_url(self.ranking_stat_output_url, verbose = verbose)
 			self.__write_output_url(url = url, verbose = verbose)
 
 
 	def snapshot_output_url(self, description, extension, verbose = False):
+		# while holding the lock, flush stream thinca, swap in a
+		# fresh coinc document, and take copies of the ranking
+		# statistic data and segment lists.  the documents are
+		# built and written to disk afterwards by the snapshot
+		# writer thread.
+		t_start = time.time()
 		with self.lock:
+			t_locked = time.time()
 			fname = self.segmentstracker.T050017_filename(description, extension)
 			fname = os.path.join(subdir_from_T050017_filename(fname), fname)
-			if self.ranking_stat_output_url is not None:
-				self.__write_ranking_stat_url(self.ranking_stat_output_url, description, snapshot = True, verbose = verbose)
-			if self.zerolag_rankingstatpdf_url is not None:
-				ligolw_utils.write_url(self.__get_zerolag_rankingstatpdf_xmldoc(), self.zerolag_rankingstatpdf_url, gz = (self.zerolag_rankingstatpdf_url or "stdout").endswith(".gz"), verbose = verbose, trap_signals = None)
+			diststats_fname = self.segmentstracker.T050017_filename(description + '_DISTSTATS', 'xml.gz')
+			diststats_fname = os.path.join(subdir_from_T050017_filename(diststats_fname), diststats_fname)
+			rankingstat = self.rankingstat.copy() if self.ranking_stat_output_url is not None else None
+			rankingstatpdf = self.rankingstatpdf
+			zerolag_rankingstatpdf = self.zerolag_rankingstatpdf.copy() if self.zerolag_rankingstatpdf_url is not None else None
 			coincs_document = self.coincs_document.get_another()
-			self.__write_output_url(url = fname, verbose = verbose)
-			self.coincs_document = coincs_document
+			self.__flush()
+			coincs_document, self.coincs_document = self.coincs_document, coincs_document
+			coincs_document.url = fname
+			with self.segmentstracker.lock:
+				seglistdicts = dict((segtype, seglistdict.copy()) for segtype, seglistdict in self.segmentstracker.seglistdicts.items())
 			# NOTE:  this operation requires stream_thinca to
 			# have been flushed by calling .pull() with flush =
-			# True.  the .__write_output_url() code path does
-			# that, but there is no check here to ensure that
-			# remains true so be careful if you are editing
-			# these methods.
+			# True.  the .__flush() call above does that, but
+			# there is no check here to ensure that remains true
+			# so be careful if you are editing this method.
 			self.stream_thinca.set_xmldoc(self.coincs_document.xmldoc, self.coincs_document.process_id)
+			# the database working file can be shared with
+			# the new document (see dbtables'
+			# get_connection_filename()), so database-backed
+			# documents are written here
+			if coincs_document.connection is not None:
+				coincs_document.write_output_url(seglistdicts = seglistdicts, verbose = verbose)
+				coincs_document = None
+		t_unlocked = time.time()
+
+		def write():
+			if rankingstat is not None:
+				self.__write_ranking_stat_url(self.ranking_stat_output_url, snapshot_fname = diststats_fname, xmldoc = self.__get_rankingstat_xmldoc(rankingstat = rankingstat, rankingstatpdf = rankingstatpdf), verbose = verbose)
+			if zerolag_rankingstatpdf is not None:
+				ligolw_utils.write_url(self.__get_zerolag_rankingstatpdf_xmldoc(zerolag_rankingstatpdf), self.zerolag_rankingstatpdf_url, gz = (self.zerolag_rankingstatpdf_url or "stdout").endswith(".gz"), verbose = verbose, trap_signals = None)
+			if coincs_document is not None:
+				coincs_document.write_output_url(seglistdicts = seglistdicts, verbose = verbose)
+			t_end = time.time()
+			with self.snapshot_history_lock:
+				self.snapshot_history.append((float(inspiral.now()), t_unlocked - t_locked, t_end - t_start))
+			if verbose:
+				print("snapshot %s: lock held for %.3f s, written in %.3f s" % (fname, t_unlocked - t_locked, t_end - t_start), file=sys.stderr)
+		self.snapshot_writer.submit(write)
+
+
+	def web_get_snapshot_history(self):
+		with self.snapshot_history_lock:
+			snapshot_history = list(self.snapshot_history)
+		return "".join("%.9f %g %g\n" % (t, lock_time, duration) for t, lock_time, duration in snapshot_history)
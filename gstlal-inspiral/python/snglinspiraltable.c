@@ -510,22 +510,118 @@ static void __del__(PyObject *self)
 }
 
 
-static PyObject *from_buffer(PyObject *cls, PyObject *args)
+/*
+ * the size in bytes of the record, including its SNR time series, at the
+ * start of data, or 0 if the record's header overruns the end of the
+ * buffer
+ */
+
+
+static size_t record_size(const char *data, const char *end)
+{
+	const struct GSTLALSnglInspiral *gstlal_snglinspiral = (const struct GSTLALSnglInspiral *) data;
+
+	if (data + sizeof(*gstlal_snglinspiral) > end)
+		return 0;
+	return sizeof(*gstlal_snglinspiral) + sizeof(gstlal_snglinspiral->snr[0]) * (gstlal_snglinspiral->G1_length + gstlal_snglinspiral->H1_length + gstlal_snglinspiral->K1_length + gstlal_snglinspiral->L1_length + gstlal_snglinspiral->V1_length);
+}
+
+
+static PyObject *record_offsets(PyObject *cls, PyObject *args)
 {
 	const char *data;
 	Py_ssize_t length;
+	Py_ssize_t offset;
+	npy_intp n = 0;
 	PyObject *result;
 
 	if(!PyArg_ParseTuple(args, "s#", (const char **) &data, &length))
 		return NULL;
+
+	/* count the records */
+	for(offset = 0; offset < length; n++) {
+		size_t size = record_size(data + offset, data + length);
+		if(!size || offset + (Py_ssize_t) size > length) {
+			PyErr_SetString(PyExc_ValueError, "buffer overrun while scanning sngl_inspiral rows");
+			return NULL;
+		}
+		offset += size;
+	}
+
+	/* record their offsets */
+	result = PyArray_SimpleNew(1, &n, NPY_INTP);
+	if(!result)
+		return NULL;
+	for(offset = 0, n = 0; offset < length; n++) {
+		((npy_intp *) PyArray_DATA((PyArrayObject *) result))[n] = offset;
+		offset += record_size(data + offset, data + length);
+	}
+
+	return result;
+}
+
+
+static PyObject *from_buffer(PyObject *cls, PyObject *args)
+{
+	const char *data;
+	Py_ssize_t length;
+	PyObject *selection = NULL;
+	PyObject *offsets = NULL;
+	Py_ssize_t next_offset = 0;
+	PyObject *result;
+
+	if(!PyArg_ParseTuple(args, "s#|O", (const char **) &data, &length, &selection))
+		return NULL;
+	const char *const start = data;
 	const char *const end = data + length;
 
+	/* optional sorted sequence of the byte offsets of the records to
+	 * convert.  all other records are skipped */
+	if(selection && selection != Py_None) {
+		offsets = PySequence_Fast(selection, "offsets must be a sequence");
+		if(!offsets)
+			return NULL;
+	}
+
 	result = PyList_New(0);
-	if(!result)
+	if(!result) {
+		Py_XDECREF(offsets);
 		return NULL;
+	}
 	while (data < end) {
+		if(offsets) {
+			size_t size;
+			if(next_offset >= PySequence_Fast_GET_SIZE(offsets))
+				break;
+			Py_ssize_t offset = PyNumber_AsSsize_t(PySequence_Fast_GET_ITEM(offsets, next_offset), PyExc_OverflowError);
+			if(offset == -1 && PyErr_Occurred()) {
+				Py_DECREF(offsets);
+				Py_DECREF(result);
+				return NULL;
+			}
+			if(offset < data - start) {
+				Py_DECREF(offsets);
+				Py_DECREF(result);
+				PyErr_SetString(PyExc_ValueError, "offsets must be sorted and must be the offsets of records");
+				return NULL;
+			}
+			if(offset > data - start) {
+				/* skip this record */
+				size = record_size(data, end);
+				if(!size) {
+					Py_DECREF(offsets);
+					Py_DECREF(result);
+					PyErr_SetString(PyExc_ValueError, "buffer overrun while skipping sngl_inspiral row");
+					return NULL;
+				}
+				data += size;
+				continue;
+			}
+			next_offset++;
+		}
 		PyObject *item = PyType_GenericNew((PyTypeObject *) cls, NULL, NULL);
 		if(!item) {
+			Py_XDECREF(offsets);
 			Py_DECREF(result);
 			return NULL;
 		}
@@ -534,6 +630,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 		data += sizeof(*gstlal_snglinspiral);
 		if (data > end)
 		{
+			Py_XDECREF(offsets);
 			Py_DECREF(item);
 			Py_DECREF(result);
 			PyErr_SetString(PyExc_ValueError, "buffer overrun while copying sngl_inspiral row");
@@ -547,6 +644,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			const size_t G1_nbytes = sizeof(gstlal_snglinspiral->snr[0]) * gstlal_snglinspiral->G1_length;
 			if (data + G1_nbytes > end)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_ValueError, "buffer overrun while copying G1 SNR time series");
@@ -555,6 +653,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			COMPLEX8TimeSeries *series = XLALCreateCOMPLEX8TimeSeries("snr", &gstlal_snglinspiral->epoch, 0., gstlal_snglinspiral->deltaT, &lalDimensionlessUnit, gstlal_snglinspiral->G1_length);
 			if (!series)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_MemoryError, "out of memory");
@@ -573,6 +672,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			const size_t H1_nbytes = sizeof(gstlal_snglinspiral->snr[0]) * gstlal_snglinspiral->H1_length;
 			if (data + H1_nbytes > end)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_ValueError, "buffer overrun while copying H1 SNR time series");
@@ -581,6 +681,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			COMPLEX8TimeSeries *series = XLALCreateCOMPLEX8TimeSeries("snr", &gstlal_snglinspiral->epoch, 0., gstlal_snglinspiral->deltaT, &lalDimensionlessUnit, gstlal_snglinspiral->H1_length);
 			if (!series)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_MemoryError, "out of memory");
@@ -599,6 +700,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			const size_t K1_nbytes = sizeof(gstlal_snglinspiral->snr[0]) * gstlal_snglinspiral->K1_length;
 			if (data + K1_nbytes > end)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_ValueError, "buffer overrun while copying K1 SNR time series");
@@ -607,6 +709,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			COMPLEX8TimeSeries *series = XLALCreateCOMPLEX8TimeSeries("snr", &gstlal_snglinspiral->epoch, 0., gstlal_snglinspiral->deltaT, &lalDimensionlessUnit, gstlal_snglinspiral->K1_length);
 			if (!series)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_MemoryError, "out of memory");
@@ -625,6 +728,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			const size_t L1_nbytes = sizeof(gstlal_snglinspiral->snr[0]) * gstlal_snglinspiral->L1_length;
 			if (data + L1_nbytes > end)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_ValueError, "buffer overrun while copying SNR time series");
@@ -634,6 +738,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			COMPLEX8TimeSeries *series = XLALCreateCOMPLEX8TimeSeries("snr", &gstlal_snglinspiral->epoch, 0., gstlal_snglinspiral->deltaT, &lalDimensionlessUnit, gstlal_snglinspiral->L1_length);
 			if (!series)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_MemoryError, "out of memory");
@@ -651,6 +756,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			const size_t V1_nbytes = sizeof(gstlal_snglinspiral->snr[0]) * gstlal_snglinspiral->V1_length;
 			if (data + V1_nbytes > end)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_ValueError, "buffer overrun while copying SNR time series");
@@ -659,6 +765,7 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 			COMPLEX8TimeSeries *series = XLALCreateCOMPLEX8TimeSeries("snr", &gstlal_snglinspiral->epoch, 0., gstlal_snglinspiral->deltaT, &lalDimensionlessUnit, gstlal_snglinspiral->V1_length);
 			if (!series)
 			{
+				Py_XDECREF(offsets);
 				Py_DECREF(item);
 				Py_DECREF(result);
 				PyErr_SetString(PyExc_MemoryError, "out of memory");
@@ -676,7 +783,16 @@ static PyObject *from_buffer(PyObject *cls, PyObject *args)
 		Py_DECREF(item);
 	}
 
-	if (data != end)
+	if (offsets) {
+		Py_ssize_t n = PySequence_Fast_GET_SIZE(offsets);
+		Py_DECREF(offsets);
+		if (next_offset != n)
+		{
+			Py_DECREF(result);
+			PyErr_SetString(PyExc_ValueError, "offsets must be sorted and must be the offsets of records");
+			return NULL;
+		}
+	} else if (data != end)
 	{
 		Py_DECREF(result);
 		PyErr_SetString(PyExc_ValueError, "did not consume entire buffer");
@@ -760,7 +876,8 @@ static PyObject *random_obj(PyObject *cls, PyObject *args)
 
 
 static struct PyMethodDef methods[] = {
-	{"from_buffer", from_buffer, METH_VARARGS | METH_CLASS, "Construct a tuple of GSTLALSnglInspiral objects from a buffer object.  The buffer is interpreted as a C array of GSTLALSnglInspiral structures.  All data is copied, the buffer can be deallocated afterwards."},
+	{"from_buffer", from_buffer, METH_VARARGS | METH_CLASS, "Construct a tuple of GSTLALSnglInspiral objects from a buffer object.  The buffer is interpreted as a C array of GSTLALSnglInspiral structures.  If the optional second argument is given it must be a sorted sequence of the byte offsets of the records to convert, as returned by .record_offsets(), and all other records are skipped.  All data is copied, the buffer can be deallocated afterwards."},
+	{"record_offsets", record_offsets, METH_VARARGS | METH_CLASS, "Return a numpy array of the byte offsets of the GSTLALSnglInspiral structures in a buffer object.  See also the module's row_dtype."},
 	{"_G1_snr_time_series_deleter", _G1_snr_time_series_deleter, METH_NOARGS, "Release the G1 SNR time series attached to the GSTLALSnglInspiral object."},
 	{"_H1_snr_time_series_deleter", _H1_snr_time_series_deleter, METH_NOARGS, "Release the H1 SNR time series attached to the GSTLALSnglInspiral object."},
 	{"_K1_snr_time_series_deleter", _K1_snr_time_series_deleter, METH_NOARGS, "Release the K1 SNR time series attached to the GSTLALSnglInspiral object."},
@@ -905,5 +1022,29 @@ PyMODINIT_FUNC PyInit__snglinspiraltable(void)
 	Py_INCREF(&gstlal_GSTLALSnglInspiral_Type);
 	PyModule_AddObject(module, "GSTLALSnglInspiral", (PyObject *) &gstlal_GSTLALSnglInspiral_Type);
 
+	/* numpy dtype description of the leading columns of the
+	 * GSTLALSnglInspiral structure, used to interpret the records'
+	 * headers as numpy structured arrays.  the itemsize is the size of
+	 * the structure excluding the SNR time series */
+
+	{
+	char ifo_format[16];
+	snprintf(ifo_format, sizeof(ifo_format), "S%d", LIGOMETA_IFO_MAX);
+	PyObject *row_dtype = Py_BuildValue("{s:[sssss],s:[sssss],s:[nnnnn],s:n}",
+		"names", "ifo", "end_time", "end_time_ns", "snr", "chisq",
+		"formats", ifo_format, "i4", "i4", "f4", "f4",
+		"offsets",
+			(Py_ssize_t) offsetof(struct GSTLALSnglInspiral, parent.ifo),
+			(Py_ssize_t) offsetof(struct GSTLALSnglInspiral, parent.end.gpsSeconds),
+			(Py_ssize_t) offsetof(struct GSTLALSnglInspiral, parent.end.gpsNanoSeconds),
+			(Py_ssize_t) offsetof(struct GSTLALSnglInspiral, parent.snr),
+			(Py_ssize_t) offsetof(struct GSTLALSnglInspiral, parent.chisq),
+		"itemsize", (Py_ssize_t) sizeof(struct GSTLALSnglInspiral)
+	);
+	if(!row_dtype)
+		return NULL;
+	PyModule_AddObject(module, "row_dtype", row_dtype);
+	}
+
 	return module;
 }
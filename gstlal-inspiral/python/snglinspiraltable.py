@@ -15,6 +15,9 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 
+import numpy
+
+
 from ligo.lw import lsctables
 import lal
 from . import _snglinspiraltable
@@ -29,6 +32,27 @@ class GSTLALSnglInspiral(_snglinspiraltable.GSTLALSnglInspiral):
 	spin1 = lsctables.SnglInspiral.spin1
 	spin2 = lsctables.SnglInspiral.spin2
 
+	# numpy dtype of the fixed-size headers of the records in the
+	# buffers that .from_buffer() decodes
+	row_dtype = numpy.dtype(_snglinspiraltable.row_dtype)
+
+	@classmethod
+	def headers_from_buffer(cls, buf):
+		"""
+		Return a tuple of two numpy arrays describing the records in
+		buf without constructing row objects:  the byte offsets of
+		the records, and a structured array of their headers with
+		dtype .row_dtype (columns ifo, end_time, end_time_ns, snr
+		and chisq).  The headers are copied so buf can be
+		deallocated afterwards.  Passing a subset of the offsets to
+		.from_buffer() constructs row objects for only those
+		records.
+		"""
+		offsets = cls.record_offsets(buf)
+		raw = numpy.frombuffer(buf, dtype = numpy.uint8)
+		headers = raw[offsets[:, numpy.newaxis] + numpy.arange(cls.row_dtype.itemsize)].view(cls.row_dtype).reshape((len(offsets),))
+		return offsets, headers
+
 	@property
 	def G1_snr_time_series(self):
 		try:
@@ -46,7 +46,6 @@
 #
 
 
-import bisect
 import copy
 try:
 	from fpconst import NaN, NegInf, PosInf
@@ -59,6 +58,7 @@ except ImportError:
 import math
 import numpy
 import random
+import sys
 
 
 from ligo.lw import ligolw
@@ -83,6 +83,13 @@ class NearestLeafTree(object):
 	closest leaf.  Only float objects are supported for the keys and
 	values.  Look-ups raise KeyError if the tree is empty.
 
+	The (key, value) pairs are stored in sorted numpy arrays.  Appending
+	a key larger than all others is amortized O(1), look-ups are
+	O(log n), and integrals of functionals that do not depend on
+	variables from an enclosing scope, like lambda D: D**3., are
+	computed from cached cumulative sums in O(log n) (see
+	.functional_integral()).
+
 	Example:
 
 	>>> x = NearestLeafTree()
@@ -133,10 +140,83 @@ class NearestLeafTree(object):
 		>>> x = NearestLeafTree(y.items())
 		"""
 		# make a copy to ensure we have a stable object
-		self.tree = list(map(tuple, items))
-		if any(len(item) != 2 for item in self.tree):
+		items = list(map(tuple, items))
+		if any(len(item) != 2 for item in items):
 			raise ValueError("items must be sequence of two-element sequences")
-		self.tree.sort()
+		if items:
+			x, y = numpy.array(items, dtype = "double").T
+		else:
+			x = y = numpy.empty((0,), dtype = "double")
+		self.__set_arrays(x, y)
+
+	def __set_arrays(self, x, y):
+		# sort by key then by value, like a sorted list of tuples
+		order = numpy.lexsort((y, x))
+		self._n = len(order)
+		self._x = numpy.empty((max(self._n, 16),), dtype = "double")
+		self._y = numpy.empty_like(self._x)
+		self._x[:self._n] = x[order]
+		self._y[:self._n] = y[order]
+		# cumulative integrals.  see .__cumulative_integral()
+		self._integrals = {}
+
+	@classmethod
+	def from_arrays(cls, x, y):
+		"""
+		Construct a NearestLeafTree from arrays of keys and values.
+
+		Example:
+
+		>>> NearestLeafTree.from_arrays([104., 100.], [100., 120.])
+		NearestLeafTree([(100, 120), (104, 100)])
+		"""
+		x = numpy.array(x, dtype = "double")
+		y = numpy.array(y, dtype = "double")
+		if x.shape != y.shape or x.ndim != 1:
+			raise ValueError("keys and values must be one-dimensional arrays of equal length")
+		self = cls.__new__(cls)
+		self.__set_arrays(x, y)
+		return self
+
+	def copy(self):
+		"""
+		Return a copy of the tree.
+		"""
+		return type(self).from_arrays(self._x[:self._n], self._y[:self._n])
+
+	def __deepcopy__(self, memo):
+		return self.copy()
+
+	def __reduce__(self):
+		# the cumulative integrals are keyed by code objects, which
+		# can't be pickled
+		return type(self).from_arrays, (self._x[:self._n], self._y[:self._n])
+
+	def __replace(self, lo, hi, x, y):
+		# replace entries lo:hi with the keys x and values y.  x and
+		# y must be sorted and belong in this position
+		k = len(x)
+		n = self._n - (hi - lo) + k
+		if n > len(self._x):
+			# grow geometrically so that appending is
+			# amortized O(1).  cumulative integrals are
+			# discarded, they are recomputed on demand
+			size = max(n, 2 * len(self._x))
+			for name in ("_x", "_y"):
+				new = numpy.empty((size,), dtype = "double")
+				new[:self._n] = getattr(self, name)[:self._n]
+				setattr(self, name, new)
+			self._integrals.clear()
+		if hi - lo != k:
+			self._x[lo + k:n] = self._x[hi:self._n]
+			self._y[lo + k:n] = self._y[hi:self._n]
+		self._x[lo:lo + k] = x
+		self._y[lo:lo + k] = y
+		self._n = n
+		# cumulative integrals up to the mid-points on either side
+		# of a modified entry are no longer correct.  see
+		# .__cumulative_integral()
+		self._integrals = dict((code, (cumsum, min(valid, max(lo - 2, 0)))) for code, (cumsum, valid) in self._integrals.items() if cumsum is not None)
 
 	def __setitem__(self, x, val):
 		"""
@@ -152,6 +232,7 @@ class NearestLeafTree(object):
 		>>> x
 		NearestLeafTree([(90, 5), (100, 0), (150, 1), (200, 0), (210, 5)])
 		"""
+		keys = self._x[:self._n]
 		if isinstance(x, slice):
 			# replace all entries in the requested range of
 			# co-ordiantes with two entries, each with the
@@ -162,40 +243,61 @@ class NearestLeafTree(object):
 			if x.step is not None:
 				raise ValueError("%s: step not supported" % repr(x))
 			if x.start is None:
-				if not self.tree:
+				if not self._n:
 					raise IndexError("open-ended slice not supported with empty tree")
 				x = slice(min(self.minkey(), x.stop), x.stop)
 			if x.stop is None:
-				if not self.tree:
+				if not self._n:
 					raise IndexError("open-ended slice not supported with empty tree")
 				x = slice(x.start, max(self.maxkey(), x.start))
 			if x.start > x.stop:
 				raise ValueError("%s: bounds out of order" % repr(x))
-			lo = bisect.bisect_left(self.tree, (x.start, NegInf))
-			hi = bisect.bisect_right(self.tree, (x.stop, PosInf))
-			self.tree[lo:hi] = ((x.start, val), (x.stop, val)) if x.start != x.stop else ((x.start, val),)
+			lo = keys.searchsorted(x.start, side = "left")
+			hi = keys.searchsorted(x.stop, side = "right")
+			if x.start != x.stop:
+				self.__replace(lo, hi, (x.start, x.stop), (val, val))
+			else:
+				self.__replace(lo, hi, (x.start,), (val,))
+		elif not self._n or x > keys[-1]:
+			# fast path for appending
+			self.__replace(self._n, self._n, (x,), (val,))
 		else:
 			# replace all entries having the same co-ordinate
 			# with this one
-			lo = bisect.bisect_left(self.tree, (x, NegInf))
-			hi = bisect.bisect_right(self.tree, (x, PosInf))
-			self.tree[lo:hi] = ((x, val),)
+			lo = keys.searchsorted(x, side = "left")
+			hi = keys.searchsorted(x, side = "right")
+			self.__replace(lo, hi, (x,), (val,))
 
 	def __getitem__(self, x):
-		if not self.tree:
+		if not self._n:
 			raise KeyError(x)
 		if isinstance(x, slice):
 			raise ValueError("slices not supported")
-		hi = bisect.bisect_right(self.tree, (x, PosInf))
-		try:
-			x_hi, val_hi = self.tree[hi]
-		except IndexError:
-			x_hi, val_hi = self.tree[-1]
-		if hi:
-			x_lo, val_lo = self.tree[hi - 1]
-		else:
-			x_lo, val_lo = x_hi, val_hi
-		return val_lo if abs(x - x_lo) < abs(x_hi - x) else val_hi
+		x = float(x)
+		hi = self._x[:self._n].searchsorted(x, side = "right")
+		lo = max(hi - 1, 0)
+		hi = min(hi, self._n - 1)
+		return float(self._y[lo] if abs(x - self._x[lo]) < abs(self._x[hi] - x) else self._y[hi])
+
+	def getvalues(self, x):
+		"""
+		Return an array of the values self[x] for each x in an array
+		of co-ordinates.
+
+		Example:
+
+		>>> x = NearestLeafTree([(100., 120.), (102., 110.), (104., 100.)])
+		>>> x.getvalues([90., 100.999, 101.001, 200.])
+		array([120., 120., 110., 100.])
+		"""
+		if not self._n:
+			raise KeyError(x)
+		x = numpy.asarray(x, dtype = "double")
+		keys = self._x[:self._n]
+		hi = keys.searchsorted(x, side = "right")
+		lo = numpy.maximum(hi - 1, 0)
+		hi = numpy.minimum(hi, self._n - 1)
+		return numpy.where(abs(x - keys[lo]) < abs(keys[hi] - x), self._y[lo], self._y[hi])
 
 	def __delitem__(self, x):
 		"""
@@ -213,105 +315,196 @@ class NearestLeafTree(object):
 		>>> x
 		NearestLeafTree([])
 		"""
+		keys = self._x[:self._n]
 		if isinstance(x, slice):
 			if x.step is not None:
 				raise ValueError("%s: step not supported" % repr(x))
 			if x.start is None:
-				if not self.tree:
+				if not self._n:
 					# no-op
 					return
 				x = slice(self.minkey(), x.stop)
 			if x.stop is None:
-				if not self.tree:
+				if not self._n:
 					# no-op
 					return
 				x = slice(x.start, self.maxkey())
 			if x.stop < x.start:
 				# no-op
 				return
-			lo = bisect.bisect_left(self.tree, (x.start, NegInf))
-			hi = bisect.bisect_right(self.tree, (x.stop, PosInf))
-			del self.tree[lo:hi]
-		elif not self.tree:
+			lo = keys.searchsorted(x.start, side = "left")
+			hi = keys.searchsorted(x.stop, side = "right")
+			self.__replace(lo, hi, (), ())
+		elif not self._n:
 			raise IndexError(x)
 		else:
-			lo = bisect.bisect_left(self.tree, (x, NegInf))
-			if self.tree[lo][0] != x:
+			lo = keys.searchsorted(x, side = "left")
+			if lo >= self._n or keys[lo] != x:
 				raise IndexError(x)
-			del self.tree[lo]
+			self.__replace(lo, lo + 1, (), ())
 
 	def __bool__(self):
 		"""
 		True if the tree is not empty, False otherwise.
 		"""
-		return bool(self.tree)
+		return bool(self._n)
 
 	def __iadd__(self, other):
 		"""
 		For every (key, value) pair in other, assign self[key]=value.
-		"""
-		for x, val in other.tree:
-			self[x] = val
+
+		Example:
+
+		>>> x = NearestLeafTree([(100., 0.), (150., 1.), (200., 0.)])
+		>>> x += NearestLeafTree([(125., 3.), (150., 2.), (250., 4.)])
+		>>> x
+		NearestLeafTree([(100, 0), (125, 3), (150, 2), (200, 0), (250, 4)])
+		"""
+		x, y = other._x[:other._n], other._y[:other._n]
+		if not len(x):
+			return self
+		# if other has more than one value for a key, the last one
+		# wins
+		keep = numpy.append(x[1:] != x[:-1], True)
+		x, y = x[keep], y[keep]
+		# the values in other replace those in self
+		keep = ~numpy.isin(self._x[:self._n], x)
+		self.__set_arrays(numpy.concatenate((self._x[:self._n][keep], x)), numpy.concatenate((self._y[:self._n][keep], y)))
 		return self
 
 	def keys(self):
-		return [x for x, val in self.tree]
+		return self._x[:self._n].tolist()
 
 	def values(self):
-		return [val for x, val in self.tree]
+		return self._y[:self._n].tolist()
 
 	def items(self):
-		return list(self.tree)
+		return list(zip(self.keys(), self.values()))
 
 	def min(self):
 		"""
 		Return the minimum value stored in the tree.  This is O(n).
 		"""
-		if not self.tree:
+		if not self._n:
 			raise ValueError("empty tree")
-		return min(val for x, val in self.tree)
+		return float(self._y[:self._n].min())
 
 	def minkey(self):
 		"""
 		Return the minimum key stored in the tree.  This is O(1).
 		"""
-		if not self.tree:
+		if not self._n:
 			raise ValueError("empty tree")
-		return self.tree[0][0]
+		return float(self._x[0])
 
 	def max(self):
 		"""
 		Return the maximum value stored in the tree.  This is O(n).
 		"""
-		if not self.tree:
+		if not self._n:
 			raise ValueError("empty tree")
-		return max(val for x, val in self.tree)
+		return float(self._y[:self._n].max())
 
 	def maxkey(self):
 		"""
 		Return the maximum key stored in the tree.  This is O(1).
 		"""
-		if not self.tree:
+		if not self._n:
 			raise ValueError("empty tree")
-		return self.tree[-1][0]
+		return float(self._x[self._n - 1])
 
 	def __contains__(self, x):
 		"""
 		True if a key in self equals x, False otherwise.
 		"""
-		try:
-			return bool(self.tree) and self.tree[bisect.bisect_left(self.tree, (x, NegInf))][0] == x
-		except IndexError:
-			return False
+		lo = self._x[:self._n].searchsorted(x, side = "left")
+		return lo < self._n and self._x[lo] == x
 
 	def __len__(self):
 		"""
 		The number of (key, value) pairs in self.
 		"""
-		return len(self.tree)
+		return self._n
 
 	def __repr__(self):
-		return "NearestLeafTree([%s])" % ", ".join("(%g, %g)" % item for item in self.tree)
+		return "NearestLeafTree([%s])" % ", ".join("(%g, %g)" % item for item in self.items())
+
+	@staticmethod
+	def __apply(w, y):
+		# evaluate the functional on an array of values.  try
+		# passing the array, and fall back to evaluating it one
+		# value at a time if the functional can't handle arrays
+		try:
+			wy = numpy.asarray(w(y), dtype = "double")
+		except (TypeError, ValueError):
+			wy = None
+		if wy is None or (wy.shape != y.shape and wy.shape != ()):
+			wy = numpy.fromiter((w(val) for val in y.tolist()), dtype = "double", count = len(y))
+		return numpy.broadcast_to(wy, y.shape)
+
+	def __segment_index(self, x, left):
+		# the f(x) = self[x] step function has the value of entry k
+		# on the interval between the mid-points of entry k and its
+		# neighbours.  return the index of the entry whose interval
+		# contains x;  if left is True, the interval that contains
+		# co-ordinates just below x.
+		keys = self._x[:self._n]
+		k = keys.searchsorted(x, side = "left" if left else "right")
+		if not k:
+			return 0
+		if k < self._n:
+			mid = (keys[k - 1] + keys[k]) / 2.
+			if (mid < x) if left else (mid <= x):
+				return k
+		return k - 1
+
+	def __cumulative_integral(self, w):
+		# if w is a function without free variables and default
+		# arguments, like lambda D: D**3., its result depends only
+		# on its argument and the integrals of w(f(x)) from the
+		# mid-point between entries 0 and 1 to each subsequent
+		# mid-point are cached, keyed by the function's code
+		# object.  the cache is extended incrementally as entries
+		# are appended.  returns None if w is not cacheable or
+		# produces non-finite values.
+		#
+		# row 0 of the cache is the cumulative sum, and row 1 is
+		# the cumulative sum of the round-off errors incurred
+		# computing it, so that the difference of two cumulative
+		# sums is accurate relative to the difference rather than
+		# relative to the integral over the whole history.
+		code = getattr(w, "__code__", None)
+		if code is None or w.__closure__ is not None or w.__defaults__ is not None:
+			return None
+		try:
+			cumsum, valid = self._integrals[code]
+		except KeyError:
+			cumsum, valid = numpy.empty((2, len(self._x)), dtype = "double"), 0
+			cumsum[:,0] = 0.
+		if cumsum is None:
+			return None
+		# entry j of the cache is the integral up to the mid-point
+		# between entries j and j + 1.  entries [0, valid] are
+		# correct
+		n = self._n - 1
+		if valid < n - 1:
+			keys = self._x[valid:self._n]
+			mid = (keys[:-1] + keys[1:]) / 2.
+			wy = self.__apply(w, self._y[valid + 1:n])
+			if not numpy.isfinite(wy).all():
+				self._integrals[code] = None, 0
+				return None
+			terms = wy * numpy.diff(mid)
+			sums = cumsum[0, valid] + terms.cumsum()
+			# Knuth's two-sum error of each addition
+			prev = numpy.concatenate(((cumsum[0, valid],), sums[:-1]))
+			delta = sums - prev
+			errors = (prev - (sums - delta)) + (terms - delta)
+			cumsum[0, valid + 1:n] = sums
+			cumsum[1, valid + 1:n] = cumsum[1, valid] + errors.cumsum()
+			valid = n - 1
+		self._integrals[code] = cumsum, valid
+		return cumsum
 
 	def functional_integral(self, lohi, w = lambda f: f):
 		"""
@@ -320,7 +513,16 @@ class NearestLeafTree(object):
 		\int_{lo}^{hi} w(f(x)) dx
 
 		The arguments are the lo and hi bounds and the functional
-		w(f).  The default functional is w(f) = f.
+		w(f).  The default functional is w(f) = f.  w is evaluated
+		on arrays of values if it can be, so it should be written in
+		terms of operations that numpy arrays support, like w(f) =
+		f**3.
+
+		If w is a function without free variables and default
+		arguments then the integrals of w(f(x)) between the
+		mid-points of adjacent entries are accumulated and cached,
+		and the integral over an interval spanning many entries is
+		computed from the cache in O(log n) time.
 
 		Example:
 
@@ -336,7 +538,7 @@ class NearestLeafTree(object):
 		"""
 		lo, hi = lohi
 
-		if not self.tree:
+		if not self._n:
 			raise ValueError("empty tree")
 		if lo < hi:
 			swapped = False
@@ -349,30 +551,78 @@ class NearestLeafTree(object):
 		# now we are certain that lo < hi and that there is at
 		# least one entry in the tree
 
-		# construct an array of (x,y) pairs such that f(x) = y and
-		# continues to equal y until the next x.  ensure the 0th
-		# and last entries in the array are the left and right
-		# edges of the integration domain.
-		i = bisect.bisect_right(self.tree, (lo, NegInf))
-		j = bisect.bisect_right(self.tree, (hi, PosInf))
-		if i > 0:
-			i -= 1
-		samples = self.tree[i:j+1]
-		samples = [((a_key + b_key) / 2., b_val) for (a_key, a_val), (b_key, b_val) in zip(samples[:-1], samples[1:])]
-		if not samples:
-			samples = [(lo, self[lo])]
-		elif samples[0][0] > lo:
-			samples.insert(0, (lo, self[lo]))
+		# find the entries whose values f(x) takes at the left and
+		# right edges of the integration domain.
+		i = self.__segment_index(lo, False)
+		j = self.__segment_index(hi, True)
+		keys = self._x
+		if i == j:
+			result = (hi - lo) * w(float(self._y[i]))
 		else:
-			samples[0] = lo, self[lo]
-		if samples[-1][0] < hi:
-			samples.append((hi, self[hi]))
-		else:
-			samples[-1] = hi, self[hi]
-		# return the integral
-		result = sum((b_key - a_key) * w(a_val) for (a_key, a_val), (b_key, b_val) in zip(samples[:-1], samples[1:]))
+			# short intervals are summed directly, which is
+			# faster than bringing the cache up to date
+			cumsum = self.__cumulative_integral(w) if j - i > 64 else None
+			if cumsum is not None:
+				wy = self.__apply(w, self._y[[i, j]])
+				result = ((keys[i] + keys[i + 1]) / 2. - lo) * wy[0] + ((cumsum[0, j - 1] - cumsum[0, i]) + (cumsum[1, j - 1] - cumsum[1, i])) + (hi - (keys[j - 1] + keys[j]) / 2.) * wy[1]
+			elif j - i > 16:
+				# the mid-points between entries i through j
+				# bound the intervals on which f(x) takes
+				# their values
+				edges = numpy.concatenate(((lo,), (keys[i:j] + keys[i + 1:j + 1]) / 2., (hi,)))
+				result = (numpy.diff(edges) * self.__apply(w, self._y[i:j + 1])).sum()
+			else:
+				# a few entries.  not worth the numpy overhead
+				keys = keys[i:j + 1].tolist()
+				edges = [lo] + [(a + b) / 2. for a, b in zip(keys[:-1], keys[1:])] + [hi]
+				result = sum((b - a) * w(val) for a, b, val in zip(edges[:-1], edges[1:], self._y[i:j + 1].tolist()))
+			result = float(result)
 		return -result if swapped else result
 
+	def functional_integrals(self, lo, hi, w = lambda f: f):
+		"""
+		Array version of .functional_integral().  lo and hi are
+		arrays of the bounds of the intervals, the return value is
+		an array of the integrals of w(f(x)) over them.  Intervals
+		that span more than one entry are computed from the cache
+		of integrals if w can be cached (see
+		.functional_integral()), otherwise one at a time.
+
+		Example:
+
+		>>> x = NearestLeafTree([(100., 0.), (150., 2.), (200., 0.)])
+		>>> x.functional_integrals([130., 100., 300., 150.], [170., 150., 500., 100.])
+		array([ 80.,  50.,   0., -50.])
+		"""
+		if not self._n:
+			raise ValueError("empty tree")
+		lo = numpy.asarray(lo, dtype = "double")
+		hi = numpy.asarray(hi, dtype = "double")
+		swapped = lo > hi
+		lo, hi = numpy.where(swapped, hi, lo), numpy.where(swapped, lo, hi)
+
+		# same as .__segment_index():  the number of mid-points
+		# below lo or hi
+		keys = self._x[:self._n]
+		mid = (keys[:-1] + keys[1:]) / 2.
+		i = mid.searchsorted(lo, side = "right")
+		j = mid.searchsorted(hi, side = "left")
+
+		# intervals within one entry's domain.  this includes lo ==
+		# hi, which gives 0 or NaN as it does for
+		# .functional_integral()
+		with numpy.errstate(invalid = "ignore"):
+			result = (hi - lo) * self.__apply(w, self._y[i])
+		many, = (i != j).nonzero()
+		if len(many):
+			cumsum = self.__cumulative_integral(w)
+			if cumsum is not None:
+				i, j, lo, hi = i[many], j[many], lo[many], hi[many]
+				result[many] = ((keys[i] + keys[i + 1]) / 2. - lo) * self.__apply(w, self._y[i]) + ((cumsum[0, j - 1] - cumsum[0, i]) + (cumsum[1, j - 1] - cumsum[1, i])) + (hi - (keys[j - 1] + keys[j]) / 2.) * self.__apply(w, self._y[j])
+			else:
+				result[many] = [self.functional_integral(lohi, w) for lohi in zip(lo[many].tolist(), hi[many].tolist())]
+		return numpy.where(swapped, -result, result)
+
 	def weighted_mean(self, lohi, weight = lambda y: 1.):
 		"""
 		Given the function f(x) = self[x], compute
@@ -401,7 +651,7 @@ class NearestLeafTree(object):
 		2.0
 		"""
 		lo, hi = lohi
-		if not self.tree:
+		if not self._n:
 			raise ValueError("empty tree")
 		if lo > hi:
 			# remove a common factor of -1 from the numerator
@@ -419,10 +669,17 @@ class NearestLeafTree(object):
 
 	@classmethod
 	def from_xml(cls, xml, name):
-		return cls(map(tuple, ligolw_array.get_array(xml, u"%s:nearestleaftree" % name).array[:]))
+		array = ligolw_array.get_array(xml, u"%s:nearestleaftree" % name).array
+		if not array.size:
+			return cls()
+		if array.ndim != 2 or array.shape[1] != 2:
+			raise ValueError("items must be sequence of two-element sequences")
+		return cls.from_arrays(array[:,0], array[:,1])
 
 	def to_xml(self, name):
-		return ligolw_array.Array.build(u"%s:nearestleaftree" % name, numpy.array(self.tree, dtype = "double"))
+		# an empty tree is written as a 1-D array, as it always has
+		# been
+		return ligolw_array.Array.build(u"%s:nearestleaftree" % name, numpy.stack((self._x[:self._n], self._y[:self._n]), axis = 1) if self._n else numpy.array([], dtype = "double"))
 
 
 class HorizonHistories(dict):
@@ -548,26 +805,38 @@ class HorizonHistories(dict):
 		# and last entries in the array are the left and right
 		# edges of the integration domain.
 
-		samples = sorted(set(x for value in self.values() for x in value.keys()))
-		i = bisect.bisect_right(samples, lo)
-		j = bisect.bisect_right(samples, hi)
+		samples = numpy.unique(numpy.concatenate([value._x[:value._n] for value in self.values()]))
+		i = samples.searchsorted(lo, side = "right")
+		j = samples.searchsorted(hi, side = "right")
 		if i > 0:
 			i -= 1
 		samples = samples[i:j+1]
-		samples = [((a + b) / 2., self.getdict(b)) for a, b in zip(samples[:-1], samples[1:])]
-		if not samples:
-			samples = [(lo, self.getdict(lo))]
-		elif samples[0][0] > lo:
-			samples.insert(0, (lo, self.getdict(lo)))
+		# the co-ordinates of the edges, and the co-ordinates at
+		# which to evaluate f(x) for the interval starting at each
+		# edge
+		edges = (samples[:-1] + samples[1:]) / 2.
+		x = samples[1:]
+		if not len(edges):
+			edges = x = numpy.array((lo,))
+		elif edges[0] > lo:
+			edges = numpy.concatenate(((lo,), edges))
+			x = numpy.concatenate(((lo,), x))
 		else:
-			samples[0] = lo, self.getdict(lo)
-		if samples[-1][0] < hi:
-			samples.append((hi, self.getdict(hi)))
+			edges[0] = x[0] = lo
+		if edges[-1] < hi:
+			edges = numpy.append(edges, hi)
 		else:
-			samples[-1] = hi, self.getdict(hi)
+			edges[-1] = hi
+		# the final edge does not start an interval
+		x = x[:len(edges) - 1]
+
+		# evaluate the histories at all the co-ordinates at once.
+		# w() is evaluated one dictionary at a time
+		keys = list(self.keys())
+		values = numpy.stack([self[key].getvalues(x) for key in keys], axis = 1).tolist()
 
 		# return the integral
-		result = sum((b_key - a_key) * w(a_val) for (a_key, a_val), (b_key, b_val) in zip(samples[:-1], samples[1:]))
+		result = float(sum(dx * w(dict(zip(keys, f))) for dx, f in zip(numpy.diff(edges).tolist(), values)))
 		return -result if swapped else result
 
 	def weighted_mean_dict(self, *args, **kwargs):
@@ -618,7 +887,7 @@ class HorizonHistories(dict):
 				j += 1
 			del items[j:]
 			if verbose:
-				print("\"%s\":  %s horizon history reduced to %.3g%% of original size" % (filename, instrument, 100. * j / (i + 1.)), file=sys.stderr)
+				print("%s horizon history reduced to %.3g%% of original size" % (instrument, 100. * j / (i + 1.)), file=sys.stderr)
 
 			# replace
 			self[instrument] = type(horizon_history)(items)
@@ -34,15 +34,22 @@ except ImportError:
 	NaN = float("nan")
 	NegInf = float("-inf")
 	PosInf = float("+inf")
+import contextlib
+import hashlib
 import itertools
+import json
 import math
+import multiprocessing
 import numpy
 import os
-import random
+import pickle
 import scipy
 from scipy import stats
 from scipy import spatial
+import shutil
 import sys
+import tempfile
+import time
 import h5py
 
 from ligo.lw import ligolw
@@ -250,9 +257,73 @@ Documentation of classes and functions
 #
 
 
+def random_source_orientations(n, rng = None):
+	"""
+	Draw n random sky locations, polarizations, and orbital plane
+	inclinations, uniformly distributed on the sphere and isotropic.
+	Returns a tuple of four arrays:  right ascension, declination,
+	polarization, and cos^2 of the inclination.  rng is the
+	numpy.random.Generator to use (default = a new one seeded from the
+	operating system's entropy source).
+	"""
+	if rng is None:
+		rng = numpy.random.default_rng()
+	ra = rng.uniform(0., 2. * math.pi, n)
+	dec = math.pi / 2. - numpy.arccos(rng.uniform(-1., 1., n))
+	psi = rng.uniform(0., 2. * math.pi, n)
+	cosi2 = rng.uniform(-1., 1., n)**2.
+	return ra, dec, psi, cosi2
+
+
+def antenna_responses(responses, ra, dec, psi, gmst):
+	"""
+	Compute F+ and Fx for a sequence of detector response tensors at
+	arrays of sky locations and polarizations.  This is
+	lal.ComputeDetAMResponse() evaluated on arrays.  Returns two
+	arrays, F+ and Fx, each with one row for each detector and one
+	column for each sky location.
+
+	Example:
+
+	>>> import lalsimulation
+	>>> resp = lalsimulation.DetectorPrefixToLALDetector("H1").response
+	>>> fplus, fcross = antenna_responses([resp], numpy.array([1.]), numpy.array([.3]), numpy.array([.2]), 0.)
+	>>> numpy.allclose((fplus[0, 0], fcross[0, 0]), lal.ComputeDetAMResponse(resp, 1., .3, .2, 0.))
+	True
+	"""
+	gha = gmst - numpy.asarray(ra)
+	cosgha, singha = numpy.cos(gha), numpy.sin(gha)
+	cosdec, sindec = numpy.cos(dec), numpy.sin(dec)
+	cospsi, sinpsi = numpy.cos(psi), numpy.sin(psi)
+
+	# the polarization basis vectors
+	X = numpy.array((-cospsi * singha - sinpsi * cosgha * sindec, -cospsi * cosgha + sinpsi * singha * sindec, sinpsi * cosdec))
+	Y = numpy.array((sinpsi * singha - cospsi * cosgha * sindec, sinpsi * cosgha + cospsi * singha * sindec, cospsi * cosdec))
+
+	# the response tensors are symmetric
+	responses = numpy.array(responses, dtype = "double")
+	DX = numpy.einsum("kij,jn->kin", responses, X)
+	DY = numpy.einsum("kij,jn->kin", responses, Y)
+	fplus = (X * DX).sum(axis = 1) - (Y * DY).sum(axis = 1)
+	fcross = 2. * (X * DY).sum(axis = 1)
+	return fplus, fcross
+
+
+def _bin_indexes(bins, x):
+	"""
+	The indexes of the bins that contain the values in the array x,
+	for a binning that covers the values.  For internal use only.
+	"""
+	return numpy.minimum(bins.upper().searchsorted(x, side = "right"), len(bins) - 1)
+
+
 # FIXME: This code is no longer used.
-def P_instruments_given_signal(horizon_distances, n_samples = 500000, min_instruments = 2, min_distance = 0.):
+def P_instruments_given_signal(horizon_distances, n_samples = 500000, min_instruments = 2, min_distance = 0., rng = None, block_size = 65536):
 	r"""
+	rng is the numpy.random.Generator to use (default = a new one
+	seeded from the operating system's entropy source).  The samples
+	are drawn and processed in blocks of block_size at a time.
+
 	Example:
 
 	>>> P_instruments_given_signal({"H1": 120., "L1": 120.})
@@ -266,6 +337,8 @@ def P_instruments_given_signal(horizon_distances, n_samples = 500000, min_instru
 		raise ValueError("min_distance=%g must be >= 0" % min_distance)
 	if min_instruments < 1:
 		raise ValueError("min_instruments=%d must be >= 1" % min_instruments)
+	if rng is None:
+		rng = numpy.random.default_rng()
 
 	# get instrument names
 	names = tuple(horizon_distances.keys())
@@ -293,39 +366,26 @@ def P_instruments_given_signal(horizon_distances, n_samples = 500000, min_instru
 	# as good as any other
 	gmst = 0.0
 
-	# in the loop, we'll need a sequence of integers to enumerate
-	# instruments.  construct it here to avoid doing it repeatedly in
-	# the loop
-	indexes = tuple(range(len(names)))
-
-	# avoid attribute look-ups and arithmetic in the loop
-	acos = math.acos
-	numpy_array = numpy.array
-	numpy_dot = numpy.dot
-	numpy_sqrt = numpy.sqrt
-	random_uniform = random.uniform
-	twopi = 2. * math.pi
-	pi_2 = math.pi / 2.
-	xlal_am_resp = lal.ComputeDetAMResponse
-
-	# loop as many times as requested
+	# instrument combinations are accumulated in an array indexed by
+	# a bit mask with bit i set if names[i] is in the combination
+	P = numpy.zeros(1 << len(names), dtype = "double")
+
+	# loop over blocks of samples until as many have succeeded as
+	# were requested
 	successes = fails = 0
 	while successes < n_samples:
-		# select random sky location and source orbital plane
-		# inclination and choice of polarization
-		ra = random_uniform(0., twopi)
-		dec = pi_2 - acos(random_uniform(-1., 1.))
-		psi = random_uniform(0., twopi)
-		cosi2 = random_uniform(-1., 1.)**2.
+		# select random sky locations and source orbital plane
+		# inclinations and choices of polarization
+		ra, dec, psi, cosi2 = random_source_orientations(min(block_size, n_samples - successes), rng = rng)
 
 		# compute F+^2 and Fx^2 for each antenna from the sky
-		# location and antenna responses
-		fpfc2 = numpy_array(tuple(xlal_am_resp(resp, ra, dec, psi, gmst) for resp in resps))**2.
+		# locations and antenna responses
+		fplus, fcross = antenna_responses(resps, ra, dec, psi, gmst)
 
 		# 1/8 ratio of inverse SNR to distance for each instrument
 		# (1/8 because horizon distance is defined for an SNR of 8,
 		# and we've omitted that factor for performance)
-		snr_times_D_over_8 = DH * numpy_sqrt(numpy_dot(fpfc2, ((1. + cosi2)**2. / 4., cosi2)))
+		snr_times_D_over_8 = DH[:, numpy.newaxis] * numpy.sqrt(fplus**2. * (1. + cosi2)**2. / 4. + fcross**2. * cosi2)
 
 		# the volume visible to each instrument given the
 		# requirement that a source be above the SNR threshold is
@@ -351,49 +411,49 @@ def P_instruments_given_signal(horizon_distances, n_samples = 500000, min_instru
 
 		# order[0] is index of instrument that can see sources the
 		# farthest, order[1] is index of instrument that can see
-		# sources the next farthest, etc.
-		order = sorted(indexes, key = V_at_snr_threshold.__getitem__, reverse = True)
-		ordered_names = tuple(names[i] for i in order)
-
-		# instrument combination and volume of space (up to
-		# irrelevant proportionality constant) visible to that
-		# combination given the requirement that a source be above
-		# the SNR threshold in that combination.  sequence of
-		# instrument combinations is left as a generator expression
-		# for lazy evaluation
-		instruments = (frozenset(ordered_names[:n]) for n in range(min_instruments, len(order) + 1))
-		V = tuple(V_at_snr_threshold[i] for i in order[min_instruments - 1:])
-		if V[0] <= min_distance:
-			# fewer than the required minimum number of
-			# instruments can see sources in this configuration
-			# far enough way in this direction to form coincs.
-			# if this happens too often we report a convergence
-			# rate failure
-			# FIXME:  min_distance is a misnomer, it's compared
-			# to a volume-like thing with a mystery
-			# proportionality constant factored out, so who
-			# knows what to call it.  who cares.
-			fails += 1
-			if successes + fails >= n_samples and fails / float(successes + fails) > .90:
-				raise ValueError("convergence too slow:  success/fail ratio = %d/%d" % (successes, fails))
-			continue
+		# sources the next farthest, etc.  ties are left in the
+		# order of the names
+		order = numpy.argsort(-V_at_snr_threshold, axis = 0, kind = "stable")
+
+		# instrument combinations as bit masks and volumes of space
+		# (up to irrelevant proportionality constant) visible to
+		# those combinations given the requirement that a source be
+		# above the SNR threshold in that combination
+		instruments = numpy.cumsum(numpy.left_shift(1, order), axis = 0)[min_instruments - 1:]
+		V = numpy.take_along_axis(V_at_snr_threshold, order, axis = 0)[min_instruments - 1:]
+
+		# fewer than the required minimum number of instruments can
+		# see sources in these configurations far enough way in
+		# this direction to form coincs.  if this happens too often
+		# we report a convergence rate failure
+		# FIXME:  min_distance is a misnomer, it's compared to a
+		# volume-like thing with a mystery proportionality constant
+		# factored out, so who knows what to call it.  who cares.
+		visible = V[0] > min_distance
+		fails += len(visible) - visible.sum()
+		visible = numpy.flatnonzero(visible)
+		instruments = instruments[:, visible]
+		V = V[:, visible]
 
 		# for each instrument combination, probability that a
 		# source visible to at least the minimum required number of
 		# instruments is visible to that combination (here is where
 		# the proportionality constant and factor of
 		# (8/snr_threshold)**3 drop out of the calculation)
-		P = tuple(x / V[0] for x in V)
+		p = V / V[0]
 
 		# accumulate result.  p - pnext is the probability that a
 		# source (that is visible to at least the minimum required
 		# number of instruments) is visible to that combination of
 		# instruments and not any other combination of instruments.
-		for key, p, pnext in zip(instruments, P, P[1:] + (0.,)):
-			result[key] += p - pnext
-		successes += 1
+		pnext = numpy.concatenate((p[1:], numpy.zeros((1, p.shape[1]))))
+		P += numpy.bincount(instruments.ravel(), weights = (p - pnext).ravel(), minlength = len(P))
+		successes += len(visible)
+
+		if successes < n_samples and successes + fails >= n_samples and fails / float(successes + fails) > .90:
+			raise ValueError("convergence too slow:  success/fail ratio = %d/%d" % (successes, fails))
 	for key in result:
-		result[key] /= n_samples
+		result[key] = P[sum(1 << names.index(name) for name in key)] / n_samples
 
 	#
 	# make sure it's normalized.  allow an all-0 result in the event
@@ -422,6 +482,139 @@ def P_instruments_given_signal(horizon_distances, n_samples = 500000, min_instru
 #
 
 
+class SNRPDFStore(object):
+	"""
+	A persistent on-disk store of SNRPDF cache entries that can be
+	shared by all the jobs that can see the directory.
+
+	Each entry is a directory named by a SHA-1 of its cache key and of
+	the SNRPDF's parameters (SNR cut-off, distance quantization and
+	minimum ratio) holding the P(snrs | instruments, horizon
+	distances, signal) array and its logarithm as .npy files, which
+	are memory-mapped read-only when loaded, and a small JSON file
+	holding the key, the binning and ln P(instruments | horizon
+	distances, signal).  Entries are created under a temporary name
+	and renamed into place, so readers never see partial entries.
+	Jobs that race to compute the same entry each compute it;  the
+	first to rename its copy into place publishes it and the others
+	discard theirs.  An index file lists the entries, one JSON record
+	per line, appended to after each entry is published.
+	"""
+	# bump this whenever the contents of the SNR PDFs change to
+	# invalidate existing stores
+	format_version = 1
+
+	index_name = "index.jsonl"
+
+	def __init__(self, path):
+		self.path = path
+		if not os.path.isdir(path):
+			try:
+				os.makedirs(path)
+			except OSError:
+				# another job created it
+				if not os.path.isdir(path):
+					raise
+
+	@staticmethod
+	def params(snrpdf):
+		return [snrpdf.snr_cutoff, snrpdf.log_distance_tolerance, snrpdf.min_ratio]
+
+	@staticmethod
+	def encode_key(key):
+		instruments, quants, min_instruments = key
+		return {"instruments": sorted(instruments), "quantizedhorizons": sorted([instrument, quant] for instrument, quant in quants), "min_instruments": min_instruments}
+
+	@staticmethod
+	def decode_key(record):
+		return frozenset(record["instruments"]), frozenset((instrument, quant) for instrument, quant in record["quantizedhorizons"]), record["min_instruments"]
+
+	def entry_name(self, snrpdf, key):
+		stamp = json.dumps([self.format_version, self.params(snrpdf), self.encode_key(key)], sort_keys = True)
+		return hashlib.sha1(stamp.encode("utf-8")).hexdigest()
+
+	def contains(self, snrpdf, key):
+		return os.path.isdir(os.path.join(self.path, self.entry_name(snrpdf, key)))
+
+	def get(self, snrpdf, key):
+		"""
+		Return (ln P(instruments), BinnedArray, ln BinnedArray) for
+		the entry with the given key, or None if there is no such
+		entry.  The arrays are memory-mapped read-only.
+		"""
+		entrypath = os.path.join(self.path, self.entry_name(snrpdf, key))
+		try:
+			with open(os.path.join(entrypath, "meta.json")) as f:
+				meta = json.load(f)
+			array = numpy.load(os.path.join(entrypath, "pdf.npy"), mmap_mode = "r")
+			lnarray = numpy.load(os.path.join(entrypath, "lnpdf.npy"), mmap_mode = "r")
+		except (IOError, OSError):
+			return None
+		bins = rate.NDBins([rate.ATanLogarithmicBins(*args) for args in meta["bins"]])
+		return meta["lnP_instruments"], rate.BinnedArray(bins, array = array), rate.BinnedArray(bins, array = lnarray)
+
+	def put(self, snrpdf, key, lnP_instruments, binnedarray, lnbinnedarray):
+		"""
+		Publish an entry.  If the entry already exists it is left
+		as-is.  Only ATanLogarithmicBins binnings are supported.
+		"""
+		name = self.entry_name(snrpdf, key)
+		entrypath = os.path.join(self.path, name)
+		if os.path.exists(entrypath):
+			return
+		if not all(isinstance(bins, rate.ATanLogarithmicBins) for bins in binnedarray.bins):
+			raise TypeError("only ATanLogarithmicBins can be stored")
+		record = self.encode_key(key)
+		record.update(name = name, params = self.params(snrpdf))
+		tmppath = tempfile.mkdtemp(prefix = ".%s." % name, dir = self.path)
+		try:
+			# mkdtemp() makes the directory private, but the store
+			# is meant to be shared
+			os.chmod(tmppath, 0o755)
+			numpy.save(os.path.join(tmppath, "pdf.npy"), numpy.ascontiguousarray(binnedarray.array))
+			numpy.save(os.path.join(tmppath, "lnpdf.npy"), numpy.ascontiguousarray(lnbinnedarray.array))
+			with open(os.path.join(tmppath, "meta.json"), "w") as f:
+				json.dump({"lnP_instruments": lnP_instruments, "bins": [[bins.min, bins.max, bins.n] for bins in binnedarray.bins], "key": record}, f)
+			os.rename(tmppath, entrypath)
+		except OSError:
+			# somebody else has already put this entry in place
+			shutil.rmtree(tmppath, ignore_errors = True)
+			if not os.path.isdir(entrypath):
+				raise
+			return
+		except:
+			shutil.rmtree(tmppath, ignore_errors = True)
+			raise
+		# one write() of a short line to a file opened for appending
+		# is not interleaved with other jobs' writes
+		fd = os.open(os.path.join(self.path, self.index_name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+		try:
+			os.write(fd, (json.dumps(record, sort_keys = True) + "\n").encode("utf-8"))
+		finally:
+			os.close(fd)
+
+	def keys(self, snrpdf):
+		"""
+		Return the keys of the entries in the store for the
+		SNRPDF's parameters, from the index.
+		"""
+		params = self.params(snrpdf)
+		keys = set()
+		try:
+			with open(os.path.join(self.path, self.index_name)) as f:
+				for line in f:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						# a line being written right now
+						continue
+					if record["params"] == params and os.path.isdir(os.path.join(self.path, record["name"])):
+						keys.add(self.decode_key(record))
+		except (IOError, OSError):
+			pass
+		return keys
+
+
 # FIXME: This code is no longer used.
 class SNRPDF(object):
 	#
@@ -433,6 +626,10 @@ class SNRPDF(object):
 	DEFAULT_FILENAME = os.path.join(gstlal_config_paths["pkgdatadir"], "inspiral_snr_pdf.xml.gz")
 	snr_joint_pdf_cache = {}
 
+	# Monte Carlo sample counts used to build cache entries
+	n_samples_instruments = 1000000
+	n_samples_snrs = 160000
+
 	@ligolw_array.use_in
 	@ligolw_param.use_in
 	class LIGOLWContentHandler(ligolw.LIGOLWContentHandler):
@@ -450,7 +647,7 @@ class SNRPDF(object):
 
 
 	# FIXME:  is the default choice of distance quantization appropriate?
-	def __init__(self, snr_cutoff, log_distance_tolerance = math.log(1.05), min_ratio = 0.1):
+	def __init__(self, snr_cutoff, log_distance_tolerance = math.log(1.05), min_ratio = 0.1, store = None):
 		"""
 		snr_cutoff sets the minimum SNR below which it is
 		impossible to obtain a candidate (the trigger SNR
@@ -461,6 +658,11 @@ class SNRPDF(object):
 		whose horizon distance is less than min_ratio * the horizon
 		distance of the most sensitive instrument is considered to
 		be off (it's horizon distance is set to 0).
+
+		store, if not None, is an SNRPDFStore or the path to one.
+		Cache entries that are missing are loaded from it on first
+		use, and entries computed by .add_to_cache() and
+		.add_to_cache_parallel() are published to it.
 		"""
 		if log_distance_tolerance <= 0.:
 			raise ValueError("require log_distance_tolerance > 0")
@@ -469,6 +671,9 @@ class SNRPDF(object):
 		self.snr_cutoff = snr_cutoff
 		self.log_distance_tolerance = log_distance_tolerance
 		self.min_ratio = min_ratio
+		if store is not None and not isinstance(store, SNRPDFStore):
+			store = SNRPDFStore(store)
+		self.store = store
 
 
 	def quantize_horizon_distances(self, horizon_distances):
@@ -498,7 +703,7 @@ class SNRPDF(object):
 
 	@property
 	def quants(self):
-		return [NegInf] + range(int(math.ceil(math.log(self.min_ratio) / self.log_distance_tolerance)), 1)
+		return [NegInf] + list(range(int(math.ceil(math.log(self.min_ratio) / self.log_distance_tolerance)), 1))
 
 
 	def quantized_horizon_distances(self, quants):
@@ -520,16 +725,41 @@ class SNRPDF(object):
 		return frozenset(instruments), frozenset(self.quantize_horizon_distances(horizon_distances).items()), min_instruments
 
 
+	def cache_keys(self, horizon_distances, min_instruments):
+		"""
+		Return the keys of the cache entries for a set of horizon
+		distances and a value of min_instruments, one for each
+		combination of min_instruments or more instruments.
+		"""
+		return [self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments) for n in range(min_instruments, len(horizon_distances) + 1) for instruments in itertools.combinations(sorted(horizon_distances), n)]
+
+
+	def get_cache_entry(self, key):
+		"""
+		Return the cache entry for key, loading it from the store
+		if it is not in memory.  Raises KeyError if there is no
+		such entry.
+		"""
+		try:
+			return self.snr_joint_pdf_cache[key]
+		except KeyError:
+			entry = self.store.get(self, key) if self.store is not None else None
+			if entry is None:
+				raise
+			self.insert_cache_entry(key, *entry)
+			return self.snr_joint_pdf_cache[key]
+
+
 	def get_snr_joint_pdf_binnedarray(self, instruments, horizon_distances, min_instruments):
-		return self.snr_joint_pdf_cache[self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments)].binnedarray
+		return self.get_cache_entry(self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments)).binnedarray
 
 
 	def get_snr_joint_pdf(self, instruments, horizon_distances, min_instruments):
-		return self.snr_joint_pdf_cache[self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments)].pdf
+		return self.get_cache_entry(self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments)).pdf
 
 
 	def lnP_instruments(self, instruments, horizon_distances, min_instruments):
-		return self.snr_joint_pdf_cache[self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments)].lnP_instruments
+		return self.get_cache_entry(self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments)).lnP_instruments
 
 
 	def lnP_snrs(self, snrs, horizon_distances, min_instruments):
@@ -551,54 +781,150 @@ class SNRPDF(object):
 
 
 	def add_to_cache(self, horizon_distances, min_instruments, verbose = False):
+		for key, lnP_instruments, binnedarray in self.cache_entries(horizon_distances, (min_instruments,), verbose = verbose):
+			self.insert_cache_entry(key, lnP_instruments, binnedarray, publish = True)
+
+
+	def insert_cache_entry(self, key, lnP_instruments, binnedarray, lnbinnedarray = None, publish = False):
+		"""
+		Add a P(snrs | instruments, horizon distances, signal)
+		BinnedArray and the corresponding ln P(instruments |
+		horizon distances, signal) to the cache under key.  The
+		logarithm of the BinnedArray is computed if lnbinnedarray is
+		not given.  If publish is True and there is a store the
+		entry is also written to the store.
+		"""
+		if lnbinnedarray is None:
+			lnbinnedarray = binnedarray.copy()
+			with numpy.errstate(divide = "ignore"):
+				lnbinnedarray.array = numpy.log(lnbinnedarray.array)
+		self.snr_joint_pdf_cache[key] = self.cacheentry(lnP_instruments, rate.InterpBinnedArray(lnbinnedarray, fill_value = NegInf), binnedarray)
+		if publish and self.store is not None:
+			self.store.put(self, key, lnP_instruments, binnedarray, lnbinnedarray)
+
+
+	def cache_entries(self, horizon_distances, min_instruments, rng = None, verbose = False):
+		"""
+		Compute the cache entries that are missing for a set of
+		horizon distances and each of a sequence of values of
+		min_instruments.  Returns a list of (key, ln
+		P(instruments), BinnedArray) tuples that can be passed to
+		.insert_cache_entry().  The SNR PDFs do not depend on
+		min_instruments and are computed once for all values of
+		it.  rng is the numpy.random.Generator to use for the Monte
+		Carlo integrations (default = a new one seeded from the
+		operating system's entropy source).
+		"""
+		if rng is None:
+			rng = numpy.random.default_rng()
+
 		#
 		# input check
 		#
 
-		if len(horizon_distances) < min_instruments:
-			raise ValueError("require at least %d instruments, got %s" % (min_instruments, ", ".join(sorted(horizon_distances))))
+		if len(horizon_distances) < max(min_instruments):
+			raise ValueError("require at least %d instruments, got %s" % (max(min_instruments), ", ".join(sorted(horizon_distances))))
+
+		entries = []
+		binnedarrays = {}
+		quantized_horizon_distances = self.quantized_horizon_distances(self.quantize_horizon_distances(horizon_distances).items())
+		for n_min in min_instruments:
+			# skip the keys that are already in the cache or the
+			# store
+			keys = [key for key in self.cache_keys(horizon_distances, n_min) if not (key in self.snr_joint_pdf_cache or (self.store is not None and self.store.contains(self, key)))]
+			if not keys:
+				continue
 
-		#
-		# compute P(instruments | horizon distances, signal)
-		#
+			#
+			# compute P(instruments | horizon distances, signal)
+			#
 
-		if verbose:
-			print("For horizon distances %s, requiring %d instrument(s):" % (", ".join("%s = %.4g Mpc" % item for item in sorted(horizon_distances.items())), min_instruments), file=sys.stderr)
+			if verbose:
+				print("For horizon distances %s, requiring %d instrument(s):" % (", ".join("%s = %.4g Mpc" % item for item in sorted(horizon_distances.items())), n_min), file=sys.stderr)
 
-		P_instruments = P_instruments_given_signal(
-			self.quantized_horizon_distances(self.quantize_horizon_distances(horizon_distances).items()),
-			min_instruments = min_instruments,
-			n_samples = 1000000
-		)
+			P_instruments = P_instruments_given_signal(
+				quantized_horizon_distances,
+				min_instruments = n_min,
+				n_samples = self.n_samples_instruments,
+				rng = rng
+			)
 
-		if verbose:
-			for key_value in sorted((",".join(sorted(key)), value) for key, value in P_instruments.items()):
-				print("\tP(%s | signal) = %g" % key_value, file=sys.stderr)
-			print("generating P(snrs | signal) ...", file=sys.stderr)
+			if verbose:
+				for key_value in sorted((",".join(sorted(key)), value) for key, value in P_instruments.items()):
+					print("\tP(%s | signal) = %g" % key_value, file=sys.stderr)
+				print("generating P(snrs | signal) ...", file=sys.stderr)
 
-		#
-		# compute P(snrs | instruments, horizon distances, signal)
-		#
+			#
+			# compute P(snrs | instruments, horizon distances, signal)
+			#
+
+			for key in keys:
+				instruments = key[0]
+				if instruments not in binnedarrays:
+					with ProgressBar(text = "%s candidates" % ", ".join(sorted(instruments))) if verbose else contextlib.nullcontext() as progressbar:
+						binnedarrays[instruments] = self.joint_pdf_of_snrs(instruments, self.quantized_horizon_distances(key[1]), self.snr_cutoff, n_samples = self.n_samples_snrs, progressbar = progressbar, rng = rng)
+				entries.append((key, math.log(P_instruments[instruments]) if P_instruments[instruments] else NegInf, binnedarrays[instruments]))
+
+		return entries
+
+
+	@staticmethod
+	def cache_entries_wrapper(args):
+		# runs in the worker processes of .add_to_cache_parallel().
+		# NDBins can't be pickled, so the BinnedArrays are sent back
+		# as their 1-D binnings and arrays
+		self, horizon_distances, min_instruments, seed_sequence = args
+		return [(key, lnP_instruments, tuple(binnedarray.bins), binnedarray.array) for key, lnP_instruments, binnedarray in self.cache_entries(horizon_distances, min_instruments, rng = numpy.random.default_rng(seed_sequence))]
 
-		for n in range(min_instruments, len(horizon_distances) + 1):
-			for instruments in itertools.combinations(sorted(horizon_distances), n):
-				instruments = frozenset(instruments)
-				key = self.snr_joint_pdf_keyfunc(instruments, horizon_distances, min_instruments)
-				# already in cache?
-				if key in self.snr_joint_pdf_cache:
-					continue
-				# need to build
-				with ProgressBar(text = "%s candidates" % ", ".join(sorted(instruments))) if verbose else None as progressbar:
-					binnedarray = self.joint_pdf_of_snrs(instruments, self.quantized_horizon_distances(key[1]), self.snr_cutoff, progressbar = progressbar)
-				lnbinnedarray = binnedarray.copy()
-				with numpy.errstate(divide = "ignore"):
-					lnbinnedarray.array = numpy.log(lnbinnedarray.array)
-				pdf = rate.InterpBinnedArray(lnbinnedarray, fill_value = NegInf)
-				self.snr_joint_pdf_cache[key] = self.cacheentry(math.log(P_instruments[instruments]) if P_instruments[instruments] else NegInf, pdf, binnedarray)
+
+	def add_to_cache_parallel(self, horizon_distances, min_instruments, nprocs = 8, seed = None, verbose = False):
+		"""
+		Add the cache entries for each of a sequence of sets of
+		horizon distances and each of a sequence of values of
+		min_instruments, distributing the sets of horizon distances
+		among nprocs processes.  Sets of horizon distances that
+		quantize to the same values are computed once.  The random
+		number generator for each set is initialized from a child
+		of numpy.random.SeedSequence(seed), so results are
+		reproducible given seed regardless of the number of
+		processes (default = seed from the operating system's
+		entropy source).
+		"""
+		if nprocs < 1:
+			raise ValueError("nprocs=%d must be >= 1" % nprocs)
+		min_instruments = tuple(sorted(set(min_instruments)))
+
+		# one task for each distinct set of quantized horizon
+		# distances, in the order in which they first appear
+		tasks = []
+		seen = set()
+		for distances in horizon_distances:
+			quants = frozenset(self.quantize_horizon_distances(distances).items())
+			if quants not in seen:
+				seen.add(quants)
+				tasks.append(distances)
+		tasks = [(self, distances, min_instruments, seed_sequence) for distances, seed_sequence in zip(tasks, numpy.random.SeedSequence(seed).spawn(len(tasks)))]
+
+		start_time = time.time()
+		if nprocs == 1:
+			results = map(self.cache_entries_wrapper, tasks)
+		else:
+			pool = multiprocessing.get_context("fork").Pool(min(nprocs, len(tasks)) or 1)
+			results = pool.imap_unordered(self.cache_entries_wrapper, tasks)
+		try:
+			for n, entries in enumerate(results, 1):
+				for key, lnP_instruments, bins, array in entries:
+					self.insert_cache_entry(key, lnP_instruments, rate.BinnedArray(rate.NDBins(bins), array = array), publish = True)
+				if verbose:
+					elapsed = time.time() - start_time
+					print("computed %d/%d sets of horizon distances, %.1f s elapsed, %.3g sets/s" % (n, len(tasks), elapsed, n / elapsed), file=sys.stderr)
+		finally:
+			if nprocs != 1:
+				pool.terminate()
 
 
 	@staticmethod
-	def joint_pdf_of_snrs(instruments, inst_horiz_mapping, snr_cutoff, n_samples = 160000, bins = rate.ATanLogarithmicBins(3.6, 1200., 170), progressbar = None):
+	def joint_pdf_of_snrs(instruments, inst_horiz_mapping, snr_cutoff, n_samples = 160000, bins = rate.ATanLogarithmicBins(3.6, 1200., 170), progressbar = None, rng = None, block_size = 1024):
 		"""
 		Return a BinnedArray containing
 
@@ -638,10 +964,15 @@ class SNRPDF(object):
 		The n_samples parameter sets the number of iterations for
 		the internal Monte Carlo sampling loop, and progressbar can
 		be a glue.text_progress_bar.ProgressBar instance for
-		verbosity.
+		verbosity.  rng is the numpy.random.Generator to use
+		(default = a new one seeded from the operating system's
+		entropy source).  The samples are drawn and processed
+		block_size at a time.
 		"""
 		if progressbar is not None:
 			progressbar.max = n_samples
+		if rng is None:
+			rng = numpy.random.default_rng()
 
 		# get instrument names in alphabetical order
 		instruments = sorted(instruments)
@@ -663,7 +994,7 @@ class SNRPDF(object):
 		# (meaning the PDF will be left 0 in that bin).
 		pdf = rate.BinnedArray(rate.NDBins([bins] * len(instruments)))
 		snr_sequence = rate.ATanLogarithmicBins(3.6, 1200., 500)
-		snr_snrlo_snrhi_sequence = numpy.array(zip(snr_sequence.centres(), snr_sequence.lower(), snr_sequence.upper())[:-1])
+		snr_snrlo_snrhi_sequence = numpy.array(list(zip(snr_sequence.centres(), snr_sequence.lower(), snr_sequence.upper()))[:-1])
 
 		# compute the SNR at which to begin iterations over bins
 		assert type(snr_cutoff) is float
@@ -687,42 +1018,33 @@ class SNRPDF(object):
 		# value is as good as any other
 		gmst = 0.0
 
-		# run the sampler the requested # of iterations.  save some
-		# symbols to avoid doing module attribute look-ups in the
-		# loop
-		acos = math.acos
-		random_uniform = random.uniform
-		twopi = 2. * math.pi
-		pi_2 = math.pi / 2.
-		xlal_am_resp = lal.ComputeDetAMResponse
-		# FIXME:  scipy.stats.rice.rvs broken on reference OS.
-		# switch to it when we can rely on a new-enough scipy
-		#rice_rvs = stats.rice.rvs	# broken on reference OS
-		# the .reshape is needed in the event that x is a 1x1
-		# array:  numpy returns a scalar from sqrt(), but we must
-		# have something that we can iterate over
-		rice_rvs = lambda x: numpy.sqrt(stats.ncx2.rvs(2., x**2.)).reshape(x.shape)
-		for i in range(n_samples):
+		# run the sampler the requested # of iterations, block_size
+		# samples at a time
+		for i in range(0, n_samples, block_size):
+			n = min(block_size, n_samples - i)
 			if progressbar is not None:
-				progressbar.increment()
-			# select random sky location and source orbital
-			# plane inclination and choice of polarization
-			ra = random_uniform(0., twopi)
-			dec = pi_2 - acos(random_uniform(-1., 1.))
-			psi = random_uniform(0., twopi)
-			cosi2 = random_uniform(-1., 1.)**2.
-
-			# F+^2 and Fx^2 for each instrument
-			fpfc2 = numpy.array(tuple(xlal_am_resp(resp, ra, dec, psi, gmst) for resp in resps))**2.
-			fpfc2_other = numpy.array(tuple(xlal_am_resp(resp, ra, dec, psi, gmst) for resp in resps_other))**2.
-
-			# ratio of distance to inverse SNR for each instrument
+				progressbar.increment(delta = n)
+			# select random sky locations and source orbital
+			# plane inclinations and choices of polarization
+			ra, dec, psi, cosi2 = random_source_orientations(n, rng = rng)
+
+			# F+^2 and Fx^2 factors for each sample
 			fpfc_factors = ((1. + cosi2)**2. / 4., cosi2)
-			snr_times_D = DH_times_8 * numpy.dot(fpfc2, fpfc_factors)**0.5
+
+			# ratio of distance to inverse SNR for each
+			# instrument and sample
+			fplus, fcross = antenna_responses(resps, ra, dec, psi, gmst)
+			snr_times_D = DH_times_8[:, numpy.newaxis] * numpy.sqrt(fplus**2. * fpfc_factors[0] + fcross**2. * fpfc_factors[1])
+
+			# samples for which one of the instruments that
+			# must be able to see the event is blind to it are
+			# skipped
+			keep = numpy.flatnonzero(snr_times_D.min(axis = 0) > 0.)
+			snr_times_D = snr_times_D[:, keep]
 
 			# snr * D in instrument whose SNR grows fastest
 			# with decreasing D
-			max_snr_times_D = snr_times_D.max()
+			max_snr_times_D = snr_times_D.max(axis = 0)
 
 			# snr_times_D.min() / snr_min = the furthest a
 			# source can be and still be above snr_min in all
@@ -732,37 +1054,29 @@ class SNRPDF(object):
 			# decreasing distance --- the SNR the source has in
 			# the most sensitive instrument when visible to all
 			# instruments in the combo
-			try:
-				start_index = snr_sequence[max_snr_times_D / (snr_times_D.min() / snr_min)]
-			except ZeroDivisionError:
-				# one of the instruments that must be able
-				# to see the event is blind to it
-				continue
+			start_index = _bin_indexes(snr_sequence, max_snr_times_D / (snr_times_D.min(axis = 0) / snr_min))
 
 			# min_D_other is minimum distance at which source
 			# becomes visible in an instrument that isn't
 			# involved.  max_snr_times_D / min_D_other gives
 			# the SNR in the most sensitive instrument at which
 			# the source becomes visible to one of the
-			# instruments not allowed to participate
+			# instruments not allowed to participate.  if all
+			# the instruments that must not see it are blind to
+			# it, or there are no other instruments, there is
+			# no limit
+			end_index = numpy.full(len(keep), len(snr_snrlo_snrhi_sequence))
 			if len(DH_times_8_other):
-				min_D_other = (DH_times_8_other * numpy.dot(fpfc2_other, fpfc_factors)**0.5).min() / snr_cutoff
-				try:
-					end_index = snr_sequence[max_snr_times_D / min_D_other] + 1
-				except ZeroDivisionError:
-					# all instruments that must not see
-					# it are blind to it
-					end_index = None
-			else:
-				# there are no other instruments
-				end_index = None
+				fplus, fcross = antenna_responses(resps_other, ra[keep], dec[keep], psi[keep], gmst)
+				min_D_other = (DH_times_8_other[:, numpy.newaxis] * numpy.sqrt(fplus**2. * fpfc_factors[0][keep] + fcross**2. * fpfc_factors[1][keep])).min(axis = 0) / snr_cutoff
+				seen = min_D_other > 0.
+				end_index[seen] = numpy.minimum(_bin_indexes(snr_sequence, max_snr_times_D[seen] / min_D_other[seen]) + 1, end_index[seen])
 
 			# if start_index >= end_index then in order for the
 			# source to be close enough to be visible in all
 			# the instruments that must see it it is already
 			# visible to one or more instruments that must not.
-			# don't need to check for this, the for loop that
-			# comes next will simply not have any iterations.
+			# such samples contribute no (sample, SNR) pairs.
 
 			# iterate over the nominal SNRs (= noise-free SNR
 			# in the most sensitive instrument) at which we
@@ -776,17 +1090,21 @@ class SNRPDF(object):
 			#
 			#	snr_times_D / D
 			#
-			# scipy's Rice-distributed RV code is used to
-			# add the effect of background noise, converting
-			# the noise-free SNRs into simulated observed SNRs
+			# a Rice-distributed RV is used to add the effect of
+			# background noise, converting the noise-free SNRs
+			# into simulated observed SNRs
 			#
 			# number of sources b/w Dlo and Dhi:
 			#
 			#	d count \propto D^2 |dD|
 			#	  count \propto Dhi^3 - Dlo**3
-			D_Dhi_Dlo_sequence = max_snr_times_D / snr_snrlo_snrhi_sequence[start_index:end_index]
-			for snr, weight in zip(rice_rvs(snr_times_D / numpy.reshape(D_Dhi_Dlo_sequence[:,0], (len(D_Dhi_Dlo_sequence), 1))), D_Dhi_Dlo_sequence[:,1]**3. - D_Dhi_Dlo_sequence[:,2]**3.):
-				pdf[tuple(snr)] += weight
+			index = numpy.arange(len(snr_snrlo_snrhi_sequence))
+			sample, index = numpy.nonzero((start_index[:, numpy.newaxis] <= index) & (index < end_index[:, numpy.newaxis]))
+			D_Dhi_Dlo = max_snr_times_D[sample, numpy.newaxis] / snr_snrlo_snrhi_sequence[index]
+			snr = snr_times_D[:, sample] / D_Dhi_Dlo[:, 0]
+			snr = numpy.sqrt((snr + rng.standard_normal(snr.shape))**2. + rng.standard_normal(snr.shape)**2.)
+			weight = D_Dhi_Dlo[:, 1]**3. - D_Dhi_Dlo[:, 2]**3.
+			pdf.array += numpy.bincount(numpy.ravel_multi_index(tuple(_bin_indexes(b, x) for b, x in zip(pdf.bins, snr)), pdf.array.shape), weights = weight, minlength = pdf.array.size).reshape(pdf.array.shape)
 
 		# check for divide-by-zeros that weren't caught.  also
 		# finds NaNs if they're there
@@ -807,7 +1125,7 @@ class SNRPDF(object):
 		for i in range(len(instruments)):
 			slices = [range_all] * len(instruments)
 			slices[i] = range_low
-			pdf.array[slices] = 0.
+			pdf.array[tuple(slices)] = 0.
 		# convert bin counts to normalized PDF
 		pdf.to_pdf()
 		# one last sanity check
@@ -839,10 +1157,7 @@ class SNRPDF(object):
 				ligolw_param.get_pyvalue(elem, u"min_instruments:key")
 			)
 
-			lnbinnedarray = binnedarray.copy()
-			with numpy.errstate(divide = "ignore"):
-				lnbinnedarray.array = numpy.log(lnbinnedarray.array)
-			self.snr_joint_pdf_cache[key] = self.cacheentry(ligolw_param.get_pyvalue(elem, u"lnp_instruments"), rate.InterpBinnedArray(lnbinnedarray, fill_value = NegInf), binnedarray)
+			self.insert_cache_entry(key, ligolw_param.get_pyvalue(elem, u"lnp_instruments"), binnedarray)
 		return self
 
 
@@ -1058,6 +1373,26 @@ def normsq_along_one(x):
 	return numpy.add.reduce(x * x, axis=(1,))
 
 
+class LazyDict(dict):
+	"""
+	Dictionary whose missing values are computed, and stored, on first
+	retrieval by calling factory with the key.
+
+	>>> d = LazyDict(lambda key: key * 2)
+	>>> d[3]
+	6
+	>>> 3 in d
+	True
+	"""
+	def __init__(self, factory):
+		super(LazyDict, self).__init__()
+		self.factory = factory
+
+	def __missing__(self, key):
+		value = self[key] = self.factory(key)
+		return value
+
+
 def margprob(Dmat):
 	"""
 	Compute the marginalized probability along the second dimension of a
@@ -1187,7 +1522,7 @@ class TimePhaseSNR(object):
 	locations = {"H1":lal.CachedDetectors[lal.LHO_4K_DETECTOR].location, "L1":lal.CachedDetectors[lal.LLO_4K_DETECTOR].location, "V1":lal.CachedDetectors[lal.VIRGO_DETECTOR].location, "K1":lal.CachedDetectors[lal.KAGRA_DETECTOR].location}
 	numchunks = 20
 
-	def __init__(self, transtt = None, transtp = None, transpt = None, transpp = None, transdd = None, norm = None, tree_data = None, margsky = None, verbose = False, margstart = 0, margstop = None, SNR=None, psd_fname=None):
+	def __init__(self, transtt = None, transtp = None, transpt = None, transpp = None, transdd = None, norm = None, tree_data = None, margsky = None, verbose = False, margstart = 0, margstop = None, SNR=None, psd_fname=None, lazy = False, mmap_dir = None):
 		"""
 		Initialize a new class from scratch via explicit computation
 		of the tree data and marginalized probability distributions or by providing
@@ -1195,6 +1530,13 @@ class TimePhaseSNR(object):
 		one of these from scratch, but instead will read the data from disk using the
 		from_hdf() method below.
 
+		If lazy is True the KD tree for each instrument combination
+		is not built until it is first needed.  If mmap_dir is not
+		None it names a directory written by .to_mmap_dir(), the
+		trees are built lazily, and they are loaded from (and, when
+		built, saved to) serialized copies in that directory whose
+		arrays are memory-mapped.
+
 		transtt, transtp, transpt, transpp, transdd are required.  They
 		can be produced by running gstlal_inspiral_compute_dtdphideff_cov_matrix.  An
 		example is here
@@ -1266,6 +1608,9 @@ class TimePhaseSNR(object):
 		self.transpt = transpt
 		self.transpp = transpp
 		self.transdd = transdd
+		# the (dt, dphi) co-ordinate transformation matrices for
+		# each instrument pair, used by .batch()
+		self.coordtransmats = dict((pair, numpy.array([[transtt[pair], transtp[pair]], [transpt[pair], transpp[pair]]], dtype = "double")) for pair in transtt)
 
 		self.tree_data = tree_data
 		self.margsky = margsky
@@ -1280,13 +1625,14 @@ class TimePhaseSNR(object):
 		# produce KD trees for all the combinations.  NOTE we slice
 		# into the same array for memory considerations.  the KDTree
 		# does *not* make copies of the data so be careful to not
-		# modify it afterward
-		self.KDTree = {}
-		for combo in self.combos:
-			if verbose:
-				print("initializing tree for: ", combo, file=sys.stderr)
-			slcs = sorted(sum(self.instrument_pair_slices(self.instrument_pairs(combo)).values(),[]))
-			self.KDTree[combo] = spatial.cKDTree(self.tree_data[:,slcs])
+		# modify it afterward.  the trees are constructed on demand,
+		# if not lazy construct them all now
+		self.verbose = verbose
+		self.mmap_dir = mmap_dir
+		self.KDTree = LazyDict(self.make_kdtree)
+		if not lazy and mmap_dir is None:
+			for combo in self.combos:
+				self.KDTree[combo]
 
 		# NOTE: This is super slow we have a premarginalized h5 file in
 		# the tree, see the helper class InspiralExtrinsics
@@ -1306,6 +1652,119 @@ class TimePhaseSNR(object):
 					marg[margstart + self.numchunks * cnt : margstart + self.numchunks * (cnt+1)] = margprob(Dmat)
 				self.margsky[combo] = numpy.array(marg, dtype="float32")
 
+	def make_kdtree(self, combo):
+		"""
+		Construct the KD tree for an instrument combination.  If
+		.mmap_dir is set the tree is loaded from its serialized copy
+		in that directory, with its data memory-mapped, or if there
+		isn't one the tree is built and then saved there.
+		"""
+		if self.mmap_dir is not None:
+			filename = os.path.join(self.mmap_dir, "kdtree_%s" % ",".join(combo))
+			try:
+				with open(filename + ".pickle", "rb") as f:
+					nbuffers, tree = pickle.load(f)
+			except FileNotFoundError:
+				pass
+			else:
+				if self.verbose:
+					print("mapping tree for: ", combo, file=sys.stderr)
+				return pickle.loads(tree, buffers = [numpy.load("%s.%d.npy" % (filename, i), mmap_mode = "r") for i in range(nbuffers)])
+
+		if self.verbose:
+			print("initializing tree for: ", combo, file=sys.stderr)
+		slcs = sorted(sum(self.instrument_pair_slices(self.instrument_pairs(combo)).values(),[]))
+		tree = spatial.cKDTree(self.tree_data[:,slcs])
+
+		if self.mmap_dir is not None:
+			# serialize the tree with its large arrays stored as
+			# separate .npy files that can be mapped.  the
+			# buffers are moved into place first, the .pickle
+			# file last so its presence means the set is
+			# complete.  the directory might be read-only, that
+			# is not an error
+			buffers = []
+			tree_pickle = pickle.dumps(tree, protocol = 5, buffer_callback = buffers.append)
+			try:
+				for i, buf in enumerate(buffers):
+					fd, tmpname = tempfile.mkstemp(dir = self.mmap_dir, prefix = ".", suffix = ".npy")
+					with os.fdopen(fd, "wb") as f:
+						numpy.save(f, numpy.frombuffer(buf.raw(), dtype = "uint8"))
+					os.chmod(tmpname, 0o644)
+					os.rename(tmpname, "%s.%d.npy" % (filename, i))
+				fd, tmpname = tempfile.mkstemp(dir = self.mmap_dir, prefix = ".", suffix = ".pickle")
+				with os.fdopen(fd, "wb") as f:
+					pickle.dump((len(buffers), tree_pickle), f)
+				os.chmod(tmpname, 0o644)
+				os.rename(tmpname, filename + ".pickle")
+			except OSError:
+				pass
+		return tree
+
+	@staticmethod
+	def mmap_dir_name(parent, fnames):
+		"""
+		Return the name of the directory in parent that holds the
+		memory-mappable copy of the data in the HDF5 files fnames.
+		The name is derived from the files' names, sizes and
+		modification times so that changes to the files are
+		noticed.
+		"""
+		stamp = json.dumps([(os.path.abspath(fname), os.stat(fname).st_size, os.stat(fname).st_mtime_ns) for fname in fnames])
+		return os.path.join(parent, "time_phase_snr_%s" % hashlib.sha1(stamp.encode("utf-8")).hexdigest())
+
+	def to_mmap_dir(self, dirname):
+		"""
+		Write the tree data, the marginalized probabilities and the
+		transformation parameters to dirname in a form that
+		.from_mmap_dir() can memory-map.  The directory is created
+		atomically, if it already exists it is left as-is.  KD
+		trees are added to it as they are built by instances
+		loaded from it.
+		"""
+		parent = os.path.dirname(os.path.abspath(dirname))
+		tmpdir = tempfile.mkdtemp(dir = parent, prefix = ".%s." % os.path.basename(dirname))
+		try:
+			numpy.save(os.path.join(tmpdir, "treedata.npy"), numpy.ascontiguousarray(self.tree_data))
+			for combo, marg in self.margsky.items():
+				numpy.save(os.path.join(tmpdir, "marg_%s.npy" % ",".join(combo)), numpy.ascontiguousarray(marg))
+			params = {}
+			for name, mat in (("transtt", self.transtt), ("transtp", self.transtp), ("transpt", self.transpt), ("transpp", self.transpp), ("transdd", self.transdd), ("norm", self.norm)):
+				params[name] = dict((",".join(sorted(k)), float(v)) for k, v in mat.items())
+			with open(os.path.join(tmpdir, "params.json"), "w") as f:
+				json.dump(params, f)
+			os.chmod(tmpdir, 0o755)
+			try:
+				os.rename(tmpdir, dirname)
+			except OSError:
+				# another process got there first
+				if not os.path.isdir(dirname):
+					raise
+				shutil.rmtree(tmpdir)
+		except:
+			shutil.rmtree(tmpdir, ignore_errors = True)
+			raise
+
+	@staticmethod
+	def from_mmap_dir(dirname, **kwargs):
+		"""
+		Initialize one of these from a directory written by
+		.to_mmap_dir().  The arrays are memory-mapped read-only, so
+		all processes on a machine share one copy of them, and the
+		KD trees are loaded or built only when first needed.
+		"""
+		with open(os.path.join(dirname, "params.json")) as f:
+			# NOTE:  values are stored as numpy arrays, as
+			# .from_hdf5() does, so arithmetic with them is done
+			# in the same precision
+			params = dict((name, dict((frozenset(k.split(",")), numpy.array(v)) for k, v in mat.items())) for name, mat in json.load(f).items())
+		tree_data = numpy.load(os.path.join(dirname, "treedata.npy"), mmap_mode = "r")
+		margsky = {}
+		for name in os.listdir(dirname):
+			if name.startswith("marg_") and name.endswith(".npy"):
+				margsky[tuple(name[5:-4].split(","))] = numpy.load(os.path.join(dirname, name), mmap_mode = "r")
+		return TimePhaseSNR(tree_data = tree_data, margsky = margsky, mmap_dir = dirname, **params, **kwargs)
+
 	def to_hdf5(self, fname):
 		"""
 		If you have initialized one of these from scratch and want to
@@ -1336,10 +1795,21 @@ class TimePhaseSNR(object):
 		f.close()
 
 	@staticmethod
-	def from_hdf5(fname, other_fnames = [], **kwargs):
+	def from_hdf5(fname, other_fnames = [], mmap_dir = None, **kwargs):
 		"""
 		Initialize one of these from a file instead of computing it from scratch
+
+		If mmap_dir is not None it names a directory in which to
+		keep a memory-mappable copy of the data.  The first time a
+		file is loaded the copy is created, afterwards it is
+		loaded with .from_mmap_dir() instead of reading the file.
 		"""
+		if mmap_dir is not None:
+			dirname = TimePhaseSNR.mmap_dir_name(mmap_dir, [fname] + list(other_fnames))
+			if not os.path.isdir(dirname):
+				TimePhaseSNR.from_hdf5(fname, other_fnames, lazy = True).to_mmap_dir(dirname)
+			return TimePhaseSNR.from_mmap_dir(dirname, **kwargs)
+
 		f = h5py.File(fname, "r")
 		# These *have* to be here
 		transtt = dict((frozenset(k.split(",")), numpy.array(f["transtt"][k])) for k in f["transtt"])
@@ -1575,6 +2045,72 @@ class TimePhaseSNR(object):
 		# is 1 for a double right at threshold.
 		return numpy.exp(-D2 / 2.) * self.margsky[combo][nearestix] / self.norm[frozenset(combo)] * 5.66 / (sum(s**2 for s in snr.values())**.5)**4
 
+	def batch(self, time, phase, snr, horizon, workers = -1):
+		"""
+		Array counterpart of .__call__().  time, phase, snr and
+		horizon are equal-length sequences of dictionaries, one of
+		each for each candidate, as would be passed to
+		.__call__().  Returns a numpy array of the probabilities.
+
+		The candidates are grouped by instrument combination, and
+		each group is evaluated by .batch_combo().  The results
+		agree with .__call__()'s to single-precision accuracy.
+		"""
+		result = numpy.empty((len(time),), dtype = "double")
+		groups = {}
+		for n, t in enumerate(time):
+			groups.setdefault(tuple(sorted(t)), []).append(n)
+
+		for combo, index in groups.items():
+			result[index] = self.batch_combo(
+				combo,
+				dict((ifo, numpy.array([time[n][ifo] for n in index], dtype = "double")) for ifo in combo),
+				dict((ifo, numpy.array([phase[n][ifo] for n in index], dtype = "double")) for ifo in combo),
+				dict((ifo, numpy.array([snr[n][ifo] for n in index], dtype = "double")) for ifo in combo),
+				dict((ifo, numpy.array([horizon[n][ifo] for n in index], dtype = "double")) for ifo in combo),
+				workers = workers
+			)
+
+		return result
+
+	def batch_combo(self, combo, time, phase, snr, horizon, workers = -1):
+		"""
+		Compute the probabilities for a sequence of candidates
+		that all have triggers in the instruments in combo (a
+		sorted tuple).  time, phase, snr and horizon are
+		dictionaries mapping each of those instruments to an array
+		of the values for the candidates.  The co-ordinates of all
+		candidates are computed together and the KD tree is queried
+		for all of them in one call using workers parallel worker
+		threads (-1 = one per CPU).  Returns a numpy array of the
+		probabilities.
+		"""
+		# FIXME:  see .__call__() for the explanation of this
+		# factor
+		snr_factor = 5.66 / (sum(snr[ifo]**2 for ifo in combo)**.5)**4
+		#
+		# NOTE shortcut for single IFO
+		#
+		if len(combo) == 1:
+			return 1. / self.norm[frozenset(combo)] * snr_factor
+
+		Deff = dict((ifo, horizon[ifo] / snr[ifo] * 8.0) for ifo in combo)
+
+		# same packing as .dtdphideffpoints():  dt, dphi, and
+		# effective distance ratio for each pair
+		pairs = self.instrument_pairs(combo)
+		points = numpy.zeros((len(snr_factor), 3 * len(pairs)), dtype = "float32")
+		for k, (ifo1, ifo2) in enumerate(pairs):
+			pair = frozenset((ifo1, ifo2))
+			points[:,3*k], points[:,3*k+1] = numpy.dot(self.coordtransmats[pair], (time[ifo1] - time[ifo2], phase[ifo1] - phase[ifo2]))
+			points[:,3*k+2] = numpy.log(Deff[ifo1] / Deff[ifo2]) * self.transdd[pair]
+
+		treedataslices = sorted(sum(self.instrument_pair_slices(pairs).values(),[]))
+		nearestix = self.KDTree[combo].query(points, workers = workers)[1]
+		D = points - self.tree_data[nearestix][:,treedataslices]
+		D2 = numpy.einsum("ij,ij->i", D, D)
+		return numpy.exp(-D2 / 2.) * self.margsky[combo][nearestix] / self.norm[frozenset(combo)] * snr_factor
+
 
 #
 # =============================================================================
@@ -1585,6 +2121,92 @@ class TimePhaseSNR(object):
 #
 
 
+def mkinterp_array(binnedarray, fill_value = 0.):
+	"""
+	Array-valued counterpart of lal.rate.InterpBinnedArray() for 1-
+	and 2-dimensional binnings.  Returns a function of one or two
+	arrays of co-ordinates that returns an array of the interpolated
+	values.  The interpolation is the same piece-wise linear
+	interpolation on the bin centres, padded with fill_value at the
+	binning's boundaries, that lal.rate.InterpBinnedArray() uses when
+	scipy's interp1d and interp2d are not available, and it gives
+	identical results.
+	"""
+	# NOTE:  co-ordinate and padding logic copied from
+	# lal.rate.InterpBinnedArray()
+	coords = tuple(numpy.hstack((l[0], c, u[-1])) for l, c, u in zip(binnedarray.bins.lower(), binnedarray.bins.centres(), binnedarray.bins.upper()))
+	if len(coords) not in (1, 2):
+		raise ValueError("only 1- and 2-dimensional binnings are supported")
+	z = binnedarray.at_centres()
+	z = numpy.pad(z, [(1, 1)] * z.ndim, mode = "constant", constant_values = [(fill_value, fill_value)] * z.ndim)
+	slices = []
+	for c in coords:
+		finite_indexes, = numpy.isfinite(c).nonzero()
+		assert len(finite_indexes) != 0
+		lo, hi = finite_indexes.min(), finite_indexes.max()
+		while lo < hi and c[lo + 1] == c[lo]:
+			lo += 1
+		while lo < hi and c[hi - 1] == c[hi]:
+			hi -= 1
+		assert lo < hi
+		slices.append(slice(lo, hi + 1))
+	z = z[tuple(slices)]
+
+	if len(coords) == 1:
+		coords0 = coords[0][slices[0]]
+		lo, hi = coords0[0], coords0[-1]
+		with numpy.errstate(invalid = "ignore"):
+			dz_over_dcoords0 = (z[1:] - z[:-1]) / (coords0[1:] - coords0[:-1])
+
+		def interp(x):
+			x = numpy.asarray(x, dtype = "double")
+			result = numpy.full(x.shape, fill_value, dtype = "double")
+			inside = (lo < x) & (x < hi)
+			x = x[inside]
+			i = coords0.searchsorted(x) - 1
+			# an infinite value is returned as-is
+			with numpy.errstate(invalid = "ignore"):
+				result[inside] = numpy.where(numpy.isinf(z[i]), z[i], z[i] + (x - coords0[i]) * dz_over_dcoords0[i])
+			return result
+
+		return interp
+
+	coords0, coords1 = (c[slc] for c, slc in zip(coords, slices))
+
+	lox, hix = coords0[0], coords0[-1]
+	loy, hiy = coords1[0], coords1[-1]
+	dcoords0 = coords0[1:] - coords0[:-1]
+	dcoords1 = coords1[1:] - coords1[:-1]
+	with numpy.errstate(invalid = "ignore"):
+		dz0 = z[1:,:] - z[:-1,:]
+		dz1 = z[:,1:] - z[:,:-1]
+
+	def interp(x, y):
+		x = numpy.asarray(x, dtype = "double")
+		y = numpy.asarray(y, dtype = "double")
+		result = numpy.full(x.shape, fill_value, dtype = "double")
+		inside = (lox < x) & (x < hix) & (loy < y) & (y < hiy)
+		x = x[inside]
+		y = y[inside]
+		i = coords0.searchsorted(x) - 1
+		j = coords1.searchsorted(y) - 1
+		dx = (x - coords0[i]) / dcoords0[i]
+		dy = (y - coords1[j]) / dcoords1[j]
+		# each rectangle between bin centres is split into two
+		# triangles along its diagonal, and the plane through the
+		# vertices of the triangle containing the point is
+		# evaluated.  an infinite vertex value is returned as-is
+		with numpy.errstate(invalid = "ignore"):
+			z_lo = z[i, j]
+			lower = numpy.where(numpy.isinf(z_lo), z_lo, z_lo + dx * dz0[i, j] + dy * dz1[i, j])
+			z_hi = z[i + 1, j + 1]
+			upper = numpy.where(numpy.isinf(z_hi), z_hi, z_hi + (1. - dx) * -dz0[i, j + 1] + (1. - dy) * -dz1[i + 1, j])
+		result[inside] = numpy.where(dx + dy <= 1., lower, upper)
+		return result
+
+	return interp
+
+
 class p_of_instruments_given_horizons(object):
 	"""
 	The goal of this class is to compute :math:`P(\\vec{O} | \\vec{D_H},
@@ -1868,8 +2490,11 @@ class p_of_instruments_given_horizons(object):
 		Create an interpolated represenation over the grid of horizon ratios
 		"""
 		self.interps = {}
+		self.array_interps = {}
 		for I in self.histograms:
 			self.interps[I] = rate.InterpBinnedArray(self.histograms[I])
+			if len(self.histograms[I].bins) <= 2:
+				self.array_interps[I] = mkinterp_array(self.histograms[I])
 
 	def __call__(self, instruments, horizon_distances):
 		"""
@@ -1882,6 +2507,23 @@ class p_of_instruments_given_horizons(object):
 		H = [horizon_distances[k] for k in sorted(horizon_distances)]
 		return self.interps[tuple(sorted(instruments))](*[min(max(h / H[0], self.first_center), self.last_center) for h in H[1:]])
 
+	def batch(self, instruments, horizon_distances):
+		"""
+		Array counterpart of .__call__().  horizon_distances is a
+		dictionary of arrays of the horizon distances for a sequence
+		of candidates, all of which have triggers in instruments.
+		Returns an array of the probabilities.  The same caveat as
+		for .__call__() applies.
+		"""
+		H = [horizon_distances[k] for k in sorted(horizon_distances)]
+		coords = [numpy.clip(h / H[0], self.first_center, self.last_center) for h in H[1:]]
+		instruments = tuple(sorted(instruments))
+		if instruments in self.array_interps:
+			return self.array_interps[instruments](*coords)
+		# more than 2 dimensions, one at a time
+		interp = self.interps[instruments]
+		return numpy.fromiter((interp(*x) for x in zip(*(c.tolist() for c in coords))), dtype = "double", count = len(H[0]))
+
 	def to_hdf5(self, fname):
 		"""
 		Record the class data to a file so that you don't have to remake it from scratch
@@ -2030,14 +2672,42 @@ class InspiralExtrinsics(object):
 		on_ifos = tuple(sorted(horizons.keys()))
 		return self.p_of_ifos[on_ifos](instruments, horizons)
 
+	def p_of_instruments_given_horizons_batch(self, instruments, horizons):
+		"""
+		Array counterpart of .p_of_instruments_given_horizons().
+		horizons is a dictionary of arrays of the horizon distances
+		for a sequence of candidates, all of which have triggers in
+		instruments.  Returns an array of the probabilities, which
+		are 0 where .p_of_instruments_given_horizons() would raise
+		ValueError.
+		"""
+		names = sorted(horizons)
+		# group the candidates by which instruments are on,
+		# encoded as bit patterns
+		on = sum(numpy.where(horizons[name] != 0, 1 << k, 0) for k, name in enumerate(names))
+		result = numpy.zeros(on.shape, dtype = "double")
+		for pattern in numpy.unique(on).tolist():
+			on_ifos = tuple(name for k, name in enumerate(names) if pattern & (1 << k))
+			if not set(instruments) <= set(on_ifos):
+				continue
+			index, = (on == pattern).nonzero()
+			if len(on_ifos) == 1:
+				result[index] = 1.0
+			else:
+				result[index] = self.p_of_ifos[on_ifos].batch(instruments, dict((name, horizons[name][index]) for name in on_ifos))
+		return result
+
 
 	@classmethod
 	def load_time_phase_snr(cls, filename = None):
+		# if GSTLAL_DTDPHI_MMAP_DIR is set, keep a memory-mappable
+		# copy of the data there so that processes on a machine
+		# share it, see TimePhaseSNR.from_hdf5()
 		if not cls.time_phase_snr:
 			if filename is not None:
-				cls.time_phase_snr = TimePhaseSNR.from_hdf5(filename)
+				cls.time_phase_snr = TimePhaseSNR.from_hdf5(filename, mmap_dir = os.environ.get("GSTLAL_DTDPHI_MMAP_DIR"))
 			else:
-				cls.time_phase_snr = TimePhaseSNR.from_hdf5(os.path.join(gstlal_config_paths["pkgdatadir"], "inspiral_dtdphi_pdf.h5"))
+				cls.time_phase_snr = TimePhaseSNR.from_hdf5(os.path.join(gstlal_config_paths["pkgdatadir"], "inspiral_dtdphi_pdf.h5"), mmap_dir = os.environ.get("GSTLAL_DTDPHI_MMAP_DIR"))
 
 
 #
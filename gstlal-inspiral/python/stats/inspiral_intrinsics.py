@@ -89,6 +89,12 @@ class UniformInTemplatePopulationModel(object):
 		assert snr >= 0.
 		return self.lnP
 
+	@gstlalstats.assert_ln_probability
+	def lnP_template_signal_batch(self, template_ids, snrs):
+		snrs = numpy.asarray(snrs, dtype = "double")
+		assert (snrs >= 0.).all()
+		return numpy.full(snrs.shape, self.lnP, dtype = "double")
+
 
 class SourcePopulationModel(object):
 	#
@@ -152,3 +158,30 @@ class SourcePopulationModel(object):
 		# PPoly's .__call__() returns an array, so we need the
 		# final [0] to flatten it
 		return lnP_vs_snr(min(snr, self.max_snr))[0]
+
+	@gstlalstats.assert_ln_probability
+	def lnP_template_signal_batch(self, template_ids, snrs):
+		"""
+		Array version of .lnP_template_signal().  template_ids and
+		snrs are equal-length arrays.  The candidates are sorted by
+		template, and each template's polynomial is evaluated for
+		all of its candidates in one call.
+		"""
+		template_ids = numpy.asarray(template_ids)
+		snrs = numpy.asarray(snrs, dtype = "double")
+		assert (snrs >= 0.).all()
+		snrs = numpy.minimum(snrs, self.max_snr)
+		lnP = numpy.empty(snrs.shape, dtype = "double")
+		order = template_ids.argsort(kind = "stable")
+		boundaries = numpy.flatnonzero(numpy.diff(template_ids[order])) + 1
+		for index in numpy.split(order, boundaries):
+			if not len(index):
+				continue
+			template_id = template_ids[index[0]].item()
+			try:
+				lnP_vs_snr = self.polys[template_id]
+			except KeyError:
+				raise KeyError("template ID %d is not in this model" % template_id)
+			# PPoly returns an array with one column
+			lnP[index] = lnP_vs_snr(snrs[index])[:,0]
+		return lnP
@@ -27,6 +27,8 @@
 
 
 import cmath
+from collections import defaultdict
+import itertools
 try:
 	from fpconst import NegInf
 except ImportError:
@@ -68,6 +70,7 @@ from gstlal import paths as gstlal_config_paths
 
 
 __all__ = [
+	"CandidateBlock",
 	"LnSignalDensity",
 	"LnNoiseDensity",
 	"DatalessLnSignalDensity",
@@ -100,6 +103,171 @@ def idq_interp(idq_file):
 	return out
 
 
+#
+# =============================================================================
+#
+#                               Candidate Blocks
+#
+# =============================================================================
+#
+
+
+class CandidateBlock(object):
+	"""
+	A block of candidates stored as arrays, the array counterpart of
+	the sequences of keyword argument dictionaries accepted by the
+	.lnP_batch() methods.  instruments is a sorted tuple of the names
+	of all instruments in the network, which sets the order of the
+	columns of the two-dimensional arrays.  Those have one row for
+	each candidate:
+
+	mask:  True where the candidate has a trigger from the instrument.
+	snrs, chi2s_over_snr2s, phase, dt:  the trigger parameters, 0
+	where there is no trigger.
+	start, end:  the boundaries of the instruments' segments.
+
+	template_id is a one-dimensional array of the template IDs.
+	"""
+	def __init__(self, instruments, mask, snrs, chi2s_over_snr2s, phase, dt, start, end, template_id):
+		self.instruments = tuple(instruments)
+		self.mask = mask
+		self.snrs = snrs
+		self.chi2s_over_snr2s = chi2s_over_snr2s
+		self.phase = phase
+		self.dt = dt
+		self.start = start
+		self.end = end
+		self.template_id = template_id
+
+	def __len__(self):
+		return len(self.template_id)
+
+	def select(self, index, mask = None):
+		"""
+		Return a new CandidateBlock containing the candidates
+		selected by index, which can be anything that can index a
+		numpy array.  If mask is not None it replaces the
+		candidates' trigger masks, and it must not add triggers
+		that the candidates do not have.
+		"""
+		if mask is None:
+			mask = self.mask[index]
+		elif (mask & ~self.mask[index]).any():
+			raise ValueError("mask adds triggers")
+		return type(self)(self.instruments, mask, *[numpy.where(mask, getattr(self, name)[index], 0.) for name in ("snrs", "chi2s_over_snr2s", "phase", "dt")] + [self.start[index], self.end[index], self.template_id[index]])
+
+	def kwargs(self, n):
+		"""
+		Return the parameters of candidate n as a dictionary of the
+		keyword arguments in the form yielded by
+		LnNoiseDensity.random_params().
+		"""
+		triggered = [(k, instrument) for k, instrument in enumerate(self.instruments) if self.mask[n, k]]
+		snrs, chi2s_over_snr2s, phase, dt = (getattr(self, name)[n].tolist() for name in ("snrs", "chi2s_over_snr2s", "phase", "dt"))
+		return {
+			"segments": dict((instrument, segments.segment(start, end)) for instrument, start, end in zip(self.instruments, self.start[n].tolist(), self.end[n].tolist())),
+			"snrs": dict((instrument, snrs[k]) for k, instrument in triggered),
+			"chi2s_over_snr2s": dict((instrument, chi2s_over_snr2s[k]) for k, instrument in triggered),
+			"phase": dict((instrument, phase[k]) for k, instrument in triggered),
+			"dt": dict((instrument, dt[k]) for k, instrument in triggered),
+			"template_id": self.template_id[n].item()
+		}
+
+	def kwargs_seq(self):
+		"""
+		Return a list of the keyword argument dictionaries of all
+		candidates, see .kwargs().
+		"""
+		return [self.kwargs(n) for n in range(len(self))]
+
+	def combos(self):
+		"""
+		Generator yielding a two-element tuple for each distinct
+		combination of triggered instruments:  the combination as a
+		sorted tuple of instrument names, and an array of the
+		indexes of the candidates that have it.
+		"""
+		codes = self.mask.dot(1 << numpy.arange(len(self.instruments)))
+		for code in numpy.unique(codes).tolist():
+			index, = (codes == code).nonzero()
+			yield tuple(instrument for k, instrument in enumerate(self.instruments) if code & (1 << k)), index
+
+
+def randcoord_array(binning, size, ns = None, domain = None):
+	"""
+	Array counterpart of lal.rate.NDBins.randcoord().  Draws size
+	co-ordinates from the same distribution using numpy's random
+	number generator.  Returns a tuple of arrays, one for each
+	co-ordinate, and an array of the natural logarithms of the PDF
+	from which they were drawn.
+	"""
+	if ns is None:
+		ns = (1.,) * len(binning)
+	if domain is None:
+		domain = (slice(None, None),) * len(binning)
+	coords = []
+	lnP = numpy.zeros((size,), dtype = "double")
+	for bins, n, d in zip(binning, ns, domain):
+		# NOTE:  boundary logic copied from
+		# lal.rate.Bins.randcoord()
+		if d.step is not None:
+			raise NotImplementedError("step not supported: %s" % repr(d))
+		l = numpy.array(bins.lower(), dtype = "double")
+		u = numpy.array(bins.upper(), dtype = "double")
+		lo, hi, _ = bins[d].indices(len(l))
+		if d.start is not None:
+			l[lo] = d.start
+		if d.stop is not None:
+			u[hi - 1] = d.stop
+		if math.isinf(u[lo] - l[lo]):
+			lo += 1
+		if math.isinf(u[hi - 1] - l[hi - 1]):
+			hi -= 1
+		if not lo < hi:
+			raise ValueError("slice too small")
+		ln_dx = numpy.log(u - l)
+		if numpy.isinf(ln_dx[lo:hi]).any():
+			raise ValueError("unavoidable infinite bin detected")
+		# bin indexes drawn from the distribution of
+		# lal.iterutils.randindex(), whose CDF goes as index^n
+		if n == 1.:
+			index = numpy.random.randint(lo, hi, size)
+			ln_Pi = numpy.full((size,), -math.log(hi - lo), dtype = "double")
+		else:
+			cdf = numpy.arange(lo, hi + 1, dtype = "double")**n
+			cdf -= cdf[0]
+			cdf /= cdf[-1]
+			beta = lo**n / (hi**n - lo**n)
+			alpha = hi / (1. + beta)**(1. / n)
+			index = numpy.minimum(numpy.floor(alpha * (numpy.random.random_sample(size) + beta)**(1. / n)).astype("intp"), hi - 1)
+			ln_Pi = numpy.log(cdf[1:] - cdf[:-1])[index - lo]
+		coords.append(numpy.random.uniform(l[index], u[index]))
+		lnP += ln_Pi - ln_dx[index]
+	return tuple(coords), lnP
+
+
+def random_toa_offsets(coinc_rates, instruments, size):
+	"""
+	Array counterpart of lalburst.snglcoinc.CoincRates.plausible_toas().
+	Returns an array of size rows of mutually coincident
+	time-of-arrival offsets, one column for each instrument in
+	instruments, drawn using numpy's random number generator.
+	"""
+	anchor, others = instruments[0], instruments[1:]
+	tau = numpy.array([coinc_rates.tau[frozenset((anchor, instrument))] for instrument in others])
+	ijseq = [(i, j, coinc_rates.tau[frozenset((others[i], others[j]))]) for i, j in itertools.combinations(range(len(others)), 2)]
+	dt = numpy.zeros((size, len(instruments)), dtype = "double")
+	todo = numpy.arange(size)
+	while len(todo):
+		offsets = numpy.random.uniform(-tau, +tau, (len(todo), len(others)))
+		accept = numpy.ones((len(todo),), dtype = "bool")
+		for i, j, maxdt in ijseq:
+			accept &= abs(offsets[:,i] - offsets[:,j]) <= maxdt
+		dt[todo[accept], 1:] = offsets[accept]
+		todo = todo[~accept]
+	return dt
+
+
 #
 # =============================================================================
 #
@@ -169,6 +337,7 @@ class LnLRDensity(snglcoinc.LnLRDensity):
 
 		try:
 			del self.interps
+			del self.array_interps
 		except AttributeError:
 			pass
 		return self
@@ -210,6 +379,66 @@ class LnLRDensity(snglcoinc.LnLRDensity):
 
 	def mkinterps(self):
 		self.interps = dict((key, lnpdf.mkinterp()) for key, lnpdf in self.densities.items())
+		self.array_interps = dict((key, inspiral_extrinsics.mkinterp_array(lnpdf)) for key, lnpdf in self.densities.items())
+
+	def lnP_batch(self, kwargs_seq):
+		"""
+		Evaluate the density for a sequence of candidates.
+		kwargs_seq is a sequence of dictionaries of the keyword
+		arguments that would be passed to .__call__(), the return
+		value is a numpy array of the results.  This
+		implementation invokes .__call__() for each candidate in
+		turn, sub-classes override it to evaluate the candidates
+		together.
+		"""
+		return numpy.fromiter((self(**kwargs) for kwargs in kwargs_seq), dtype = "double", count = len(kwargs_seq))
+
+	def snr_chi_lnP_batch(self, kwargs_seq, keyfunc):
+		"""
+		Return an array of the sums over each candidate's
+		instruments of the (SNR, \chi^2) PDFs, as added to ln P
+		by .__call__().  keyfunc maps an instrument name to the key
+		in .array_interps of that instrument's PDF.  Each PDF is
+		interpolated at the co-ordinates of all candidates in one
+		call.
+		"""
+		coords = defaultdict(lambda: ([], [], []))
+		for n, kwargs in enumerate(kwargs_seq):
+			snrs = kwargs["snrs"]
+			for instrument, chi2_over_snr2 in kwargs["chi2s_over_snr2s"].items():
+				index, snr, chi = coords[keyfunc(instrument)]
+				index.append(n)
+				snr.append(snrs[instrument])
+				chi.append(chi2_over_snr2)
+		lnP = numpy.zeros(len(kwargs_seq), dtype = "double")
+		for key, (index, snr, chi) in coords.items():
+			numpy.add.at(lnP, index, self.array_interps[key](snr, chi))
+		return lnP
+
+	def lnP_block(self, block):
+		"""
+		Evaluate the density for the candidates in a
+		CandidateBlock.  Returns a numpy array of the results.
+		This implementation passes the candidates' parameters to
+		.lnP_batch(), sub-classes override it to evaluate the
+		candidates directly from the block's arrays.
+		"""
+		return self.lnP_batch(block.kwargs_seq())
+
+	def snr_chi_lnP_block(self, block, keyfunc):
+		"""
+		Array counterpart of .snr_chi_lnP_batch() for the
+		candidates in a CandidateBlock.
+		"""
+		coords = defaultdict(lambda: ([], [], []))
+		for k, instrument in enumerate(block.instruments):
+			index, = block.mask[:,k].nonzero()
+			for seq, values in zip(coords[keyfunc(instrument)], (index, block.snrs[index, k], block.chi2s_over_snr2s[index, k])):
+				seq.append(values)
+		lnP = numpy.zeros((len(block),), dtype = "double")
+		for key, (index, snr, chi) in coords.items():
+			numpy.add.at(lnP, numpy.concatenate(index), self.array_interps[key](numpy.concatenate(snr), numpy.concatenate(chi)))
+		return lnP
 
 	def finish(self):
 		snr_kernel_width_at_8 = 8.,
@@ -409,6 +638,120 @@ class LnSignalDensity(LnLRDensity):
 
 		return lnP + sum(interp(snrs[instrument], chi2_over_snr2) for instrument, chi2_over_snr2 in chi2s_over_snr2s.items())
 
+	def lnP_batch(self, kwargs_seq):
+		"""
+		Evaluate the density for a sequence of candidates.  See
+		LnLRDensity.lnP_batch().  The horizon distance and
+		instrument terms are computed for each candidate in turn,
+		the dt, dphi, SNR probability and the (SNR, \chi^2) and iDQ
+		interpolators are evaluated for all candidates together.
+		"""
+		lnP = numpy.full(len(kwargs_seq), NegInf, dtype = "double")
+		lnP_population = numpy.zeros(len(kwargs_seq), dtype = "double")
+		lnP_templates = math.log(len(self.template_ids))
+		index = []
+		horizons_seq = []
+		for n, kwargs in enumerate(kwargs_seq):
+			segments, snrs, template_id = kwargs["segments"], kwargs["snrs"], kwargs["template_id"]
+			assert frozenset(segments) == self.instruments
+			if len(snrs) < self.min_instruments:
+				continue
+			# see .__call__() for an explanation of the terms
+			assert all(segments.values()), "encountered trigger with duration = 0"
+			horizons = dict((instrument, (self.horizon_history[instrument].functional_integral(map(float, seg), lambda d: d**3.) / float(abs(seg)))**(1./3.)) for instrument, seg in segments.items())
+			horizon = sorted(horizons.values())[-self.min_instruments] / TYPICAL_HORIZON_DISTANCE
+			if not horizon:
+				continue
+			x = 3. * math.log(horizon * self.horizon_factors[template_id]) + lnP_templates
+			try:
+				x += math.log(self.InspiralExtrinsics.p_of_instruments_given_horizons(snrs.keys(), horizons))
+			except ValueError:
+				continue
+			lnP[n] = x
+			lnP_population[n] = self.population_model.lnP_template_signal(template_id, max(snrs.values()))
+			index.append(n)
+			horizons_seq.append(horizons)
+
+		# dt, dphi, snr probability, for all candidates together
+		if index:
+			with numpy.errstate(divide = "ignore"):
+				lnP[index] += numpy.log(self.InspiralExtrinsics.time_phase_snr.batch([kwargs_seq[n]["dt"] for n in index], [kwargs_seq[n]["phase"] for n in index], [kwargs_seq[n]["snrs"] for n in index], horizons_seq))
+		lnP += lnP_population
+		valid, = numpy.isfinite(lnP).nonzero()
+		kwargs_seq = [kwargs_seq[n] for n in valid]
+
+		# iDQ glitch probability, evaluated for all of an
+		# instrument's triggers together
+		times = defaultdict(lambda: ([], []))
+		for n, kwargs in zip(valid, kwargs_seq):
+			for ifo, seg in kwargs["segments"].items():
+				if ifo in kwargs["snrs"]:
+					index, t = times[ifo]
+					index.append(n)
+					t.append(float(seg[1]))
+		for ifo, (index, t) in times.items():
+			t = numpy.array(t)
+			interp = self.idq_glitch_lnl[ifo]
+			numpy.subtract.at(lnP, index, numpy.max((interp(t - 1.), interp(t), interp(t + 1.)), axis = 0))
+
+		lnP[valid] += self.snr_chi_lnP_batch(kwargs_seq, lambda instrument: "snr_chi")
+		return lnP
+
+	def lnP_block(self, block):
+		"""
+		Evaluate the density for the candidates in a
+		CandidateBlock.  See LnLRDensity.lnP_block().  All terms
+		are computed for all candidates together, those that depend
+		on the instrument combination for each combination's
+		candidates together.
+		"""
+		assert frozenset(block.instruments) == self.instruments
+		lnP = numpy.full((len(block),), NegInf, dtype = "double")
+		valid, = (block.mask.sum(axis = 1) >= self.min_instruments).nonzero()
+		block = block.select(valid)
+
+		# see .__call__() for an explanation of the terms
+		duration = block.end - block.start
+		assert duration.all(), "encountered trigger with duration = 0"
+		horizons = numpy.empty(duration.shape, dtype = "double")
+		for k, instrument in enumerate(block.instruments):
+			horizons[:,k] = (self.horizon_history[instrument].functional_integrals(block.start[:,k], block.end[:,k], lambda d: d**3.) / duration[:,k])**(1./3.)
+		horizon = numpy.sort(horizons, axis = 1)[:,-self.min_instruments] / TYPICAL_HORIZON_DISTANCE
+		template_ids, inverse = numpy.unique(block.template_id, return_inverse = True)
+		horizon_factors = numpy.array([self.horizon_factors[template_id] for template_id in template_ids.tolist()], dtype = "double")[inverse.reshape(-1)]
+		x = numpy.full((len(block),), NegInf, dtype = "double")
+		with numpy.errstate(divide = "ignore"):
+			x[horizon != 0] = 3. * numpy.log(horizon * horizon_factors)[horizon != 0] + math.log(len(self.template_ids))
+
+		# P(instruments | horizon distances) and the dt, dphi, snr
+		# probability
+		for combo, index in block.combos():
+			index = index[numpy.isfinite(x[index])]
+			if not len(index):
+				continue
+			p = self.InspiralExtrinsics.p_of_instruments_given_horizons_batch(combo, dict((instrument, horizons[index, k]) for k, instrument in enumerate(block.instruments)))
+			x[index[~(p > 0.)]] = NegInf
+			index, p = index[p > 0.], p[p > 0.]
+			columns = [block.instruments.index(instrument) for instrument in combo]
+			with numpy.errstate(divide = "ignore"):
+				x[index] += numpy.log(p) + numpy.log(self.InspiralExtrinsics.time_phase_snr.batch_combo(combo, *(dict(zip(combo, values[index][:,columns].T)) for values in (block.dt, block.phase, block.snrs, horizons))))
+		finite, = numpy.isfinite(x).nonzero()
+		block = block.select(finite)
+
+		# population model
+		x[finite] += self.population_model.lnP_template_signal_batch(block.template_id, block.snrs.max(axis = 1))
+
+		# iDQ glitch probability
+		for k, instrument in enumerate(block.instruments):
+			index, = block.mask[:,k].nonzero()
+			t = block.end[index, k]
+			interp = self.idq_glitch_lnl[instrument]
+			x[finite[index]] -= numpy.max((interp(t - 1.), interp(t), interp(t + 1.)), axis = 0)
+
+		x[finite] += self.snr_chi_lnP_block(block, lambda instrument: "snr_chi")
+		lnP[valid] = x
+		return lnP
+
 	def __iadd__(self, other):
 		super(LnSignalDensity, self).__iadd__(other)
 		self.horizon_history += other.horizon_history
@@ -719,6 +1062,10 @@ class DatalessLnSignalDensity(LnSignalDensity):
 		interp = self.interps["snr_chi"]
 		return lnP + sum(interp(snrs[instrument], chi2_over_snr2) for instrument, chi2_over_snr2 in chi2s_over_snr2s.items())
 
+	# .__call__() is overridden, use the generic implementations
+	lnP_batch = LnLRDensity.lnP_batch
+	lnP_block = LnLRDensity.lnP_block
+
 	def __iadd__(self, other):
 		raise NotImplementedError
 
@@ -840,7 +1187,7 @@ class LnNoiseDensity(LnLRDensity):
 		# around it.  you might might to make this bigger.
 		triggers_per_second_per_template = {}
 		for instrument, seg in segments.items():
-			triggers_per_second_per_template[instrument] = (self.triggerrates[instrument] & trigger_rate.ratebinlist([trigger_rate.ratebin(seg[1] - 3600., seg[1] + 3600., count = 0)])).density / len(self.template_ids)
+			triggers_per_second_per_template[instrument] = self.triggerrates[instrument].density_in((seg[1] - 3600., seg[1] + 3600.)) / len(self.template_ids)
 		# sanity check rates
 		assert all(triggers_per_second_per_template[instrument] for instrument in snrs), "impossible candidate in %s at %s when rates were %s triggers/s/template" % (", ".join(sorted(snrs)), ", ".join("%s s in %s" % (str(seg[1]), instrument) for instrument, seg in sorted(segments.items())), str(triggers_per_second_per_template))
 
@@ -866,6 +1213,86 @@ class LnNoiseDensity(LnLRDensity):
 		interps = self.interps
 		return lnP + sum(interps["%s_snr_chi" % instrument](snrs[instrument], chi2_over_snr2) for instrument, chi2_over_snr2 in chi2s_over_snr2s.items())
 
+	def lnP_batch(self, kwargs_seq):
+		"""
+		Evaluate the density for a sequence of candidates.  See
+		LnLRDensity.lnP_batch().  The trigger rates are measured
+		for each candidate in turn, the coincidence rate terms are
+		computed once for each distinct set of trigger rates, and
+		the (SNR, \chi^2) interpolators are evaluated for all
+		candidates together.
+		"""
+		lnP = numpy.full(len(kwargs_seq), NegInf, dtype = "double")
+		coinc_rates = {}
+		for n, kwargs in enumerate(kwargs_seq):
+			segments, snrs = kwargs["segments"], kwargs["snrs"]
+			assert frozenset(segments) == self.instruments
+			if len(snrs) < self.min_instruments:
+				continue
+			# see .__call__() for an explanation of the terms
+			triggers_per_second_per_template = {}
+			for instrument, seg in segments.items():
+				triggers_per_second_per_template[instrument] = self.triggerrates[instrument].density_in((seg[1] - 3600., seg[1] + 3600.)) / len(self.template_ids)
+			assert all(triggers_per_second_per_template[instrument] for instrument in snrs), "impossible candidate in %s at %s when rates were %s triggers/s/template" % (", ".join(sorted(snrs)), ", ".join("%s s in %s" % (str(seg[1]), instrument) for instrument, seg in sorted(segments.items())), str(triggers_per_second_per_template))
+			key = tuple(sorted(triggers_per_second_per_template.items()))
+			try:
+				lnP_t, lnP_instruments = coinc_rates[key]
+			except KeyError:
+				lnP_t, lnP_instruments = coinc_rates[key] = math.log(sum(self.coinc_rates.strict_coinc_rates(**triggers_per_second_per_template).values()) * len(self.template_ids)), self.coinc_rates.lnP_instruments(**triggers_per_second_per_template)
+			lnP[n] = lnP_t + lnP_instruments[frozenset(snrs)]
+		valid, = numpy.isfinite(lnP).nonzero()
+		lnP[valid] += self.snr_chi_lnP_batch([kwargs_seq[n] for n in valid], lambda instrument: "%s_snr_chi" % instrument)
+		return lnP
+
+	def lnP_block(self, block):
+		"""
+		Evaluate the density for the candidates in a
+		CandidateBlock.  See LnLRDensity.lnP_block().  The trigger
+		rates and the coincidence rate terms are computed for all
+		candidates together, using the same arithmetic as
+		snglcoinc.CoincRates.
+		"""
+		assert frozenset(block.instruments) == self.instruments
+		lnP = numpy.full((len(block),), NegInf, dtype = "double")
+		valid, = (block.mask.sum(axis = 1) >= self.min_instruments).nonzero()
+		block = block.select(valid)
+
+		# see .__call__() for an explanation of the terms
+		rates = dict((instrument, self.triggerrates[instrument].densities_in(block.end[:,k] - 3600., block.end[:,k] + 3600.) / len(self.template_ids)) for k, instrument in enumerate(block.instruments))
+		impossible = (block.mask & ~numpy.array([rates[instrument] != 0. for instrument in block.instruments]).T).any(axis = 1)
+		if impossible.any():
+			n = impossible.argmax()
+			raise AssertionError("impossible candidate in %s at %s when rates were %s triggers/s/template" % (", ".join(instrument for k, instrument in enumerate(block.instruments) if block.mask[n, k]), ", ".join("%s s in %s" % (str(block.end[n, k]), instrument) for k, instrument in enumerate(block.instruments)), str(dict((instrument, rate[n]) for instrument, rate in rates.items()))))
+		tau = self.coinc_rates.tau
+		if tau and max(rate.max(initial = 0.) for rate in rates.values()) * max(tau.values()) >= 1.:
+			raise ValueError("events per coincidence window must be << 1: max window = %g" % max(tau.values()))
+		coinc_rates = {}
+		for instruments, rate_factor in self.coinc_rates.rate_factors.items():
+			coinc_rates[instruments] = rate_factor
+			for instrument in instruments:
+				coinc_rates[instruments] = coinc_rates[instruments] * rates[instrument]
+		for instruments in sorted(coinc_rates, reverse = True, key = lambda instruments: len(instruments)):
+			for key, rate in coinc_rates.items():
+				if instruments < key:
+					coinc_rates[instruments] = coinc_rates[instruments] - rate
+		assert all((rate >= 0.).all() for rate in coinc_rates.values()), "encountered negative rate"
+		total_rate = sum(coinc_rates.values())
+		if not total_rate.all():
+			raise ZeroDivisionError("all rates are 0")
+		x = numpy.log(total_rate * len(self.template_ids))
+		P_instruments = dict((instruments, rate / total_rate) for instruments, rate in coinc_rates.items())
+		norm = sum(numpy.sort(numpy.array(list(P_instruments.values())), axis = 0))
+		assert (abs(1.0 - norm) < 1e-14).all()
+		for combo, index in block.combos():
+			P = P_instruments[frozenset(combo)][index]
+			with numpy.errstate(divide = "ignore"):
+				x[index] += numpy.where(P != 0., numpy.log(P / norm[index]), NegInf)
+
+		finite, = numpy.isfinite(x).nonzero()
+		x[finite] += self.snr_chi_lnP_block(block.select(finite), lambda instrument: "%s_snr_chi" % instrument)
+		lnP[valid] = x
+		return lnP
+
 	def __iadd__(self, other):
 		super(LnNoiseDensity, self).__iadd__(other)
 		self.triggerrates += other.triggerrates
@@ -890,7 +1317,9 @@ class LnNoiseDensity(LnLRDensity):
 		else:
 			# same as parent class, but with .lnzerolagdensity
 			# added
-			self.interps = dict((key, (pdf + self.lnzerolagdensity.densities[key]).mkinterp()) for key, pdf in self.densities.items())
+			pdfs = dict((key, pdf + self.lnzerolagdensity.densities[key]) for key, pdf in self.densities.items())
+			self.interps = dict((key, pdf.mkinterp()) for key, pdf in pdfs.items())
+			self.array_interps = dict((key, inspiral_extrinsics.mkinterp_array(pdf)) for key, pdf in pdfs.items())
 
 	def add_noise_model(self, number_of_events = 1):
 		#
@@ -1036,6 +1465,82 @@ class LnNoiseDensity(LnLRDensity):
 			# bit is corrected for other than H1L1
 			yield (), kwargs, sum(seq[1::2], lnP_t + lnP_instruments + lnP_template_id)
 
+	def random_params_blocks(self, block_size = 16384):
+		"""
+		Array counterpart of .random_params().  Generator that
+		yields an endless sequence of two-element tuples, each
+		containing a CandidateBlock of randomly generated
+		candidates and an array of the natural logarithms (up to
+		an arbitrary constant) of the PDF from which they have been
+		drawn evaluated at the candidates' parameters.  The
+		candidates are drawn from the same distribution as those of
+		.random_params(), block_size at a time, using numpy's
+		random number generator.  Candidates at times when too few
+		instruments are on are discarded, so blocks can contain
+		fewer than block_size candidates.
+
+		The sequence is suitable for input to the
+		.ln_lr_samples_blocks() log likelihood ratio generator.
+		"""
+		instruments = tuple(sorted(self.instruments))
+		snr_slope = 0.8 / len(instruments)**3
+		domain = (slice(self.snr_min, None), slice(self.chi2_over_snr2_min, self.chi2_over_snr2_max))
+		lo, hi = self.triggerrates.extent_all()
+		lnP_t = -math.log(hi - lo)
+		lnP_template_id = -math.log(len(self.template_ids))
+		template_ids = numpy.array(sorted(self.template_ids))
+		# see .random_params() for the instrument selection.
+		# element [n, k] is ln P for k of n instruments
+		lnP_instruments = numpy.full((len(instruments) + 1, len(instruments) + 1), NegInf, dtype = "double")
+		for n in range(self.min_instruments, len(instruments) + 1):
+			for k in range(self.min_instruments, n + 1):
+				lnP_instruments[n, k] = -math.log((n - self.min_instruments + 1) * (math.factorial(n) // math.factorial(k) // math.factorial(n - k)))
+		twopi = 2. * math.pi
+		while 1:
+			t = numpy.random.uniform(lo, hi, block_size)
+			rates = self.triggerrates.densities_at(t)
+			on = numpy.array([rates[instrument] > 0 for instrument in instruments]).T
+			n_on = on.sum(axis = 1)
+			# FIXME:  see .random_params()
+			keep = n_on >= self.min_instruments
+			t, on, n_on = t[keep], on[keep], n_on[keep]
+			if not len(t):
+				continue
+
+			# pick k between min_instruments and the number of
+			# instruments that are on inclusively, then k of
+			# those instruments by ranking random keys
+			k = numpy.random.randint(self.min_instruments, n_on + 1)
+			keys = numpy.where(on, numpy.random.random_sample(on.shape), 2.)
+			mask = keys.argsort(axis = 1).argsort(axis = 1) < k[:,numpy.newaxis]
+			lnP = lnP_instruments[n_on, k] + (lnP_t + lnP_template_id)
+
+			snrs = numpy.zeros(mask.shape, dtype = "double")
+			chi2s_over_snr2s = numpy.zeros(mask.shape, dtype = "double")
+			for col, instrument in enumerate(instruments):
+				index, = mask[:,col].nonzero()
+				(snrs[index, col], chi2s_over_snr2s[index, col]), lnP_coords = randcoord_array(self.densities["%s_snr_chi" % instrument].bins, len(index), ns = (snr_slope, 1.), domain = domain)
+				lnP[index] += lnP_coords
+			phase = numpy.where(mask, numpy.random.uniform(0., twopi, mask.shape), 0.)
+			dt = numpy.zeros(mask.shape, dtype = "double")
+			block = CandidateBlock(
+				instruments,
+				mask,
+				snrs,
+				chi2s_over_snr2s,
+				phase,
+				dt,
+				# FIXME: waveform duration hard-coded to
+				# 10 s, generalize
+				numpy.repeat((t - 10.0)[:,numpy.newaxis], len(instruments), axis = 1),
+				numpy.repeat(t[:,numpy.newaxis], len(instruments), axis = 1),
+				# FIXME:  see .random_params()
+				numpy.random.choice(template_ids, len(t))
+			)
+			for combo, index in block.combos():
+				dt[numpy.ix_(index, [instruments.index(instrument) for instrument in combo])] = random_toa_offsets(self.coinc_rates, combo, len(index))
+			yield block, lnP
+
 	def to_xml(self, name):
 		xml = super(LnNoiseDensity, self).to_xml(name)
 		xml.appendChild(self.triggerrates.to_xml(u"triggerrates"))
@@ -1105,10 +1610,18 @@ class DatalessLnNoiseDensity(LnNoiseDensity):
 		interp = self.interps["snr_chi"]
 		return lnP + sum(interp(snrs[instrument], chi2_over_snr2) for instrument, chi2_over_snr2 in chi2s_over_snr2s.items())
 
+	# .__call__() is overridden, use the generic implementations
+	lnP_batch = LnLRDensity.lnP_batch
+	lnP_block = LnLRDensity.lnP_block
+
 	def random_params(self):
 		# won't work
 		raise NotImplementedError
 
+	def random_params_blocks(self, *args, **kwargs):
+		# won't work
+		raise NotImplementedError
+
 	def __iadd__(self, other):
 		raise NotImplementedError
 
@@ -215,6 +215,50 @@ class ratebin(segments.segment):
 		return self.__class__(self[0] + x, self[1] + x, count = self._count)
 
 
+class _ratebinindex(object):
+	"""
+	Arrays of the boundaries and counts of the ratebins in a coalesced
+	ratebinlist, and their cumulative counts and livetimes, for O(log
+	n) queries.  The arrays grow geometrically so that appending is
+	amortized O(1).  For internal use by ratebinlist.
+	"""
+	def __init__(self, seglist):
+		self.owner = id(seglist)
+		self.n = len(seglist)
+		size = max(self.n, 16)
+		self.lo = numpy.empty((size,), dtype = "double")
+		self.hi = numpy.empty((size,), dtype = "double")
+		self.count = numpy.empty((size,), dtype = "double")
+		self.lo[:self.n] = numpy.fromiter((float(seg[0]) for seg in seglist), dtype = "double", count = self.n)
+		self.hi[:self.n] = numpy.fromiter((float(seg[1]) for seg in seglist), dtype = "double", count = self.n)
+		self.count[:self.n] = numpy.fromiter((seg.count or 0 for seg in seglist), dtype = "double", count = self.n)
+		# entry i is the total of the bins preceding bin i
+		self.cumcount = numpy.empty((size + 1,), dtype = "double")
+		self.cumlivetime = numpy.empty((size + 1,), dtype = "double")
+		self.cumcount[0] = self.cumlivetime[0] = 0.
+		self.count[:self.n].cumsum(out = self.cumcount[1:self.n + 1])
+		(self.hi[:self.n] - self.lo[:self.n]).cumsum(out = self.cumlivetime[1:self.n + 1])
+
+	def append(self, seg):
+		size = len(self.lo)
+		if self.n >= size:
+			for name in ("lo", "hi", "count", "cumcount", "cumlivetime"):
+				old = getattr(self, name)
+				new = numpy.empty((len(old) + size,), dtype = "double")
+				new[:len(old)] = old
+				setattr(self, name, new)
+		self.n += 1
+		self.set_last(seg)
+
+	def set_last(self, seg):
+		i = self.n - 1
+		self.lo[i] = seg[0]
+		self.hi[i] = seg[1]
+		self.count[i] = seg.count or 0
+		self.cumcount[i + 1] = self.cumcount[i] + self.count[i]
+		self.cumlivetime[i + 1] = self.cumlivetime[i] + (self.hi[i] - self.lo[i])
+
+
 class ratebinlist(segments.segmentlist):
 	"""
 	Modified version of the segmentlist type (see ligo.segments) whose
@@ -270,7 +314,23 @@ class ratebinlist(segments.segmentlist):
 
 	NOTE:  the XML I/O feature of this class will only work correctly
 	for float-valued boundaries and integer counts.
+
+	NOTE:  the .density and .density_in() queries are answered from
+	cumulative count and livetime arrays that are built on demand and
+	maintained by .add_ratebin() when it appends to the list or
+	extends its last bin.  Any other modification of the list discards
+	them, and they are rebuilt by the next query.
 	"""
+	def __index(self):
+		# return the cumulative count and livetime arrays, building
+		# them if they have been discarded.  the owner check
+		# rejects arrays inherited by a (shallow) copy of the list,
+		# which would otherwise be shared by both
+		index = getattr(self, "_index", None)
+		if index is None or index.owner != id(self):
+			self._index = index = _ratebinindex(self)
+		return index
+
 	def __getitem__(self, index):
 		# make sure to return slices as ratebinlist objects, not
 		# native list objects
@@ -291,7 +351,82 @@ class ratebinlist(segments.segmentlist):
 	def density(self):
 		# NOTE:  event density at times when there are no segments
 		# is 0., not NaN!
-		return self.count / float(abs(self)) if self else 0.
+		if not self:
+			return 0.
+		index = self.__index()
+		return float(index.cumcount[index.n] / index.cumlivetime[index.n])
+
+	def density_in(self, seg):
+		"""
+		Return the mean density in the interval seg.  Equivalent to
+
+		(self & type(self)([ratebin(seg, count = 0)])).density
+
+		but O(log n) instead of O(n).  The ratebinlist must be
+		coalesced.
+
+		Example:
+
+		>>> x = ratebinlist([ratebin(0, 10, count = 5), ratebin(15, 25, count = 20)])
+		>>> x.density_in((5, 20))
+		1.25
+		>>> (x & ratebinlist([ratebin(5, 20, count = 0)])).density
+		1.25
+		>>> x.density_in((10, 15))
+		0.0
+		"""
+		index = self.__index()
+		lo, hi = map(float, seg)
+		# the bins that intersect seg are i through j - 1
+		i = index.hi[:index.n].searchsorted(lo, side = "right")
+		j = index.lo[:index.n].searchsorted(hi, side = "left")
+		if i >= j:
+			return 0.
+		# the first and last bins are clipped to seg.  the density
+		# of a clipped bin is the same as the bin's
+		lo_i, hi_i = index.lo[i], index.hi[i]
+		if i == j - 1:
+			return float(index.count[i] / (hi_i - lo_i))
+		first = hi_i - max(lo, lo_i)
+		lo_j, hi_j = index.lo[j - 1], index.hi[j - 1]
+		last = min(hi, hi_j) - lo_j
+		count = index.count[i] / (hi_i - lo_i) * first + (index.cumcount[j - 1] - index.cumcount[i + 1]) + index.count[j - 1] / (hi_j - lo_j) * last
+		livetime = first + (index.cumlivetime[j - 1] - index.cumlivetime[i + 1]) + last
+		return float(count / livetime)
+
+	def densities_in(self, lo, hi):
+		"""
+		Array version of .density_in().  lo and hi are arrays of
+		the boundaries of the intervals, the return value is an
+		array of the mean densities in them.  The ratebinlist must
+		be coalesced.
+
+		Example:
+
+		>>> x = ratebinlist([ratebin(0, 10, count = 5), ratebin(15, 25, count = 20)])
+		>>> x.densities_in([5., 10., 0.], [20., 15., 5.])
+		array([1.25, 0.  , 0.5 ])
+		"""
+		index = self.__index()
+		lo = numpy.asarray(lo, dtype = "double")
+		hi = numpy.asarray(hi, dtype = "double")
+		# see .density_in() for the arithmetic
+		i = index.hi[:index.n].searchsorted(lo, side = "right")
+		j = index.lo[:index.n].searchsorted(hi, side = "left")
+		result = numpy.zeros(lo.shape, dtype = "double")
+		one = i == j - 1
+		k = i[one]
+		result[one] = index.count[k] / (index.hi[k] - index.lo[k])
+		many = i < j - 1
+		lo, hi, i, j = lo[many], hi[many], i[many], j[many]
+		lo_i, hi_i = index.lo[i], index.hi[i]
+		first = hi_i - numpy.maximum(lo, lo_i)
+		lo_j, hi_j = index.lo[j - 1], index.hi[j - 1]
+		last = numpy.minimum(hi, hi_j) - lo_j
+		count = index.count[i] / (hi_i - lo_i) * first + (index.cumcount[j - 1] - index.cumcount[i + 1]) + index.count[j - 1] / (hi_j - lo_j) * last
+		livetime = first + (index.cumlivetime[j - 1] - index.cumlivetime[i + 1]) + last
+		result[many] = count / livetime
+		return result
 
 	def segmentlist(self):
 		"""
@@ -315,17 +450,29 @@ class ratebinlist(segments.segmentlist):
 		[10@[0,20)]
 		"""
 		seg = ratebin(seg, count = count)
-		# tail optimization cases
+		# tail optimization cases.  these keep the cumulative
+		# count and livetime arrays up to date, if they exist
+		index = getattr(self, "_index", None)
+		if index is not None and index.owner != id(self):
+			index = None
 		if not self:
 			self.append(seg)
+			if index is not None:
+				index.append(seg)
 		elif not seg.disjoint(self[-1]):
 			self[-1] |= seg
+			if index is not None:
+				index.set_last(self[-1])
 		elif seg.disjoint(self[-1]) > 0:
 			self.append(seg)
+			if index is not None:
+				index.append(seg)
 		else:
 			# general case.  implementation of .__ior__()
 			# allows us to use a tuple here
 			self |= (seg,)
+			index = None
+		self._index = index
 
 	def find(self, item):
 		"""
@@ -379,6 +526,30 @@ class ratebinlist(segments.segmentlist):
 			return 0.
 		return self[i].density
 
+	def densities_at(self, x):
+		"""
+		Array version of .density_at().  x is an array of
+		co-ordinates, the return value is an array of the densities
+		at them.  The ratebinlist must be coalesced.
+
+		Example:
+
+		>>> x = ratebinlist([ratebin(0, 10, count = 5), ratebin(15, 25, count = 2.5)])
+		>>> x.densities_at([-1., 0., 10., 20.])
+		array([0.  , 0.5 , 0.  , 0.25])
+		"""
+		index = self.__index()
+		x = numpy.asarray(x, dtype = "double")
+		# the bin that can contain x is the last one that starts
+		# at or before it
+		i = index.lo[:index.n].searchsorted(x, side = "right") - 1
+		inside = i >= 0
+		inside[inside] = x[inside] < index.hi[i[inside]]
+		result = numpy.zeros(x.shape, dtype = "double")
+		i = i[inside]
+		result[inside] = index.count[i] / (index.hi[i] - index.lo[i])
+		return result
+
 	def __iand__(self, other):
 		if not other or not self:
 			del self[:]
@@ -389,9 +560,10 @@ class ratebinlist(segments.segmentlist):
 		def andgen(self, other):
 			self_next = iter(self).__next__
 			other_next = iter(other).__next__
-			self_seg = self_next()
-			other_seg = other_next()
 			try:
+				# the slice of self can be empty
+				self_seg = self_next()
+				other_seg = other_next()
 				while 1:
 					while self_seg[1] <= other_seg[0]:
 						self_seg = self_next()
@@ -491,6 +663,9 @@ class ratebinlist(segments.segmentlist):
 		del self[i : ]
 		return self
 
+	def __copy__(self):
+		return self.__class__(self)
+
 	@classmethod
 	def from_xml(cls, xml, name):
 		# need to cast start and stop to floats, otherwise they are
@@ -503,6 +678,27 @@ class ratebinlist(segments.segmentlist):
 		return ligolw_array.Array.build(u"%s:ratebinlist" % name, numpy.array([(seg[0], seg[1], seg.count) for seg in self], dtype = "double"))
 
 
+#
+# methods that modify a ratebinlist discard its cumulative count and
+# livetime arrays.  this includes the in-place methods inherited from
+# segmentlist that bypass the list methods
+#
+
+
+def _discards_index(method):
+	def wrapper(self, *args, **kwargs):
+		self._index = None
+		return method(self, *args, **kwargs)
+	wrapper.__name__ = method.__name__
+	wrapper.__doc__ = method.__doc__
+	return wrapper
+
+
+for name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend", "insert", "pop", "remove", "sort", "reverse", "clear", "protract", "contract", "shift"):
+	setattr(ratebinlist, name, _discards_index(getattr(ratebinlist, name)))
+del name
+
+
 #
 # =============================================================================
 #
@@ -567,6 +763,9 @@ class triggerrates(segments.segmentlistdict):
 	def density_at(self, x):
 		return dict((key, value.density_at(x)) for key, value in self.items())
 
+	def densities_at(self, x):
+		return dict((key, value.densities_at(x)) for key, value in self.items())
+
 	def random_uniform(self):
 		lo, hi = self.extent_all()
 		uniform = random.uniform
@@ -223,7 +223,7 @@ class backgroundcollector(object):
 
 class StreamThinca(object):
 	def __init__(self, xmldoc, process_id, delta_t, min_instruments = 2, sngls_snr_threshold = None):
-		self.ln_lr_from_triggers = None
+		self.ln_lr_from_triggers_batch = None
 		self.delta_t = delta_t
 		self.min_instruments = min_instruments
 		self.sngls_snr_threshold = sngls_snr_threshold
@@ -245,6 +245,27 @@ class StreamThinca(object):
 		self.backgroundcollector = backgroundcollector()
 
 
+	@property
+	def ln_lr_from_triggers(self):
+		"""
+		Single-candidate form of .ln_lr_from_triggers_batch:  a
+		function of (triggers, offset vector) returning the
+		ranking statistic, or None.  Assigning a function of that
+		form sets .ln_lr_from_triggers_batch to one that calls it
+		for each candidate in turn.
+		"""
+		if self.ln_lr_from_triggers_batch is None:
+			return None
+		return lambda events, offsetvector: self.ln_lr_from_triggers_batch([(events, offsetvector)])[0]
+
+	@ln_lr_from_triggers.setter
+	def ln_lr_from_triggers(self, func):
+		if func is None:
+			self.ln_lr_from_triggers_batch = None
+		else:
+			self.ln_lr_from_triggers_batch = lambda candidates: [func(events, offsetvector) for events, offsetvector in candidates]
+
+
 	def push(self, instrument, events, t_complete):
 		"""
 		Push new triggers into the coinc engine.  Returns True if
@@ -261,8 +282,10 @@ class StreamThinca(object):
 		# lists to determine which triggers are eligible for
 		# inclusion in the background model and is the destination
 		# for triggers identified for inclusion in the background
-		# model. self.ln_lr_from_triggers is the ranking statistic
-		# function (if set).
+		# model. self.ln_lr_from_triggers_batch is the ranking
+		# statistic function (if set).  it is given a sequence of
+		# (triggers, offset vector) pairs and returns an array of
+		# ranking statistic values.
 
 		# extract times when instruments were producing SNR.  used
 		# to define "on instruments" for coinc tables, as a safety
@@ -324,26 +347,33 @@ class StreamThinca(object):
 				self.last_coincs.add(events, coinc, coincmaps, coinc_inspiral)
 
 
-		for node in max_last_coinc_snr:
-			if max_last_coinc_snr[node] is not None:
-				events, coinc, coincmaps, coinc_inspiral = max_last_coinc_snr[node]
-				# assign ranking statistic, FAP and FAR
-				if self.ln_lr_from_triggers is not None:
-					coinc.likelihood = self.ln_lr_from_triggers(events, node.offset_vector)
-					if fapfar is not None:
-						# FIXME:  add proper columns to
-						# store these values in
-						coinc_inspiral.combined_far = fapfar.far_from_rank(coinc.likelihood) * FAR_trialsfactor
-						if len(events) == 1 and cap_singles and coinc_inspiral.combined_far < 1. / fapfar.livetime:
-							coinc_inspiral.combined_far = 1. / fapfar.livetime	
-						coinc_inspiral.false_alarm_rate = fapfar.fap_from_rank(coinc.likelihood)
-				if zerolag_rankingstatpdf is not None and coinc.likelihood is not None:
-					zerolag_rankingstatpdf.zero_lag_lr_lnpdf.count[coinc.likelihood,] += 1
-
-				self.coinc_tables.append_coinc(coinc, coincmaps, coinc_inspiral)
-				self.last_coincs.add(events, coinc, coincmaps, coinc_inspiral)
-				self.sngl_inspiral_table.extend([sngl_trigger for sngl_trigger in events if sngl_trigger.event_id not in self.clustered_sngl_ids])
-				self.clustered_sngl_ids |= set(e.event_id for e in events)
+		# assign ranking statistics to the clustered candidates.
+		# they are evaluated all together
+
+		clustered = [(node, candidate) for node, candidate in max_last_coinc_snr.items() if candidate is not None]
+		if self.ln_lr_from_triggers_batch is not None and clustered:
+			ln_lrs = self.ln_lr_from_triggers_batch([(events, node.offset_vector) for node, (events, coinc, coincmaps, coinc_inspiral) in clustered])
+		else:
+			ln_lrs = [None] * len(clustered)
+
+		for (node, (events, coinc, coincmaps, coinc_inspiral)), ln_lr in zip(clustered, ln_lrs):
+			# assign ranking statistic, FAP and FAR
+			if ln_lr is not None:
+				coinc.likelihood = float(ln_lr)
+				if fapfar is not None:
+					# FIXME:  add proper columns to
+					# store these values in
+					coinc_inspiral.combined_far = fapfar.far_from_rank(coinc.likelihood) * FAR_trialsfactor
+					if len(events) == 1 and cap_singles and coinc_inspiral.combined_far < 1. / fapfar.livetime:
+						coinc_inspiral.combined_far = 1. / fapfar.livetime	
+					coinc_inspiral.false_alarm_rate = fapfar.fap_from_rank(coinc.likelihood)
+			if zerolag_rankingstatpdf is not None and coinc.likelihood is not None:
+				zerolag_rankingstatpdf.zero_lag_lr_lnpdf.count[coinc.likelihood,] += 1
+
+			self.coinc_tables.append_coinc(coinc, coincmaps, coinc_inspiral)
+			self.last_coincs.add(events, coinc, coincmaps, coinc_inspiral)
+			self.sngl_inspiral_table.extend([sngl_trigger for sngl_trigger in events if sngl_trigger.event_id not in self.clustered_sngl_ids])
+			self.clustered_sngl_ids |= set(e.event_id for e in events)
 
 
 		# add selected singles to the noise model
@@ -42,7 +42,9 @@
 
 import numpy
 import os
+import shutil
 import sys
+import tempfile
 import warnings
 
 import lal
@@ -132,11 +134,11 @@ class BankFragment(object):
 		self.start = start
 		self.end = end
 
-	def set_template_bank(self, template_bank, tolerance, snr_thresh, identity_transform = False, verbose = False):
+	def set_template_bank(self, template_bank, tolerance, snr_thresh, identity_transform = False, svd_method = "gsl", verbose = False):
 		if verbose:
 			print("\t%d templates of %d samples" % template_bank.shape, file=sys.stderr)
 
-		self.orthogonal_template_bank, self.singular_values, self.mix_matrix, self.chifacs = cbc_template_fir.decompose_templates(template_bank, tolerance, identity = identity_transform)
+		self.orthogonal_template_bank, self.singular_values, self.mix_matrix, self.chifacs = cbc_template_fir.decompose_templates(template_bank, tolerance, identity = identity_transform, svd_method = svd_method)
 
 		if self.singular_values is not None:
 			self.sum_of_squares_weights = numpy.sqrt(self.chifacs.mean() * gstlalmisc.ss_coeffs(self.singular_values,snr_thresh))
@@ -148,7 +150,7 @@ class BankFragment(object):
 
 
 class Bank(object):
-	def __init__(self, bank_xmldoc, psd, time_slices, gate_fap, snr_threshold, tolerance, flow = 40.0, autocorrelation_length = None, logname = None, identity_transform = False, verbose = False, bank_id = None, fhigh = None):
+	def __init__(self, bank_xmldoc, psd, time_slices, gate_fap, snr_threshold, tolerance, flow = 40.0, autocorrelation_length = None, logname = None, identity_transform = False, verbose = False, bank_id = None, fhigh = None, nprocs = 1, template_cache = None, svd_method = "gsl"):
 		# FIXME: remove template_bank_filename when no longer needed
 		# by trigger generator element
 		self.template_bank_filename = None
@@ -168,6 +170,8 @@ class Bank(object):
 			time_slices,
 			autocorrelation_length = autocorrelation_length,
 			fhigh = fhigh,
+			nprocs = nprocs,
+			cache = template_cache,
 			verbose = verbose)
 
 		# Include signal inspiral table
@@ -187,7 +191,7 @@ class Bank(object):
 		for i, bank_fragment in enumerate(self.bank_fragments):
 			if verbose:
 				print("constructing template decomposition %d of %d:  %g s ... %g s" % (i + 1, len(self.bank_fragments), -bank_fragment.end, -bank_fragment.start), file=sys.stderr)
-			bank_fragment.set_template_bank(template_bank[i], tolerance, self.snr_threshold, identity_transform = identity_transform, verbose = verbose)
+			bank_fragment.set_template_bank(template_bank[i], tolerance, self.snr_threshold, identity_transform = identity_transform, svd_method = svd_method, verbose = verbose)
 
 		if bank_fragment.sum_of_squares_weights is not None:
 			self.gate_threshold = sum_of_squares_threshold_from_fap(gate_fap, numpy.array([weight**2 for bank_fragment in self.bank_fragments for weight in bank_fragment.sum_of_squares_weights], dtype = "double"))
@@ -206,7 +210,7 @@ class Bank(object):
 
 
 
-def build_bank(template_bank_url, psd, flow, ortho_gate_fap, snr_threshold, svd_tolerance, padding = 1.5, identity_transform = False, verbose = False, autocorrelation_length = 201, samples_min = 1024, samples_max_256 = 1024, samples_max_64 = 2048, samples_max = 4096, bank_id = None, contenthandler = None, sample_rate = None, instrument_override = None):
+def build_bank(template_bank_url, psd, flow, ortho_gate_fap, snr_threshold, svd_tolerance, padding = 1.5, identity_transform = False, verbose = False, autocorrelation_length = 201, samples_min = 1024, samples_max_256 = 1024, samples_max_64 = 2048, samples_max = 4096, bank_id = None, contenthandler = None, sample_rate = None, instrument_override = None, nprocs = 1, template_cache = None, svd_method = "gsl"):
 	"""!
 	Return an instance of a Bank class.
 
@@ -226,6 +230,9 @@ def build_bank(template_bank_url, psd, flow, ortho_gate_fap, snr_threshold, svd_
 	@param samples_max The maximum number of samples in any time slice below 64 Hz
 	@param bank_id The id of the bank in question
 	@param contenthandler The ligolw content handler for file I/O
+	@param nprocs The number of processes to use to generate the whitened templates
+	@param template_cache A cbc_template_fir.TemplateCache in which to look up and store the whitened templates
+	@param svd_method The SVD implementation, "gsl" for the full decomposition or "randomized" for a truncated decomposition that stops at svd_tolerance, see cbc_template_fir.decompose_templates()
 	"""
 
 	# Open template bank file
@@ -270,7 +277,10 @@ def build_bank(template_bank_url, psd, flow, ortho_gate_fap, snr_threshold, svd_
 		identity_transform = identity_transform,
 		verbose = verbose,
 		bank_id = bank_id,
-		fhigh = fhigh
+		fhigh = fhigh,
+		nprocs = nprocs,
+		template_cache = template_cache,
+		svd_method = svd_method
 	)
 
 	# FIXME: remove this when no longer needed
@@ -279,16 +289,64 @@ def build_bank(template_bank_url, psd, flow, ortho_gate_fap, snr_threshold, svd_
 	return bank
 
 
-def write_bank(filename, banks, psd_input, cliplefts = None, cliprights = None, verbose = False):
-	"""Write SVD banks to a LIGO_LW xml file."""
+#
+# binary SVD bank files are directories containing a LIGO_LW document,
+# holding everything except the arrays, and a tree of .npy files holding
+# the arrays:  one sub-directory per bank, named by the bank's index in
+# the document, each containing one sub-directory per bank fragment.
+# the arrays are memory-mapped read-only when the bank is read so they
+# are only paged in as they are used and are shared through the page
+# cache by all of the processes on a node that read the same bank.
+#
+
+
+BINARY_BANK_DOCUMENT = "bank.xml.gz"
+
+
+def _put_array(elem, dirname, name, array):
+	if dirname is None:
+		elem.appendChild(ligolw_array.Array.build(name, array))
+	else:
+		numpy.save(os.path.join(dirname, "%s.npy" % name), numpy.ascontiguousarray(array))
+
+
+def _get_array(elem, dirname, name):
+	if dirname is None:
+		return ligolw_array.get_array(elem, name).array
+	try:
+		return numpy.load(os.path.join(dirname, "%s.npy" % name), mmap_mode = "r")
+	except IOError:
+		# same exception ligolw_array.get_array() raises
+		raise ValueError("no array named '%s' in %s" % (name, dirname))
+
+
+def write_bank(filename, banks, psd_input, cliplefts = None, cliprights = None, binary = False, verbose = False):
+	"""
+	Write SVD banks to a LIGO_LW xml file or, if binary is True, to a
+	binary SVD bank directory.  The directory is assembled under a
+	temporary name and renamed into place, replacing any existing bank
+	of the same name.
+	"""
+
+	if binary:
+		arraydir = tempfile.mkdtemp(prefix = ".%s." % os.path.basename(filename.rstrip(os.sep)), dir = os.path.dirname(os.path.abspath(filename)))
+		# mkdtemp() makes the directory private
+		os.chmod(arraydir, 0o755)
+	else:
+		arraydir = None
 
 	# Create new document
 	xmldoc = ligolw.Document()
 	lw = xmldoc.appendChild(ligolw.LIGO_LW())
 
-	for bank, clipleft, clipright in zip(banks, cliplefts, cliprights):
+	for n, (bank, clipleft, clipright) in enumerate(zip(banks, cliplefts, cliprights)):
 		# set up root for this sub bank
 		root = lw.appendChild(ligolw.LIGO_LW(Attributes({u"Name": u"gstlal_svd_bank_Bank"})))
+		if arraydir is not None:
+			bankdir = os.path.join(arraydir, "%d" % n)
+			os.mkdir(bankdir)
+		else:
+			bankdir = None
 
 		# FIXME FIXME FIXME move this clipping stuff to the Bank class
 		# set the right clipping index
@@ -324,16 +382,24 @@ def write_bank(filename, banks, psd_input, cliplefts = None, cliprights = None,
 		bank.sigmasq = bank.sigmasq[clipleft:clipright]
 
 		# Add root-level arrays
-		# FIXME:  ligolw format now supports complex-valued data
-		root.appendChild(ligolw_array.Array.build('autocorrelation_bank_real', bank.autocorrelation_bank.real))
-		root.appendChild(ligolw_array.Array.build('autocorrelation_bank_imag', bank.autocorrelation_bank.imag))
-		root.appendChild(ligolw_array.Array.build('autocorrelation_mask', bank.autocorrelation_mask))
-		root.appendChild(ligolw_array.Array.build('sigmasq', numpy.array(bank.sigmasq)))
+		if bankdir is None:
+			# FIXME:  ligolw format now supports complex-valued data
+			_put_array(root, bankdir, 'autocorrelation_bank_real', bank.autocorrelation_bank.real)
+			_put_array(root, bankdir, 'autocorrelation_bank_imag', bank.autocorrelation_bank.imag)
+		else:
+			_put_array(root, bankdir, 'autocorrelation_bank', bank.autocorrelation_bank)
+		_put_array(root, bankdir, 'autocorrelation_mask', bank.autocorrelation_mask)
+		_put_array(root, bankdir, 'sigmasq', numpy.array(bank.sigmasq))
 
 		# Write bank fragments
 		for i, frag in enumerate(bank.bank_fragments):
 			# Start new bank fragment container
 			el = root.appendChild(ligolw.LIGO_LW())
+			if bankdir is not None:
+				fragdir = os.path.join(bankdir, "%d" % i)
+				os.mkdir(fragdir)
+			else:
+				fragdir = None
 
 			# Apply clipping option
 			if frag.mix_matrix is not None:
@@ -346,30 +412,51 @@ def write_bank(filename, banks, psd_input, cliplefts = None, cliprights = None,
 			el.appendChild(ligolw_param.Param.from_pyvalue('end', frag.end))
 
 			# Add arrays
-			el.appendChild(ligolw_array.Array.build('chifacs', frag.chifacs))
+			_put_array(el, fragdir, 'chifacs', frag.chifacs)
 			if frag.mix_matrix is not None:
-				el.appendChild(ligolw_array.Array.build('mix_matrix', frag.mix_matrix))
-			el.appendChild(ligolw_array.Array.build('orthogonal_template_bank', frag.orthogonal_template_bank))
+				_put_array(el, fragdir, 'mix_matrix', frag.mix_matrix)
+			_put_array(el, fragdir, 'orthogonal_template_bank', frag.orthogonal_template_bank)
 			if frag.singular_values is not None:
-				el.appendChild(ligolw_array.Array.build('singular_values', frag.singular_values))
+				_put_array(el, fragdir, 'singular_values', frag.singular_values)
 			if frag.sum_of_squares_weights is not None:
-				el.appendChild(ligolw_array.Array.build('sum_of_squares_weights', frag.sum_of_squares_weights))
+				_put_array(el, fragdir, 'sum_of_squares_weights', frag.sum_of_squares_weights)
 
 	# put a copy of the processed PSD file in
 	# FIXME in principle this could be different for each bank included in
 	# this file, but we only put one here
-	psd = psd_input[bank.sngl_inspiral_table[0].ifo]
-	lal.series.make_psd_xmldoc({bank.sngl_inspiral_table[0].ifo: psd}, lw)
+	if psd_input is not None:
+		psd = psd_input[bank.sngl_inspiral_table[0].ifo]
+		lal.series.make_psd_xmldoc({bank.sngl_inspiral_table[0].ifo: psd}, lw)
 
 	# Write to file
-	ligolw_utils.write_filename(xmldoc, filename, gz = filename.endswith('.gz'), verbose = verbose)
+	if arraydir is None:
+		ligolw_utils.write_filename(xmldoc, filename, gz = filename.endswith('.gz'), verbose = verbose)
+		return
+	ligolw_utils.write_filename(xmldoc, os.path.join(arraydir, BINARY_BANK_DOCUMENT), gz = True, verbose = verbose)
+	if os.path.isdir(filename):
+		# move the old bank out of the way, but don't delete it
+		# until the new one is in place
+		olddir = tempfile.mkdtemp(prefix = ".%s." % os.path.basename(filename.rstrip(os.sep)), dir = os.path.dirname(os.path.abspath(filename)))
+		os.rename(filename, os.path.join(olddir, "bank"))
+		os.rename(arraydir, filename)
+		shutil.rmtree(olddir)
+	else:
+		os.rename(arraydir, filename)
 
 
 def read_banks(filename, contenthandler, verbose = False):
-	"""Read SVD banks from a LIGO_LW xml file."""
+	"""
+	Read SVD banks from a LIGO_LW xml file or, if filename is a
+	directory, from a binary SVD bank written by write_bank().
+	"""
 
 	# Load document
-	xmldoc = ligolw_utils.load_url(filename, contenthandler = contenthandler, verbose = verbose)
+	if os.path.isdir(filename):
+		arraydir = filename
+		xmldoc = ligolw_utils.load_filename(os.path.join(arraydir, BINARY_BANK_DOCUMENT), contenthandler = contenthandler, verbose = verbose)
+	else:
+		arraydir = None
+		xmldoc = ligolw_utils.load_url(filename, contenthandler = contenthandler, verbose = verbose)
 
 	banks = []
 
@@ -383,7 +470,8 @@ def read_banks(filename, contenthandler, verbose = False):
 		# the bank file does not contain psd ligolw element.
 		raw_psd = None
 
-	for root in (elem for elem in xmldoc.getElementsByTagName(ligolw.LIGO_LW.tagName) if elem.hasAttribute(u"Name") and elem.Name == "gstlal_svd_bank_Bank"):
+	for n, root in enumerate(elem for elem in xmldoc.getElementsByTagName(ligolw.LIGO_LW.tagName) if elem.hasAttribute(u"Name") and elem.Name == "gstlal_svd_bank_Bank"):
+		bankdir = os.path.join(arraydir, "%d" % n) if arraydir is not None else None
 
 		# Create new SVD bank object
 		bank = Bank.__new__(Bank)
@@ -409,9 +497,12 @@ def read_banks(filename, contenthandler, verbose = False):
 			pass
 
 		# Read root-level arrays
-		bank.autocorrelation_bank = ligolw_array.get_array(root, 'autocorrelation_bank_real').array + 1j * ligolw_array.get_array(root, 'autocorrelation_bank_imag').array
-		bank.autocorrelation_mask = ligolw_array.get_array(root, 'autocorrelation_mask').array
-		bank.sigmasq = ligolw_array.get_array(root, 'sigmasq').array
+		if bankdir is None:
+			bank.autocorrelation_bank = _get_array(root, bankdir, 'autocorrelation_bank_real') + 1j * _get_array(root, bankdir, 'autocorrelation_bank_imag')
+		else:
+			bank.autocorrelation_bank = _get_array(root, bankdir, 'autocorrelation_bank')
+		bank.autocorrelation_mask = _get_array(root, bankdir, 'autocorrelation_mask')
+		bank.sigmasq = _get_array(root, bankdir, 'sigmasq')
 
 		# prepare the horizon distance factors
 		bank.horizon_factors = dict((row.template_id, sigmasq**.5) for row, sigmasq in zip(bank.sngl_inspiral_table, bank.sigmasq))
@@ -422,7 +513,8 @@ def read_banks(filename, contenthandler, verbose = False):
 
 		# Read bank fragments
 		bank.bank_fragments = []
-		for el in (node for node in root.childNodes if node.tagName == ligolw.LIGO_LW.tagName):
+		for i, el in enumerate(node for node in root.childNodes if node.tagName == ligolw.LIGO_LW.tagName):
+			fragdir = os.path.join(bankdir, "%d" % i) if bankdir is not None else None
 			frag = BankFragment(
 				rate = ligolw_param.get_pyvalue(el, 'rate'),
 				start = ligolw_param.get_pyvalue(el, 'start'),
@@ -430,18 +522,18 @@ def read_banks(filename, contenthandler, verbose = False):
 			)
 
 			# Read arrays
-			frag.chifacs = ligolw_array.get_array(el, 'chifacs').array
+			frag.chifacs = _get_array(el, fragdir, 'chifacs')
 			try:
-				frag.mix_matrix = ligolw_array.get_array(el, 'mix_matrix').array
+				frag.mix_matrix = _get_array(el, fragdir, 'mix_matrix')
 			except ValueError:
 				frag.mix_matrix = None
-			frag.orthogonal_template_bank = ligolw_array.get_array(el, 'orthogonal_template_bank').array
+			frag.orthogonal_template_bank = _get_array(el, fragdir, 'orthogonal_template_bank')
 			try:
-				frag.singular_values = ligolw_array.get_array(el, 'singular_values').array
+				frag.singular_values = _get_array(el, fragdir, 'singular_values')
 			except ValueError:
 				frag.singular_values = None
 			try:
-				frag.sum_of_squares_weights = ligolw_array.get_array(el, 'sum_of_squares_weights').array
+				frag.sum_of_squares_weights = _get_array(el, fragdir, 'sum_of_squares_weights')
 			except ValueError:
 				frag.sum_of_squares_weights = None
 			bank.bank_fragments.append(frag)
@@ -0,0 +1,250 @@
+# Copyright (C) 2020  Kipp Cannon
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+
+
+"""
+Column-oriented, append-only on-disk storage for LIGO Light-Weight tables.
+
+Each table is stored as an HDF5 group holding one chunked, resizable
+dataset per column.  Rows are buffered in RAM and written in batches, so
+the cost of writing a trigger is a few attribute look-ups rather than
+growing an in-RAM LIGO_LW table for the life of the job.  The remainder
+of the document (process metadata, time slides, segments, etc.) is stored
+verbatim as LIGO_LW XML, and the complete document can be reconstructed on
+demand with load_url() for uploads and the offline post-processing tools.
+"""
+
+
+import io
+import sys
+
+
+import h5py
+import numpy
+
+
+from ligo.lw import lsctables
+from ligo.lw import types as ligolw_types
+from ligo.lw import utils as ligolw_utils
+
+
+__all__ = ["TriggerStore", "write_document", "load_url"]
+
+
+#
+# =============================================================================
+#
+#                                 Trigger Store
+#
+# =============================================================================
+#
+
+
+class TriggerStore(object):
+	"""
+	Append-only column store for LIGO_LW table rows backed by an HDF5
+	file.
+	"""
+	def __init__(self, filename, mode = "w", batch_size = 4096, chunk_size = 65536):
+		if mode not in ("r", "w", "a"):
+			raise ValueError("invalid mode '%s'" % mode)
+		self.filename = filename
+		self.batch_size = batch_size
+		self.chunk_size = chunk_size
+		self.h5file = h5py.File(filename, mode)
+		self.buffers = dict((name, []) for name, group in self.h5file.items() if isinstance(group, h5py.Group))
+
+
+	@staticmethod
+	def column_dtype(coltype):
+		if coltype in ligolw_types.StringTypes:
+			return h5py.string_dtype()
+		try:
+			return numpy.dtype(ligolw_types.ToNumPyType[coltype])
+		except KeyError:
+			raise TypeError("cannot store columns of type '%s'" % coltype)
+
+
+	def create_table(self, table):
+		"""
+		Create the group for a table, using its Name attribute as the
+		group name and its Column elements as the schema.  If the
+		group exists its schema must match.
+		"""
+		name = table.Name
+		columnnames = list(table.columnnames)
+		columntypes = list(table.columntypes)
+		if name in self.h5file:
+			group = self.h5file[name]
+			if list(group.attrs["columnnames"]) != columnnames or list(group.attrs["columntypes"]) != columntypes:
+				raise ValueError("schema for table '%s' does not match existing table" % name)
+			return
+		group = self.h5file.create_group(name)
+		group.attrs["columnnames"] = columnnames
+		group.attrs["columntypes"] = columntypes
+		for colname, coltype in zip(columnnames, columntypes):
+			group.create_dataset(colname, shape = (0,), maxshape = (None,), chunks = (self.chunk_size,), dtype = self.column_dtype(coltype), compression = "gzip", compression_opts = 1, shuffle = True)
+		self.buffers[name] = []
+
+
+	def append(self, name, rows):
+		"""
+		Append rows to the named table.  The rows are buffered and
+		written when at least .batch_size of them have accumulated,
+		or when .flush() is called.
+		"""
+		buf = self.buffers[name]
+		buf.extend(rows)
+		if len(buf) >= self.batch_size:
+			self.flush(name)
+
+
+	def __write_rows(self, group, rows):
+		n = len(group[group.attrs["columnnames"][0]])
+		for colname, coltype in zip(group.attrs["columnnames"], group.attrs["columntypes"]):
+			values = [getattr(row, colname) for row in rows]
+			isnull = numpy.fromiter((value is None for value in values), dtype = bool, count = len(values))
+			if isnull.any():
+				# NULL values are recorded in a mask dataset
+				# created the first time one is seen.  rows
+				# written before then are not NULL, which is
+				# the mask's fill value
+				nullname = "%s.null" % colname
+				if nullname not in group:
+					group.create_dataset(nullname, shape = (n,), maxshape = (None,), chunks = (self.chunk_size,), dtype = bool, compression = "gzip", compression_opts = 1)
+				fill = "" if coltype in ligolw_types.StringTypes else 0
+				values = [fill if null else value for value, null in zip(values, isnull)]
+			dataset = group[colname]
+			dataset.resize((n + len(rows),))
+			dataset[n:] = numpy.array(values, dtype = dataset.dtype)
+			if "%s.null" % colname in group:
+				dataset = group["%s.null" % colname]
+				dataset.resize((n + len(rows),))
+				dataset[n:] = isnull
+
+
+	def flush(self, name = None):
+		"""
+		Write buffered rows to disk, for the named table or for all
+		tables if name is None.
+		"""
+		for name in (self.buffers if name is None else (name,)):
+			buf = self.buffers[name]
+			if buf:
+				self.__write_rows(self.h5file[name], buf)
+				del buf[:]
+		self.h5file.flush()
+
+
+	def __len__(self):
+		"""
+		The total number of rows in the store, including buffered
+		rows.
+		"""
+		return sum(len(self.h5file[name][self.h5file[name].attrs["columnnames"][0]]) + len(buf) for name, buf in self.buffers.items())
+
+
+	def to_table(self, table):
+		"""
+		Append the rows stored for the table whose Name matches that
+		of table to table, and return table.  Only columns that table
+		possesses are restored.
+		"""
+		group = self.h5file[table.Name]
+		self.flush(table.Name)
+		columns = []
+		for colname in table.columnnames:
+			if colname not in group:
+				continue
+			dataset = group[colname]
+			values = dataset.asstr()[:] if h5py.check_string_dtype(dataset.dtype) is not None else dataset[:]
+			values = values.tolist()
+			if "%s.null" % colname in group:
+				for i in numpy.flatnonzero(group["%s.null" % colname][:]):
+					values[i] = None
+			columns.append((colname, values))
+		RowType = table.RowType
+		for values in zip(*(values for colname, values in columns)):
+			row = RowType()
+			for (colname, ignored), value in zip(columns, values):
+				setattr(row, colname, value)
+			table.append(row)
+		return table
+
+
+	def close(self):
+		if self.h5file.mode != "r":
+			self.flush()
+		self.h5file.close()
+
+
+#
+# =============================================================================
+#
+#                                   Document
+#
+# =============================================================================
+#
+
+
+#
+# name of the dataset holding the LIGO_LW XML document containing
+# everything except the contents of the stored tables
+#
+
+
+DOCUMENT_DATASET = "document"
+
+
+def write_document(store, xmldoc):
+	"""
+	Record the xmldoc in the store.  The stored tables in xmldoc must
+	have had their rows moved to the store, only their Column
+	metadata is retained.
+	"""
+	if DOCUMENT_DATASET in store.h5file:
+		del store.h5file[DOCUMENT_DATASET]
+	fileobj = io.StringIO()
+	xmldoc.write(fileobj)
+	store.h5file.create_dataset(DOCUMENT_DATASET, data = fileobj.getvalue(), dtype = h5py.string_dtype())
+
+
+def load_url(url, contenthandler, verbose = False):
+	"""
+	Reconstruct the complete LIGO_LW XML document from a trigger store
+	file, and return it.  The rows of each stored table are appended
+	to the document's table of the same name.
+	"""
+	filename = ligolw_utils.local_path_from_url(url)
+	if verbose:
+		print("reading %s ..." % filename, file = sys.stderr)
+	store = TriggerStore(filename, mode = "r")
+	try:
+		xmldoc = ligolw_utils.load_fileobj(io.BytesIO(store.h5file[DOCUMENT_DATASET][()]), contenthandler = contenthandler)
+		for name in store.buffers:
+			store.to_table(lsctables.TableByName[name].get_table(xmldoc))
+	finally:
+		store.close()
+	return xmldoc
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Measure the whitened template generation rate of
+cbc_template_fir.generate_templates() as a function of the number of
+worker processes, and the time taken by
+cbc_template_fir.decompose_templates() to decompose each of the bank's
+time slices with each of the SVD methods.
+
+Example:
+
+	GSTLAL_FIR_WHITEN=0 ./cbc_template_fir_benchmark.py --template-bank bank.xml.gz --reference-psd psd.xml.gz --processes 1,2,4,8
+"""
+
+
+from optparse import OptionParser
+import sys
+import time
+
+
+import lal.series
+from ligo.lw import lsctables
+from ligo.lw import utils as ligolw_utils
+from gstlal import cbc_template_fir
+from gstlal import svd_bank
+from gstlal import templates
+
+
+parser = OptionParser(description = __doc__)
+parser.add_option("--template-bank", metavar = "filename", help = "Load the template bank from this LIGO light-weight XML file (required).  The file must record the approximant as svd_bank.read_approximant() expects.")
+parser.add_option("--reference-psd", metavar = "filename", help = "Load the spectrum from this LIGO light-weight XML file (required).")
+parser.add_option("--flow", metavar = "Hz", type = "float", default = 40.0, help = "Set the template low-frequency cut-off (default = 40.0).")
+parser.add_option("--processes", metavar = "N[,N...]", default = "1,2,4", help = "Comma-separated list of worker counts to time (default = \"1,2,4\").")
+parser.add_option("--svd-tolerance", metavar = "match", type = "float", default = 0.9995, help = "Set the SVD reconstruction tolerance (default = 0.9995).")
+parser.add_option("--svd-method", metavar = "name", action = "append", help = "Time this SVD method (can be given multiple times, default = all).")
+parser.add_option("--repeat", metavar = "count", type = "int", default = 1, help = "Time each worker count this many times and report the best (default = 1).")
+options, filenames = parser.parse_args()
+
+if options.template_bank is None or options.reference_psd is None:
+	raise ValueError("--template-bank and --reference-psd are required")
+processes = [int(n) for n in options.processes.split(",")]
+if not options.svd_method:
+	options.svd_method = ["gsl", "randomized"]
+
+
+bank_xmldoc = ligolw_utils.load_filename(options.template_bank, contenthandler = svd_bank.DefaultContentHandler)
+sngl_inspiral_table = lsctables.SnglInspiralTable.get_table(bank_xmldoc)
+approximant = svd_bank.read_approximant(bank_xmldoc)
+psd = lal.series.read_psd_xmldoc(ligolw_utils.load_filename(options.reference_psd, contenthandler = lal.series.PSDContentHandler))[sngl_inspiral_table[0].ifo]
+time_slices = templates.time_slices(sngl_inspiral_table, fhigh = svd_bank.check_ffinal_and_find_max_ffinal(bank_xmldoc), flow = options.flow)
+
+
+print("%d templates, approximant %s" % (len(sngl_inspiral_table), approximant))
+print("%10s %12s %16s %10s" % ("processes", "seconds", "templates/s", "speed-up"))
+reference = None
+for nprocs in processes:
+	best = float("inf")
+	for i in range(options.repeat):
+		t_start = time.time()
+		template_bank, autocorrelation_bank, autocorrelation_mask, sigmasq, workspace = cbc_template_fir.generate_templates(sngl_inspiral_table, approximant, psd, options.flow, time_slices, autocorrelation_length = 201, nprocs = nprocs)
+		best = min(best, time.time() - t_start)
+	if reference is None:
+		reference = best
+	print("%10d %12.3f %16.2f %10.2f" % (nprocs, best, len(sngl_inspiral_table) / best, reference / best))
+	sys.stdout.flush()
+
+
+print()
+print("%10s %10s %12s %12s %10s %12s" % ("rate", "templates", "samples", "method", "basis", "seconds"))
+for (rate, begin, end), matrix in zip(time_slices, template_bank):
+	for svd_method in options.svd_method:
+		best = float("inf")
+		for i in range(options.repeat):
+			t_start = time.time()
+			U, s, Vh, chifacs = cbc_template_fir.decompose_templates(matrix.copy(), options.svd_tolerance, svd_method = svd_method)
+			best = min(best, time.time() - t_start)
+		print("%10d %10d %12d %12s %10d %12.3f" % (rate, matrix.shape[0], matrix.shape[1], svd_method, U.shape[0], best))
+		sys.stdout.flush()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# check that whitened templates retrieved from a TemplateCache are the same
+# as the ones generated without the cache, and that a cache hit sets the
+# template's end time as generating it does
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import numpy
+
+os.environ.setdefault("GSTLAL_FIR_WHITEN", "0")
+import lal
+from lal import LIGOTimeGPS
+import lalsimulation
+from ligo.lw import lsctables
+from gstlal import cbc_template_fir
+from gstlal import templates
+
+
+def template_table(masses):
+	table = lsctables.New(lsctables.SnglInspiralTable)
+	for mass1, mass2 in masses:
+		row = table.RowType()
+		row.mass1, row.mass2 = mass1, mass2
+		row.mchirp = (mass1 * mass2)**.6 / (mass1 + mass2)**.2
+		row.spin1x = row.spin1y = row.spin1z = 0.
+		row.spin2x = row.spin2y = row.spin2z = 0.
+		row.end = LIGOTimeGPS(0)
+		table.append(row)
+	return table
+
+
+psd = lal.CreateREAL8FrequencySeries("psd", LIGOTimeGPS(0), 0., 0.25, lal.Unit("strain^2 s"), 4097)
+lalsimulation.SimNoisePSD(psd, 10., lalsimulation.SimNoisePSDaLIGOZeroDetHighPower)
+# keep the PSD finite below the noise model's low-frequency cut-off
+psd.data.data[psd.data.data == 0.] = psd.data.data.max()
+
+failed = 0
+masses = [(20., 15.), (25., 12.), (30., 20.)]
+table = template_table(masses)
+time_slices = templates.time_slices(table, flow = 40., fhigh = 512.)
+reference = cbc_template_fir.templates_workspace(table, "IMRPhenomC", psd, 40., time_slices, autocorrelation_length = 101)
+expected = []
+for row in table:
+	data, autocorrelation, sigmasq = reference.make_whitened_template(row)
+	expected.append((data.copy(), autocorrelation.copy(), sigmasq, row.end))
+
+path = tempfile.mkdtemp()
+try:
+	for trial in ("miss", "hit"):
+		# the rows' end times must come from the cache on a hit,
+		# so start from the wrong ones
+		table = template_table(masses)
+		for row in table:
+			row.end = LIGOTimeGPS(1000)
+		workspace = cbc_template_fir.templates_workspace(table, "IMRPhenomC", psd, 40., time_slices, autocorrelation_length = 101, cache = cbc_template_fir.TemplateCache(path))
+		for row, (data, autocorrelation, sigmasq, end) in zip(table, expected):
+			if trial == "hit" and workspace.cache.get(workspace.template_cache_key(row)) is None:
+				print("template not found in cache", file = sys.stderr)
+				failed += 1
+			cached_data, cached_autocorrelation, cached_sigmasq = workspace.make_whitened_template(row)
+			if not (numpy.array_equal(cached_data, data) and numpy.array_equal(cached_autocorrelation, autocorrelation) and cached_sigmasq == sigmasq and row.end == end):
+				print("cache %s: template for m1 = %g, m2 = %g does not match the uncached template" % (trial, row.mass1, row.mass2), file = sys.stderr)
+				failed += 1
+finally:
+	shutil.rmtree(path)
+
+sys.exit(bool(failed))
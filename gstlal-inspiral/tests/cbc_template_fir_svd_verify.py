@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+# check that the randomized truncated SVD in decompose_templates() finds
+# the same number of basis vectors as the full GSL SVD, and that the
+# chifacs renormalization of the reconstruction matrix still holds
+#
+
+import os
+import sys
+import numpy
+
+os.environ.setdefault("GSTLAL_FIR_WHITEN", "0")
+from gstlal import cbc_template_fir
+
+
+def chirp_bank(n, length, rate = 512.):
+	# a family of unit-norm, quadrature-phase chirps that, like a real
+	# template bank, has a rapidly decaying singular value spectrum
+	t = numpy.arange(length) / rate + 0.01
+	bank = []
+	for m in numpy.linspace(1.0, 1.6, n):
+		f = 30. * m * (t[::-1] / t[-1])**(-3. / 8.)
+		h = f**(-7. / 6.) * numpy.hanning(length) * numpy.exp(2.j * numpy.pi * numpy.cumsum(f) / rate)
+		h *= numpy.sqrt(2. / numpy.vdot(h, h).real)
+		bank += [h.real, h.imag]
+	return numpy.array(bank)
+
+
+failed = 0
+for n, length in ((50, 512), (200, 1024)):
+	template_bank = chirp_bank(n, length)
+	for tolerance in (0.999, 0.9995, 0.99995):
+		U, s, Vh, chifacs = cbc_template_fir.decompose_templates(template_bank.copy(), tolerance, svd_method = "gsl")
+		rU, rs, rVh, rchifacs = cbc_template_fir.decompose_templates(template_bank.copy(), tolerance, svd_method = "randomized")
+		checks = {
+			"basis count": U.shape == rU.shape,
+			"singular values": numpy.allclose(s, rs, rtol = 1e-6, atol = 1e-9 * s[0]),
+			"chifacs": numpy.allclose(chifacs, rchifacs),
+			"renormalization": numpy.allclose((rVh * rVh).sum(0), rchifacs),
+			"reconstruction": numpy.allclose(numpy.dot(U.T, Vh), numpy.dot(rU.T, rVh), atol = 1e-6)
+		}
+		for name, ok in sorted(checks.items()):
+			if not ok:
+				print("%d x %d templates, tolerance %g:  %s mismatch" % (2 * n, length, tolerance, name), file=sys.stderr)
+				failed += 1
+
+sys.exit(failed)
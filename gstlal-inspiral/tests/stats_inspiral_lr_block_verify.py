@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# check that the array evaluation of the ranking statistic and of its
+# numerator and denominator densities on a CandidateBlock agrees with the
+# evaluation of the same candidates one dictionary at a time, for a block
+# drawn by LnNoiseDensity.random_params_blocks() that contains
+# single-instrument candidates and candidates removed by the fast-path cut
+#
+
+import random
+import sys
+import numpy
+
+from gstlal import far
+from gstlal.stats import inspiral_intrinsics
+
+
+def agree(a, b):
+	return a.shape == b.shape and (numpy.isfinite(a) == numpy.isfinite(b)).all() and numpy.allclose(a, b, rtol = 1e-12, atol = 0.)
+
+
+numpy.random.seed(0)
+random.seed(0)
+
+#
+# a synthetic three-instrument ranking statistic.  the instruments' live
+# times overlap only in part, so the candidates have every combination of
+# instruments on
+#
+
+t0 = 1000000000.
+instruments = ("H1", "L1", "V1")
+template_ids = list(range(1, 11))
+live = {
+	"H1": [(t0, t0 + 8000.)],
+	"L1": [(t0 + 2000., t0 + 10000.)],
+	"V1": [(t0, t0 + 4000.), (t0 + 6000., t0 + 10000.)]
+}
+horizons = {"H1": 120., "L1": 100., "V1": 50.}
+
+rankingstat = far.RankingStat(template_ids = template_ids, instruments = instruments, min_instruments = 1, delta_t = 0.005, horizon_factors = dict.fromkeys(template_ids, 1.))
+# the default population model needs a model file
+rankingstat.numerator.population_model = inspiral_intrinsics.UniformInTemplatePopulationModel(template_ids)
+for instrument, segs in live.items():
+	for start, end in segs:
+		# 1 trigger per second per template
+		rankingstat.denominator.triggerrates[instrument].add_ratebin((start, end), int(end - start) * len(template_ids))
+	for t in numpy.arange(t0, t0 + 10000., 100.).tolist():
+		rankingstat.numerator.horizon_history[instrument][t] = horizons[instrument] if any(start <= t < end for start, end in segs) else 0.
+rankingstat.denominator.add_noise_model(number_of_events = 10000)
+rankingstat.numerator.add_signal_model()
+rankingstat.numerator.finish()
+rankingstat.denominator.finish()
+
+#
+# evaluate a block of noise candidates both ways
+#
+
+failed = 0
+
+block, lnP_params = next(rankingstat.denominator.random_params_blocks(block_size = 2000))
+count = block.mask.sum(axis = 1)
+cut = rankingstat.fast_path_cut_block(block)
+if not (((count == 1) & ~cut).any() and ((count > 1) & ~cut).any() and cut.any()):
+	print("sample block does not exercise singles, coincidences and the fast-path cut", file = sys.stderr)
+	failed += 1
+kwargs_seq = block.kwargs_seq()
+if cut.tolist() != [rankingstat.fast_path_cut(**kwargs) for kwargs in kwargs_seq]:
+	print("fast_path_cut_block() disagrees with fast_path_cut()", file = sys.stderr)
+	failed += 1
+
+for name, density in (("numerator", rankingstat.numerator), ("denominator", rankingstat.denominator)):
+	if not agree(density.lnP_block(block), density.lnP_batch(kwargs_seq)):
+		print("%s: lnP_block() disagrees with lnP_batch()" % name, file = sys.stderr)
+		failed += 1
+
+ln_lr = rankingstat.ln_lr_block(block)
+if not agree(ln_lr, rankingstat.ln_lr_batch(kwargs_seq)):
+	print("ln_lr_block() disagrees with ln_lr_batch()", file = sys.stderr)
+	failed += 1
+if not numpy.isfinite(ln_lr[(count == 1) & ~cut]).any():
+	print("no single-instrument candidate was ranked", file = sys.stderr)
+	failed += 1
+
+sys.exit(bool(failed))
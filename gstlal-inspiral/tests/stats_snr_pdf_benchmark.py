@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of building the SNR PDF cache:  the Monte Carlo
+integrations P_instruments_given_signal() and SNRPDF.joint_pdf_of_snrs()
+at their default sample counts, and the full cache for a network as built
+by gstlal_inspiral_make_snr_pdf --full.  The full cache is timed on the
+first --horizon-sets sets of horizon distances and extrapolated to all of
+them.
+
+Example:
+
+	./stats_snr_pdf_benchmark.py --instruments H1,L1,V1 --threads 8 --horizon-sets 16
+"""
+
+
+import itertools
+import math
+from optparse import OptionParser
+import time
+
+
+import numpy
+from gstlal.stats import inspiral_extrinsics
+
+
+parser = OptionParser(description = __doc__)
+parser.add_option("--instruments", metavar = "name[,name,...]", default = "H1,L1,V1", help = "Set the network (default = \"H1,L1,V1\").")
+parser.add_option("--horizon-distance-tolerance", metavar = "ratio", type = "float", default = 0.05, help = "Set the horizon distance quantization, as for gstlal_inspiral_make_snr_pdf (default = 0.05).")
+parser.add_option("--min-instruments", metavar = "count[,count...]", default = "1,2", help = "Build the cache for these values of min_instruments (default = \"1,2\").")
+parser.add_option("--horizon-sets", metavar = "count", type = "int", default = 8, help = "Time the full cache build on this many sets of horizon distances (default = 8).")
+parser.add_option("--threads", metavar = "N", type = "int", default = 1, help = "Build the cache using this many processes (default = 1).")
+parser.add_option("--seed", metavar = "N", type = "int", default = 0, help = "Seed the random number generators (default = 0).")
+options, filenames = parser.parse_args()
+
+instruments = sorted(options.instruments.split(","))
+min_instruments = [int(n) for n in options.min_instruments.split(",")]
+snrpdf = inspiral_extrinsics.SNRPDF(snr_cutoff = 4., log_distance_tolerance = math.log(1.0 + options.horizon_distance_tolerance))
+rng = numpy.random.default_rng(options.seed)
+
+
+#
+# the individual integrations, for the network with equal horizon
+# distances
+#
+
+
+horizon_distances = dict.fromkeys(instruments, 1.)
+t_start = time.time()
+inspiral_extrinsics.P_instruments_given_signal(horizon_distances, n_samples = snrpdf.n_samples_instruments, min_instruments = min(min_instruments), rng = rng)
+print("P_instruments_given_signal(), %d samples: %.2f s" % (snrpdf.n_samples_instruments, time.time() - t_start))
+for n in range(1, len(instruments) + 1):
+	t_start = time.time()
+	snrpdf.joint_pdf_of_snrs(instruments[:n], horizon_distances, snrpdf.snr_cutoff, n_samples = snrpdf.n_samples_snrs, rng = rng)
+	print("joint_pdf_of_snrs() for %s, %d samples: %.2f s" % (",".join(instruments[:n]), snrpdf.n_samples_snrs, time.time() - t_start))
+
+
+#
+# the full cache, in the same order as gstlal_inspiral_make_snr_pdf --full
+#
+
+
+all_horizon_distances = []
+for loudest in instruments:
+	other_instruments = [instrument for instrument in instruments if instrument != loudest]
+	for other_distances in itertools.product(*([snrpdf.quants] * len(other_instruments))):
+		all_horizon_distances.append(snrpdf.quantized_horizon_distances([(loudest, 0.0)] + list(zip(other_instruments, other_distances))))
+all_horizon_distances.append(dict.fromkeys(instruments, 0.0))
+
+snrpdf.snr_joint_pdf_cache.clear()
+t_start = time.time()
+snrpdf.add_to_cache_parallel(all_horizon_distances[:options.horizon_sets], min_instruments, nprocs = options.threads, seed = options.seed)
+elapsed = time.time() - t_start
+n = min(options.horizon_sets, len(all_horizon_distances))
+print("full cache, %d processes:  %d of %d sets of horizon distances (%d PDFs) in %.1f s, %.3g sets/s, %.3g h for all" % (options.threads, n, len(all_horizon_distances), len(snrpdf.snr_joint_pdf_cache), elapsed, n / elapsed, elapsed / n * len(all_horizon_distances) / 3600.))
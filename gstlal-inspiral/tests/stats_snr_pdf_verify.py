@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# check the vectorized antenna responses against lal.ComputeDetAMResponse(),
+# that the SNR PDF cache is reproducible given a seed regardless of how
+# many processes build it, that entries read back from a store match the
+# ones written to it, and that gstlal_inspiral_make_snr_pdf can parse its
+# command line
+#
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+import numpy
+
+import lal
+import lalsimulation
+from gstlal.stats import inspiral_extrinsics
+
+
+failed = 0
+
+
+rng = numpy.random.default_rng(0)
+ra, dec, psi, cosi2 = inspiral_extrinsics.random_source_orientations(1000, rng = rng)
+responses = [lalsimulation.DetectorPrefixToLALDetector(instrument).response for instrument in ("H1", "L1", "V1", "K1")]
+fplus, fcross = inspiral_extrinsics.antenna_responses(responses, ra, dec, psi, 1.5)
+expected = numpy.array([[lal.ComputeDetAMResponse(response, *args) for args in zip(ra, dec, psi, [1.5] * len(ra))] for response in responses])
+if not numpy.allclose((fplus, fcross), expected.transpose(2, 0, 1), rtol = 0., atol = 1e-12):
+	print("antenna responses disagree with lal.ComputeDetAMResponse()", file = sys.stderr)
+	failed += 1
+
+
+horizon_distances = {"H1": 120., "L1": 100., "V1": 50.}
+P = inspiral_extrinsics.P_instruments_given_signal(horizon_distances, n_samples = 100000, min_instruments = 1, rng = numpy.random.default_rng(1))
+if abs(sum(P.values()) - 1.) > 1e-13 or P != inspiral_extrinsics.P_instruments_given_signal(horizon_distances, n_samples = 100000, min_instruments = 1, rng = numpy.random.default_rng(1)):
+	print("P_instruments_given_signal() not normalized or not reproducible: %s" % P, file = sys.stderr)
+	failed += 1
+
+
+snrpdf = inspiral_extrinsics.SNRPDF(snr_cutoff = 4., log_distance_tolerance = math.log(1.5))
+snrpdf.n_samples_instruments = 20000
+snrpdf.n_samples_snrs = 2000
+caches = []
+for nprocs in (1, 2):
+	snrpdf.snr_joint_pdf_cache.clear()
+	snrpdf.add_to_cache_parallel([{"H1": 1., "L1": .8}, {"H1": .5, "L1": 1.}, {"H1": 1., "L1": 0.}], (1, 2), nprocs = nprocs, seed = 2)
+	caches.append(dict((key, (entry.lnP_instruments, entry.binnedarray.array)) for key, entry in snrpdf.snr_joint_pdf_cache.items()))
+if set(caches[0]) != set(caches[1]) or any(caches[0][key][0] != caches[1][key][0] or (caches[0][key][1] != caches[1][key][1]).any() for key in caches[0]):
+	print("SNR PDF cache depends on the number of processes", file = sys.stderr)
+	failed += 1
+
+
+def lnP_snrs(snrpdf, keys):
+	# the SNR PDFs evaluated at a few points, for each key
+	return [snrpdf.lnP_snrs(dict((instrument, snr * (1. + .5 * i)) for i, instrument in enumerate(sorted(instruments))), snrpdf.quantized_horizon_distances(quants), min_instruments) for instruments, quants, min_instruments in keys for snr in (4.5, 6., 8., 12., 20.)]
+
+
+store = tempfile.mkdtemp()
+try:
+	keys = sorted(caches[1], key = repr)
+	expected = lnP_snrs(snrpdf, keys)
+	snrpdf.store = inspiral_extrinsics.SNRPDFStore(store)
+	for key, entry in snrpdf.snr_joint_pdf_cache.items():
+		lnbinnedarray = entry.binnedarray.copy()
+		with numpy.errstate(divide = "ignore"):
+			lnbinnedarray.array = numpy.log(lnbinnedarray.array)
+		snrpdf.store.put(snrpdf, key, entry.lnP_instruments, entry.binnedarray, lnbinnedarray)
+	snrpdf.snr_joint_pdf_cache.clear()
+	if snrpdf.store.keys(snrpdf) != set(caches[1]) or any(snrpdf.get_cache_entry(key).lnP_instruments != caches[1][key][0] or (snrpdf.get_cache_entry(key).binnedarray.array != caches[1][key][1]).any() for key in caches[1]):
+		print("SNR PDF store does not reproduce the cache", file = sys.stderr)
+		failed += 1
+	if not numpy.array_equal(lnP_snrs(snrpdf, keys), expected, equal_nan = True):
+		print("SNR PDFs read back from the store do not reproduce lnP_snrs()", file = sys.stderr)
+		failed += 1
+finally:
+	shutil.rmtree(store)
+
+
+# run gstlal_inspiral_make_snr_pdf's imports and parse_command_line()
+# definition, but not its main body
+program = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "gstlal_inspiral_make_snr_pdf")
+source = open(program).read()
+namespace = {"__name__": "gstlal_inspiral_make_snr_pdf"}
+exec(compile(source[:source.index("options, processparams, filenames = parse_command_line()")], program, "exec"), namespace)
+argv = sys.argv
+try:
+	sys.argv = [program, "--horizon-distances", "H1=120,L1=100", "--seed", "a.xml.gz", "--seed", "b.xml.gz", "--random-seed", "7", "--output", "snrpdf.xml.gz"]
+	options, processparams, filenames = namespace["parse_command_line"]()
+finally:
+	sys.argv = argv
+if options.seed != ["a.xml.gz", "b.xml.gz"] or options.random_seed != 7:
+	print("gstlal_inspiral_make_snr_pdf parsed --seed %s --random-seed %s" % (options.seed, options.random_seed), file = sys.stderr)
+	failed += 1
+
+
+sys.exit(bool(failed))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of the trigger_rate.ratebinlist operations used by the
+ranking statistic at the segment counts of a full observing run:
+appending bins with .add_ratebin(), the mean density in an interval
+around a candidate as computed by .density_in() and by intersecting with
+a one-bin list, and .value_slice_to_index().
+
+Example:
+
+	./stats_trigger_rate_benchmark.py --segments 10000,100000,1000000
+"""
+
+
+from optparse import OptionParser
+import time
+
+
+import numpy
+from gstlal.stats import trigger_rate
+
+
+parser = OptionParser(description = __doc__)
+parser.add_option("--segments", metavar = "N[,N...]", default = "10000,100000", help = "Comma-separated list of ratebinlist lengths to time (default = \"10000,100000\").")
+parser.add_option("--queries", metavar = "count", type = "int", default = 1000, help = "Time this many density queries at each length (default = 1000).")
+parser.add_option("--intersection-queries", metavar = "count", type = "int", default = 20, help = "Time this many density queries by intersection at each length (default = 20).  These are slow.")
+parser.add_option("--seed", metavar = "int", type = "int", default = 0, help = "Seed the random number generator (default = 0).")
+options, filenames = parser.parse_args()
+
+lengths = [int(n) for n in options.segments.split(",")]
+rng = numpy.random.RandomState(options.seed)
+
+
+print("%10s %14s %16s %16s %16s %8s" % ("segments", "append (us)", "density_in (us)", "& density (us)", "slice index (us)", "max err"))
+for n in lengths:
+	# segments are 8 s to 128 s long, separated by gaps of up to 16 s,
+	# as for a live analysis coalescing its 1 s trigger rate bins
+	durations = rng.uniform(8., 128., n)
+	starts = 1e9 + numpy.concatenate(([0.], numpy.cumsum(durations[:-1] + rng.uniform(0., 16., n - 1))))
+	counts = rng.poisson(durations * 0.5)
+
+	rates = trigger_rate.ratebinlist()
+	t_start = time.time()
+	for start, duration, count in zip(starts.tolist(), durations.tolist(), counts.tolist()):
+		rates.add_ratebin((start, start + duration), count)
+	t_append = (time.time() - t_start) / n
+
+	# 1 hour either side of a random time, as in
+	# LnNoiseDensity.__call__()
+	t = rng.uniform(starts[0], starts[-1] + durations[-1], options.queries).tolist()
+
+	# the first query builds the cumulative arrays that
+	# .add_ratebin() maintains afterwards;  time the steady state
+	rates.density_in((t[0] - 3600., t[0] + 3600.))
+	t_start = time.time()
+	density_in = [rates.density_in((x - 3600., x + 3600.)) for x in t]
+	t_density_in = (time.time() - t_start) / len(t)
+
+	t_start = time.time()
+	density = [(rates & trigger_rate.ratebinlist([trigger_rate.ratebin(x - 3600., x + 3600., count = 0)])).density for x in t[:options.intersection_queries]]
+	t_density = (time.time() - t_start) / len(density)
+	err = max(abs(a - b) / b for a, b in zip(density_in, density) if b) if any(density) else 0.
+
+	t_start = time.time()
+	for x in t:
+		rates.value_slice_to_index(slice(x - 3600., x + 3600.))
+	t_slice = (time.time() - t_start) / len(t)
+
+	print("%10d %14.3f %16.3f %16.3f %16.3f %8.1e" % (n, t_append * 1e6, t_density_in * 1e6, t_density * 1e6, t_slice * 1e6, err))
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import doctest
+import numpy
 import random
 import unittest
 import sys
@@ -60,6 +61,28 @@ class test_segmentlist(unittest.TestCase):
 			self.assertEqual(a.segmentlist(), b)
 			self.assertAlmostEqual(sum(seg.count for seg in a), count_before, places = 12)
 
+	def test_densities(self):
+		for i in range(self.algebra_repeats // 100):
+			a = random_coalesced_list(random.randint(1, self.algebra_listlength))
+			x = numpy.random.uniform(a[0][0] - 1., a[-1][1] + 1., 100)
+			lo = numpy.random.uniform(a[0][0] - 1., a[-1][1] + 1., 100)
+			hi = lo + numpy.random.uniform(0., 10., 100)
+			self.assertEqual(a.densities_at(x).tolist(), [a.density_at(y) for y in x.tolist()])
+			self.assertEqual(a.densities_in(lo, hi).tolist(), [a.density_in(seg) for seg in zip(lo.tolist(), hi.tolist())])
+
+	def test_density_in(self):
+		for i in range(self.algebra_repeats // 100):
+			# give the bins different densities
+			a = trigger_rate.ratebinlist(trigger_rate.ratebin(seg, count = random.uniform(0., 10.)) for seg in random_coalesced_list(random.randint(1, self.algebra_listlength)))
+			for j in range(100):
+				lo = random.uniform(a[0][0] - 1., a[-1][1] + 1.)
+				hi = lo + random.uniform(1. / 128., 10.)
+				expected = (a & trigger_rate.ratebinlist([trigger_rate.ratebin(lo, hi, count = 0)])).density
+				try:
+					self.assertAlmostEqual(a.density_in((lo, hi)), expected, delta = 1e-12 * max(expected, 1.))
+				except AssertionError as e:
+					raise AssertionError(str(e) + "\na = " + str(a) + "\nseg = " + str((lo, hi)))
+
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.makeSuite(test_segmentlist))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# check that triggers written to a trigger store file by a CoincsDocument
+# are read back by triggerstore.load_url() unchanged, including NULL
+# values, and with each committed batch of sngl_inspiral rows sorted as in
+# the XML output
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import numpy
+
+from ligo import segments
+from ligo.lw import lsctables
+from ligo.lw import types as ligolw_types
+from lal import LIGOTimeGPS
+from gstlal import inspiral
+from gstlal import triggerstore
+
+
+def columns(row, columnnames):
+	return tuple(getattr(row, colname) for colname in columnnames)
+
+
+rng = numpy.random.default_rng(0)
+failed = 0
+
+path = tempfile.mkdtemp()
+try:
+	url = os.path.join(path, "triggers.h5")
+	doc = inspiral.CoincsDocument(url = url, process_params = {}, process_start_time = None, comment = None, instruments = set(("H1", "L1")), seg = segments.segment(LIGOTimeGPS(1000000000), LIGOTimeGPS(1000000100)), offsetvectors = [{"H1": 0., "L1": 0.}], tmp_path = path)
+	# make the store write several batches
+	doc.store.batch_size = 7
+	table = doc.sngl_inspiral_table
+	columnnames = list(table.columnnames)
+	expected = []
+	for start in (1000000000, 1000000050):
+		batch = []
+		for i in range(20):
+			row = table.RowType()
+			for colname, coltype in zip(table.columnnames, table.columntypes):
+				if coltype in ligolw_types.IntTypes:
+					setattr(row, colname, int(rng.integers(1, 1000)))
+				elif coltype in ligolw_types.FloatTypes:
+					# exactly representable as single
+					# precision
+					setattr(row, colname, float(rng.integers(1, 1000)) / 8.)
+			row.process_id = doc.process_id
+			row.event_id = doc.get_next_sngl_id()
+			row.ifo = ("H1", "L1")[i % 2]
+			# out of time order within the batch
+			row.end = LIGOTimeGPS(start + int(rng.integers(0, 40)), int(rng.integers(0, 1000000000)))
+			if i % 3 == 0:
+				row.Gamma1 = None
+			table.append(row)
+			batch.append(columns(row, columnnames))
+		doc.commit()
+		if len(table):
+			print("commit() did not move the triggers to the store", file = sys.stderr)
+			failed += 1
+		expected += sorted(batch, key = lambda values: (LIGOTimeGPS(values[columnnames.index("end_time")], values[columnnames.index("end_time_ns")]), values[columnnames.index("ifo")]))
+	doc.write_output_url()
+
+	xmldoc = triggerstore.load_url(url, contenthandler = inspiral.LIGOLWContentHandler)
+	rows = lsctables.SnglInspiralTable.get_table(xmldoc)
+	if [columns(row, columnnames) for row in rows] != expected:
+		print("sngl_inspiral rows read back from the trigger store do not match the rows written", file = sys.stderr)
+		failed += 1
+	if len(lsctables.ProcessTable.get_table(xmldoc)) != 1 or len(lsctables.TimeSlideTable.get_table(xmldoc)) != 2:
+		print("trigger store document is missing the process or time slide metadata", file = sys.stderr)
+		failed += 1
+	xmldoc.unlink()
+finally:
+	shutil.rmtree(path)
+
+sys.exit(bool(failed))
@@ -28,10 +28,15 @@ import time
 from gi.repository import GLib
 import logging
 import subprocess
+import http.client
+import threading
 import urllib.error
+import urllib.parse
 import urllib.request
 import shutil
+import socket
 import collections
+import concurrent.futures
 from multiprocessing import Pool
 
 MIN_TIME_QUANTA = 10000
@@ -61,30 +66,156 @@ def now():
 	return LIGOTimeGPS(lal.UTCToGPS(time.gmtime()), 0)
 
 
-def get_url(url,d):
+class URLFetcher(object):
+	"""!
+	Fetch URLs concurrently with a bounded pool of @param max_workers
+	threads.  Each thread keeps one persistent HTTP connection per host,
+	which is reused across requests and across calls.  Requests time out
+	after @param timeout seconds.  URLs other than http and https ones
+	are fetched with urllib.
+	"""
+	def __init__(self, max_workers = 16, timeout = 10.):
+		self.timeout = timeout
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = max_workers)
+		self.local = threading.local()
+		self.connections = []
+
+	def __connection(self, scheme, netloc, new = False):
+		connections = self.local.__dict__.setdefault("connections", {})
+		if new and (scheme, netloc) in connections:
+			connections.pop((scheme, netloc)).close()
+		if (scheme, netloc) not in connections:
+			cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+			connections[(scheme, netloc)] = cls(netloc, timeout = self.timeout)
+			self.connections.append(connections[(scheme, netloc)])
+		return connections[(scheme, netloc)]
+
+	def fetch(self, url):
+		"""!
+		Return the contents of @param url.  Raises urllib.error.HTTPError
+		or urllib.error.URLError like urllib.request.urlopen().
+		"""
+		parts = urllib.parse.urlsplit(url)
+		if parts.scheme not in ("http", "https"):
+			return urllib.request.urlopen(url, timeout = self.timeout).read()
+		path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+		# the server might have closed an idle connection, so retry
+		# once on a new one
+		for new in (False, True):
+			connection = self.__connection(parts.scheme, parts.netloc, new = new)
+			try:
+				connection.request("GET", path)
+				response = connection.getresponse()
+				body = response.read()
+				break
+			except socket.timeout as e:
+				connection.close()
+				raise urllib.error.URLError(e)
+			except (http.client.HTTPException, OSError) as e:
+				connection.close()
+				if new:
+					raise urllib.error.URLError(e)
+		if response.status != 200:
+			raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+		return body
+
+	def map(self, func, iterable):
+		"""!
+		Return an iterator over func(item) for each item of @param
+		iterable, evaluated concurrently by the fetcher's threads.
+		func will normally call .fetch().  Exceptions are raised when
+		the corresponding result is reached.
+		"""
+		return self.executor.map(func, iterable)
+
+	def close(self):
+		self.executor.shutdown()
+		for connection in self.connections:
+			connection.close()
+		del self.connections[:]
+
+
+def parse_url_data(text):
+	"""!
+	Parse the whitespace-separated columns of numbers in @param text and
+	return a list of the columns as arrays, or an empty list if there is
+	no data.  Raises ValueError if @param text is not all numbers or the
+	rows do not all have the same number of columns, e.g. if it was
+	truncated.
+	"""
+	if isinstance(text, bytes):
+		text = text.decode("utf-8")
+	line = text.lstrip().split("\n", 1)[0]
+	if not line:
+		return []
+	data = numpy.fromstring(text, sep = " ")
+	# fromstring() stops at the first thing that is not a number
+	if len(data) != len(text.split()):
+		raise ValueError("cannot parse '%s'" % text.split()[len(data)])
+	return list(data.reshape((-1, len(line.split()))).T)
+
+
+def get_url(url, d, fetcher = None, timeout = None):
 	"""!
 	A function to pull data from @param url where @param d specifies a
-	specific route.  FIXME it assumes that the routes end in .txt
+	specific route.  If @param fetcher, a URLFetcher, is given it is
+	used to make the request.  FIXME it assumes that the routes end in .txt
 	"""
 	f = "%s%s.txt" % (url, d)
 	try:
-		jobdata = urllib.request.urlopen(f).read().split("\n")
+		if fetcher is not None:
+			jobdata = fetcher.fetch(f)
+		else:
+			jobdata = urllib.request.urlopen(f, timeout = timeout).read()
 	except urllib.error.HTTPError as e:
 		logging.error("%s : %s" % (f, str(e)))
 		return
 	except urllib.error.URLError as e:
 		logging.error("%s : %s" % (f, str(e)))
 		return
-	data = []
-	for line in jobdata:
-		if line:
-			data.append([float(x) for x in line.split()])
-	data = numpy.array(data)
-	out = []
-	if data.shape != (0,):
-		for i in range(data.shape[1]):
-			out.append(data[:,i])
-	return out
+	try:
+		return parse_url_data(jobdata)
+	except ValueError as e:
+		# includes UnicodeDecodeError
+		logging.error("%s : malformed response: %s" % (f, str(e)))
+		return
+
+
+def get_data_from_urls(jobs, job_tag, routes, fetcher = None, max_workers = 16, timeout = 10.):
+	"""!
+	A function to pull data for a set of jobs and routes from the jobs'
+	web servers, whose URLs are read from the registry files in @param
+	job_tag.  The requests are made concurrently with @param fetcher, a
+	URLFetcher, or with a new one using @param max_workers threads and
+	@param timeout.  Returns time and data dictionaries keyed by (job,
+	route), like get_data_from_kafka().
+	"""
+	start = time.time()
+	urls = {}
+	for job in jobs:
+		with open(os.path.join(job_tag, "%s_registry.txt" % job)) as f:
+			urls[job] = f.readline().strip()
+	keys = [(job, route) for job in jobs for route in routes]
+	own_fetcher = fetcher is None
+	if own_fetcher:
+		fetcher = URLFetcher(max_workers = max_workers, timeout = timeout)
+	try:
+		results = list(fetcher.map(lambda key: get_url(urls[key[0]], key[1], fetcher = fetcher), keys))
+	finally:
+		if own_fetcher:
+			fetcher.close()
+	timedata = {}
+	datadata = {}
+	failed = 0
+	for key, full_data in zip(keys, results):
+		# FIXME assumes always two columns
+		if full_data:
+			timedata[key], datadata[key] = full_data[0], full_data[1]
+		else:
+			failed += full_data is None
+			timedata[key], datadata[key] = numpy.array([]), numpy.array([])
+	logging.info("fetched %d routes from %d jobs in %.3f s, %d failed" % (len(keys), len(jobs), time.time() - start, failed))
+	return timedata, datadata
 
 
 def get_data_from_kafka(jobs, routes, kafka_consumer, req_all = False, timeout = 300):
@@ -119,13 +250,48 @@ def get_data_from_kafka(jobs, routes, kafka_consumer, req_all = False, timeout =
 	return timedata, datadata
 
 
+#
+# the reductions that reduce_data() knows how to vectorize.  given the
+# index of the first element of each group and the number of elements in
+# the group, with each group sorted on (y, x), return the index of the
+# element chosen by the reduction
+#
+
+
+REDUCTIONS = {
+	max: lambda first, count: first + count - 1,
+	min: lambda first, count: first,
+	median: lambda first, count: first + count // 2,
+}
+
+
 def reduce_data(xarr, yarr, func, level = 0):
 	"""!
 	This function does a data reduction by powers of 10 where level
 	specifies the power.  Default is 0 e.g., data reduction over 1 second
+
+	func is called with the list of (y, x) pairs in each interval and
+	returns the pair to keep.  max, min and median are evaluated for all
+	intervals at once with numpy.
 	"""
-	datadict = collections.OrderedDict()
 	assert len(yarr) == len(xarr)
+	if func in REDUCTIONS:
+		xarr = numpy.asarray(xarr, dtype = "f8")
+		yarr = numpy.asarray(yarr, dtype = "f8")
+		if not len(xarr):
+			return [], []
+		# group on the interval, and sort on y not x within each
+		keys = xarr.astype("i8") // (10**level)
+		order = numpy.lexsort((xarr, yarr, keys))
+		keys = keys[order]
+		first = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+		count = numpy.diff(numpy.append(first, len(keys)))
+		ix = order[REDUCTIONS[func](first, count)]
+		reduced_time, reduced_data = xarr[ix], yarr[ix]
+		idx = numpy.argsort(reduced_time)
+		return list(reduced_time[idx]), list(reduced_data[idx])
+
+	datadict = collections.OrderedDict()
 	for x,y in zip(xarr, yarr):
 		# reduce to this level
 		key = int(x) // (10**level)
@@ -178,13 +344,26 @@ def create_new_dataset(path, base, timedata = None, data = None, tmp = False):
 	return tmpfname, fname
 
 
+def open_dataset_file(fname):
+	"""!
+	Open the hdf5 file @param fname for reading.  Files kept open by a
+	DatasetWriter can only be read in SWMR (single writer, multiple
+	reader) mode, which files written by create_new_dataset() do not
+	support, so both are tried.
+	"""
+	try:
+		return h5py.File(fname, "r", libver = "latest", swmr = True)
+	except IOError:
+		return h5py.File(fname, "r")
+
+
 def get_dataset(path, base):
 	"""!
 	open a dataset at @param path with name @param base and return the data
 	"""
 	fname = os.path.join(path, "%s.hdf5" % base)
 	try:
-		f = h5py.File(fname, "r")
+		f = open_dataset_file(fname)
 		x,y = numpy.array(f["time"]), numpy.array(f["data"])
 		f.close()
 		return fname, x,y
@@ -193,6 +372,136 @@ def get_dataset(path, base):
 		return fname, numpy.array([]), numpy.array([])
 
 
+class DatasetWriter(object):
+	"""!
+	Keeps the time/data HDF5 files of the aggregation hierarchy open,
+	with chunked, resizable datasets, so that new samples are written in
+	place instead of each file being read and rewritten on every update.
+	The files stay open from one aggregation cycle to the next, at most
+	@param max_open_files of them, the least recently used being closed
+	when another is needed.
+
+	The files are written in SWMR (single writer, multiple reader) mode,
+	so readers that open them with open_dataset_file() (e.g.
+	get_dataset()) can do so while they are being written, and see the
+	samples written up to the last .flush().  Call .flush() once per
+	aggregation cycle, after all jobs have been processed.  Files
+	written by create_new_dataset() or that do not support SWMR are
+	converted the first time they are opened, the converted file being
+	made under a temporary name and renamed into place.
+	"""
+	def __init__(self, max_open_files = 256, chunk_size = 1024):
+		self.max_open_files = max_open_files
+		self.chunk_size = chunk_size
+		self.files = collections.OrderedDict()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	@staticmethod
+	def tmpname(fname):
+		path, name = os.path.split(fname)
+		return os.path.join(path, ".%s.tmp" % name)
+
+	def __convert(self, path, fname):
+		# SWMR needs the latest file format and chunked datasets,
+		# and new datasets cannot be created once a file is in SWMR
+		# mode
+		if os.path.exists(fname):
+			with h5py.File(fname, "r") as f:
+				if f.id.get_create_plist().get_version()[0] >= 3 and all(name in f and f[name].chunks is not None for name in ("time", "data")):
+					return
+				timedata, data = [f[name][...] if name in f else numpy.array([]) for name in ("time", "data")]
+		else:
+			makedir(path)
+			timedata = data = numpy.array([])
+		tmpfname = self.tmpname(fname)
+		with h5py.File(tmpfname, "w", libver = "latest") as f:
+			for name, values in (("time", timedata), ("data", data)):
+				f.create_dataset(name, data = values, maxshape = (None,), chunks = (self.chunk_size,), dtype = "f8")
+		os.rename(tmpfname, fname)
+
+	def open(self, path, base):
+		"""!
+		Return the open h5py.File for the dataset at @param path with
+		base name @param base, creating it if needed.
+		"""
+		fname = os.path.join(path, "%s.hdf5" % base)
+		try:
+			f = self.files.pop(fname)
+		except KeyError:
+			while len(self.files) >= self.max_open_files:
+				self.files.popitem(last = False)[1].close()
+			self.__convert(path, fname)
+			f = h5py.File(fname, "a", libver = "latest")
+			f.swmr_mode = True
+		self.files[fname] = f
+		return f
+
+	def read(self, path, base):
+		"""!
+		Return the time and data arrays of the dataset at @param path
+		with base name @param base.  A file that is not already open
+		for writing is only opened for reading, and a file that does
+		not exist reads as empty.
+		"""
+		fname = os.path.join(path, "%s.hdf5" % base)
+		if fname in self.files:
+			f = self.files[fname]
+			return f["time"][...], f["data"][...]
+		try:
+			f = open_dataset_file(fname)
+		except IOError:
+			return numpy.array([]), numpy.array([])
+		try:
+			return f["time"][...], f["data"][...]
+		finally:
+			f.close()
+
+	def replace(self, path, base, start, stop, timedata, data):
+		"""!
+		Replace the samples of the dataset at @param path with base
+		name @param base whose times are in [start, stop) with
+		@param timedata and @param data, which must be time ordered
+		and lie in that interval.  stop = None means the end of the
+		dataset.  Only the samples from start onwards are written.
+		"""
+		if len(timedata) != len(data):
+			raise ValueError("time data %d data %d" % (len(timedata), len(data)))
+		f = self.open(path, base)
+		n = len(f["time"])
+		# shortcut for the common case of appending
+		if not n or f["time"][n - 1] < start:
+			i = j = n
+		else:
+			times = f["time"][...]
+			i = times.searchsorted(start)
+			j = n if stop is None else times.searchsorted(stop)
+		for name, values in (("time", timedata), ("data", data)):
+			dataset = f[name]
+			tail = dataset[j:] if j < n else numpy.array([])
+			dataset.resize((i + len(values) + len(tail),))
+			if len(values):
+				dataset[i : i + len(values)] = values
+			if len(tail):
+				dataset[i + len(values):] = tail
+
+	def flush(self):
+		"""!
+		Write the changes to all open files to disk, making them
+		visible to readers.  The files are kept open.
+		"""
+		for f in self.files.values():
+			f.flush()
+
+	def close(self):
+		while self.files:
+			self.files.popitem()[1].close()
+
+
 def gps_to_minimum_time_quanta(gpstime):
 	"""!
 	given a gps time return the minimum time quanta, e.g., 123456789 ->
@@ -253,28 +562,29 @@ def gps_range(jobtime):
 	return range(min_t, max_t+MIN_TIME_QUANTA, MIN_TIME_QUANTA), range(min_t+MIN_TIME_QUANTA, max_t+2*MIN_TIME_QUANTA, MIN_TIME_QUANTA)
 
 
-def update_lowest_level_data_by_job_type_and_route(job, route, start, end, typ, base_dir, jobtime, jobdata, func):
+def update_lowest_level_data_by_job_type_and_route(job, route, start, end, typ, base_dir, jobtime, jobdata, func, writer = None):
+	if writer is None:
+		with DatasetWriter() as writer:
+			return update_lowest_level_data_by_job_type_and_route(job, route, start, end, typ, base_dir, jobtime, jobdata, func, writer = writer)
 	path = "/".join([base_dir, gps_to_leaf_directory(start), "by_job", job, typ])
-	try:
-		fname, prev_times, prev_data = get_dataset(path, route)
-	except:
-		setup_dir_by_job_and_level(start, typ, job, route, base_dir, verbose = True, level = 0)
-		fname, prev_times, prev_data = get_dataset(path, route)
+	f = writer.open(path, route)
+	# the stored data have already been reduced, so only the last
+	# sample can share an interval with new data
+	n = len(f["time"])
+	prev_times, prev_data = f["time"][max(n-1, 0):], f["data"][max(n-1, 0):]
 	# only get new data and assume that everything is time ordered
 	if prev_times.size:
 		this_time_ix = numpy.logical_and(jobtime > max(start-1e-16, prev_times[-1]), jobtime < end)
 	else:
 		this_time_ix = numpy.logical_and(jobtime >= start, jobtime < end)
-	this_time = numpy.concatenate((jobtime[this_time_ix], prev_times))
-	this_data = numpy.concatenate((jobdata[this_time_ix], prev_data))
 	# shortcut if there are no updates
-	if len(this_time) == len(prev_times) and len(this_data) == len(prev_data):
+	if not this_time_ix.any():
 		return []
+	this_time = numpy.concatenate((jobtime[this_time_ix], prev_times))
+	this_data = numpy.concatenate((jobdata[this_time_ix], prev_data))
 	reduced_time, reduced_data = reduce_data(this_time, this_data, func, level = 0)
 	#logging.info("processing job %s for data %s in span [%d,%d] of type %s: found %d" % (job, route, start, end, typ, len(reduced_time)))
-	tmpfname, _ = create_new_dataset(path, route, reduced_time, reduced_data, tmp = True)
-	# copy the tmp file over the original
-	shutil.move(tmpfname, fname)
+	writer.replace(path, route, prev_times[-1] if prev_times.size else start, None, reduced_time, reduced_data)
 	return [start, end]
 
 
@@ -285,74 +595,62 @@ def job_expanse(dataspan):
 	else:
 		return [], []
 
-def reduce_data_from_lower_level_by_job_type_and_route(level, base_dir, job, typ, route, func, start, end):
+def reduce_data_from_lower_level_by_job_type_and_route(level, base_dir, job, typ, route, func, start, end, writer = None):
+	if writer is None:
+		with DatasetWriter() as writer:
+			return reduce_data_from_lower_level_by_job_type_and_route(level, base_dir, job, typ, route, func, start, end, writer = writer)
 
 	this_level_dir = "/".join([base_dir, gps_to_leaf_directory(start, level = level)])
 
-	agg_data = numpy.array([])
-	agg_time = numpy.array([])
-
-	# FIXME iterate over levels instead.
-	for subdir in gps_to_sub_directories(start, level, base_dir):
-		path = "/".join([this_level_dir, subdir, "by_job", job, typ])
-		try:
-			fname, x, y = get_dataset(path, route)
-			agg_time = numpy.concatenate((agg_time, x))
-			agg_data = numpy.concatenate((agg_data, y))
-		except IOError as ioerr:
-			makedir(path)
-			# make an empty data set
-			create_new_dataset(path, route)
-			pass
+	# only the sub directory containing start can have changed.  the
+	# intervals at this level do not straddle sub directories, so only
+	# the samples in its span need to be recomputed
+	span = MIN_TIME_QUANTA * 10**(level - 1)
+	subdir_start = gps_to_minimum_time_quanta(start) // span * span
+	subdir = gps_to_leaf_directory(start, level = level - 1)[-1]
+	agg_time, agg_data = writer.read("/".join([this_level_dir, subdir, "by_job", job, typ]), route)
 	reduced_time, reduced_data = reduce_data(agg_time, agg_data, func, level=level)
 	path = "/".join([this_level_dir, "by_job", job, typ])
-	makedir(path)
 	#logging.info("processing reduced data %s for job %s  in span [%d,%d] of type %s at level %d: found %d/%d" % (d, job, s, e, typ, level, len(reduced_time), len(agg_time)))
-	tmpfname, fname = create_new_dataset(path, route, reduced_time, reduced_data, tmp = True)
-	# FIXME don't assume we can get the non temp file name this way
-	shutil.move(tmpfname, fname)
+	writer.replace(path, route, subdir_start, subdir_start + span, reduced_time, reduced_data)
 
 
-def reduce_across_jobs(jobs, this_level_dir, typ, route, func, level, start, end):
+def reduce_across_jobs(jobs, this_level_dir, typ, route, func, level, start, end, writer = None):
+	if writer is None:
+		with DatasetWriter() as writer:
+			return reduce_across_jobs(jobs, this_level_dir, typ, route, func, level, start, end, writer = writer)
 	# Process this level
-	agg_data = numpy.array([])
-	agg_time = numpy.array([])
-	for job  in sorted(jobs):
-		path = "/".join([this_level_dir, "by_job", job, typ])
-		try:
-			fname, x, y = get_dataset(path, route)
-			agg_time = numpy.concatenate((agg_time, x))
-			agg_data = numpy.concatenate((agg_data, y))
-		except IOError as ioerr:
-			makedir(path)
-			create_new_dataset(path, route)
-			pass
+	agg = [writer.read("/".join([this_level_dir, "by_job", job, typ]), route) for job in sorted(jobs)]
+	agg_time = numpy.concatenate([numpy.array([])] + [x for x, y in agg])
+	agg_data = numpy.concatenate([numpy.array([])] + [y for x, y in agg])
 	reduced_time, reduced_data = reduce_data(agg_time, agg_data, func, level=level)
 	#logging.info("processing reduced data %s in span [%d,%d] of type %s at level %d: found %d/%d" % (route, start, end, typ, level, len(reduced_time), len(agg_time)))
 	path = "/".join([this_level_dir, typ])
-	tmpfname, fname = create_new_dataset(path, route, reduced_time, reduced_data, tmp = True)
-	# FIXME don't assume we can get the non temp file name this way
-	shutil.move(tmpfname, fname)
+	writer.replace(path, route, -numpy.inf, None, reduced_time, reduced_data)
 
 
-def get_data_from_job_and_reduce(job, job_tag, routes, datatypes, prevdataspan, base_dir, jobs, timedata, datadata):
-	# get the url
-	with open(os.path.join(job_tag, "%s_registry.txt" % job)) as f:
-		url = f.readline().strip()
+def get_data_from_job_and_reduce(job, job_tag, routes, datatypes, prevdataspan, base_dir, jobs, timedata, datadata, writer = None, fetcher = None):
+	"""!
+	Update the hierarchy of reduced data for @param job.  If @param
+	writer, a DatasetWriter, is given its files are left open for the
+	next job and the caller flushes it once all jobs have been
+	processed, otherwise a writer is used for this job only.
+	If @param timedata is None the job's routes are fetched from its
+	web server, using @param fetcher, a URLFetcher, if given.  Use
+	get_data_from_urls() to fetch the data for many jobs at once.
+	"""
+	if writer is None:
+		with DatasetWriter() as writer:
+			return get_data_from_job_and_reduce(job, job_tag, routes, datatypes, prevdataspan, base_dir, jobs, timedata, datadata, writer = writer, fetcher = fetcher)
+	if timedata is None:
+		# fetch all routes at once
+		timedata, datadata = get_data_from_urls([job], job_tag, routes, fetcher = fetcher)
 	update_time = []
 	reduce_time = []
 	dataspan = set()
 	for route in routes:
 		#logging.info("processing job %s for route %s" % (job, route))
-		# FIXME assumes always two columns
-		if timedata is None:
-			full_data = get_url(url, route)
-			if full_data:
-				jobtime, jobdata = full_data[0], full_data[1]
-			else:
-				jobtime, jobdata = [], []
-		else:
-			jobtime, jobdata = timedata[(job,route)], datadata[(job,route)]
+		jobtime, jobdata = timedata[(job,route)], datadata[(job,route)]
 		gps1, gps2 = gps_range(jobtime)
 		for start, end in zip(gps1, gps2):
 			# shortcut to not reprocess data that has already been
@@ -364,13 +662,14 @@ def get_data_from_job_and_reduce(job, job_tag, routes, datatypes, prevdataspan,
 				continue
 			for (typ, func) in datatypes:
 				now = time.time()
-				for processed_time in update_lowest_level_data_by_job_type_and_route(job, route, start, end, typ, base_dir, jobtime, jobdata, func):
+				for processed_time in update_lowest_level_data_by_job_type_and_route(job, route, start, end, typ, base_dir, jobtime, jobdata, func, writer = writer):
 					dataspan.add(processed_time)
 				update_time.append(time.time()-now)
 				# descend down through the levels
 				now = time.time()
 				for level in range(1,DIRS):
-					reduce_data_from_lower_level_by_job_type_and_route(level, base_dir, job, typ, route, func, start, end)
+					reduce_data_from_lower_level_by_job_type_and_route(level, base_dir, job, typ, route, func, start, end, writer = writer)
 				reduce_time.append(time.time()-now)
-	#print "Updated %d with average time %f; Reduced %d with average time %f" % (len(update_time), numpy.mean(update_time), len(reduce_time), numpy.mean(reduce_time))
+	if update_time:
+		logging.debug("job %s: updated %d with average time %f; reduced %d with average time %f" % (job, len(update_time), numpy.mean(update_time), len(reduce_time), numpy.mean(reduce_time)))
 	return dataspan
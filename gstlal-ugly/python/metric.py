@@ -23,6 +23,8 @@ import numpy
 from gstlal import reference_psd
 from ligo.lw import utils as ligolw_utils
 import itertools
+import collections
+import multiprocessing
 import scipy
 from lal import LIGOTimeGPS
 import sys
@@ -210,8 +212,31 @@ def s2_from_x_y_z_zn(x, y, z, zn):
 #
 
 
+#
+# the metric used by waveform generation worker processes.  it is installed
+# here before the process pool is started so that each forked worker
+# inherits its own copy of the PSD and the LAL objects instead of having to
+# pickle them (they can't be)
+#
+
+_worker_metric = None
+
+
+def _waveform_data_worker(coords):
+	return _worker_metric.waveform_data(coords)
+
+
 class Metric(object):
-	def __init__(self, psd_xml, coord_func, duration = 4, flow = 30.0, fhigh = 512., approximant = "TaylorF2"):
+	def __init__(self, psd_xml, coord_func, duration = 4, flow = 30.0, fhigh = 512., approximant = "TaylorF2", nprocs = 1, cache_size = 1024, cache_resolution = 1e-9):
+		"""
+		If nprocs is greater than 1 the waveforms needed for each
+		metric tensor are generated by a pool of nprocs forked
+		worker processes.  The last cache_size metric tensors are
+		kept, keyed on their center coordinates rounded to
+		multiples of cache_resolution (0 to use the exact
+		coordinates), and returned again for centers that round to
+		the same key.  Set cache_size to 0 to disable the cache.
+		"""
 		# FIXME expose all of these things some how
 		self.duration = duration
 		self.approximant = lalsim.GetApproximantFromString(approximant)
@@ -220,7 +245,13 @@ class Metric(object):
 		self.flow = flow
 		self.fhigh = fhigh
 		self.working_length = int(round(self.duration * 2 * self.fhigh)) + 1
-		self.psd = reference_psd.interpolate_psd(series.read_psd_xmldoc(ligolw_utils.load_filename(psd_xml, verbose = True, contenthandler = series.PSDContentHandler)).values()[0], self.df)
+		self.psd = reference_psd.interpolate_psd(list(series.read_psd_xmldoc(ligolw_utils.load_filename(psd_xml, verbose = True, contenthandler = series.PSDContentHandler)).values())[0], self.df)
+		# the factors by which lal.WhitenCOMPLEX16FrequencySeries()
+		# multiplies each frequency bin, computed once and applied to
+		# all waveforms by waveform_data()
+		psd = self.psd.data.data
+		self.whitening = numpy.zeros(len(psd))
+		self.whitening[psd != 0.] = numpy.sqrt(2. * self.df / psd[psd != 0.])
 		self.revplan = lal.CreateReverseCOMPLEX16FFTPlan(self.working_length, 1)
 		self.delta_t = DELTA
 		self.t_factor = numpy.exp(-2j * numpy.pi * (numpy.arange(self.working_length) * self.df - self.fhigh) * self.delta_t)
@@ -241,48 +272,104 @@ class Metric(object):
 			sampleUnits = lal.Unit("strain"),
 			length = self.working_length
 		)
+		self.nprocs = nprocs
+		self.pool = None
+		self.cache_size = cache_size
+		self.cache_resolution = cache_resolution
+		self.cache = collections.OrderedDict()
 
+	def close(self):
+		"""
+		Shut down the waveform generation worker processes, if any.
+		"""
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool.join()
+			self.pool = None
 
-	def waveform(self, coords):
+	def sim_inspiral_fd(self, coords):
 		# Generalize to different waveform coords
 		p = self.coord_func(coords)
 
+		parameters = {}
+		parameters['m1'] = lal.MSUN_SI * p[0]
+		parameters['m2'] = lal.MSUN_SI * p[1]
+		parameters['S1x'] = p[2]
+		parameters['S1y'] = p[3]
+		parameters['S1z'] = p[4]
+		parameters['S2x'] = p[5]
+		parameters['S2y'] = p[6]
+		parameters['S2z'] = p[7]
+		parameters['distance'] = 1.e6 * lal.PC_SI
+		parameters['inclination'] = 0.
+		parameters['phiRef'] = 0.
+		parameters['longAscNodes'] = 0.
+		parameters['eccentricity'] = 0.
+		parameters['meanPerAno'] = 0.
+		parameters['deltaF'] = self.df
+		parameters['f_min'] = self.flow
+		parameters['f_max'] = self.fhigh
+		parameters['f_ref'] = 0.
+		parameters['LALparams'] = None
+		parameters['approximant'] = self.approximant
+
+		hplus, hcross = lalsim.SimInspiralFD(**parameters)
+		return hplus
+
+	def waveform(self, coords):
 		try:
-			parameters = {}
-			parameters['m1'] = lal.MSUN_SI * p[0]
-			parameters['m2'] = lal.MSUN_SI * p[1]
-			parameters['S1x'] = p[2]
-			parameters['S1y'] = p[3]
-			parameters['S1z'] = p[4]
-			parameters['S2x'] = p[5]
-			parameters['S2y'] = p[6]
-			parameters['S2z'] = p[7]
-			parameters['distance'] = 1.e6 * lal.PC_SI
-			parameters['inclination'] = 0.
-			parameters['phiRef'] = 0.
-			parameters['longAscNodes'] = 0.
-			parameters['eccentricity'] = 0.
-			parameters['meanPerAno'] = 0.
-			parameters['deltaF'] = self.df
-			parameters['f_min'] = self.flow
-			parameters['f_max'] = self.fhigh
-			parameters['f_ref'] = 0.
-			parameters['LALparams'] = None
-			parameters['approximant'] = self.approximant
-
-			hplus, hcross = lalsim.SimInspiralFD(**parameters)
-
-			fseries = hplus
+			fseries = self.sim_inspiral_fd(coords)
 			lal.WhitenCOMPLEX16FrequencySeries(fseries, self.psd)
 			fseries = add_quadrature_phase(fseries, self.working_length)
-			del hplus
-			del hcross
 		except RuntimeError:
-			print(p)
+			print(self.coord_func(coords))
 			#raise
 			return None
 		return fseries
 
+	def waveform_data(self, coords):
+		"""
+		Return the data of waveform(coords) as a numpy array
+		normalized to unit norm, or None if the waveform cannot be
+		generated.  The whitening and add_quadrature_phase() are
+		done on the array.
+		"""
+		try:
+			fseries = self.sim_inspiral_fd(coords)
+		except RuntimeError:
+			print(self.coord_func(coords))
+			return None
+		data = fseries.data.data * self.whitening[:fseries.data.length]
+		data[0] = 0.
+		if not self.working_length % 2:
+			data = data[:-1]
+		data = numpy.concatenate((numpy.zeros((fseries.data.length,), dtype = "cdouble"), 2 * data[1:]))
+		data /= numpy.abs(integrate.romb(numpy.conj(data) * data))**.5
+		return data
+
+	def waveforms(self, coords_seq):
+		"""
+		Return an array whose rows are waveform_data() for each of
+		the coordinates in coords_seq, generated by the worker
+		processes if nprocs is greater than 1.  Raises ValueError
+		if any of the waveforms cannot be generated.
+		"""
+		global _worker_metric
+
+		# daemonic processes, like the workers of another pool, can't
+		# have children
+		if self.nprocs > 1 and len(coords_seq) > 1 and not multiprocessing.current_process().daemon:
+			if self.pool is None:
+				_worker_metric = self
+				self.pool = multiprocessing.get_context("fork").Pool(self.nprocs)
+			data = self.pool.map(_waveform_data_worker, coords_seq, chunksize = max(1, len(coords_seq) // (4 * self.nprocs)))
+		else:
+			data = [self.waveform_data(coords) for coords in coords_seq]
+		for coords, w in zip(coords_seq, data):
+			if w is None:
+				raise ValueError("cannot generate waveform at %s" % (coords,))
+		return numpy.array(data)
+
 	def match_minus_1(self, w1, w2, t_factor = 1.0):
 		def norm(w):
 			n = numpy.abs(integrate.romb(numpy.conj(w) * w))**.5
@@ -306,85 +393,90 @@ class Metric(object):
 		except AttributeError:
 			return None
 
-
-	def __set_diagonal_metric_tensor_component(self, i, wp, wm, deltas, g, w1):
-		plus_match_minus_1 = self.match_minus_1(w1, wp[i,i])
-		minus_match_minus_1 = self.match_minus_1(w1, wm[i,i])
-		d2mbydx2 = (plus_match_minus_1 + minus_match_minus_1) / deltas[i]**2
-		# - 1/2 the second partial derivative
-		g[i,i] = -0.5 * d2mbydx2
-
-	def __set_tt_metric_tensor_component(self, center, w1):
-		minus_match_minus_1 = self.match_minus_1(w1, w1, t_factor = self.neg_t_factor)
-		plus_match_minus_1 = self.match_minus_1(w1, w1, t_factor = self.t_factor)
-		d2mbydx2 = (plus_match_minus_1 + minus_match_minus_1) / self.delta_t**2
-		return -0.5 * d2mbydx2
-
-	def __set_offdiagonal_metric_tensor_component(self, inds, wp, wm, deltas, g, w1):
-		i, j = inds
-		# evaluate symmetrically
-		if j <= i:
-			return None
-		fii = -2 * g[i,i] * deltas[i]**2
-		fjj = -2 * g[j,j] * deltas[j]**2
-		d2mbydxdy = (self.match_minus_1(w1, wp[i,j]) + self.match_minus_1(w1, wm[i,j]) - fii - fjj) / 2. / deltas[i] / deltas[j]
-		g[i,j] = g[j,i] = -0.5 * d2mbydxdy
-		return None
-
-	def __set_offdiagonal_time_metric_tensor_component(self, j, wp, wm, deltas, g, g_tt, delta_t, w1):
-		fjj = -2 * g[j,j] * deltas[j]**2
-		ftt = -2 * g_tt * delta_t**2
-		# Second order
-		plus_match_minus_1 = self.match_minus_1(w1, wp[j,j], t_factor = self.t_factor)
-		minus_match_minus_1 = self.match_minus_1(w1, wm[j,j], t_factor = self.neg_t_factor)
-		return -0.5 * (plus_match_minus_1 + minus_match_minus_1 - ftt - fjj) / 2 / delta_t / deltas[j]
-
-	def __call__(self, center):#, deltas = None):
-		center = numpy.array(center)
-		g = numpy.zeros((len(center), len(center)), dtype=numpy.double)
-		w1 = self.waveform(center)
-		wp = {}
-		wm = {}
+	def matches_minus_1(self, x, y):
+		"""
+		match_minus_1() of the normalized waveform data x against
+		each row of y, which are already normalized and time
+		shifted.
+		"""
+		m = numpy.abs(integrate.romb(numpy.conj(x) * y, axis = -1))
+		out = m - 1.0
+		close = ~(m < 1. - 1e-15)
+		if close.any():
+			d = x - y[close]
+			out[close] = -0.5 * numpy.abs(integrate.romb(numpy.conj(d) * d, axis = -1))
+		return out
+
+	def metric_tensor(self, center):
+		"""
+		Compute the metric tensor and its determinant at center by
+		finite differences and project out the time dimension.  All
+		of the waveforms are generated at once by waveforms(), and
+		the matches are computed together from them.
+		"""
+		center = numpy.array(center, dtype = "double")
+		n = len(center)
 		# FIXME assumes masses as first two and spins as the rest
-		deltas = numpy.zeros(len(center))
+		deltas = numpy.zeros(n)
 		deltas[0:2] = abs(center[0:2]) * DELTA
 		deltas[2:] += DELTA
-		for i, x in enumerate(deltas):
-			for j, y in enumerate(deltas):
-				dx = numpy.zeros(len(deltas))
-				dx[i] = x
-				dx[j] = y
-				if j < i:
-					continue
-				elif j == i:
-					wp[i,i] = self.waveform(center + dx)
-					wm[i,i] = self.waveform(center - dx) 
-				else:
-					wp[i,j] = wp[j,i] = self.waveform(center + dx) 
-					wm[i,j] = wm[j,i] = self.waveform(center - dx) 
-			
-		g_tt = self.__set_tt_metric_tensor_component(center, w1)
-
-		# First get the diagonal components
-		[self.__set_diagonal_metric_tensor_component(i, wp, wm, deltas, g, w1) for i in range(len(center))]
-
-		# Then the rest
-		[self.__set_offdiagonal_metric_tensor_component(ij, wp, wm, deltas, g, w1) for ij in itertools.product(range(len(center)), repeat = 2)]
-
-		g_tj = [self.__set_offdiagonal_time_metric_tensor_component(j, wp, wm, deltas, g, g_tt, self.delta_t, w1) for j in range(len(deltas))]
+
+		# the waveform at the center followed by the waveforms at
+		# center + dx and center - dx for each pair of dimensions
+		# i <= j
+		I, J = numpy.triu_indices(n)
+		coords = [center]
+		for i, j in zip(I, J):
+			dx = numpy.zeros(n)
+			dx[i] = deltas[i]
+			dx[j] = deltas[j]
+			coords += [center + dx, center - dx]
+		w = self.waveforms(coords)
+		w1, wp, wm = w[0], w[1::2], w[2::2]
+		diag = (I == J).nonzero()[0]
+
+		# the sums of the +/- matches minus 1.  - 1/2 their second
+		# partial derivatives are the metric tensor components
+		f_tt = self.matches_minus_1(w1, numpy.array((w1 * self.t_factor, w1 * self.neg_t_factor))).sum()
+		f = self.matches_minus_1(w1, wp) + self.matches_minus_1(w1, wm)
+		f_tj = self.matches_minus_1(w1, wp[diag] * self.t_factor) + self.matches_minus_1(w1, wm[diag] * self.neg_t_factor)
+		f_jj = f[diag]
+
+		g = numpy.empty((n, n), dtype = numpy.double)
+		g[I, J] = g[J, I] = -0.5 * (f - f_jj[I] - f_jj[J]) / 2. / deltas[I] / deltas[J]
+		g[numpy.diag_indices(n)] = -0.5 * f_jj / deltas**2
+		g_tt = -0.5 * f_tt / self.delta_t**2
+		g_tj = -0.5 * (f_tj - f_tt - f_jj) / 2. / self.delta_t / deltas
 
 		# project out the time component Owen 2.28
-		for i, j in itertools.product(range(len(deltas)), range(len(deltas))):
-			g[i,j] = g[i,j] -  g_tj[i] * g_tj[j] / g_tt
+		g -= numpy.outer(g_tj, g_tj) / g_tt
 
 		U, S, V = numpy.linalg.svd(g)
 		condition = S < max(S) * EIGEN_DELTA_DET
 		S[condition] = EIGEN_DELTA_DET * max(S)
 		g = numpy.dot(U, numpy.dot(numpy.diag(S), V))
-		det = numpy.product(S[S>0])
+		det = numpy.prod(S[S>0])
 
 		return g, det
 
+	def __call__(self, center):
+		center = numpy.array(center, dtype = "double")
+		if self.cache_resolution:
+			key = tuple(numpy.round(center / self.cache_resolution))
+		else:
+			key = tuple(center)
+		try:
+			g, det = self.cache[key]
+		except KeyError:
+			g, det = self.metric_tensor(center)
+			if self.cache_size:
+				self.cache[key] = g, det
+				while len(self.cache) > self.cache_size:
+					self.cache.popitem(last = False)
+		else:
+			self.cache.move_to_end(key)
+		return g.copy(), det
+
 
 	def _distancesq(self, metric_tensor, x, y):
 		delta = x - y
@@ -408,6 +500,13 @@ class Metric(object):
 		# always return floating point epsilon distance
 		return max(1e-7, (dot(delta, delta, metric_tensor)))
 
+	def distance(self, metric_tensor, x, y):
+		"""
+		Compute the distance between two points inside the cube using
+		the metric tensor, but assuming it is constant
+		"""
+		return self.distancesq(metric_tensor, x, y)**.5
+
 	def volume_element(self, metric_tensor):
 		return abs(numpy.linalg.det(metric_tensor))**.5
 
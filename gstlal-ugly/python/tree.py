@@ -15,7 +15,13 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import collections
 import itertools
+import multiprocessing
+import os
+import pickle
+import sys
+import time
 from gstlal import metric as metric_module
 import numpy
 from numpy import random
@@ -132,6 +138,14 @@ class HyperCube(object):
 		self.neighbors = []
 		self.vertices = list(itertools.product(*self.boundaries))
 
+	def __getstate__(self):
+		# the metric and the constraint function usually can't be
+		# pickled.  whoever unpickles the cube has to set them again
+		state = self.__dict__.copy()
+		state["metric"] = None
+		state["constraint_func"] = None
+		return state
+
 	def __eq__(self, other):
 		# FIXME actually make the cube hashable and call that
 		return (tuple(self.center), tuple(self.deltas)) == (tuple(other.center), tuple(other.deltas))
@@ -215,6 +229,47 @@ class HyperCube(object):
 		return self.metric.metric_match(self.metric_tensor, self.center, other.center)
 
 
+def split_cube(cube, parent, sibling, split_num_templates, mismatch, bifurcation = 0, metric_tol = 0.1):
+	"""
+	Decide how to split the cube held by a Node whose parent and
+	sibling hold the cubes parent and sibling (both None for the root)
+	and which is bifurcation levels below the root.  Returns (splitdim,
+	children):  splitdim is None if the cube is outside the region
+	allowed by its constraint function, children is None if the cube
+	is a leaf, and otherwise is the (left, right) pair of cubes from
+	splitting the cube along dimension splitdim.  The cubes' metrics
+	are reused instead of being recomputed if the metric here differs
+	from the parent's and the sibling's by no more than metric_tol.
+	"""
+	if not cube.constraint_func(cube.vertices + [cube.center]):
+		return None, None
+	splitdim = numpy.argmax(cube.num_tmps_per_side(mismatch))
+
+	if parent is None:
+		numtmps = float("inf")
+		metric_diff = 1.0
+	else:
+		# Get the number of parent templates
+		par_numtmps = parent.num_templates(mismatch)
+
+		# get the number of sibling templates
+		sib_numtmps = sibling.num_templates(mismatch)
+
+		# get our number of templates
+		numtmps = max(max(cube.num_templates(mismatch), par_numtmps / 2), sib_numtmps)
+
+		metric_diff = cube.metric_tensor - sibling.metric_tensor
+		metric_diff = numpy.linalg.norm(metric_diff) / numpy.linalg.norm(cube.metric_tensor)**.5 / numpy.linalg.norm(sibling.metric_tensor)**.5
+		metric_diff2 = cube.metric_tensor - parent.metric_tensor
+		metric_diff2 = numpy.linalg.norm(metric_diff2) / numpy.linalg.norm(cube.metric_tensor)**.5 / numpy.linalg.norm(parent.metric_tensor)**.5
+		metric_diff = max(metric_diff, metric_diff2)
+
+	# NOTE FIXME work out correct max templates per side
+	if (numtmps >= split_num_templates) or bifurcation < 2:
+		return splitdim, cube.split(splitdim, reuse_metric = metric_diff <= metric_tol)
+	return splitdim, None
+
+
 class Node(object):
 	"""
 	A Node implements a node in a binary tree decomposition of the
@@ -242,57 +297,28 @@ class Node(object):
 				self.on_boundary = True
 				print("\n\non boundary!!\n\n")
 
+	def add_children(self, left, right):
+		"""
+		Make Nodes for the cubes left and right and attach them as
+		this Node's children.
+		"""
+		self.left = Node(left, self, boundary = self.boundary)
+		self.right = Node(right, self, boundary = self.boundary)
+		self.left.sibling = self.right
+		self.right.sibling = self.left
+
 	def split(self, split_num_templates, mismatch, bifurcation = 0, verbose = True, metric_tol = 0.1, max_coord_vol = float(10)):
-		if self.cube.constraint_func(self.cube.vertices + [self.cube.center]):
-			size = self.cube.num_tmps_per_side(mismatch)
-			self.splitdim = numpy.argmax(size)
-
-			if not self.parent:
-				numtmps = float("inf")
-				par_numtmps = float("inf")
-				volume_split_condition = False
-				metric_diff = 1.0
-				metric_cond = True
-				tmp_diff = 1.0
-			else:
-				# Get the number of parent templates
-				par_numtmps = self.parent.cube.num_templates(mismatch)
-
-				# get the number of sibling templates
-				sib_numtmps = self.sibling.cube.num_templates(mismatch)
-
-				# get our number of templates
-				numtmps = max(max(self.cube.num_templates(mismatch), par_numtmps / 2), sib_numtmps)
-
-				metric_diff = self.cube.metric_tensor - self.sibling.cube.metric_tensor
-				metric_diff = numpy.linalg.norm(metric_diff) / numpy.linalg.norm(self.cube.metric_tensor)**.5 / numpy.linalg.norm(self.sibling.cube.metric_tensor)**.5
-				metric_diff2 = self.cube.metric_tensor - self.parent.cube.metric_tensor
-				metric_diff2 = numpy.linalg.norm(metric_diff2) / numpy.linalg.norm(self.cube.metric_tensor)**.5 / numpy.linalg.norm(self.parent.cube.metric_tensor)**.5
-				metric_diff = max(metric_diff, metric_diff2)
-
-				reuse_metric = self.cube #max(mts)[1]
-
-			tmps_per_side = self.cube.num_tmps_per_side(mismatch)
-			# NOTE FIXME work out correct max templates per side
-			if (numtmps >= split_num_templates) or bifurcation < 2:
-				bifurcation += 1
-				if metric_diff <= metric_tol:
-					self.cube.metric_tensor = reuse_metric.metric_tensor
-					self.cube.det = reuse_metric.det
-					left, right = self.cube.split(self.splitdim, reuse_metric = True)
-				else:
-					left, right = self.cube.split(self.splitdim)
-
-				self.left = Node(left, self, boundary = self.boundary)
-				self.right = Node(right, self, boundary = self.boundary)
-				self.left.sibling = self.right
-				self.right.sibling = self.left
-				self.left.split(split_num_templates, mismatch = mismatch, bifurcation = bifurcation)
-				self.right.split(split_num_templates, mismatch = mismatch, bifurcation = bifurcation)
-			else:
-				self.template_count[0] = self.template_count[0] + 1
-				if verbose and not (self.template_count[0] % 100):
-					print("%d tmps : level %03d @ %s : num tmps per side %s: deltas %s : vol frac. %.2f : splits %s : det %.2f : size %s".format(self.template_count[0], bifurcation, self.cube.center, tmps_per_side, self.cube.deltas, numtmps, self.on_boundary, self.cube.det**.5, size))
+		parent = self.parent.cube if self.parent else None
+		sibling = self.sibling.cube if self.sibling else None
+		self.splitdim, children = split_cube(self.cube, parent, sibling, split_num_templates, mismatch, bifurcation = bifurcation, metric_tol = metric_tol)
+		if children is not None:
+			self.add_children(*children)
+			self.left.split(split_num_templates, mismatch = mismatch, bifurcation = bifurcation + 1)
+			self.right.split(split_num_templates, mismatch = mismatch, bifurcation = bifurcation + 1)
+		elif self.splitdim is not None:
+			self.template_count[0] = self.template_count[0] + 1
+			if verbose and not (self.template_count[0] % 100):
+				print("%d tmps : level %03d @ %s : num tmps per side %s : deltas %s : on boundary %s : det %.2f" % (self.template_count[0], bifurcation, self.cube.center, self.cube.num_tmps_per_side(mismatch), self.cube.deltas, self.on_boundary, self.cube.det**.5))
 
 	# FIXME can this be made a generator?
 	#def leafnodes(self, out = set()):
@@ -311,3 +337,189 @@ class Node(object):
 		if not self.right and not self.left and self.cube.constraint_func(self.cube.vertices + [self.cube.center]):
 			out.add(self.cube)
 		return out
+
+
+#
+# the tree builder used by worker processes.  it is installed here before
+# the process pool is started so that each forked worker inherits its own
+# copy of the metric and the constraint function instead of having to
+# pickle them (they usually can't be)
+#
+
+_worker_builder = None
+
+
+def _expand_worker(args):
+	return _worker_builder.expand(*args)
+
+
+class TreeBuilder(object):
+	"""
+	Build the tree below a root Node as Node.split() does, but from an
+	explicit queue of Nodes waiting to be expanded instead of by
+	recursion.  How a Node is split depends only on its cube, its
+	parent's and sibling's cubes, and its depth, so the subtrees below
+	the Nodes in the queue are independent of each other.  The queue is
+	worked through in batches of batch_size Nodes in the order they were
+	made, expanded by a pool of nprocs forked worker processes if nprocs
+	is greater than 1, so neither the tree nor the order of its Nodes
+	depends on nprocs.
+
+	If checkpoint is not None the partially built tree is written to
+	that file every checkpoint_interval seconds and when the build is
+	complete.  If the file exists when the builder is created the tree
+	is restored from it, and build() carries on from where it stopped.
+
+	A Metric's cache returns the metric tensor computed for any center
+	that rounds to the same key, which would make the tree depend on
+	which cubes each process had seen before, so the builder switches
+	the root's Metric to exact keys.
+
+	Example:
+
+	>>> builder = TreeBuilder(bank, packing_density(4), mismatch, nprocs = 8, checkpoint = "treebank_checkpoint.pickle")	# doctest: +SKIP
+	>>> builder.build()	# doctest: +SKIP
+	>>> leaves = builder.leaves()	# doctest: +SKIP
+	"""
+	def __init__(self, root, split_num_templates, mismatch, metric_tol = 0.1, nprocs = 1, batch_size = None, checkpoint = None, checkpoint_interval = 600., verbose = False):
+		self.root = root
+		self.metric = root.cube.metric
+		self.constraint_func = root.cube.constraint_func
+		self.split_num_templates = split_num_templates
+		self.mismatch = mismatch
+		self.metric_tol = metric_tol
+		self.nprocs = nprocs
+		self.batch_size = batch_size if batch_size is not None else 16 * nprocs
+		self.checkpoint = checkpoint
+		self.checkpoint_interval = checkpoint_interval
+		self.verbose = verbose
+
+		if getattr(self.metric, "cache_resolution", 0):
+			self.metric.cache_resolution = 0
+			self.metric.cache.clear()
+
+		# all Nodes in the order they were made, and their depths
+		self.nodes = [root]
+		self.bifurcations = [0]
+		# indexes of the Nodes waiting to be expanded
+		self.queue = collections.deque([0])
+		self.n_leaves = 0
+
+		if checkpoint is not None and os.path.exists(checkpoint):
+			self.load_checkpoint()
+
+	def attach(self, cube):
+		cube.metric = self.metric
+		cube.constraint_func = self.constraint_func
+		return cube
+
+	def expand(self, cube, parent, sibling, bifurcation):
+		"""
+		split_cube() for cubes that have been through a pickle.
+		"""
+		for c in (cube, parent, sibling):
+			if c is not None:
+				self.attach(c)
+		return split_cube(cube, parent, sibling, self.split_num_templates, self.mismatch, bifurcation = bifurcation, metric_tol = self.metric_tol)
+
+	def write_checkpoint(self):
+		index = dict((id(node), i) for i, node in enumerate(self.nodes))
+		state = {
+			"split_num_templates": self.split_num_templates,
+			"mismatch": self.mismatch,
+			"metric_tol": self.metric_tol,
+			# the root's cube is the caller's, only its
+			# descendents' are saved
+			"nodes": [(node.cube if i else None, index[id(node.parent)] if i else None, bifurcation, node.splitdim) for i, (node, bifurcation) in enumerate(zip(self.nodes, self.bifurcations))],
+			"queue": list(self.queue),
+			"n_leaves": self.n_leaves
+		}
+		tmp = "%s.tmp" % self.checkpoint
+		with open(tmp, "wb") as f:
+			pickle.dump(state, f, protocol = pickle.HIGHEST_PROTOCOL)
+		os.rename(tmp, self.checkpoint)
+
+	def load_checkpoint(self):
+		with open(self.checkpoint, "rb") as f:
+			state = pickle.load(f)
+		if (state["split_num_templates"], state["mismatch"], state["metric_tol"]) != (self.split_num_templates, self.mismatch, self.metric_tol):
+			raise ValueError("%s was written with different split parameters" % self.checkpoint)
+		self.nodes = [self.root]
+		self.bifurcations = [0]
+		self.root.splitdim = state["nodes"][0][3]
+		# children always follow their parent, left before right
+		for cube, parent, bifurcation, splitdim in state["nodes"][1:]:
+			parent = self.nodes[parent]
+			node = Node(self.attach(cube), parent, boundary = parent.boundary)
+			node.splitdim = splitdim
+			if parent.left is None:
+				parent.left = node
+			else:
+				parent.right = node
+				parent.left.sibling = node
+				node.sibling = parent.left
+			self.nodes.append(node)
+			self.bifurcations.append(bifurcation)
+		self.queue = collections.deque(state["queue"])
+		self.n_leaves = state["n_leaves"]
+		if self.verbose:
+			print("resuming from %s: %d cubes, %d to be expanded" % (self.checkpoint, len(self.nodes), len(self.queue)), file = sys.stderr)
+
+	def build(self):
+		"""
+		Expand Nodes until the queue is empty.  Returns the root.
+		"""
+		global _worker_builder
+
+		pool = None
+		if self.nprocs > 1:
+			_worker_builder = self
+			pool = multiprocessing.get_context("fork").Pool(self.nprocs)
+		try:
+			t_start = t_checkpoint = t_report = time.time()
+			n_expanded = 0
+			while self.queue:
+				batch = [self.queue.popleft() for i in range(min(self.batch_size, len(self.queue)))]
+				args = []
+				for i in batch:
+					node = self.nodes[i]
+					args.append((node.cube, node.parent.cube if node.parent else None, node.sibling.cube if node.sibling else None, self.bifurcations[i]))
+				if pool is not None:
+					results = pool.map(_expand_worker, args)
+				else:
+					results = [self.expand(*arg) for arg in args]
+				for i, (splitdim, children) in zip(batch, results):
+					node = self.nodes[i]
+					node.splitdim = splitdim
+					if children is not None:
+						node.add_children(*(self.attach(cube) for cube in children))
+						self.queue.extend(range(len(self.nodes), len(self.nodes) + 2))
+						self.nodes += [node.left, node.right]
+						self.bifurcations += [self.bifurcations[i] + 1] * 2
+					elif splitdim is not None:
+						self.n_leaves += 1
+				n_expanded += len(batch)
+
+				now = time.time()
+				if self.verbose and (now - t_report >= 10. or not self.queue):
+					t_report = now
+					print("%d cubes, %d leaves, %d to be expanded, %.1f cubes/s" % (len(self.nodes), self.n_leaves, len(self.queue), n_expanded / (now - t_start)), file = sys.stderr)
+				if self.checkpoint is not None and now - t_checkpoint >= self.checkpoint_interval:
+					self.write_checkpoint()
+					t_checkpoint = now
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+				_worker_builder = None
+		if self.checkpoint is not None:
+			self.write_checkpoint()
+		return self.root
+
+	def leaves(self):
+		"""
+		Return the cubes of the leaf Nodes that are inside the
+		region allowed by the constraint function, in the order the
+		Nodes were made.
+		"""
+		return [node.cube for node in self.nodes if node.left is None and node.right is None and node.splitdim is not None]
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+import numpy
+
+
+from gstlal import aggregator
+
+
+#
+# =============================================================================
+#
+#                                    Tests
+#
+# =============================================================================
+#
+
+
+def reduce_by_second(times, data):
+	# the (time, value) of the largest value in each second
+	reduced = {}
+	for t, y in zip(times, data):
+		if int(t) not in reduced or y > reduced[int(t)][1]:
+			reduced[int(t)] = (t, y)
+	return [reduced[key][0] for key in sorted(reduced)], [reduced[key][1] for key in sorted(reduced)]
+
+
+class test_dataset_writer(unittest.TestCase):
+	def setUp(self):
+		self.base_dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.base_dir, aggregator.gps_to_leaf_directory(1000000000), "by_job", "job0", "max")
+
+	def tearDown(self):
+		shutil.rmtree(self.base_dir)
+
+	def tmpfiles(self):
+		return [name for dirpath, dirnames, filenames in os.walk(self.base_dir) for name in filenames if name.endswith(".tmp")]
+
+	def test_hierarchy(self):
+		rng = numpy.random.RandomState(0)
+		times = 1000000000. + 0.25 * numpy.arange(200)
+		data = rng.uniform(size = len(times))
+		# the second batch overlaps the last second of the first.  the
+		# writer's files stay open from one batch to the next
+		with aggregator.DatasetWriter() as writer:
+			for batch in (slice(0, 121), slice(121, None)):
+				timedata = {("job0", "snr"): times[batch]}
+				datadata = {("job0", "snr"): data[batch]}
+				aggregator.get_data_from_job_and_reduce("job0", None, ["snr"], [("max", max)], [], self.base_dir, ["job0"], timedata, datadata, writer = writer)
+				writer.flush()
+				stored_times, stored_data = writer.read(self.path, "snr")
+				expected_times, expected_data = reduce_by_second(times[:batch.stop], data[:batch.stop])
+				self.assertEqual(list(stored_times), expected_times)
+				self.assertEqual(list(stored_data), expected_data)
+				self.assertEqual(self.tmpfiles(), [])
+		# the level 1 file holds the largest value in each 10 s
+		path = os.path.join(self.base_dir, aggregator.gps_to_leaf_directory(1000000000, level = 1), "by_job", "job0", "max")
+		fname, stored_times, stored_data = aggregator.get_dataset(path, "snr")
+		self.assertEqual(list(stored_data), [data[(times // 10) == t].max() for t in sorted(set(times // 10))])
+
+	def read_in_another_process(self, base):
+		# an HDF5 file open for writing cannot be opened again by
+		# the same process, so readers are tested in another one
+		return json.loads(subprocess.check_output([sys.executable, "-c", "import json, sys; from gstlal import aggregator; print(json.dumps(aggregator.get_dataset(sys.argv[1], sys.argv[2])[2].tolist()))", self.path, base]))
+
+	def test_readers(self):
+		with aggregator.DatasetWriter() as writer:
+			writer.replace(self.path, "snr", 0., None, [1000000000.], [1.])
+			writer.flush()
+			f = writer.files[os.path.join(self.path, "snr.hdf5")]
+			self.assertEqual(self.read_in_another_process("snr"), [1.])
+			writer.replace(self.path, "snr", 1000000001., None, [1000000001.], [2.])
+			writer.flush()
+			# readers see what has been flushed, and the file
+			# is not closed and reopened to get there
+			self.assertEqual(self.read_in_another_process("snr"), [1., 2.])
+			self.assertIs(writer.files[os.path.join(self.path, "snr.hdf5")], f)
+		self.assertEqual(list(aggregator.get_dataset(self.path, "snr")[2]), [1., 2.])
+		self.assertEqual(self.tmpfiles(), [])
+
+	def test_read(self):
+		aggregator.makedir(self.path)
+		aggregator.create_new_dataset(self.path, "snr", timedata = [1000000000.], data = [1.])
+		with aggregator.DatasetWriter() as writer:
+			# reading neither opens files for writing nor creates
+			# them
+			self.assertEqual([list(x) for x in writer.read(self.path, "snr")], [[1000000000.], [1.]])
+			self.assertEqual([list(x) for x in writer.read(self.path, "missing")], [[], []])
+			self.assertEqual(len(writer.files), 0)
+			self.assertFalse(os.path.exists(os.path.join(self.path, "missing.hdf5")))
+			# files written by create_new_dataset() are converted
+			writer.replace(self.path, "snr", 1000000001., None, [1000000001.], [2.])
+			self.assertEqual([list(x) for x in writer.read(self.path, "snr")], [[1000000000., 1000000001.], [1., 2.]])
+		self.assertEqual(list(aggregator.get_dataset(self.path, "snr")[2]), [1., 2.])
+		self.assertEqual(self.tmpfiles(), [])
+
+	def test_max_open_files(self):
+		with aggregator.DatasetWriter(max_open_files = 2) as writer:
+			for route in ("a", "b", "c"):
+				writer.replace(self.path, route, 0., None, [1000000000.], [1.])
+			self.assertEqual(len(writer.files), 2)
+			# the least recently used has been closed
+			self.assertEqual(list(aggregator.get_dataset(self.path, "a")[2]), [1.])
+		self.assertEqual(self.tmpfiles(), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
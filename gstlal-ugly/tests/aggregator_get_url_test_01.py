@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+
+
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+from gstlal import aggregator
+
+
+#
+# =============================================================================
+#
+#                                 Stub Server
+#
+# =============================================================================
+#
+
+
+#
+# serves the routes of a few fake jobs, with a route that answers slowly,
+# one that does not exist and some with malformed bodies.  counts the
+# connections made to it
+#
+
+
+ROUTES = {
+	"/job0/snr.txt": b"1000000000.0 5.5\n1000000001.0 6.5\n1000000002.5 7.25\n",
+	"/job0/far.txt": b"1000000000.0 1e-5\n",
+	"/job1/snr.txt": b"1000000003.0 8\n\n1000000004.0 9\n",
+	"/job1/far.txt": b"",
+	"/job2/snr.txt": b"1000000005.0 1 2\n1000000006.0 3 4\n",
+	# malformed:  truncated, not numbers, not UTF-8
+	"/bad/snr.txt": b"1000000007.0 1\n1000000008.0",
+	"/bad/far.txt": b"1000000007.0 1\n1000000008.0 <html>\n",
+	"/bad/latency.txt": b"1000000007.0 \xff\n",
+}
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	delay = 0.
+
+	def setup(self):
+		super(StubHandler, self).setup()
+		with self.server.lock:
+			self.server.connections += 1
+
+	def do_GET(self):
+		if self.path == "/slow/snr.txt":
+			time.sleep(self.delay)
+		try:
+			body = ROUTES[self.path]
+		except KeyError:
+			# unlike .send_error() this keeps the connection open
+			body = b"not found\n"
+			self.send_response(404)
+		else:
+			self.send_response(200)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class test_get_url(unittest.TestCase):
+	def setUp(self):
+		self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+		self.server.daemon_threads = True
+		self.server.lock = threading.Lock()
+		self.server.connections = 0
+		self.thread = threading.Thread(target = self.server.serve_forever)
+		self.thread.start()
+		self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+		self.job_tag = tempfile.mkdtemp()
+		for job in ("job0", "job1", "job2", "slow", "missing", "bad"):
+			with open(os.path.join(self.job_tag, "%s_registry.txt" % job), "w") as f:
+				f.write("%s/%s/\n" % (self.url, job))
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.thread.join()
+		shutil.rmtree(self.job_tag)
+
+	def test_parse(self):
+		x, y = aggregator.parse_url_data(b"1 2\n3 4\n\n5 6\n")
+		self.assertEqual(list(x), [1., 3., 5.])
+		self.assertEqual(list(y), [2., 4., 6.])
+		self.assertEqual(aggregator.parse_url_data(b""), [])
+		self.assertEqual(aggregator.parse_url_data(b"\n\n"), [])
+
+	def test_parse_malformed(self):
+		for text in (b"1 2\n3", b"1 2\n3 x\n", b"1 \xff\n"):
+			with self.assertRaises(ValueError):
+				aggregator.parse_url_data(text)
+
+	def test_get_url(self):
+		fetcher = aggregator.URLFetcher(max_workers = 2, timeout = 1.)
+		try:
+			for kwargs in ({}, {"fetcher": fetcher}):
+				x, y = aggregator.get_url("%s/job0/" % self.url, "snr", **kwargs)
+				self.assertEqual(list(x), [1000000000.0, 1000000001.0, 1000000002.5])
+				self.assertEqual(list(y), [5.5, 6.5, 7.25])
+				self.assertEqual(len(aggregator.get_url("%s/job2/" % self.url, "snr", **kwargs)), 3)
+				self.assertEqual(aggregator.get_url("%s/job1/" % self.url, "far", **kwargs), [])
+				self.assertIsNone(aggregator.get_url("%s/missing/" % self.url, "snr", **kwargs))
+				for route in ("snr", "far", "latency"):
+					self.assertIsNone(aggregator.get_url("%s/bad/" % self.url, route, **kwargs))
+		finally:
+			fetcher.close()
+
+	def test_get_data_from_urls(self):
+		fetcher = aggregator.URLFetcher(max_workers = 4, timeout = 1.)
+		try:
+			for i in range(3):
+				timedata, datadata = aggregator.get_data_from_urls(["job0", "job1", "missing"], self.job_tag, ["snr", "far"], fetcher = fetcher)
+		finally:
+			fetcher.close()
+		self.assertEqual(sorted(timedata), sorted((job, route) for job in ("job0", "job1", "missing") for route in ("snr", "far")))
+		self.assertEqual(list(timedata[("job1", "snr")]), [1000000003.0, 1000000004.0])
+		self.assertEqual(list(datadata[("job1", "snr")]), [8., 9.])
+		self.assertEqual(list(datadata[("job0", "far")]), [1e-5])
+		self.assertEqual(len(timedata[("job1", "far")]), 0)
+		self.assertEqual(len(timedata[("missing", "snr")]), 0)
+
+	def test_malformed(self):
+		# a malformed body fails its route only
+		timedata, datadata = aggregator.get_data_from_urls(["bad", "job0"], self.job_tag, ["snr", "far"])
+		self.assertEqual(len(timedata[("bad", "snr")]), 0)
+		self.assertEqual(len(timedata[("bad", "far")]), 0)
+		self.assertEqual(list(datadata[("job0", "snr")]), [5.5, 6.5, 7.25])
+		self.assertEqual(list(datadata[("job0", "far")]), [1e-5])
+		# connections are reused across requests and calls
+		self.assertLessEqual(self.server.connections, 4)
+
+	def test_timeout(self):
+		StubHandler.delay = 2.
+		fetcher = aggregator.URLFetcher(max_workers = 4, timeout = 0.5)
+		try:
+			t_start = time.time()
+			timedata, datadata = aggregator.get_data_from_urls(["slow", "job0"], self.job_tag, ["snr"], fetcher = fetcher)
+			self.assertLess(time.time() - t_start, 1.)
+		finally:
+			fetcher.close()
+			StubHandler.delay = 0.
+		self.assertEqual(len(timedata[("slow", "snr")]), 0)
+		self.assertEqual(len(timedata[("job0", "snr")]), 3)
+
+
+if __name__ == "__main__":
+	unittest.main()
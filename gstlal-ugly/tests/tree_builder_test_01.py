@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+import numpy
+
+
+from gstlal import tree
+
+
+#
+# =============================================================================
+#
+#                                    Tests
+#
+# =============================================================================
+#
+
+
+class Interrupted(Exception):
+	pass
+
+
+class analytic_metric(object):
+	"""
+	A cheap metric that varies across the space, so the tree has
+	leaves at different depths.  Raises Interrupted once limit metric
+	tensors have been computed, if limit is not None.
+	"""
+	def __init__(self, limit = None):
+		self.limit = limit
+		self.calls = 0
+
+	def __call__(self, center):
+		self.calls += 1
+		if self.limit is not None and self.calls > self.limit:
+			raise Interrupted
+		g = numpy.diag(10. / numpy.asarray(center)**2)
+		return g, numpy.linalg.det(g)
+
+	def distance(self, metric_tensor, x, y):
+		delta = numpy.asarray(x) - numpy.asarray(y)
+		return numpy.dot(delta, numpy.dot(metric_tensor, delta))**.5
+
+
+def make_root(metric):
+	return tree.Node(tree.HyperCube(numpy.array([[1., 3.], [1., 3.]]), 0.03, constraint_func = lambda vertices: True, metric = metric))
+
+
+def summary(builder):
+	return [(tuple(cube.center), tuple(cube.deltas), cube.metric_tensor.tolist()) for cube in builder.leaves()]
+
+
+class test_tree_builder(unittest.TestCase):
+	def setUp(self):
+		self.base_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.base_dir)
+
+	def build(self, **kwargs):
+		builder = tree.TreeBuilder(make_root(analytic_metric()), tree.packing_density(2), 0.03, **kwargs)
+		builder.build()
+		return builder
+
+	def test_nprocs(self):
+		expected = summary(self.build(nprocs = 1, batch_size = 4))
+		self.assertGreater(len(expected), 10)
+		self.assertEqual(summary(self.build(nprocs = 2, batch_size = 4)), expected)
+
+	def test_resume(self):
+		expected = summary(self.build(batch_size = 4))
+		checkpoint = os.path.join(self.base_dir, "checkpoint.pickle")
+		# checkpoint after every batch, and stop part way through
+		builder = tree.TreeBuilder(make_root(analytic_metric(limit = 40)), tree.packing_density(2), 0.03, batch_size = 4, checkpoint = checkpoint, checkpoint_interval = 0.)
+		with self.assertRaises(Interrupted):
+			builder.build()
+		builder = tree.TreeBuilder(make_root(analytic_metric()), tree.packing_density(2), 0.03, batch_size = 4, checkpoint = checkpoint, checkpoint_interval = 0.)
+		self.assertGreater(len(builder.nodes), 1)
+		self.assertTrue(builder.queue)
+		builder.build()
+		self.assertEqual(summary(builder), expected)
+
+
+if __name__ == "__main__":
+	unittest.main()